@@ -0,0 +1,92 @@
+"""Tablas iniciales: documentos_electronicos y logs_envio
+
+Revision ID: 0001
+Revises:
+Create Date: 2024-11-24 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'documentos_electronicos',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('clave', sa.String(50), nullable=False),
+        sa.Column('tipo_documento', sa.String(2), nullable=False),
+        sa.Column('numero_consecutivo', sa.String(20), nullable=False),
+        sa.Column('fecha_emision', sa.DateTime(), nullable=False),
+        sa.Column('fecha_creacion', sa.DateTime(), server_default=sa.func.now()),
+        sa.Column('fecha_actualizacion', sa.DateTime(), server_default=sa.func.now()),
+        sa.Column('emisor_nombre', sa.String(100), nullable=False),
+        sa.Column('emisor_cedula', sa.String(20), nullable=False),
+        sa.Column('emisor_email', sa.String(160)),
+        sa.Column('receptor_nombre', sa.String(100)),
+        sa.Column('receptor_cedula', sa.String(20)),
+        sa.Column('receptor_email', sa.String(160)),
+        sa.Column('total_gravado', sa.Numeric(18, 5)),
+        sa.Column('total_exento', sa.Numeric(18, 5)),
+        sa.Column('total_exonerado', sa.Numeric(18, 5)),
+        sa.Column('total_venta', sa.Numeric(18, 5), nullable=False),
+        sa.Column('total_descuentos', sa.Numeric(18, 5)),
+        sa.Column('total_venta_neta', sa.Numeric(18, 5), nullable=False),
+        sa.Column('total_impuesto', sa.Numeric(18, 5)),
+        sa.Column('total_comprobante', sa.Numeric(18, 5), nullable=False),
+        sa.Column('codigo_moneda', sa.String(3), server_default='CRC'),
+        sa.Column('tipo_cambio', sa.Numeric(18, 5), server_default='1.00000'),
+        sa.Column('xml_sin_firmar', sa.Text()),
+        sa.Column('xml_firmado', sa.Text()),
+        sa.Column('estado_local', sa.String(20), server_default='generado'),
+        sa.Column('estado_hacienda', sa.String(20)),
+        sa.Column('mensaje_hacienda', sa.Text()),
+        sa.Column('respuesta_hacienda', sa.JSON()),
+        sa.Column('intentos_envio', sa.Integer(), server_default='0'),
+        sa.Column('ultimo_intento', sa.DateTime()),
+        sa.Column('es_anulado', sa.Boolean(), server_default=sa.false()),
+        sa.Column('motivo_anulacion', sa.Text()),
+        sa.Column('fecha_anulacion', sa.DateTime()),
+        sa.Column('condicion_venta', sa.String(2)),
+        sa.Column('plazo_credito', sa.String(10)),
+        sa.Column('medio_pago', sa.JSON()),
+        sa.Column('documento_referencia', sa.String(50)),
+        sa.Column('tipo_referencia', sa.String(2)),
+        sa.Column('motivo_referencia', sa.Text()),
+    )
+    op.create_index('ix_documentos_electronicos_id', 'documentos_electronicos', ['id'])
+    op.create_index('ix_documentos_electronicos_clave', 'documentos_electronicos', ['clave'], unique=True)
+
+    op.create_table(
+        'logs_envio',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('clave_documento', sa.String(50), nullable=False),
+        sa.Column('fecha_intento', sa.DateTime(), server_default=sa.func.now()),
+        sa.Column('tipo_operacion', sa.String(20), nullable=False),
+        sa.Column('url_endpoint', sa.String(200)),
+        sa.Column('headers_request', sa.JSON()),
+        sa.Column('payload_request', sa.Text()),
+        sa.Column('codigo_respuesta', sa.Integer()),
+        sa.Column('headers_response', sa.JSON()),
+        sa.Column('payload_response', sa.Text()),
+        sa.Column('tiempo_respuesta_ms', sa.Integer()),
+        sa.Column('exitoso', sa.Boolean(), server_default=sa.false()),
+        sa.Column('mensaje_error', sa.Text()),
+    )
+    op.create_index('ix_logs_envio_id', 'logs_envio', ['id'])
+    op.create_index('ix_logs_envio_clave_documento', 'logs_envio', ['clave_documento'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_logs_envio_clave_documento', table_name='logs_envio')
+    op.drop_index('ix_logs_envio_id', table_name='logs_envio')
+    op.drop_table('logs_envio')
+    op.drop_index('ix_documentos_electronicos_clave', table_name='documentos_electronicos')
+    op.drop_index('ix_documentos_electronicos_id', table_name='documentos_electronicos')
+    op.drop_table('documentos_electronicos')
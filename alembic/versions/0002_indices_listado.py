@@ -0,0 +1,39 @@
+"""Índices compuestos para el listado paginado por (fecha_emision, id)
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-11-25 00:00:00
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+INDICES = [
+    ('ix_documentos_fecha_id', ['fecha_emision', 'id']),
+    ('ix_documentos_emisor_fecha_id', ['emisor_cedula', 'fecha_emision', 'id']),
+    ('ix_documentos_emisor_tipo_fecha_id', ['emisor_cedula', 'tipo_documento', 'fecha_emision', 'id']),
+    ('ix_documentos_emisor_estado_fecha_id', ['emisor_cedula', 'estado_hacienda', 'fecha_emision', 'id']),
+    ('ix_documentos_tipo_fecha_id', ['tipo_documento', 'fecha_emision', 'id']),
+    ('ix_documentos_estado_fecha_id', ['estado_hacienda', 'fecha_emision', 'id']),
+]
+
+
+def upgrade() -> None:
+    # CONCURRENTLY no bloquea escrituras en tablas grandes, pero no corre dentro de una transacción
+    with op.get_context().autocommit_block():
+        for nombre, columnas in INDICES:
+            op.create_index(nombre, 'documentos_electronicos', columnas,
+                            postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for nombre, _ in reversed(INDICES):
+            op.drop_index(nombre, table_name='documentos_electronicos',
+                          postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,29 @@
+"""Referencias al almacén de blobs para XML, respuesta de Hacienda y PDF
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-11-26 00:00:00
+
+Los XML en línea existentes se trasladan con `python -m app.workers.migrar_blobs`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+COLUMNAS = ['xml_sin_firmar_ref', 'xml_firmado_ref', 'respuesta_xml_ref', 'pdf_ref']
+
+
+def upgrade() -> None:
+    for columna in COLUMNAS:
+        op.add_column('documentos_electronicos', sa.Column(columna, sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    for columna in reversed(COLUMNAS):
+        op.drop_column('documentos_electronicos', columna)
@@ -0,0 +1,158 @@
+"""Particionado mensual de documentos_electronicos y logs_envio
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2024-11-27 00:00:00
+
+Convierte ambas tablas en tablas particionadas por rango mensual
+(fecha_emision / fecha_intento), crea las particiones del rango de datos
+existente más los próximos meses y una partición DEFAULT de respaldo.
+La función crear_particion_mensual() la usa también el mantenimiento
+(app.workers.mantenimiento_particiones) para crear los meses siguientes.
+
+Copia todas las filas: en tablas grandes correr en una ventana de mantenimiento.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+MESES_ADELANTE = 3
+
+# Crea la partición del mes de `mes` si no existe. Si la partición DEFAULT ya tiene
+# filas de ese mes, se trasladan a la nueva antes de adjuntarla.
+CREAR_PARTICION_MENSUAL = """
+CREATE OR REPLACE FUNCTION crear_particion_mensual(tabla text, columna text, mes date)
+RETURNS text AS $$
+DECLARE
+    desde date := date_trunc('month', mes)::date;
+    hasta date := (date_trunc('month', mes) + interval '1 month')::date;
+    nombre text := tabla || '_' || to_char(mes, 'YYYY_MM');
+    defecto text := tabla || '_default';
+BEGIN
+    IF to_regclass(nombre) IS NOT NULL THEN
+        RETURN nombre;
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING STORAGE)', nombre, tabla);
+    IF to_regclass(defecto) IS NOT NULL THEN
+        EXECUTE format(
+            'WITH movidas AS (DELETE FROM %I WHERE %I >= %L AND %I < %L RETURNING *) '
+            'INSERT INTO %I SELECT * FROM movidas',
+            defecto, columna, desde, columna, hasta, nombre
+        );
+    END IF;
+    EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                   tabla, nombre, desde, hasta);
+    RETURN nombre;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+INDICES_DOCUMENTOS = [
+    ('ix_documentos_fecha_id', ['fecha_emision', 'id']),
+    ('ix_documentos_emisor_fecha_id', ['emisor_cedula', 'fecha_emision', 'id']),
+    ('ix_documentos_emisor_tipo_fecha_id', ['emisor_cedula', 'tipo_documento', 'fecha_emision', 'id']),
+    ('ix_documentos_emisor_estado_fecha_id', ['emisor_cedula', 'estado_hacienda', 'fecha_emision', 'id']),
+    ('ix_documentos_tipo_fecha_id', ['tipo_documento', 'fecha_emision', 'id']),
+    ('ix_documentos_estado_fecha_id', ['estado_hacienda', 'fecha_emision', 'id']),
+]
+
+
+def _particionar(tabla: str, columna: str, indices_legado: list) -> None:
+    legado = f"{tabla}_legado"
+    op.execute(f"ALTER TABLE {tabla} RENAME TO {legado}")
+    op.execute(f"ALTER TABLE {legado} RENAME CONSTRAINT {tabla}_pkey TO {legado}_pkey")
+    # Los nombres de índice son únicos por esquema: se liberan para la tabla nueva
+    for indice in indices_legado:
+        op.execute(f"DROP INDEX IF EXISTS {indice}")
+
+    op.execute(
+        f"CREATE TABLE {tabla} (LIKE {legado} INCLUDING DEFAULTS INCLUDING STORAGE) "
+        f"PARTITION BY RANGE ({columna})"
+    )
+    op.execute(f"ALTER SEQUENCE {tabla}_id_seq OWNED BY {tabla}.id")
+    # La clave de partición forma parte de toda restricción única
+    op.execute(f"ALTER TABLE {tabla} ADD PRIMARY KEY (id, {columna})")
+    op.execute(f"CREATE TABLE {tabla}_default PARTITION OF {tabla} DEFAULT")
+
+    # Particiones del rango existente y de los próximos meses, antes de copiar
+    op.execute(f"""
+        SELECT crear_particion_mensual('{tabla}', '{columna}', mes::date)
+        FROM generate_series(
+            date_trunc('month', LEAST(COALESCE((SELECT min({columna}) FROM {legado}), now()), now())),
+            date_trunc('month', now()) + interval '{MESES_ADELANTE} months',
+            interval '1 month'
+        ) AS mes
+    """)
+
+
+def upgrade() -> None:
+    op.execute(CREAR_PARTICION_MENSUAL)
+
+    # documentos_electronicos: la clave sigue siendo única junto con la fecha de emisión
+    _particionar('documentos_electronicos', 'fecha_emision',
+                 ['ix_documentos_electronicos_id', 'ix_documentos_electronicos_clave'] +
+                 [nombre for nombre, _ in INDICES_DOCUMENTOS])
+    op.create_unique_constraint('uq_documentos_clave_fecha', 'documentos_electronicos', ['clave', 'fecha_emision'])
+    for nombre, columnas in INDICES_DOCUMENTOS:
+        op.create_index(nombre, 'documentos_electronicos', columnas)
+    op.execute("INSERT INTO documentos_electronicos SELECT * FROM documentos_electronicos_legado")
+    op.execute("DROP TABLE documentos_electronicos_legado")
+
+    # logs_envio: fecha_intento pasa a ser obligatoria
+    op.execute("UPDATE logs_envio SET fecha_intento = now() WHERE fecha_intento IS NULL")
+    _particionar('logs_envio', 'fecha_intento', ['ix_logs_envio_id', 'ix_logs_envio_clave_documento'])
+    op.execute("ALTER TABLE logs_envio ALTER COLUMN fecha_intento SET DEFAULT now()")
+    op.create_index('ix_logs_envio_clave_documento', 'logs_envio', ['clave_documento'])
+    op.execute("INSERT INTO logs_envio SELECT * FROM logs_envio_legado")
+    op.execute("DROP TABLE logs_envio_legado")
+
+    # Particiones archivadas por el mantenimiento (bloques JSONL en el almacén de blobs)
+    op.create_table(
+        'archivos_particiones',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('tabla', sa.String(length=63), nullable=False),
+        sa.Column('particion', sa.String(length=63), nullable=False),
+        sa.Column('desde', sa.DateTime(), nullable=False),
+        sa.Column('hasta', sa.DateTime(), nullable=False),
+        sa.Column('filas', sa.Integer(), nullable=False),
+        sa.Column('bloques', sa.JSON(), nullable=False),
+        sa.Column('fecha_archivo', sa.DateTime(), server_default=sa.func.now()),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('particion')
+    )
+    op.create_index('ix_archivos_particiones_tabla_rango', 'archivos_particiones', ['tabla', 'desde', 'hasta'])
+
+
+def _desparticionar(tabla: str, columna: str, indices: list) -> None:
+    op.execute(f"CREATE TABLE {tabla}_plana (LIKE {tabla} INCLUDING DEFAULTS INCLUDING STORAGE)")
+    op.execute(f"INSERT INTO {tabla}_plana SELECT * FROM {tabla}")
+    op.execute(f"ALTER SEQUENCE {tabla}_id_seq OWNED BY {tabla}_plana.id")
+    op.execute(f"DROP TABLE {tabla}")
+    op.execute(f"ALTER TABLE {tabla}_plana RENAME TO {tabla}")
+    op.execute(f"ALTER TABLE {tabla} ADD CONSTRAINT {tabla}_pkey PRIMARY KEY (id)")
+    for nombre, columnas, unico in indices:
+        op.create_index(nombre, tabla, columnas, unique=unico)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_archivos_particiones_tabla_rango', table_name='archivos_particiones')
+    op.drop_table('archivos_particiones')
+
+    _desparticionar('logs_envio', 'fecha_intento', [
+        ('ix_logs_envio_id', ['id'], False),
+        ('ix_logs_envio_clave_documento', ['clave_documento'], False),
+    ])
+    op.execute("ALTER TABLE logs_envio ALTER COLUMN fecha_intento DROP NOT NULL")
+
+    _desparticionar('documentos_electronicos', 'fecha_emision', [
+        ('ix_documentos_electronicos_id', ['id'], False),
+        ('ix_documentos_electronicos_clave', ['clave'], True),
+    ] + [(nombre, columnas, False) for nombre, columnas in INDICES_DOCUMENTOS])
+
+    op.execute("DROP FUNCTION IF EXISTS crear_particion_mensual(text, text, date)")
@@ -0,0 +1,120 @@
+"""Resumen diario de ventas e impuestos mantenido por triggers
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2024-11-28 00:00:00
+
+Tabla resumen_diario con los totales por (emisor, día, tipo de documento,
+moneda, estado de Hacienda). Triggers por sentencia sobre
+documentos_electronicos le suman cada inserción, cambio de estado o borrado
+usando las tablas de transición, de modo que un INSERT multi-fila del
+repositorio se agrega en una sola operación. Se llena con los datos
+existentes; `python -m app.workers.reconstruir_resumen` lo recalcula.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+LLAVE = ['emisor_cedula', 'fecha', 'tipo_documento', 'codigo_moneda', 'estado_hacienda']
+MONTOS = ['total_gravado', 'total_exento', 'total_exonerado', 'total_venta', 'total_descuentos',
+          'total_venta_neta', 'total_impuesto', 'total_comprobante']
+
+
+def _filas(tabla: str, signo: int) -> str:
+    """Filas de una tabla de transición con la llave del resumen y el signo del cambio"""
+    montos = ", ".join(f"COALESCE({monto}, 0) AS {monto}" for monto in MONTOS)
+    return (
+        f"SELECT emisor_cedula, fecha_emision::date AS fecha, tipo_documento, "
+        f"COALESCE(codigo_moneda, 'CRC') AS codigo_moneda, "
+        f"COALESCE(estado_hacienda, 'pendiente') AS estado_hacienda, "
+        f"{signo} AS signo, {montos} FROM {tabla}"
+    )
+
+
+def _sumar(filas: str) -> str:
+    """Sumar al resumen el efecto neto de las filas (los cambios que se compensan no escriben)"""
+    llave = ", ".join(LLAVE)
+    sumas = ", ".join(f"sum(signo * {monto})" for monto in MONTOS)
+    cambios = " OR ".join(["sum(signo) <> 0"] + [f"sum(signo * {monto}) <> 0" for monto in MONTOS])
+    actualizar = ", ".join(f"{c} = r.{c} + EXCLUDED.{c}" for c in ['cantidad'] + MONTOS)
+    # El ORDER BY fija el orden de bloqueo entre sentencias concurrentes
+    return f"""
+        INSERT INTO resumen_diario AS r ({llave}, cantidad, {", ".join(MONTOS)}, fecha_actualizacion)
+        SELECT {llave}, sum(signo), {sumas}, now()
+        FROM ({filas}) AS delta
+        GROUP BY {llave}
+        HAVING {cambios}
+        ORDER BY {llave}
+        ON CONFLICT ({llave}) DO UPDATE SET {actualizar}, fecha_actualizacion = now()
+    """
+
+
+def _aplicar(filas: str) -> str:
+    """Sumar las filas y quitar los grupos que quedaron sin documentos"""
+    llave = ", ".join(LLAVE)
+    return f"""
+        {_sumar(filas)};
+        DELETE FROM resumen_diario r
+        USING (SELECT DISTINCT {llave} FROM ({filas}) AS delta) AS k
+        WHERE {" AND ".join(f"r.{c} = k.{c}" for c in LLAVE)} AND r.cantidad = 0;
+    """
+
+
+ACTUALIZAR_RESUMEN = f"""
+CREATE OR REPLACE FUNCTION actualizar_resumen_diario() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        {_aplicar(_filas('nuevas', 1))}
+    ELSIF TG_OP = 'UPDATE' THEN
+        {_aplicar(_filas('nuevas', 1) + ' UNION ALL ' + _filas('viejas', -1))}
+    ELSE
+        {_aplicar(_filas('viejas', -1))}
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+TRIGGERS = {
+    'resumen_diario_insert': "AFTER INSERT ON documentos_electronicos REFERENCING NEW TABLE AS nuevas",
+    'resumen_diario_update': "AFTER UPDATE ON documentos_electronicos REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas",
+    'resumen_diario_delete': "AFTER DELETE ON documentos_electronicos REFERENCING OLD TABLE AS viejas",
+}
+
+
+def upgrade() -> None:
+    op.create_table(
+        'resumen_diario',
+        sa.Column('emisor_cedula', sa.String(length=20), nullable=False),
+        sa.Column('fecha', sa.Date(), nullable=False),
+        sa.Column('tipo_documento', sa.String(length=2), nullable=False),
+        sa.Column('codigo_moneda', sa.String(length=3), nullable=False),
+        sa.Column('estado_hacienda', sa.String(length=20), nullable=False),
+        sa.Column('cantidad', sa.Integer(), nullable=False, server_default='0'),
+        *[sa.Column(monto, sa.Numeric(20, 5), nullable=False, server_default='0') for monto in MONTOS],
+        sa.Column('fecha_actualizacion', sa.DateTime(), server_default=sa.func.now()),
+        sa.PrimaryKeyConstraint(*LLAVE)
+    )
+    op.create_index('ix_resumen_diario_fecha', 'resumen_diario', ['fecha'])
+
+    op.execute(ACTUALIZAR_RESUMEN)
+    for nombre, definicion in TRIGGERS.items():
+        op.execute(f"CREATE TRIGGER {nombre} {definicion} FOR EACH STATEMENT "
+                   f"EXECUTE FUNCTION actualizar_resumen_diario()")
+
+    # Documentos existentes (los triggers ya cubren lo que se escriba desde aquí)
+    op.execute(_sumar(_filas('documentos_electronicos', 1)))
+
+
+def downgrade() -> None:
+    for nombre in TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS {nombre} ON documentos_electronicos")
+    op.execute("DROP FUNCTION IF EXISTS actualizar_resumen_diario()")
+    op.drop_index('ix_resumen_diario_fecha', table_name='resumen_diario')
+    op.drop_table('resumen_diario')
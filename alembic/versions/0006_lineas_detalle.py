@@ -0,0 +1,81 @@
+"""Líneas de detalle de los documentos con índices de búsqueda
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2024-11-29 00:00:00
+
+Tabla lineas_detalle particionada por mes de fecha_emision, igual que
+documentos_electronicos (el mantenimiento de particiones la incluye). Índices
+por CABYS, código comercial, emisor y receptor, y un índice trigram (pg_trgm)
+sobre el detalle para búsquedas por texto. Las líneas se guardan al emitir;
+los documentos anteriores a esta migración no tienen líneas.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+MESES_ADELANTE = 3
+
+INDICES = [
+    ('ix_lineas_cabys_fecha_id', ['codigo_cabys', 'fecha_emision', 'id']),
+    ('ix_lineas_codigo_comercial_fecha_id', ['codigo_comercial', 'fecha_emision', 'id']),
+    ('ix_lineas_emisor_fecha_id', ['emisor_cedula', 'fecha_emision', 'id']),
+    ('ix_lineas_receptor_fecha_id', ['receptor_cedula', 'fecha_emision', 'id']),
+]
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    op.create_table(
+        'lineas_detalle',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('clave_documento', sa.String(length=50), nullable=False),
+        sa.Column('fecha_emision', sa.DateTime(), nullable=False),
+        sa.Column('numero_linea', sa.Integer(), nullable=False),
+        sa.Column('tipo_documento', sa.String(length=2), nullable=False),
+        sa.Column('emisor_cedula', sa.String(length=20), nullable=False),
+        sa.Column('receptor_cedula', sa.String(length=20), nullable=True),
+        sa.Column('codigo_cabys', sa.String(length=13), nullable=True),
+        sa.Column('codigo_comercial_tipo', sa.String(length=2), nullable=True),
+        sa.Column('codigo_comercial', sa.String(length=20), nullable=True),
+        sa.Column('detalle', sa.String(length=200), nullable=False),
+        sa.Column('unidad_medida', sa.String(length=15), nullable=True),
+        sa.Column('codigo_moneda', sa.String(length=3), nullable=True),
+        sa.Column('cantidad', sa.Numeric(18, 5), nullable=False),
+        sa.Column('precio_unitario', sa.Numeric(18, 5), nullable=False),
+        sa.Column('monto_total', sa.Numeric(18, 5), nullable=False),
+        sa.Column('monto_descuento', sa.Numeric(18, 5), nullable=True),
+        sa.Column('subtotal', sa.Numeric(18, 5), nullable=False),
+        sa.Column('impuesto_neto', sa.Numeric(18, 5), nullable=True),
+        sa.Column('monto_total_linea', sa.Numeric(18, 5), nullable=False),
+        sa.Column('impuestos', sa.JSON(), nullable=True),
+        sa.PrimaryKeyConstraint('id', 'fecha_emision'),
+        sa.UniqueConstraint('clave_documento', 'numero_linea', 'fecha_emision', name='uq_lineas_clave_linea_fecha'),
+        postgresql_partition_by='RANGE (fecha_emision)'
+    )
+    for nombre, columnas in INDICES:
+        op.create_index(nombre, 'lineas_detalle', columnas)
+    op.create_index('ix_lineas_detalle_trgm', 'lineas_detalle', ['detalle'],
+                    postgresql_using='gin', postgresql_ops={'detalle': 'gin_trgm_ops'})
+
+    op.execute("CREATE TABLE lineas_detalle_default PARTITION OF lineas_detalle DEFAULT")
+    op.execute(f"""
+        SELECT crear_particion_mensual('lineas_detalle', 'fecha_emision', mes::date)
+        FROM generate_series(
+            date_trunc('month', now()),
+            date_trunc('month', now()) + interval '{MESES_ADELANTE} months',
+            interval '1 month'
+        ) AS mes
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('lineas_detalle')
+    # pg_trgm se deja instalada: puede usarla otro objeto de la base
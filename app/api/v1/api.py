@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from app.api.v1.endpoints import facturas, utils, documentos, emails, facturas_v44, referencias
+from app.api.v1.endpoints import facturas, utils, documentos, emails, facturas_v44, referencias, callbacks, reportes
 
 api_router = APIRouter()
 api_router.include_router(facturas.router, prefix="/facturas", tags=["facturas"])
@@ -7,4 +7,6 @@ api_router.include_router(facturas_v44.router, prefix="/facturas-v44", tags=["fa
 api_router.include_router(documentos.router, prefix="/documentos", tags=["documentos"])
 api_router.include_router(utils.router, prefix="/utils", tags=["utilidades"])
 api_router.include_router(emails.router, prefix="/emails", tags=["correos"])
-api_router.include_router(referencias.router, prefix="/referencias", tags=["referencias"])
\ No newline at end of file
+api_router.include_router(referencias.router, prefix="/referencias", tags=["referencias"])
+api_router.include_router(callbacks.router, prefix="/callbacks", tags=["callbacks"])
+api_router.include_router(reportes.router, prefix="/reportes", tags=["reportes"])
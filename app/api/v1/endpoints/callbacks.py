@@ -0,0 +1,65 @@
+import logging
+import secrets
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Body, HTTPException, Query
+
+from app.core.config import settings
+from app.core.metrics import metricas
+from app.services.repositorio_documentos import repositorio_documentos
+from app.services.respuesta_hacienda import ESTADOS_FINALES, interpretar_respuesta, verificar_respuesta
+from app.services.sondeo_estados import planificador_sondeo
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+@router.post("/hacienda", summary="Callback de Recepción de Hacienda")
+async def callback_hacienda(
+    notificacion: Dict[str, Any] = Body(...),
+    token: Optional[str] = Query(None, description="Secreto compartido incluido en el callbackUrl")
+):
+    """
+    Recibir la notificación de Hacienda con el resultado de un comprobante.
+
+    Hacienda envía `clave`, `fecha`, `ind-estado` y `respuesta-xml` (MensajeHacienda
+    en base64). La notificación se verifica y se aplica de forma idempotente: las
+    repeticiones y los estados ya finales no cambian el documento.
+    """
+    if settings.hacienda_callback_token and not secrets.compare_digest(
+        token or "", settings.hacienda_callback_token
+    ):
+        metricas.incrementar("callbacks_hacienda", resultado="no_autorizado")
+        raise HTTPException(status_code=403, detail="Token de callback inválido")
+
+    clave = notificacion.get('clave')
+    if not clave:
+        raise HTTPException(status_code=400, detail="Falta la clave del comprobante")
+
+    problema = verificar_respuesta(clave, notificacion)
+    if problema:
+        metricas.incrementar("callbacks_hacienda", resultado="invalido")
+        logger.warning(f"⚠️ Callback rechazado para {clave}: {problema}")
+        raise HTTPException(status_code=400, detail=problema)
+
+    interpretado = interpretar_respuesta(clave, notificacion)
+    estado = interpretado['estado']
+    if estado not in ESTADOS_FINALES:
+        # Estado intermedio: el resultado final llegará en otro callback o por sondeo
+        metricas.incrementar("callbacks_hacienda", resultado="intermedio")
+        return {"clave": clave, "estado": estado, "actualizado": False}
+
+    try:
+        actualizado = await repositorio_documentos.actualizar_estado_hacienda(
+            clave, estado, interpretado['mensaje'], interpretado['respuesta']
+        )
+    except Exception as e:
+        logger.error(f"❌ No se pudo guardar el callback de {clave}: {e}")
+        raise HTTPException(status_code=503, detail="No se pudo guardar el estado")
+
+    await planificador_sondeo.finalizar(clave)
+    metricas.incrementar("callbacks_hacienda", resultado="aplicado" if actualizado else "repetido")
+    logger.info(f"📨 Callback de Hacienda para {clave}: {estado}")
+
+    return {"clave": clave, "estado": estado, "actualizado": actualizado}
@@ -1,98 +1,257 @@
 from fastapi import APIRouter, HTTPException, Query
-from typing import List, Optional
+from fastapi.responses import Response, StreamingResponse
+from typing import AsyncIterator, List, Optional
 from datetime import datetime, timedelta
+import asyncio
+import json
+import logging
+from app.schemas.documento import EstadoMasivoRequest
+from app.services.almacen_blobs import almacen_blobs
+from app.services.cache_estados import cache_estados
+from app.services.cola_envios import cola_envios
 from app.services.hacienda_client import HaciendaClient
+from app.services.particiones import gestor_particiones
+from app.services.pdf_generator_official import pdf_generator_official
+from app.services.repositorio_documentos import repositorio_documentos
+from app.services.respuesta_hacienda import ESTADOS_FINALES, interpretar_respuesta
+from app.services.sondeo_estados import planificador_sondeo
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 hacienda_client = HaciendaClient()
 
+# Claves resueltas por tramo contra el almacén antes de consultar a Hacienda
+LOTE_ESTADO_MASIVO = 500
+
 @router.get("/{clave}", summary="Consultar Estado de Documento")
 async def consultar_documento(clave: str):
     """
-    Consultar el estado de un documento electrónico en el sistema de Hacienda.
+    Consultar un documento electrónico y su estado en Hacienda según lo guardado.
+    
+    El estado se mantiene al día por callbacks y por el sondeo de los workers,
+    así que esta consulta no llama a Hacienda. La respuesta se sirve desde la
+    caché de Redis (sin expiración para aceptado/rechazado). Si el documento ya
+    salió de la ventana de retención se busca en las particiones archivadas.
     
     - **clave**: Clave única del documento de 50 caracteres
     """
     if len(clave) != 50:
         raise HTTPException(status_code=400, detail="La clave debe tener exactamente 50 caracteres")
     
+    resultado = await cache_estados.obtener(clave, lambda: _cargar_documento(clave))
+    if resultado is None:
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+    return resultado
+
+async def _cargar_documento(clave: str) -> Optional[dict]:
+    """Documento tal como lo entrega la consulta por clave (None si no existe)"""
     try:
-        estado = await hacienda_client.consultar_estado(clave)
-        return {
-            "clave": clave,
-            "estado": estado.get("ind-estado", "desconocido"),
-            "fecha_procesamiento": estado.get("fecha-procesamiento"),
-            "mensaje_hacienda": estado.get("mensaje-hacienda"),
-            "respuesta_xml": estado.get("respuesta-xml")
-        }
+        documento = await repositorio_documentos.obtener(clave)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al consultar documento: {str(e)}")
+    if documento is None:
+        return await _consultar_archivado(clave)
+    
+    respuesta = documento.respuesta_hacienda or {}
+    try:
+        respuesta_xml = await repositorio_documentos.obtener_respuesta_xml(documento)
+    except Exception as e:
+        logger.warning(f"⚠️ MensajeHacienda de {clave} no disponible: {e}")
+        respuesta_xml = None
+    return {
+        "clave": clave,
+        "tipo_documento": documento.tipo_documento,
+        "numero_consecutivo": documento.numero_consecutivo,
+        "fecha_emision": documento.fecha_emision.isoformat(),
+        "emisor_cedula": documento.emisor_cedula,
+        "receptor_nombre": documento.receptor_nombre,
+        "total_comprobante": documento.total_comprobante,
+        "estado_local": documento.estado_local,
+        "estado": documento.estado_hacienda or "pendiente",
+        "intentos_envio": documento.intentos_envio,
+        "fecha_procesamiento": respuesta.get("fecha-procesamiento"),
+        "mensaje_hacienda": documento.mensaje_hacienda,
+        "respuesta_xml": respuesta_xml
+    }
+
+async def _consultar_archivado(clave: str) -> Optional[dict]:
+    """Documento de una partición ya archivada (fuera de la ventana de retención)"""
+    try:
+        archivados = await gestor_particiones.buscar_archivado("documentos_electronicos", clave)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al consultar el archivo: {str(e)}")
+    if not archivados:
+        return None
+    
+    documento = archivados[-1]
+    respuesta = documento.get("respuesta_hacienda") or {}
+    respuesta_xml = None
+    if documento.get("respuesta_xml_ref"):
+        respuesta_xml = await almacen_blobs.obtener_texto(documento["respuesta_xml_ref"])
+    return {
+        "clave": clave,
+        "tipo_documento": documento["tipo_documento"],
+        "numero_consecutivo": documento["numero_consecutivo"],
+        "fecha_emision": documento["fecha_emision"],
+        "emisor_cedula": documento["emisor_cedula"],
+        "receptor_nombre": documento.get("receptor_nombre"),
+        "total_comprobante": documento.get("total_comprobante"),
+        "estado_local": documento.get("estado_local"),
+        "estado": documento.get("estado_hacienda") or "pendiente",
+        "intentos_envio": documento.get("intentos_envio"),
+        "fecha_procesamiento": respuesta.get("fecha-procesamiento"),
+        "mensaje_hacienda": documento.get("mensaje_hacienda"),
+        "respuesta_xml": respuesta_xml,
+        "archivado": True
+    }
 
 @router.get("/", summary="Listar Documentos")
 async def listar_documentos(
     fecha_inicio: Optional[datetime] = Query(None, description="Fecha de inicio (YYYY-MM-DD)"),
     fecha_fin: Optional[datetime] = Query(None, description="Fecha de fin (YYYY-MM-DD)"),
     tipo_documento: Optional[str] = Query(None, description="Tipo: 01=Factura, 02=ND, 03=NC, 04=Tiquete"),
-    estado: Optional[str] = Query(None, description="Estado del documento"),
-    limit: int = Query(50, description="Número máximo de resultados", le=200),
-    offset: int = Query(0, description="Número de registros a saltar")
+    estado: Optional[str] = Query(None, description="Estado del documento en Hacienda"),
+    emisor: Optional[str] = Query(None, description="Cédula del emisor"),
+    cursor: Optional[str] = Query(None, description="Cursor devuelto en 'siguiente_cursor' de la página anterior"),
+    limit: int = Query(50, description="Número máximo de resultados", ge=1, le=200),
+    incluir_total: bool = Query(False, description="Contar el total exacto (más costoso en rangos grandes)")
 ):
     """
     Listar documentos electrónicos con filtros opcionales.
+    
+    Ordenados del más reciente al más antiguo y paginados por cursor: para la
+    siguiente página enviar el `siguiente_cursor` recibido con los mismos filtros.
     """
     if not fecha_inicio:
         fecha_inicio = datetime.now() - timedelta(days=30)
     if not fecha_fin:
         fecha_fin = datetime.now()
     
-    # Aquí iría la lógica para consultar la base de datos
-    # Por ahora retornamos datos de ejemplo
-    documentos_ejemplo = [
+    try:
+        pagina = await repositorio_documentos.listar(
+            emisor=emisor,
+            tipo_documento=tipo_documento,
+            estado=estado,
+            fecha_inicio=fecha_inicio,
+            fecha_fin=fecha_fin,
+            cursor=cursor,
+            limite=limit,
+            incluir_total=incluir_total
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    documentos = [
         {
-            "clave": "506241120241234567890123456789012345678901234567",
-            "tipo_documento": "01",
-            "numero_consecutivo": "00100001010000000001000001",
-            "fecha_emision": "2024-11-24T10:30:00",
-            "estado": "aceptado",
-            "monto_total": 115000.00,
-            "receptor_nombre": "Cliente Ejemplo S.A."
+            "clave": fila["clave"],
+            "tipo_documento": fila["tipo_documento"],
+            "numero_consecutivo": fila["numero_consecutivo"],
+            "fecha_emision": fila["fecha_emision"].isoformat(),
+            "emisor_cedula": fila["emisor_cedula"],
+            "estado_local": fila["estado_local"],
+            "estado": fila["estado_hacienda"] or "pendiente",
+            "monto_total": float(fila["total_comprobante"]) if fila["total_comprobante"] is not None else None,
+            "codigo_moneda": fila["codigo_moneda"],
+            "receptor_nombre": fila["receptor_nombre"]
         }
+        for fila in pagina['documentos']
     ]
     
     return {
-        "documentos": documentos_ejemplo,
-        "total": 1,
+        "documentos": documentos,
+        "total": pagina['total'],
         "limit": limit,
-        "offset": offset,
+        "siguiente_cursor": pagina['siguiente_cursor'],
         "filtros": {
             "fecha_inicio": fecha_inicio.isoformat(),
             "fecha_fin": fecha_fin.isoformat(),
             "tipo_documento": tipo_documento,
-            "estado": estado
+            "estado": estado,
+            "emisor": emisor
         }
     }
 
+async def _flujo_estados(claves: List[str], concurrencia: Optional[int]) -> AsyncIterator[str]:
+    """Resolver estados por tramos: primero los finales guardados, luego Hacienda"""
+    for inicio in range(0, len(claves), LOTE_ESTADO_MASIVO):
+        lote = list(dict.fromkeys(claves[inicio:inicio + LOTE_ESTADO_MASIVO]))
+        
+        try:
+            almacenados = await repositorio_documentos.obtener_estados_finales(lote)
+        except Exception as e:
+            logger.warning(f"⚠️ Almacén de estados no disponible: {e}")
+            almacenados = {}
+        
+        for clave, guardado in almacenados.items():
+            yield json.dumps({
+                "clave": clave,
+                "estado": guardado['estado'],
+                "mensaje_hacienda": guardado['mensaje'],
+                "origen": "almacen"
+            }, ensure_ascii=False) + "\n"
+        
+        pendientes = [clave for clave in lote if clave not in almacenados]
+        async for respuesta in hacienda_client.consultar_flujo(pendientes, concurrencia):
+            clave = respuesta['clave']
+            interpretado = interpretar_respuesta(clave, respuesta)
+            if interpretado['estado'] in ESTADOS_FINALES:
+                try:
+                    await repositorio_documentos.actualizar_estado_hacienda(
+                        clave, interpretado['estado'], interpretado['mensaje'], interpretado['respuesta']
+                    )
+                    await planificador_sondeo.finalizar(clave)
+                except Exception as e:
+                    logger.warning(f"⚠️ No se pudo guardar el estado de {clave}: {e}")
+            
+            yield json.dumps({
+                "clave": clave,
+                "estado": interpretado['estado'],
+                "fecha_procesamiento": respuesta.get("fecha-procesamiento"),
+                "mensaje_hacienda": interpretado['mensaje'],
+                "origen": "hacienda"
+            }, ensure_ascii=False) + "\n"
+
+@router.post("/estado-masivo", summary="Consultar Estado de Múltiples Documentos")
+async def consultar_estado_masivo(solicitud: EstadoMasivoRequest):
+    """
+    Consultar el estado de muchos documentos a la vez.
+    
+    La respuesta es NDJSON (una línea JSON por clave) y se transmite a medida que
+    cada consulta termina, sin esperar al lote completo. Los documentos que ya
+    tienen estado final guardado no se consultan a Hacienda.
+    
+    - **claves**: Claves de 50 caracteres
+    - **concurrencia**: Consultas simultáneas a Hacienda (opcional)
+    """
+    return StreamingResponse(
+        _flujo_estados(solicitud.claves, solicitud.concurrencia),
+        media_type="application/x-ndjson"
+    )
+
 @router.post("/{clave}/reenviar", summary="Reenviar Documento a Hacienda")
 async def reenviar_documento(clave: str):
     """
-    Reenviar un documento electrónico al sistema de Hacienda.
+    Volver a encolar el XML firmado guardado para entregarlo a Hacienda.
     """
     if len(clave) != 50:
         raise HTTPException(status_code=400, detail="La clave debe tener exactamente 50 caracteres")
     
     try:
-        # Aquí buscaríamos el XML en la base de datos
-        # Por ahora simulamos el reenvío
-        resultado = await hacienda_client.reenviar_documento(clave)
-        return {
-            "clave": clave,
-            "estado": "reenviado",
-            "mensaje": "Documento reenviado exitosamente",
-            "fecha_reenvio": datetime.now().isoformat(),
-            "respuesta_hacienda": resultado
-        }
+        xml_firmado = await repositorio_documentos.obtener_xml(clave, firmado=True)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al reenviar documento: {str(e)}")
+    if xml_firmado is None:
+        raise HTTPException(status_code=404, detail="Documento no encontrado o sin XML firmado")
+    
+    encolado = await cola_envios.encolar(clave, xml_firmado)
+    return {
+        "clave": clave,
+        "estado": "reenviado" if encolado else "ya_en_cola_o_entregado",
+        "mensaje": "Documento encolado para reenvío" if encolado
+                   else "El documento ya está en la cola o ya fue entregado a Hacienda",
+        "fecha_reenvio": datetime.now().isoformat()
+    }
 
 @router.delete("/{clave}", summary="Anular Documento")
 async def anular_documento(clave: str, motivo: str):
@@ -123,26 +282,38 @@ async def anular_documento(clave: str, motivo: str):
 @router.get("/{clave}/pdf", summary="Descargar PDF del Comprobante")
 async def descargar_pdf(clave: str):
     """
-    Generar y descargar el PDF de un documento electrónico.
+    Descargar el PDF de un documento electrónico.
+    
+    Se genera a partir del XML guardado la primera vez que se pide y queda en
+    el almacén de blobs para las siguientes descargas.
     """
     if len(clave) != 50:
         raise HTTPException(status_code=400, detail="La clave debe tener exactamente 50 caracteres")
     
     try:
-        # Aquí iría la lógica para generar el PDF
-        return {
-            "clave": clave,
-            "pdf_url": f"/api/v1/documentos/{clave}/download",
-            "pdf_generado": True,
-            "fecha_generacion": datetime.now().isoformat()
-        }
+        pdf = await repositorio_documentos.obtener_pdf(clave)
+        if pdf is None:
+            xml = await repositorio_documentos.obtener_xml(clave, firmado=True) or \
+                await repositorio_documentos.obtener_xml(clave, firmado=False)
+            if xml is None:
+                raise HTTPException(status_code=404, detail="Documento no encontrado o XML no disponible")
+            pdf = await asyncio.to_thread(pdf_generator_official.generar_pdf_factura, xml)
+            await repositorio_documentos.guardar_pdf(clave, pdf)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al generar PDF: {str(e)}")
+    
+    return Response(
+        content=pdf,
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'inline; filename="{clave}.pdf"'}
+    )
 
 @router.get("/{clave}/xml", summary="Obtener XML del Documento")
 async def obtener_xml(clave: str, firmado: bool = True):
     """
-    Obtener el XML de un documento electrónico.
+    Obtener el XML guardado de un documento electrónico.
     
     - **clave**: Clave del documento
     - **firmado**: Si se debe retornar el XML firmado (default: True)
@@ -151,13 +322,15 @@ async def obtener_xml(clave: str, firmado: bool = True):
         raise HTTPException(status_code=400, detail="La clave debe tener exactamente 50 caracteres")
     
     try:
-        # Aquí buscaríamos el XML en la base de datos
-        return {
-            "clave": clave,
-            "xml_disponible": True,
-            "firmado": firmado,
-            "xml_content": "<?xml version='1.0' encoding='UTF-8'?>...",  # XML real aquí
-            "fecha_generacion": datetime.now().isoformat()
-        }
+        xml = await repositorio_documentos.obtener_xml(clave, firmado=firmado)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al obtener XML: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error al obtener XML: {str(e)}")
+    if xml is None:
+        raise HTTPException(status_code=404, detail="Documento no encontrado o XML no disponible")
+    
+    return {
+        "clave": clave,
+        "xml_disponible": True,
+        "firmado": firmado,
+        "xml_content": xml
+    }
@@ -59,7 +59,7 @@ async def enviar_factura_email(
         
         # Simular XML (en implementación real lo obtendrías de la BD)
         xml_content = f'''<?xml version="1.0" encoding="UTF-8"?>
-<FacturaElectronica xmlns="https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronicaV44">
+<FacturaElectronica xmlns="https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronica">
     <Clave>{clave}</Clave>
     <NumeroConsecutivo>{datos_factura['numero_consecutivo']}</NumeroConsecutivo>
     <FechaEmision>{datos_factura['fecha_emision']}</FechaEmision>
@@ -206,7 +206,7 @@ async def enviar_email_prueba(
         }
         
         xml_prueba = '''<?xml version="1.0" encoding="UTF-8"?>
-<FacturaElectronica xmlns="https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronicaV44">
+<FacturaElectronica xmlns="https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronica">
     <Clave>50624112024310277607901001000012345678901234567890</Clave>
     <NumeroConsecutivo>01001000012345678901</NumeroConsecutivo>
     <FechaEmision>2025-08-15T20:00:00</FechaEmision>
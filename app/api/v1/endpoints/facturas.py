@@ -1,9 +1,16 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from typing import List
+from fastapi import APIRouter, HTTPException, Query
+from typing import List, Optional
+from app.core.config import settings
 from app.schemas.factura import FacturaCreate, FacturaResponse, FacturaElectronica
 from app.services.xml_generator_official import xml_generator_official
+from app.services.xml_generator import xml_generator
 from app.services.xml_signer_simple import signer
+from app.api.v1.idempotencia import idempotente
 from app.services.hacienda_client import HaciendaClient
+from app.services.cola_envios import cola_envios
+from app.services.repositorio_documentos import datos_documento, datos_lineas, repositorio_documentos
+from app.services.consecutivos import asignador_consecutivos
+from app.services.resiliencia import circuito_hacienda
 import uuid
 from datetime import datetime
 
@@ -11,9 +18,9 @@ router = APIRouter()
 hacienda_client = HaciendaClient()
 
 @router.post("/", response_model=FacturaResponse, summary="Crear Factura Electrónica")
+@idempotente
 async def crear_factura(
     factura_data: FacturaCreate,
-    background_tasks: BackgroundTasks,
     firmar: bool = True,
     enviar_hacienda: bool = True
 ):
@@ -27,12 +34,29 @@ async def crear_factura(
     Retorna la clave única del documento y el estado actual.
     """
     try:
-        consecutivo = await hacienda_client.obtener_consecutivo("01")
+        consecutivo = await hacienda_client.obtener_consecutivo(
+            "01", factura_data.emisor.identificacion_numero
+        )
+        
+        # Con el circuito de Hacienda abierto se emite en contingencia
+        contingencia = enviar_hacienda and await circuito_hacienda.esta_abierto()
+        fecha_emision = datetime.now()
+        clave = await hacienda_client.generar_clave(
+            pais="506",
+            dia=fecha_emision.strftime("%d"),
+            mes=fecha_emision.strftime("%m"),
+            anno=fecha_emision.strftime("%Y"),
+            cedula_emisor=factura_data.emisor.identificacion_numero,
+            tipo_documento="01",
+            numero_consecutivo=consecutivo,
+            situacion=settings.situacion_contingencia if contingencia else "1"
+        )
         
         factura = FacturaElectronica(
+            clave=clave,
             codigo_actividad=factura_data.codigo_actividad,
             numero_consecutivo=consecutivo,
-            fecha_emision=datetime.now(),
+            fecha_emision=fecha_emision,
             emisor=factura_data.emisor,
             receptor=factura_data.receptor,
             condicion_venta=factura_data.condicion_venta,
@@ -51,14 +75,20 @@ async def crear_factura(
             except Exception as e:
                 raise HTTPException(status_code=400, detail=f"Error al firmar documento: {str(e)}")
         
+        # Persistir antes de encolar: el worker, el sondeo y el callback actualizan la fila por clave
+        await repositorio_documentos.guardar(datos_documento(
+            factura, "01", xml_sin_firmar, xml_firmado,
+            estado_local="firmado" if xml_firmado else "generado"
+        ), datos_lineas(factura, "01"))
+        
         if enviar_hacienda and xml_firmado:
-            background_tasks.add_task(enviar_a_hacienda, factura.clave, xml_firmado)
+            await cola_envios.encolar(factura.clave, xml_firmado, contingencia=contingencia)
         
         return FacturaResponse(
             clave=factura.clave,
             numero_consecutivo=consecutivo,
             fecha_emision=factura.fecha_emision,
-            estado="generada" if not enviar_hacienda else "enviando",
+            estado="generada" if not enviar_hacienda else "contingencia" if contingencia else "enviando",
             xml_firmado=xml_firmado if firmar else xml_sin_firmar
         )
         
@@ -66,6 +96,7 @@ async def crear_factura(
         raise HTTPException(status_code=500, detail=f"Error al crear factura: {str(e)}")
 
 @router.post("/notas-credito", response_model=FacturaResponse, summary="Crear Nota de Crédito")
+@idempotente
 async def crear_nota_credito(
     nota_data: FacturaCreate,
     factura_referencia: str,
@@ -81,7 +112,9 @@ async def crear_nota_credito(
     - **motivo**: Motivo de la nota de crédito
     """
     try:
-        consecutivo = await hacienda_client.obtener_consecutivo("03")
+        consecutivo = await hacienda_client.obtener_consecutivo(
+            "03", nota_data.emisor.identificacion_numero
+        )
         
         nota = FacturaElectronica(
             codigo_actividad=nota_data.codigo_actividad,
@@ -113,6 +146,7 @@ async def crear_nota_credito(
         raise HTTPException(status_code=500, detail=f"Error al crear nota de crédito: {str(e)}")
 
 @router.post("/tiquetes", response_model=FacturaResponse, summary="Crear Tiquete Electrónico")
+@idempotente
 async def crear_tiquete(
     tiquete_data: FacturaCreate,
     firmar: bool = True,
@@ -122,7 +156,9 @@ async def crear_tiquete(
     Crear un tiquete electrónico (para ventas de consumidor final).
     """
     try:
-        consecutivo = await hacienda_client.obtener_consecutivo("04")
+        consecutivo = await hacienda_client.obtener_consecutivo(
+            "04", tiquete_data.emisor.identificacion_numero
+        )
         
         tiquete = FacturaElectronica(
             codigo_actividad=tiquete_data.codigo_actividad,
@@ -154,6 +190,7 @@ async def crear_tiquete(
         raise HTTPException(status_code=500, detail=f"Error al crear tiquete: {str(e)}")
 
 @router.post("/notas-debito", response_model=FacturaResponse, summary="Crear Nota de Débito")
+@idempotente
 async def crear_nota_debito(
     nota_data: FacturaCreate,
     factura_referencia: str,
@@ -169,7 +206,9 @@ async def crear_nota_debito(
     - **motivo**: Motivo de la nota de débito
     """
     try:
-        consecutivo = await hacienda_client.obtener_consecutivo("02")
+        consecutivo = await hacienda_client.obtener_consecutivo(
+            "02", nota_data.emisor.identificacion_numero
+        )
         
         nota = FacturaElectronica(
             codigo_actividad=nota_data.codigo_actividad,
@@ -201,9 +240,9 @@ async def crear_nota_debito(
         raise HTTPException(status_code=500, detail=f"Error al crear nota de débito: {str(e)}")
 
 @router.post("/facturas-exportacion", response_model=FacturaResponse, summary="Crear Factura de Exportación")
+@idempotente
 async def crear_factura_exportacion(
     factura_data: FacturaCreate,
-    background_tasks: BackgroundTasks,
     firmar: bool = True,
     enviar_hacienda: bool = True
 ):
@@ -215,12 +254,29 @@ async def crear_factura_exportacion(
     - **enviar_hacienda**: Si se debe enviar automáticamente a Hacienda (default: True)
     """
     try:
-        consecutivo = await hacienda_client.obtener_consecutivo("05")
+        consecutivo = await hacienda_client.obtener_consecutivo(
+            "05", factura_data.emisor.identificacion_numero
+        )
+        
+        # Con el circuito de Hacienda abierto se emite en contingencia
+        contingencia = enviar_hacienda and await circuito_hacienda.esta_abierto()
+        fecha_emision = datetime.now()
+        clave = await hacienda_client.generar_clave(
+            pais="506",
+            dia=fecha_emision.strftime("%d"),
+            mes=fecha_emision.strftime("%m"),
+            anno=fecha_emision.strftime("%Y"),
+            cedula_emisor=factura_data.emisor.identificacion_numero,
+            tipo_documento="05",
+            numero_consecutivo=consecutivo,
+            situacion=settings.situacion_contingencia if contingencia else "1"
+        )
         
         factura = FacturaElectronica(
+            clave=clave,
             codigo_actividad=factura_data.codigo_actividad,
             numero_consecutivo=consecutivo,
-            fecha_emision=datetime.now(),
+            fecha_emision=fecha_emision,
             emisor=factura_data.emisor,
             receptor=factura_data.receptor,
             condicion_venta=factura_data.condicion_venta,
@@ -239,45 +295,48 @@ async def crear_factura_exportacion(
             except Exception as e:
                 raise HTTPException(status_code=400, detail=f"Error al firmar documento: {str(e)}")
         
+        # Persistir antes de encolar: el worker, el sondeo y el callback actualizan la fila por clave
+        await repositorio_documentos.guardar(datos_documento(
+            factura, "05", xml_sin_firmar, xml_firmado,
+            estado_local="firmado" if xml_firmado else "generado"
+        ), datos_lineas(factura, "05"))
+        
         if enviar_hacienda and xml_firmado:
-            background_tasks.add_task(enviar_a_hacienda, factura.clave, xml_firmado)
+            await cola_envios.encolar(factura.clave, xml_firmado, contingencia=contingencia)
         
         return FacturaResponse(
             clave=factura.clave,
             numero_consecutivo=consecutivo,
             fecha_emision=factura.fecha_emision,
-            estado="generada" if not enviar_hacienda else "enviando",
+            estado="generada" if not enviar_hacienda else "contingencia" if contingencia else "enviando",
             xml_firmado=xml_firmado if firmar else xml_sin_firmar
         )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al crear factura de exportación: {str(e)}")
 
-async def enviar_a_hacienda(clave: str, xml_firmado: str):
-    """
-    Tarea en background para enviar documento a Hacienda
-    """
-    try:
-        resultado = await hacienda_client.enviar_documento(clave, xml_firmado)
-        print(f"Documento {clave} enviado a Hacienda: {resultado}")
-    except Exception as e:
-        print(f"Error al enviar documento {clave} a Hacienda: {e}")
-
-@router.get("/consecutivos/{tipo_documento}", summary="Obtener Próximo Consecutivo")
-async def obtener_consecutivo(tipo_documento: str):
+@router.get("/consecutivos/{tipo_documento}", summary="Consultar Próximo Consecutivo")
+async def obtener_consecutivo(
+    tipo_documento: str,
+    emisor: str = Query(..., description="Número de identificación del emisor"),
+    sucursal: Optional[str] = Query(None, description="Sucursal (3 dígitos)"),
+    terminal: Optional[str] = Query(None, description="Terminal (5 dígitos)")
+):
     """
-    Obtener el próximo número consecutivo para un tipo de documento desde Hacienda.
+    Consultar el próximo número consecutivo de un emisor sin consumirlo.
     
     - **tipo_documento**: 01=Factura, 02=Nota Débito, 03=Nota Crédito, 04=Tiquete
     """
     try:
-        consecutivo = await hacienda_client.obtener_consecutivo(tipo_documento)
+        consecutivo = await asignador_consecutivos.consultar_siguiente(emisor, tipo_documento, sucursal, terminal)
         
         return {
             "tipo_documento": tipo_documento,
             "consecutivo": consecutivo,
             "timestamp": datetime.now().isoformat(),
-            "fuente": "hacienda_api"
+            "fuente": "asignador_consecutivos"
         }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error obteniendo consecutivo: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error obteniendo consecutivo: {str(e)}")
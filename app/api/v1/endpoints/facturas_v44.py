@@ -1,12 +1,20 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Query
 from typing import List
-from app.schemas.factura_v44 import FacturaCreateV44, FacturaResponse, FacturaElectronicaV44
-from app.services.xml_generator_v44 import xml_generator_v44
-from app.services.xsd_validator import xsd_validator
-from app.services.pdf_generator_official import pdf_generator_official
+from app.schemas.factura_v44 import FacturaCreateV44, FacturaResponse, FacturaElectronicaV44, MensajeReceptorCreateV44
+from app.services.xsd_validator import xsd_validator, validador_para
+from app.services.xml_generator_v44 import (
+    MENSAJE_RECEPTOR_V44, TIPO_MENSAJE_RECEPTOR, TIPOS_V44, tipo_comprobante, xml_generator_v44
+)
+from app.services.pipeline_documentos import pipeline_documentos
+from app.services.calculo_totales import calculadora_totales
+from app.services.cache_emisores import cache_emisores
 from app.services.email_service import email_service
 from app.services.xml_signer_production import signer_production as signer
+from app.api.v1.idempotencia import idempotente
 from app.services.hacienda_client import HaciendaClient
+from app.services.cola_envios import cola_envios
+from app.services.repositorio_documentos import datos_documento, datos_lineas, repositorio_documentos
+from app.services.resiliencia import circuito_hacienda
 from app.core.config import settings
 import uuid
 from datetime import datetime
@@ -16,34 +24,58 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 hacienda_client = HaciendaClient()
 
-@router.post("/", response_model=FacturaResponse, summary="Crear Factura Electrónica v4.4")
-async def crear_factura_v44(
+# Clave y consecutivo con el formato del XSD para validar el XML antes de asignar los definitivos
+CLAVE_PROVISIONAL = "0" * 50
+CONSECUTIVO_PROVISIONAL = "0" * 20
+
+MODOS_TOTALES = ("calcular: los montos de las líneas y del resumen se calculan de cantidad, precio, "
+                 "descuentos e impuestos; validar: igual, pero si los montos enviados no cuadran responde 422 "
+                 "con las diferencias")
+
+
+def validar_totales(factura_data: FacturaCreateV44) -> None:
+    """422 con las diferencias si los montos enviados no cuadran con los calculados"""
+    diferencias = calculadora_totales.validar(
+        [d.model_dump() for d in factura_data.detalles_servicio],
+        factura_data.resumen_factura.model_dump(),
+        [c.model_dump() for c in factura_data.otros_cargos or []],
+        factura_data.medio_pago
+    )
+    if diferencias:
+        raise HTTPException(status_code=422, detail={
+            "mensaje": "Los montos enviados no cuadran con los calculados de las líneas",
+            "diferencias": diferencias
+        })
+
+async def emitir_v44(
+    tipo: str,
     factura_data: FacturaCreateV44,
-    background_tasks: BackgroundTasks,
-    firmar: bool = True,
-    enviar_hacienda: bool = True,
-    enviar_email: bool = True
-):
+    firmar: bool,
+    enviar_hacienda: bool,
+    enviar_email: bool,
+    totales: str
+) -> FacturaResponse:
     """
-    Crear una nueva factura electrónica según normativa v4.4 oficial del Ministerio de Hacienda de Costa Rica.
-    
-    - **factura_data**: Datos de la factura con estructura v4.4 completa
-    - **firmar**: Si se debe firmar digitalmente el documento (default: True)
-    - **enviar_hacienda**: Si se debe enviar automáticamente a Hacienda (default: True)
-    - **enviar_email**: Si se debe enviar por email (default: True)
-    
-    Retorna la clave única del documento y el estado actual.
+    Flujo común de emisión v4.4 para todos los tipos de comprobante: consecutivo y clave,
+    XML del tipo (validado contra su XSD), firma, persistencia, cola de Hacienda y email.
     """
     try:
-        # Obtener consecutivo
-        consecutivo = await hacienda_client.obtener_consecutivo("01")
+        # Con totales=validar, los montos que no cuadran se rechazan antes de asignar consecutivo
+        if totales == "validar":
+            validar_totales(factura_data)
+        
+        # La factura de compra la emite el receptor: consecutivo y clave con su cédula
+        tipo_comprobante_v44 = tipo_comprobante(tipo)
+        obligado = factura_data.receptor if tipo_comprobante_v44.emite_receptor else factura_data.emisor
+        if obligado is None:
+            raise HTTPException(status_code=422, detail=f"{tipo_comprobante_v44.nombre} requiere receptor")
         
-        # Crear objeto factura completo
+        # Crear objeto factura completo (clave y consecutivo provisionales hasta validar contra el XSD)
         factura = FacturaElectronicaV44(
             proveedor_sistemas=factura_data.proveedor_sistemas or settings.proveedor_sistemas,
             codigo_actividad_emisor=factura_data.codigo_actividad_emisor,
             codigo_actividad_receptor=factura_data.codigo_actividad_receptor,
-            numero_consecutivo=consecutivo,
+            numero_consecutivo=CONSECUTIVO_PROVISIONAL,
             fecha_emision=datetime.now(),
             emisor=factura_data.emisor,
             receptor=factura_data.receptor,
@@ -57,26 +89,17 @@ async def crear_factura_v44(
             informacion_referencia=factura_data.informacion_referencia
         )
         
-        # Generar clave única
-        factura.clave = await hacienda_client.generar_clave(
-            pais="506",
-            dia=datetime.now().strftime("%d"),
-            mes=datetime.now().strftime("%m"),
-            anno=datetime.now().strftime("%Y"),
-            cedula_emisor=factura.emisor.identificacion_numero,
-            tipo_documento="01",
-            numero_consecutivo=consecutivo
-        )
-        
-        # Preparar datos para el generador XML
+        # Preparar datos para el generador XML (el emisor validado sale de la caché de emisores)
+        perfil_emisor = cache_emisores.perfil(factura.emisor)
         datos_xml = {
-            'clave': factura.clave,
+            'clave': CLAVE_PROVISIONAL,
             'proveedor_sistemas': factura.proveedor_sistemas,
             'codigo_actividad_emisor': factura.codigo_actividad_emisor,
             'codigo_actividad_receptor': factura.codigo_actividad_receptor,
             'numero_consecutivo': factura.numero_consecutivo,
             'fecha_emision': factura.fecha_emision,
-            'emisor': factura.emisor.model_dump(),
+            'emisor': perfil_emisor.datos,
+            'perfil_emisor': perfil_emisor,
             'receptor': factura.receptor.model_dump() if factura.receptor else None,
             'condicion_venta': factura.condicion_venta,
             'condicion_venta_otros': factura.condicion_venta_otros,
@@ -88,26 +111,60 @@ async def crear_factura_v44(
             'informacion_referencia': [r.model_dump() for r in factura.informacion_referencia] if factura.informacion_referencia else []
         }
         
-        # Generar XML v4.4
-        xml_sin_firmar = xml_generator_v44.generar_xml_factura(datos_xml)
+        # Generar XML v4.4 (validación, firma y PDF usan el mismo árbol)
+        documento = pipeline_documentos.generar(datos_xml, tipo)
+        
+        # Guardar los montos calculados, los mismos del XML
+        calculadora_totales.aplicar(factura, documento.datos['detalles_servicio'], documento.datos['resumen'])
         
-        # Validar contra XSD
-        validacion = xsd_validator.validate_and_report(xml_sin_firmar)
+        # Un XML que no cumple el XSD no se firma, guarda ni encola; se rechaza antes de gastar consecutivo
+        validacion = pipeline_documentos.validar(documento)
         if not validacion['valido']:
             logger.error(f"XML no válido según XSD: {validacion['errores']}")
-            # Continuar con advertencia pero no fallar
+            raise HTTPException(status_code=422, detail={
+                "mensaje": f"El XML generado no cumple el XSD de {tipo_comprobante_v44.nombre}",
+                "errores": validacion['errores']
+            })
+        
+        # Obtener consecutivo
+        consecutivo = await hacienda_client.obtener_consecutivo(tipo, obligado.identificacion_numero)
+        
+        # Con el circuito de Hacienda abierto se emite en contingencia
+        contingencia = await circuito_hacienda.esta_abierto()
+        
+        # Generar clave única
+        factura.numero_consecutivo = consecutivo
+        factura.clave = await hacienda_client.generar_clave(
+            pais="506",
+            dia=datetime.now().strftime("%d"),
+            mes=datetime.now().strftime("%m"),
+            anno=datetime.now().strftime("%Y"),
+            cedula_emisor=obligado.identificacion_numero,
+            tipo_documento=tipo,
+            numero_consecutivo=consecutivo,
+            situacion=settings.situacion_contingencia if contingencia else "1"
+        )
+        pipeline_documentos.numerar(documento, factura.clave, consecutivo)
+        xml_sin_firmar = documento.xml_sin_firmar
         
         xml_firmado = None
         if firmar:
             try:
-                xml_firmado = signer.firmar_xml(xml_sin_firmar)
+                pipeline_documentos.firmar(documento)
+                xml_firmado = documento.xml_firmado
             except Exception as e:
                 logger.error(f"Error al firmar documento: {e}")
                 xml_firmado = xml_sin_firmar  # Usar sin firmar como fallback
         
-        # Enviar a Hacienda en background
+        # Persistir antes de encolar: el worker actualiza la fila al entregar
+        await repositorio_documentos.guardar(datos_documento(
+            factura, tipo, xml_sin_firmar, xml_firmado,
+            estado_local="firmado" if firmar else "generado"
+        ), datos_lineas(factura, tipo))
+        
+        # Encolar para entrega a Hacienda (workers de app.workers.envio_worker)
         if enviar_hacienda and xml_firmado:
-            background_tasks.add_task(enviar_a_hacienda, factura.clave, xml_firmado)
+            await cola_envios.encolar(factura.clave, xml_firmado, contingencia=contingencia)
         
         # Enviar email en background
         email_sent = False
@@ -115,7 +172,8 @@ async def crear_factura_v44(
         if enviar_email and factura.receptor and factura.receptor.correo_electronico:
             try:
                 # Generar PDF
-                pdf_content = pdf_generator_official.generar_pdf_factura(xml_firmado or xml_sin_firmar)
+                pdf_content = pipeline_documentos.pdf(documento)
+                await repositorio_documentos.guardar_pdf(factura.clave, pdf_content)
                 
                 # Enviar email
                 result = await email_service.enviar_factura_email(
@@ -142,8 +200,9 @@ async def crear_factura_v44(
         
         estado = "generada"
         if enviar_hacienda:
-            estado = "enviando"
+            estado = "contingencia" if contingencia else "enviando"
         
+        pipeline_documentos.registrar(documento)
         return FacturaResponse(
             clave=factura.clave,
             numero_consecutivo=consecutivo,
@@ -154,19 +213,59 @@ async def crear_factura_v44(
             message_id_email=message_id
         )
         
+    except HTTPException:
+        raise
+    except ValueError as e:
+        # Campos que el XSD del tipo exige y no vienen en la solicitud
+        logger.error(f"Comprobante {tipo} v4.4 incompleto: {e}")
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
-        logger.error(f"Error al crear factura v4.4: {e}")
-        raise HTTPException(status_code=500, detail=f"Error al crear factura: {str(e)}")
+        logger.error(f"Error al crear comprobante {tipo} v4.4: {e}")
+        raise HTTPException(status_code=500, detail=f"Error al crear comprobante: {str(e)}")
+
+def referencia(documento_referencia: str, codigo: str, razon: str) -> dict:
+    """InformacionReferencia a partir de la clave del documento referido (el tipo va en la clave)"""
+    return {
+        'tipo_doc': documento_referencia[29:31],
+        'numero': documento_referencia,
+        'fecha_emision': datetime.now(),
+        'codigo': codigo,
+        'razon': razon
+    }
+
+@router.post("/", response_model=FacturaResponse, summary="Crear Factura Electrónica v4.4")
+@idempotente
+async def crear_factura_v44(
+    factura_data: FacturaCreateV44,
+    firmar: bool = True,
+    enviar_hacienda: bool = True,
+    enviar_email: bool = True,
+    totales: str = Query("calcular", description=MODOS_TOTALES, pattern="^(calcular|validar)$")
+):
+    """
+    Crear una nueva factura electrónica según normativa v4.4 oficial del Ministerio de Hacienda de Costa Rica.
+    
+    - **factura_data**: Datos de la factura con estructura v4.4 completa
+    - **firmar**: Si se debe firmar digitalmente el documento (default: True)
+    - **enviar_hacienda**: Si se debe enviar automáticamente a Hacienda (default: True)
+    - **enviar_email**: Si se debe enviar por email (default: True)
+    - **totales**: calcular (default) o validar los montos de las líneas y del resumen
+    
+    Retorna la clave única del documento y el estado actual.
+    """
+    return await emitir_v44("01", factura_data, firmar, enviar_hacienda, enviar_email, totales)
 
 @router.post("/notas-credito", response_model=FacturaResponse, summary="Crear Nota de Crédito v4.4")
+@idempotente
 async def crear_nota_credito_v44(
     nota_data: FacturaCreateV44,
-    factura_referencia: str,
-    motivo: str,
-    background_tasks: BackgroundTasks,
+    factura_referencia: str = Query(..., min_length=50, max_length=50),
+    motivo: str = Query(..., max_length=180),
+    codigo_referencia: str = Query("01", min_length=2, max_length=2, description="01: anula el documento de referencia"),
     firmar: bool = True,
     enviar_hacienda: bool = True,
-    enviar_email: bool = True
+    enviar_email: bool = True,
+    totales: str = Query("calcular", description=MODOS_TOTALES, pattern="^(calcular|validar)$")
 ):
     """
     Crear una nota de crédito electrónica v4.4.
@@ -174,39 +273,165 @@ async def crear_nota_credito_v44(
     - **nota_data**: Datos de la nota de crédito
     - **factura_referencia**: Clave de la factura que se está creditando
     - **motivo**: Motivo de la nota de crédito
+    - **codigo_referencia**: Código de referencia de Hacienda (default: 01, anula documento)
+    """
+    nota_data.informacion_referencia = [referencia(factura_referencia, codigo_referencia, motivo)]
+    return await emitir_v44("03", nota_data, firmar, enviar_hacienda, enviar_email, totales)
+
+@router.post("/notas-debito", response_model=FacturaResponse, summary="Crear Nota de Débito v4.4")
+@idempotente
+async def crear_nota_debito_v44(
+    nota_data: FacturaCreateV44,
+    factura_referencia: str = Query(..., min_length=50, max_length=50),
+    motivo: str = Query(..., max_length=180),
+    codigo_referencia: str = Query("02", min_length=2, max_length=2, description="02: corrige monto del documento de referencia"),
+    firmar: bool = True,
+    enviar_hacienda: bool = True,
+    enviar_email: bool = True,
+    totales: str = Query("calcular", description=MODOS_TOTALES, pattern="^(calcular|validar)$")
+):
+    """
+    Crear una nota de débito electrónica v4.4.
+    
+    - **nota_data**: Datos de la nota de débito
+    - **factura_referencia**: Clave del documento que se está debitando
+    - **motivo**: Motivo de la nota de débito
+    - **codigo_referencia**: Código de referencia de Hacienda (default: 02, corrige monto)
+    """
+    nota_data.informacion_referencia = [referencia(factura_referencia, codigo_referencia, motivo)]
+    return await emitir_v44("02", nota_data, firmar, enviar_hacienda, enviar_email, totales)
+
+@router.post("/tiquetes", response_model=FacturaResponse, summary="Crear Tiquete Electrónico v4.4")
+@idempotente
+async def crear_tiquete_v44(
+    tiquete_data: FacturaCreateV44,
+    firmar: bool = True,
+    enviar_hacienda: bool = True,
+    enviar_email: bool = True,
+    totales: str = Query("calcular", description=MODOS_TOTALES, pattern="^(calcular|validar)$")
+):
+    """
+    Crear un tiquete electrónico v4.4 (el receptor es opcional).
+    """
+    return await emitir_v44("04", tiquete_data, firmar, enviar_hacienda, enviar_email, totales)
+
+@router.post("/facturas-compra", response_model=FacturaResponse, summary="Crear Factura Electrónica de Compra v4.4")
+@idempotente
+async def crear_factura_compra_v44(
+    factura_data: FacturaCreateV44,
+    firmar: bool = True,
+    enviar_hacienda: bool = True,
+    enviar_email: bool = True,
+    totales: str = Query("calcular", description=MODOS_TOTALES, pattern="^(calcular|validar)$")
+):
+    """
+    Crear una factura electrónica de compra v4.4.
+    
+    La emite el comprador (receptor) por lo adquirido a un proveedor no inscrito (emisor):
+    el consecutivo y la clave usan la cédula del receptor.
+    """
+    return await emitir_v44("08", factura_data, firmar, enviar_hacienda, enviar_email, totales)
+
+@router.post("/facturas-exportacion", response_model=FacturaResponse, summary="Crear Factura Electrónica de Exportación v4.4")
+@idempotente
+async def crear_factura_exportacion_v44(
+    factura_data: FacturaCreateV44,
+    firmar: bool = True,
+    enviar_hacienda: bool = True,
+    enviar_email: bool = True,
+    totales: str = Query("calcular", description=MODOS_TOTALES, pattern="^(calcular|validar)$")
+):
+    """
+    Crear una factura electrónica de exportación v4.4.
+    """
+    return await emitir_v44("09", factura_data, firmar, enviar_hacienda, enviar_email, totales)
+
+@router.post("/recibos-pago", response_model=FacturaResponse, summary="Crear Recibo Electrónico de Pago v4.4")
+@idempotente
+async def crear_recibo_pago_v44(
+    recibo_data: FacturaCreateV44,
+    factura_referencia: str = Query(..., min_length=50, max_length=50),
+    motivo: str = Query("Pago de factura a crédito", max_length=180),
+    firmar: bool = True,
+    enviar_hacienda: bool = True,
+    enviar_email: bool = True,
+    totales: str = Query("calcular", description=MODOS_TOTALES, pattern="^(calcular|validar)$")
+):
+    """
+    Crear un recibo electrónico de pago v4.4 sobre una factura a crédito.
+    
+    - **factura_referencia**: Clave de la factura que se está pagando
+    - **condicion_venta** del recibo debe ser 09 o 11, según el XSD
+    """
+    recibo_data.informacion_referencia = [referencia(factura_referencia, "04", motivo)]
+    return await emitir_v44("10", recibo_data, firmar, enviar_hacienda, enviar_email, totales)
+
+@router.post("/mensajes-receptor", response_model=FacturaResponse, summary="Crear Mensaje Receptor v4.4")
+@idempotente
+async def crear_mensaje_receptor_v44(
+    mensaje_data: MensajeReceptorCreateV44,
+    firmar: bool = True
+):
+    """
+    Aceptar (1), aceptar parcialmente (2) o rechazar (3) un comprobante recibido.
+    
+    El mensaje lleva la clave del comprobante del otro contribuyente, así que no se guarda en
+    documentos_electronicos ni pasa por la cola de envíos: se devuelve firmado para enviarlo aparte.
     """
     try:
-        consecutivo = await hacienda_client.obtener_consecutivo("03")
-        
-        # Crear la nota con información de referencia
-        nota_data.informacion_referencia = [{
-            'tipo_doc': '01',  # Factura
-            'numero': factura_referencia,
-            'fecha_emision': datetime.now(),
-            'codigo': '01',  # Anula documento de referencia
-            'razon': motivo
-        }]
+        consecutivo = await hacienda_client.obtener_consecutivo(
+            TIPO_MENSAJE_RECEPTOR[mensaje_data.mensaje], mensaje_data.numero_cedula_receptor
+        )
+        datos = mensaje_data.model_dump()
+        datos['numero_consecutivo_receptor'] = consecutivo
+        xml_sin_firmar = xml_generator_v44.generar_xml_mensaje_receptor(datos)
         
-        # Usar la misma lógica pero con tipo de documento 03
-        # ... (implementación similar adaptada para notas de crédito)
+        valido, errores = validador_para(MENSAJE_RECEPTOR_V44.compilar().xsd).validate_xml(xml_sin_firmar)
+        if not valido:
+            logger.error(f"MensajeReceptor no válido según XSD: {errores}")
         
-        return await crear_factura_v44(nota_data, background_tasks, firmar, enviar_hacienda, enviar_email)
+        xml_firmado = None
+        if firmar:
+            try:
+                xml_firmado = signer.firmar_xml(xml_sin_firmar)
+            except Exception as e:
+                logger.error(f"Error al firmar mensaje receptor: {e}")
         
+        return FacturaResponse(
+            clave=mensaje_data.clave,
+            numero_consecutivo=consecutivo,
+            fecha_emision=datetime.now(),
+            estado="generada",
+            xml_firmado=xml_firmado or xml_sin_firmar
+        )
+    
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error al crear nota de crédito v4.4: {e}")
-        raise HTTPException(status_code=500, detail=f"Error al crear nota de crédito: {str(e)}")
+        logger.error(f"Error al crear mensaje receptor v4.4: {e}")
+        raise HTTPException(status_code=500, detail=f"Error al crear mensaje receptor: {str(e)}")
 
 @router.get("/validar-xsd", summary="Validar configuración XSD")
 async def validar_configuracion_xsd():
     """
-    Verificar la configuración del validador XSD
+    Verificar la configuración del validador XSD (factura y cada tipo de comprobante v4.4)
     """
     info = xsd_validator.get_schema_info()
+    tipos = {}
+    for tipo in [*TIPOS_V44.values(), MENSAJE_RECEPTOR_V44]:
+        info_tipo = validador_para(tipo.compilar().xsd).get_schema_info()
+        tipos[tipo.codigo] = {
+            'documento': tipo.raiz,
+            'xsd_configurado': info_tipo['esquema_cargado'],
+            'ruta_xsd': info_tipo['ruta_xsd'],
+            'namespace': info_tipo['namespace']
+        }
     return {
         'xsd_configurado': info['esquema_cargado'],
         'ruta_xsd': info['ruta_xsd'],
         'version': info['version'],
-        'namespace': info['namespace']
+        'namespace': info['namespace'],
+        'tipos': tipos
     }
 
 @router.get("/certificado", summary="Información del certificado digital")
@@ -223,11 +448,3 @@ async def obtener_info_certificado():
             'algoritmo': 'RSA-SHA256' if info.get('disponible') else 'Simulado'
         }
     }
-
-async def enviar_a_hacienda(clave: str, xml_firmado: str):
-    """Tarea en background para enviar a Hacienda"""
-    try:
-        resultado = await hacienda_client.enviar_documento(clave, xml_firmado)
-        logger.info(f"Documento {clave} enviado a Hacienda: {resultado}")
-    except Exception as e:
-        logger.error(f"Error enviando documento {clave} a Hacienda: {e}")
\ No newline at end of file
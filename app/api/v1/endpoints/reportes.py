@@ -0,0 +1,152 @@
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
+from datetime import date, datetime, timedelta
+import logging
+from app.services.repositorio_documentos import repositorio_documentos
+from app.services.resumen_diario import MONTOS, agregador_resumen
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+@router.get("/resumen", summary="Resumen de Ventas e Impuestos")
+async def resumen_ventas(
+    fecha_inicio: Optional[date] = Query(None, description="Primer día (YYYY-MM-DD), por defecto el inicio del mes"),
+    fecha_fin: Optional[date] = Query(None, description="Último día incluido (YYYY-MM-DD), por defecto hoy"),
+    emisor: Optional[str] = Query(None, description="Cédula del emisor"),
+    tipo_documento: Optional[str] = Query(None, description="Tipo: 01=Factura, 02=ND, 03=NC, 04=Tiquete"),
+    moneda: Optional[str] = Query(None, description="Código de moneda (CRC, USD, ...)"),
+    estado: Optional[str] = Query(None, description="Estado en Hacienda (aceptado, rechazado, pendiente, ...)"),
+    agrupacion: str = Query("mes", description="Período de cada fila: dia, mes o total", pattern="^(dia|mes|total)$")
+):
+    """
+    Totales de ventas e impuestos por período, tipo de documento, moneda y estado.
+    
+    Se calcula sólo sobre la tabla resumen_diario (mantenida al emitir y al
+    cambiar el estado de cada documento), sin recorrer los documentos. Los montos
+    van en la moneda de cada documento; `totales` los suma por moneda.
+    """
+    if not fecha_fin:
+        fecha_fin = date.today()
+    if not fecha_inicio:
+        fecha_inicio = fecha_fin.replace(day=1)
+    if fecha_inicio > fecha_fin:
+        raise HTTPException(status_code=400, detail="fecha_inicio no puede ser posterior a fecha_fin")
+    
+    try:
+        filas = await agregador_resumen.consultar(
+            fecha_inicio, fecha_fin, emisor=emisor, tipo_documento=tipo_documento,
+            moneda=moneda, estado=estado, agrupacion=agrupacion
+        )
+    except Exception as e:
+        logger.error(f"❌ Error consultando el resumen: {e}")
+        raise HTTPException(status_code=500, detail=f"Error al consultar el resumen: {str(e)}")
+    
+    totales = {}
+    for fila in filas:
+        total = totales.setdefault(fila["codigo_moneda"], {"cantidad": 0, **{monto: 0 for monto in MONTOS}})
+        total["cantidad"] += fila["cantidad"]
+        for monto in MONTOS:
+            total[monto] += fila[monto]
+    
+    def montos(registro: dict) -> dict:
+        return {**registro, **{monto: float(registro[monto]) for monto in MONTOS}}
+    
+    return {
+        "resumen": [montos(fila) for fila in filas],
+        "totales": {moneda: montos(total) for moneda, total in totales.items()},
+        "filtros": {
+            "fecha_inicio": fecha_inicio.isoformat(),
+            "fecha_fin": fecha_fin.isoformat(),
+            "emisor": emisor,
+            "tipo_documento": tipo_documento,
+            "moneda": moneda,
+            "estado": estado,
+            "agrupacion": agrupacion
+        }
+    }
+
+@router.get("/lineas", summary="Buscar Líneas de Detalle Vendidas")
+async def buscar_lineas(
+    fecha_inicio: Optional[datetime] = Query(None, description="Fecha de inicio (YYYY-MM-DD), por defecto hace 90 días"),
+    fecha_fin: Optional[datetime] = Query(None, description="Fecha de fin (YYYY-MM-DD), por defecto ahora"),
+    cabys: Optional[str] = Query(None, description="Código CABYS exacto (13 dígitos)", pattern="^[0-9]{13}$"),
+    codigo_comercial: Optional[str] = Query(None, description="Código comercial del producto"),
+    texto: Optional[str] = Query(None, description="Texto contenido en el detalle", min_length=3, max_length=100),
+    emisor: Optional[str] = Query(None, description="Cédula del emisor"),
+    receptor: Optional[str] = Query(None, description="Cédula del receptor"),
+    cursor: Optional[str] = Query(None, description="Cursor devuelto en 'siguiente_cursor' de la página anterior"),
+    limit: int = Query(50, description="Número máximo de líneas", ge=1, le=200),
+    incluir_totales: bool = Query(False, description="Sumar cantidades y montos del rango completo por moneda")
+):
+    """
+    Buscar lo vendido por producto, emisor o receptor sin leer los XML.
+    
+    Las líneas se guardan en su propia tabla al emitir cada documento. Paginado
+    por cursor del más reciente al más antiguo, igual que el listado de documentos.
+    """
+    if not fecha_fin:
+        fecha_fin = datetime.now()
+    if not fecha_inicio:
+        fecha_inicio = fecha_fin - timedelta(days=90)
+    
+    try:
+        pagina = await repositorio_documentos.buscar_lineas(
+            fecha_inicio, fecha_fin, codigo_cabys=cabys, codigo_comercial=codigo_comercial,
+            texto=texto, emisor=emisor, receptor=receptor, cursor=cursor,
+            limite=limit, incluir_totales=incluir_totales
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"❌ Error buscando líneas: {e}")
+        raise HTTPException(status_code=500, detail=f"Error al buscar líneas: {str(e)}")
+    
+    def monto(valor) -> Optional[float]:
+        return float(valor) if valor is not None else None
+    
+    lineas = [
+        {
+            "clave": linea.clave_documento,
+            "numero_linea": linea.numero_linea,
+            "fecha_emision": linea.fecha_emision.isoformat(),
+            "tipo_documento": linea.tipo_documento,
+            "emisor_cedula": linea.emisor_cedula,
+            "receptor_cedula": linea.receptor_cedula,
+            "codigo_cabys": linea.codigo_cabys,
+            "codigo_comercial": linea.codigo_comercial,
+            "detalle": linea.detalle,
+            "unidad_medida": linea.unidad_medida,
+            "cantidad": monto(linea.cantidad),
+            "precio_unitario": monto(linea.precio_unitario),
+            "subtotal": monto(linea.subtotal),
+            "impuesto_neto": monto(linea.impuesto_neto),
+            "monto_total_linea": monto(linea.monto_total_linea),
+            "codigo_moneda": linea.codigo_moneda
+        }
+        for linea in pagina['lineas']
+    ]
+    
+    totales = None
+    if pagina['totales'] is not None:
+        totales = {
+            moneda: {campo: monto(valor) if campo not in ('codigo_moneda', 'lineas', 'documentos') else valor
+                     for campo, valor in total.items() if campo != 'codigo_moneda'}
+            for moneda, total in pagina['totales'].items()
+        }
+    
+    return {
+        "lineas": lineas,
+        "limit": limit,
+        "siguiente_cursor": pagina['siguiente_cursor'],
+        "totales": totales,
+        "filtros": {
+            "fecha_inicio": fecha_inicio.isoformat(),
+            "fecha_fin": fecha_fin.isoformat(),
+            "cabys": cabys,
+            "codigo_comercial": codigo_comercial,
+            "texto": texto,
+            "emisor": emisor,
+            "receptor": receptor
+        }
+    }
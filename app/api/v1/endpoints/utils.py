@@ -3,6 +3,7 @@ from typing import Dict, Any
 from app.services.xml_signer_simple import signer
 from app.services.xml_validator import XMLValidator
 from app.services.hacienda_client import HaciendaClient
+from app.services.cola_envios import cola_envios
 from lxml import etree
 
 router = APIRouter()
@@ -204,4 +205,25 @@ async def test_hacienda():
             "autenticacion": "fallida",
             "error": str(e),
             "mensaje": "Error al conectar con Hacienda"
-        }
\ No newline at end of file
+        }
+
+@router.get("/cola-envios", summary="Estado de la Cola de Envíos")
+async def estado_cola_envios():
+    """
+    Profundidad de la cola persistente de envíos a Hacienda (pendientes, en proceso y muertos).
+    """
+    try:
+        return await cola_envios.estadisticas()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Cola de envíos no disponible: {str(e)}")
+
+@router.post("/cola-envios/reintentar-muertos", summary="Reencolar Documentos Fallidos")
+async def reintentar_muertos(limite: int = 100):
+    """
+    Devolver a la cola los documentos que agotaron sus intentos de entrega.
+    """
+    try:
+        reencolados = await cola_envios.reencolar_muertos(limite)
+        return {"reencolados": reencolados}
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Cola de envíos no disponible: {str(e)}")
@@ -0,0 +1,76 @@
+"""
+Soporte del encabezado Idempotency-Key en las rutas de creación de documentos
+"""
+
+import functools
+import inspect
+import logging
+from typing import Optional
+
+from fastapi import Header, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.services.idempotencia import huella_solicitud, registro_idempotencia
+
+logger = logging.getLogger(__name__)
+
+LONGITUD_MAXIMA_LLAVE = 255
+
+
+def idempotente(endpoint):
+    """
+    Decorador para rutas de creación: agrega el encabezado opcional
+    Idempotency-Key y, cuando viene, ejecuta la ruta una sola vez por llave.
+
+    Las repeticiones reciben la respuesta original (con `Idempotent-Replayed: true`),
+    las simultáneas esperan a la primera y reusar la llave con otro cuerpo es un 422.
+    Sin el encabezado la ruta se comporta igual que antes.
+    """
+    firma = inspect.signature(endpoint)
+    alcance = endpoint.__name__
+
+    @functools.wraps(endpoint)
+    async def envoltura(*args, idempotency_key: Optional[str] = None, **kwargs):
+        if not idempotency_key:
+            return await endpoint(*args, **kwargs)
+        if len(idempotency_key) > LONGITUD_MAXIMA_LLAVE:
+            raise HTTPException(status_code=400,
+                                detail=f"Idempotency-Key admite hasta {LONGITUD_MAXIMA_LLAVE} caracteres")
+
+        argumentos = firma.bind(*args, **kwargs)
+        argumentos.apply_defaults()
+        huella = huella_solicitud(jsonable_encoder(argumentos.arguments))
+
+        try:
+            original = await registro_idempotencia.reservar(alcance, idempotency_key, huella)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        except TimeoutError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except Exception as e:
+            logger.error(f"❌ Registro de idempotencia no disponible: {e}")
+            raise HTTPException(status_code=503, detail="Registro de idempotencia no disponible")
+        if original is not None:
+            return JSONResponse(content=original, headers={"Idempotent-Replayed": "true"})
+
+        try:
+            resultado = await endpoint(*args, **kwargs)
+        except BaseException:
+            await registro_idempotencia.liberar(alcance, idempotency_key)
+            raise
+
+        try:
+            await registro_idempotencia.completar(alcance, idempotency_key, huella, jsonable_encoder(resultado))
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo guardar la respuesta de la Idempotency-Key {idempotency_key}: {e}")
+        return resultado
+
+    # FastAPI lee el encabezado a partir de la firma
+    encabezado = inspect.Parameter(
+        "idempotency_key", inspect.Parameter.KEYWORD_ONLY, annotation=Optional[str],
+        default=Header(None, alias="Idempotency-Key",
+                       description="Llave única del cliente para reintentar sin duplicar el documento")
+    )
+    envoltura.__signature__ = firma.replace(parameters=[*firma.parameters.values(), encabezado])
+    return envoltura
@@ -0,0 +1,70 @@
+"""
+Registro de métricas en memoria del proceso
+Contadores, gauges y observaciones simples expuestos en GET /metrics
+"""
+
+import threading
+from collections import defaultdict
+from typing import Dict, Any
+
+
+def _nombre_completo(nombre: str, etiquetas: Dict[str, Any]) -> str:
+    """Construir nombre con etiquetas al estilo nombre{k=v,...}"""
+    if not etiquetas:
+        return nombre
+    partes = ",".join(f"{k}={v}" for k, v in sorted(etiquetas.items()))
+    return f"{nombre}{{{partes}}}"
+
+
+class RegistroMetricas:
+    """
+    Registro de métricas del proceso.
+    Cada worker de uvicorn mantiene su propio registro.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores: Dict[str, float] = defaultdict(float)
+        self._gauges: Dict[str, float] = {}
+        self._observaciones: Dict[str, Dict[str, float]] = {}
+
+    def incrementar(self, nombre: str, valor: float = 1.0, **etiquetas) -> None:
+        """Incrementar un contador"""
+        clave = _nombre_completo(nombre, etiquetas)
+        with self._lock:
+            self._contadores[clave] += valor
+
+    def fijar(self, nombre: str, valor: float, **etiquetas) -> None:
+        """Fijar el valor actual de un gauge"""
+        clave = _nombre_completo(nombre, etiquetas)
+        with self._lock:
+            self._gauges[clave] = valor
+
+    def retirar(self, nombre: str, **etiquetas) -> None:
+        """Quitar un gauge que ya no se publica (p. ej. de un limitador descartado)"""
+        clave = _nombre_completo(nombre, etiquetas)
+        with self._lock:
+            self._gauges.pop(clave, None)
+
+    def observar(self, nombre: str, valor: float, **etiquetas) -> None:
+        """Registrar una observación (cantidad, suma y máximo)"""
+        clave = _nombre_completo(nombre, etiquetas)
+        with self._lock:
+            obs = self._observaciones.setdefault(clave, {'cantidad': 0, 'suma': 0.0, 'maximo': 0.0})
+            obs['cantidad'] += 1
+            obs['suma'] += valor
+            if valor > obs['maximo']:
+                obs['maximo'] = valor
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Obtener una copia de todas las métricas"""
+        with self._lock:
+            return {
+                'contadores': dict(self._contadores),
+                'gauges': dict(self._gauges),
+                'observaciones': {k: dict(v) for k, v in self._observaciones.items()}
+            }
+
+
+# Instancia global
+metricas = RegistroMetricas()
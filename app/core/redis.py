@@ -0,0 +1,28 @@
+"""
+Conexión Redis compartida del proceso (redis.asyncio)
+"""
+
+import logging
+from typing import Optional
+import redis.asyncio as aioredis
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_redis: Optional[aioredis.Redis] = None
+
+
+def obtener_redis() -> aioredis.Redis:
+    """Obtener el cliente Redis compartido (pool de conexiones interno)"""
+    global _redis
+    if _redis is None:
+        _redis = aioredis.from_url(settings.redis_url, decode_responses=True)
+    return _redis
+
+
+async def cerrar_redis() -> None:
+    """Cerrar el pool de conexiones Redis"""
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
@@ -392,6 +392,18 @@ TIPOS_TRANSACCION = {
     "04": "Devolución de producto"
 }
 
+# Unidades de medida de servicios (las demás líneas cuentan como mercancías en el resumen)
+UNIDADES_SERVICIO = {
+    "Al": "Alquiler de uso habitacional",
+    "Alc": "Alquiler de uso comercial",
+    "Cm": "Comisiones",
+    "I": "Intereses",
+    "Os": "Otro tipo de servicio",
+    "Sp": "Servicios Profesionales",
+    "Spe": "Servicios personales",
+    "St": "Servicios técnicos"
+}
+
 # Códigos de Descuento según XSD v4.4
 CODIGOS_DESCUENTO = {
     "01": "Regalía",
@@ -1,11 +1,144 @@
-from sqlalchemy import create_engine
+import asyncio
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
+from app.core.metrics import metricas
+
+logger = logging.getLogger(__name__)
+
+
+def url_asincrona(url: str) -> str:
+    """URL de la base de datos con el driver asyncpg"""
+    for prefijo in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefijo):
+            return "postgresql+asyncpg://" + url[len(prefijo):]
+    return url
 
+
+# Motor síncrono: migraciones y scripts de mantenimiento (no usar dentro del event loop)
 engine = create_engine(settings.database_url)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def _motor_asincrono(url: str):
+    return create_async_engine(
+        url_asincrona(url),
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=True,
+    )
+
+
+# Motor asíncrono del API y los workers; el pool se dimensiona por proceso
+async_engine = _motor_asincrono(settings.database_url)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+# Réplicas de lectura opcionales (listados, búsquedas y reportes)
+replica_engines = [_motor_asincrono(url) for url in settings.database_replica_urls]
+
+# Segundos de retraso de una réplica: 0 si ya aplicó todo lo recibido (una
+# primaria sin escrituras no cuenta como retraso) o si no está en recuperación;
+# NULL si tiene WAL pendiente y aún no aplicó ninguna transacción desde que arrancó
+_CONSULTA_LAG = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+
+class EnrutadorLecturas:
+    """
+    Reparte las sesiones de sólo lectura entre las réplicas.
+
+    Cada `intervalo` segundos mide el retraso de replicación de cada réplica
+    (en segundo plano; sólo la primera medición se espera) y lo publica en
+    el gauge `db_replica_lag_segundos`. Las sesiones van por turnos a las
+    réplicas con retraso dentro de `lag_maximo`; si ninguna lo está, o no
+    responden, van a la primaria. Las escrituras y las lecturas que deben
+    ver lo recién escrito (consulta por clave, XML, PDF) usan siempre
+    AsyncSessionLocal.
+    """
+
+    def __init__(self, motores: List, lag_maximo: Optional[float] = None, intervalo: Optional[float] = None):
+        self.fabricas = [async_sessionmaker(motor, expire_on_commit=False) for motor in motores]
+        self.motores = motores
+        self.lag_maximo = lag_maximo if lag_maximo is not None else settings.db_replica_lag_maximo
+        self.intervalo = intervalo if intervalo is not None else settings.db_replica_intervalo_medicion
+        self._lags: List[Optional[float]] = [None] * len(motores)
+        self._proxima_medicion = 0.0
+        self._medicion: Optional[asyncio.Task] = None
+        self._turno = itertools.count()
+
+    async def _medir_replica(self, indice: int) -> None:
+        try:
+            async with self.motores[indice].connect() as conexion:
+                valor = await asyncio.wait_for(conexion.scalar(_CONSULTA_LAG), timeout=self.intervalo)
+            lag = float(valor) if valor is not None else float('inf')
+        except Exception as e:
+            if self._lags[indice] != float('inf'):
+                logger.warning(f"⚠️ Réplica de lectura {indice} no disponible: {e}")
+            lag = float('inf')
+            metricas.incrementar("db_replica_errores", replica=indice)
+        else:
+            if self._lags[indice] is not None and self._lags[indice] <= self.lag_maximo < lag:
+                logger.warning(f"⚠️ Réplica de lectura {indice} atrasada {lag:.1f}s; se lee de la primaria")
+        self._lags[indice] = lag
+        # -1: réplica sin responder o con retraso desconocido
+        metricas.fijar("db_replica_lag_segundos", lag if lag != float('inf') else -1, replica=indice)
+
+    async def medir(self) -> List[Optional[float]]:
+        """Medir el retraso de todas las réplicas"""
+        self._proxima_medicion = time.monotonic() + self.intervalo
+        await asyncio.gather(*(self._medir_replica(i) for i in range(len(self.motores))))
+        return list(self._lags)
+
+    async def _elegir(self):
+        if not self.fabricas:
+            return None
+        if time.monotonic() >= self._proxima_medicion and (self._medicion is None or self._medicion.done()):
+            self._medicion = asyncio.create_task(self.medir())
+        if all(lag is None for lag in self._lags):
+            await asyncio.shield(self._medicion)
+
+        disponibles = [i for i, lag in enumerate(self._lags) if lag is not None and lag <= self.lag_maximo]
+        if not disponibles:
+            return None
+        return disponibles[next(self._turno) % len(disponibles)]
+
+    @asynccontextmanager
+    async def sesion(self) -> AsyncIterator[AsyncSession]:
+        """Sesión de sólo lectura en una réplica al día, o en la primaria"""
+        indice = await self._elegir()
+        if indice is None:
+            metricas.incrementar("db_lecturas", destino="primaria")
+            async with AsyncSessionLocal() as sesion:
+                yield sesion
+            return
+        metricas.incrementar("db_lecturas", destino="replica")
+        async with self.fabricas[indice]() as sesion:
+            yield sesion
+
+
+# Instancia global
+enrutador_lecturas = EnrutadorLecturas(replica_engines)
+
+
+def sesion_lectura():
+    """Sesión para listados, búsquedas y reportes (admiten unos segundos de retraso)"""
+    return enrutador_lecturas.sesion()
+
 Base = declarative_base()
 
 def get_db():
@@ -13,4 +146,14 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def obtener_sesion():
+    async with AsyncSessionLocal() as sesion:
+        yield sesion
+
+async def cerrar_base_datos() -> None:
+    """Cerrar las conexiones de los pools asíncronos (al apagar el proceso)"""
+    await async_engine.dispose()
+    for motor in replica_engines:
+        await motor.dispose()
@@ -1,15 +1,17 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Decimal, Boolean, JSON
+from sqlalchemy import Column, Integer, String, Date, DateTime, Text, Numeric, Boolean, JSON, Index, UniqueConstraint
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 from app.models.database import Base
 
 class DocumentoElectronico(Base):
     __tablename__ = "documentos_electronicos"
     
-    id = Column(Integer, primary_key=True, index=True)
-    clave = Column(String(50), unique=True, index=True, nullable=False)
+    # Particionada por mes de fecha_emision: forma parte de la llave primaria y de la unicidad de la clave
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    clave = Column(String(50), nullable=False)
     tipo_documento = Column(String(2), nullable=False)  # 01=Factura, 02=ND, 03=NC, 04=Tiquete
     numero_consecutivo = Column(String(20), nullable=False)
-    fecha_emision = Column(DateTime, nullable=False)
+    fecha_emision = Column(DateTime, primary_key=True, nullable=False)
     fecha_creacion = Column(DateTime, default=func.now())
     fecha_actualizacion = Column(DateTime, default=func.now(), onupdate=func.now())
     
@@ -24,22 +26,30 @@ class DocumentoElectronico(Base):
     receptor_email = Column(String(160))
     
     # Montos
-    total_gravado = Column(Decimal(18, 5))
-    total_exento = Column(Decimal(18, 5))
-    total_exonerado = Column(Decimal(18, 5))
-    total_venta = Column(Decimal(18, 5), nullable=False)
-    total_descuentos = Column(Decimal(18, 5))
-    total_venta_neta = Column(Decimal(18, 5), nullable=False)
-    total_impuesto = Column(Decimal(18, 5))
-    total_comprobante = Column(Decimal(18, 5), nullable=False)
+    total_gravado = Column(Numeric(18, 5))
+    total_exento = Column(Numeric(18, 5))
+    total_exonerado = Column(Numeric(18, 5))
+    total_venta = Column(Numeric(18, 5), nullable=False)
+    total_descuentos = Column(Numeric(18, 5))
+    total_venta_neta = Column(Numeric(18, 5), nullable=False)
+    total_impuesto = Column(Numeric(18, 5))
+    total_comprobante = Column(Numeric(18, 5), nullable=False)
     
     # Código de moneda
     codigo_moneda = Column(String(3), default="CRC")
-    tipo_cambio = Column(Decimal(18, 5), default=1.00000)
+    tipo_cambio = Column(Numeric(18, 5), default=1.00000)
     
-    # XML y estado
-    xml_sin_firmar = Column(Text)
-    xml_firmado = Column(Text)
+    # XML, respuesta de Hacienda y PDF: referencias (SHA-256) al almacén de blobs
+    xml_sin_firmar_ref = Column(String(64))
+    xml_firmado_ref = Column(String(64))
+    respuesta_xml_ref = Column(String(64))
+    pdf_ref = Column(String(64))
+    
+    # XML en línea de filas anteriores al almacén (app.workers.migrar_blobs los vacía)
+    xml_sin_firmar = deferred(Column(Text))
+    xml_firmado = deferred(Column(Text))
+    
+    # Estado
     estado_local = Column(String(20), default="generado")  # generado, firmado, enviado, error
     estado_hacienda = Column(String(20))  # aceptado, rechazado, procesando, etc.
     mensaje_hacienda = Column(Text)
@@ -64,15 +74,28 @@ class DocumentoElectronico(Base):
     tipo_referencia = Column(String(2))
     motivo_referencia = Column(Text)
     
+    # Listados paginados por (fecha_emision, id) para cada combinación de filtros
+    __table_args__ = (
+        UniqueConstraint('clave', 'fecha_emision', name='uq_documentos_clave_fecha'),
+        Index('ix_documentos_fecha_id', 'fecha_emision', 'id'),
+        Index('ix_documentos_emisor_fecha_id', 'emisor_cedula', 'fecha_emision', 'id'),
+        Index('ix_documentos_emisor_tipo_fecha_id', 'emisor_cedula', 'tipo_documento', 'fecha_emision', 'id'),
+        Index('ix_documentos_emisor_estado_fecha_id', 'emisor_cedula', 'estado_hacienda', 'fecha_emision', 'id'),
+        Index('ix_documentos_tipo_fecha_id', 'tipo_documento', 'fecha_emision', 'id'),
+        Index('ix_documentos_estado_fecha_id', 'estado_hacienda', 'fecha_emision', 'id'),
+        {'postgresql_partition_by': 'RANGE (fecha_emision)'},
+    )
+    
     def __repr__(self):
         return f"<DocumentoElectronico(clave='{self.clave}', tipo='{self.tipo_documento}', estado='{self.estado_local}')>"
 
 class LogEnvio(Base):
     __tablename__ = "logs_envio"
     
-    id = Column(Integer, primary_key=True, index=True)
+    # Particionada por mes de fecha_intento
+    id = Column(Integer, primary_key=True, autoincrement=True)
     clave_documento = Column(String(50), nullable=False, index=True)
-    fecha_intento = Column(DateTime, default=func.now())
+    fecha_intento = Column(DateTime, primary_key=True, default=func.now(), server_default=func.now())
     tipo_operacion = Column(String(20), nullable=False)  # envio, consulta, reenvio
     
     # Request
@@ -90,5 +113,102 @@ class LogEnvio(Base):
     exitoso = Column(Boolean, default=False)
     mensaje_error = Column(Text)
     
+    __table_args__ = (
+        {'postgresql_partition_by': 'RANGE (fecha_intento)'},
+    )
+    
+    def __repr__(self):
+        return f"<LogEnvio(clave='{self.clave_documento}', operacion='{self.tipo_operacion}', exitoso={self.exitoso})>"
+
+class LineaDocumento(Base):
+    __tablename__ = "lineas_detalle"
+    
+    # Líneas de detalle de cada documento, particionadas igual que documentos_electronicos
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    clave_documento = Column(String(50), nullable=False)
+    fecha_emision = Column(DateTime, primary_key=True, nullable=False)
+    numero_linea = Column(Integer, nullable=False)
+    tipo_documento = Column(String(2), nullable=False)
+    emisor_cedula = Column(String(20), nullable=False)
+    receptor_cedula = Column(String(20))
+    
+    # Producto
+    codigo_cabys = Column(String(13))
+    codigo_comercial_tipo = Column(String(2))
+    codigo_comercial = Column(String(20))
+    detalle = Column(String(200), nullable=False)
+    unidad_medida = Column(String(15))
+    
+    # Montos en la moneda del documento
+    codigo_moneda = Column(String(3), default="CRC")
+    cantidad = Column(Numeric(18, 5), nullable=False)
+    precio_unitario = Column(Numeric(18, 5), nullable=False)
+    monto_total = Column(Numeric(18, 5), nullable=False)
+    monto_descuento = Column(Numeric(18, 5))
+    subtotal = Column(Numeric(18, 5), nullable=False)
+    impuesto_neto = Column(Numeric(18, 5))
+    monto_total_linea = Column(Numeric(18, 5), nullable=False)
+    impuestos = Column(JSON)  # [{"codigo", "codigo_tarifa", "tarifa", "monto"}]
+    
+    # Búsquedas por producto (CABYS, código comercial o texto del detalle), emisor y receptor
+    __table_args__ = (
+        UniqueConstraint('clave_documento', 'numero_linea', 'fecha_emision', name='uq_lineas_clave_linea_fecha'),
+        Index('ix_lineas_cabys_fecha_id', 'codigo_cabys', 'fecha_emision', 'id'),
+        Index('ix_lineas_codigo_comercial_fecha_id', 'codigo_comercial', 'fecha_emision', 'id'),
+        Index('ix_lineas_emisor_fecha_id', 'emisor_cedula', 'fecha_emision', 'id'),
+        Index('ix_lineas_receptor_fecha_id', 'receptor_cedula', 'fecha_emision', 'id'),
+        Index('ix_lineas_detalle_trgm', 'detalle', postgresql_using='gin',
+              postgresql_ops={'detalle': 'gin_trgm_ops'}),
+        {'postgresql_partition_by': 'RANGE (fecha_emision)'},
+    )
+    
+    def __repr__(self):
+        return f"<LineaDocumento(clave='{self.clave_documento}', linea={self.numero_linea}, cabys='{self.codigo_cabys}')>"
+
+class ArchivoParticion(Base):
+    __tablename__ = "archivos_particiones"
+    
+    id = Column(Integer, primary_key=True)
+    tabla = Column(String(63), nullable=False)
+    particion = Column(String(63), nullable=False, unique=True)
+    desde = Column(DateTime, nullable=False)
+    hasta = Column(DateTime, nullable=False)
+    filas = Column(Integer, nullable=False)
+    # [{"primera": clave, "ultima": clave, "ref": sha256, "filas": n}] en orden de clave
+    bloques = Column(JSON, nullable=False)
+    fecha_archivo = Column(DateTime, server_default=func.now())
+    
+    __table_args__ = (
+        Index('ix_archivos_particiones_tabla_rango', 'tabla', 'desde', 'hasta'),
+    )
+    
+    def __repr__(self):
+        return f"<ArchivoParticion(particion='{self.particion}', filas={self.filas})>"
+
+class ResumenDiario(Base):
+    __tablename__ = "resumen_diario"
+    
+    # Totales por día de emisión; los mantienen los triggers de documentos_electronicos (migración 0005)
+    emisor_cedula = Column(String(20), primary_key=True)
+    fecha = Column(Date, primary_key=True)
+    tipo_documento = Column(String(2), primary_key=True)
+    codigo_moneda = Column(String(3), primary_key=True)
+    estado_hacienda = Column(String(20), primary_key=True)  # "pendiente" si aún no tiene estado
+    
+    cantidad = Column(Integer, nullable=False, default=0)
+    total_gravado = Column(Numeric(20, 5), nullable=False, default=0)
+    total_exento = Column(Numeric(20, 5), nullable=False, default=0)
+    total_exonerado = Column(Numeric(20, 5), nullable=False, default=0)
+    total_venta = Column(Numeric(20, 5), nullable=False, default=0)
+    total_descuentos = Column(Numeric(20, 5), nullable=False, default=0)
+    total_venta_neta = Column(Numeric(20, 5), nullable=False, default=0)
+    total_impuesto = Column(Numeric(20, 5), nullable=False, default=0)
+    total_comprobante = Column(Numeric(20, 5), nullable=False, default=0)
+    fecha_actualizacion = Column(DateTime, server_default=func.now())
+    
+    __table_args__ = (
+        Index('ix_resumen_diario_fecha', 'fecha'),
+    )
+    
     def __repr__(self):
-        return f"<LogEnvio(clave='{self.clave_documento}', operacion='{self.tipo_operacion}', exitoso={self.exitoso})>"
\ No newline at end of file
+        return f"<ResumenDiario(emisor='{self.emisor_cedula}', fecha='{self.fecha}', cantidad={self.cantidad})>"
@@ -0,0 +1,23 @@
+from pydantic import BaseModel, Field, validator
+from typing import List, Optional
+
+from app.core.config import settings
+
+class EstadoMasivoRequest(BaseModel):
+    claves: List[str] = Field(..., min_items=1, description="Claves de 50 caracteres a consultar")
+    concurrencia: Optional[int] = Field(None, ge=1, description="Consultas simultáneas a Hacienda")
+
+    @validator('claves')
+    def validar_claves(cls, v):
+        if len(v) > settings.consulta_masiva_max_claves:
+            raise ValueError(f'Máximo {settings.consulta_masiva_max_claves} claves por solicitud')
+        invalidas = [clave for clave in v if len(clave) != 50]
+        if invalidas:
+            raise ValueError(f'Claves inválidas (deben tener 50 caracteres): {invalidas[:5]}')
+        return v
+
+    @validator('concurrencia')
+    def validar_concurrencia(cls, v):
+        if v is not None:
+            return min(v, settings.consulta_masiva_max_concurrencia)
+        return v
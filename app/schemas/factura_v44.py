@@ -14,7 +14,9 @@ class TipoDocumento(str, Enum):
     NOTA_DEBITO = "02"
     NOTA_CREDITO = "03"
     TIQUETE_ELECTRONICO = "04"
-    FACTURA_EXPORTACION = "05"
+    FACTURA_COMPRA = "08"
+    FACTURA_EXPORTACION = "09"
+    RECIBO_PAGO = "10"
 
 class CodigoComercial(BaseModel):
     tipo: str = Field(..., max_length=2, description="Tipo de código comercial")
@@ -176,6 +178,20 @@ class FacturaCreateV44(BaseModel):
     resumen_factura: ResumenFactura
     informacion_referencia: Optional[List[InformacionReferencia]] = []
 
+class MensajeReceptorCreateV44(BaseModel):
+    clave: str = Field(..., min_length=50, max_length=50, description="Clave del comprobante recibido")
+    numero_cedula_emisor: str = Field(..., min_length=9, max_length=12, description="Cédula de quien emitió el comprobante")
+    fecha_emision_doc: datetime = Field(..., description="Fecha de emisión del comprobante recibido")
+    mensaje: str = Field(..., pattern="^[123]$", description="1=Aceptado, 2=Aceptado parcialmente, 3=Rechazado")
+    detalle_mensaje: Optional[str] = Field(None, max_length=160)
+    monto_total_impuesto: Optional[Decimal] = Field(None, ge=0)
+    codigo_actividad: Optional[str] = Field(None, min_length=6, max_length=6)
+    condicion_impuesto: Optional[str] = Field(None, min_length=2, max_length=2)
+    monto_total_impuesto_acreditar: Optional[Decimal] = Field(None, ge=0)
+    monto_total_de_gasto_aplicable: Optional[Decimal] = Field(None, ge=0)
+    total_factura: Decimal = Field(..., ge=0)
+    numero_cedula_receptor: str = Field(..., min_length=9, max_length=12, description="Cédula de quien recibe (y responde)")
+
 class FacturaResponse(BaseModel):
     clave: str
     numero_consecutivo: str
@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional, Union
+
+import boto3
+import zstandard
+from botocore.exceptions import ClientError
+
+from app.core.config import settings
+from app.core.metrics import metricas
+
+logger = logging.getLogger(__name__)
+
+
+def huella(contenido: bytes) -> str:
+    """Referencia de un blob: SHA-256 (hex) del contenido sin comprimir"""
+    return hashlib.sha256(contenido).hexdigest()
+
+
+def ruta_blob(referencia: str) -> str:
+    """Ruta relativa del objeto (dos niveles de directorio para repartir los archivos)"""
+    if len(referencia) != 64 or not all(c in "0123456789abcdef" for c in referencia):
+        raise ValueError(f"Referencia de blob inválida: {referencia!r}")
+    return f"{referencia[:2]}/{referencia[2:4]}/{referencia}.zst"
+
+
+class AlmacenBlobs:
+    """
+    Almacén de XML y PDF direccionado por contenido.
+
+    Cada blob se guarda comprimido con zstd bajo el SHA-256 de su contenido, así
+    que guardar dos veces lo mismo no duplica el objeto y en la fila sólo queda la
+    referencia (64 caracteres). Los backends implementan `_existe`, `_escribir` y
+    `_leer` sobre bytes ya comprimidos; todo corre en hilos para no bloquear el loop.
+    """
+
+    nombre = "base"
+
+    def __init__(self, nivel: Optional[int] = None):
+        self.nivel = nivel or settings.blob_zstd_nivel
+
+    async def guardar(self, contenido: Union[str, bytes]) -> str:
+        """Guardar un blob y devolver su referencia"""
+        if isinstance(contenido, str):
+            contenido = contenido.encode('utf-8')
+        referencia = huella(contenido)
+        await asyncio.to_thread(self._guardar, referencia, contenido)
+        return referencia
+
+    def _guardar(self, referencia: str, contenido: bytes) -> None:
+        ruta = ruta_blob(referencia)
+        if self._existe(ruta):
+            metricas.incrementar("blobs_duplicados", backend=self.nombre)
+            return
+        comprimido = zstandard.ZstdCompressor(level=self.nivel).compress(contenido)
+        self._escribir(ruta, comprimido)
+        metricas.incrementar("blobs_guardados", backend=self.nombre)
+        metricas.incrementar("blobs_bytes_originales", len(contenido), backend=self.nombre)
+        metricas.incrementar("blobs_bytes_comprimidos", len(comprimido), backend=self.nombre)
+
+    async def obtener(self, referencia: str) -> Optional[bytes]:
+        """Contenido original del blob, o None si no existe"""
+        return await asyncio.to_thread(self._obtener, referencia)
+
+    def _obtener(self, referencia: str) -> Optional[bytes]:
+        comprimido = self._leer(ruta_blob(referencia))
+        if comprimido is None:
+            return None
+        contenido = zstandard.ZstdDecompressor().decompress(comprimido)
+        if huella(contenido) != referencia:
+            metricas.incrementar("blobs_corruptos", backend=self.nombre)
+            raise ValueError(f"El blob {referencia} no coincide con su huella")
+        return contenido
+
+    async def obtener_texto(self, referencia: str) -> Optional[str]:
+        """Contenido del blob decodificado como UTF-8 (XML)"""
+        contenido = await self.obtener(referencia)
+        return contenido.decode('utf-8') if contenido is not None else None
+
+    # Implementados por cada backend
+    def _existe(self, ruta: str) -> bool:
+        raise NotImplementedError
+
+    def _escribir(self, ruta: str, datos: bytes) -> None:
+        raise NotImplementedError
+
+    def _leer(self, ruta: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+
+class AlmacenLocal(AlmacenBlobs):
+    """Blobs en un directorio local (o un volumen compartido entre procesos)"""
+
+    nombre = "local"
+
+    def __init__(self, raiz: Optional[str] = None, nivel: Optional[int] = None):
+        super().__init__(nivel)
+        self.raiz = Path(raiz or settings.blob_ruta_local)
+
+    def _existe(self, ruta: str) -> bool:
+        return (self.raiz / ruta).exists()
+
+    def _escribir(self, ruta: str, datos: bytes) -> None:
+        destino = self.raiz / ruta
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        # Escribir aparte y renombrar: un lector nunca ve un archivo a medias
+        descriptor, temporal = tempfile.mkstemp(dir=destino.parent, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as archivo:
+                archivo.write(datos)
+            os.replace(temporal, destino)
+        except BaseException:
+            Path(temporal).unlink(missing_ok=True)
+            raise
+
+    def _leer(self, ruta: str) -> Optional[bytes]:
+        try:
+            return (self.raiz / ruta).read_bytes()
+        except FileNotFoundError:
+            return None
+
+
+class AlmacenS3(AlmacenBlobs):
+    """Blobs en un bucket S3 o compatible (MinIO) vía boto3"""
+
+    nombre = "s3"
+
+    def __init__(self, bucket: Optional[str] = None, endpoint_url: Optional[str] = None,
+                 prefijo: Optional[str] = None, nivel: Optional[int] = None):
+        super().__init__(nivel)
+        self.bucket = bucket or settings.blob_s3_bucket
+        self.endpoint_url = endpoint_url or settings.blob_s3_endpoint_url
+        self.prefijo = (prefijo if prefijo is not None else settings.blob_s3_prefijo).strip("/")
+        if not self.bucket:
+            raise ValueError("BLOB_S3_BUCKET es obligatorio con BLOB_BACKEND=s3")
+        self._cliente = None
+
+    @property
+    def cliente(self):
+        if self._cliente is None:
+            self._cliente = boto3.client(
+                's3',
+                endpoint_url=self.endpoint_url,
+                region_name=settings.aws_region,
+                aws_access_key_id=settings.aws_access_key_id,
+                aws_secret_access_key=settings.aws_secret_access_key
+            )
+        return self._cliente
+
+    def _llave(self, ruta: str) -> str:
+        return f"{self.prefijo}/{ruta}" if self.prefijo else ruta
+
+    def _existe(self, ruta: str) -> bool:
+        try:
+            self.cliente.head_object(Bucket=self.bucket, Key=self._llave(ruta))
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def _escribir(self, ruta: str, datos: bytes) -> None:
+        self.cliente.put_object(Bucket=self.bucket, Key=self._llave(ruta), Body=datos,
+                                ContentType='application/zstd')
+
+    def _leer(self, ruta: str) -> Optional[bytes]:
+        try:
+            return self.cliente.get_object(Bucket=self.bucket, Key=self._llave(ruta))['Body'].read()
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+
+def crear_almacen() -> AlmacenBlobs:
+    """Almacén según BLOB_BACKEND"""
+    if settings.blob_backend == "s3":
+        return AlmacenS3()
+    if settings.blob_backend != "local":
+        raise ValueError(f"BLOB_BACKEND desconocido: {settings.blob_backend}")
+    return AlmacenLocal()
+
+
+# Instancia global
+almacen_blobs = crear_almacen()
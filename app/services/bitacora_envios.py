@@ -0,0 +1,176 @@
+import asyncio
+import json
+import logging
+import random
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+import httpx
+from sqlalchemy import insert
+
+from app.core.config import settings
+from app.core.metrics import metricas
+from app.models.database import AsyncSessionLocal, async_engine
+from app.models.documento import LogEnvio
+
+logger = logging.getLogger(__name__)
+
+# Columnas en el orden del COPY
+_COLUMNAS = (
+    'clave_documento', 'fecha_intento', 'tipo_operacion', 'url_endpoint',
+    'headers_request', 'payload_request', 'codigo_respuesta', 'headers_response',
+    'payload_response', 'tiempo_respuesta_ms', 'exitoso', 'mensaje_error',
+)
+_COLUMNAS_JSON = {'headers_request', 'headers_response'}
+
+# Encabezados que nunca se guardan en claro
+_ENCABEZADOS_SENSIBLES = {'authorization', 'cookie', 'set-cookie'}
+
+
+def _encabezados(headers) -> Dict[str, str]:
+    return {
+        nombre: "***" if nombre.lower() in _ENCABEZADOS_SENSIBLES else valor
+        for nombre, valor in (headers or {}).items()
+    }
+
+
+def _cuerpo(kwargs: Dict[str, Any]) -> Optional[str]:
+    if kwargs.get('json') is not None:
+        return json.dumps(kwargs['json'], ensure_ascii=False)
+    contenido = kwargs.get('content') or kwargs.get('data')
+    if isinstance(contenido, bytes):
+        return contenido.decode('utf-8', errors='replace')
+    if isinstance(contenido, dict):
+        return json.dumps(contenido, ensure_ascii=False)
+    return contenido
+
+
+class BitacoraEnvios:
+    """
+    Registro de cada interacción con Hacienda en logs_envio sin escribir en el camino crítico.
+
+    Las filas se acumulan en un buffer circular en memoria y una única tarea las
+    escribe por lotes (COPY o INSERT multi-fila) al llegar a `lote` filas o cada
+    `intervalo_ms`. Si la base no da abasto y el buffer se llena, se descartan
+    las filas más antiguas y se cuentan en `logs_envio_descartados`.
+
+    Los payloads completos se guardan siempre que hubo error y sólo en una
+    muestra de los éxitos; el resto conserva encabezados, código y tiempos.
+    """
+
+    def __init__(self, capacidad: Optional[int] = None, lote: Optional[int] = None,
+                 intervalo_ms: Optional[float] = None, muestreo_exito: Optional[float] = None,
+                 modo: Optional[str] = None):
+        self.capacidad = capacidad or settings.logs_envio_capacidad
+        self.lote = lote or settings.logs_envio_lote
+        self.intervalo = (intervalo_ms if intervalo_ms is not None else settings.logs_envio_intervalo_ms) / 1000
+        self.muestreo_exito = settings.logs_envio_muestreo_exito if muestreo_exito is None else muestreo_exito
+        self.modo = modo or settings.logs_envio_modo
+        self._buffer: Deque[Dict[str, Any]] = deque(maxlen=self.capacidad)
+        self._temporizador: Optional[asyncio.TimerHandle] = None
+        self._escritor: Optional[asyncio.Task] = None
+
+    # --------------------------------------------------------------- registro
+
+    def registrar_solicitud(self, clave: str, operacion: str, url: str, kwargs: Dict[str, Any],
+                            response: Optional[httpx.Response], error: Optional[BaseException],
+                            tiempo_ms: float) -> None:
+        """Encolar la fila de una solicitud a Hacienda (no bloquea)"""
+        exitoso = error is None and response is not None and response.status_code < 400
+        conservar = not exitoso or random.random() < self.muestreo_exito
+        mensaje_error = None
+        if error is not None:
+            mensaje_error = f"{type(error).__name__}: {error}"
+        elif not exitoso:
+            mensaje_error = response.headers.get('X-Error-Cause') or f"HTTP {response.status_code}"
+
+        self.registrar({
+            'clave_documento': clave,
+            'fecha_intento': datetime.now(),
+            'tipo_operacion': operacion,
+            'url_endpoint': url[:200],
+            'headers_request': _encabezados(kwargs.get('headers')),
+            'payload_request': _cuerpo(kwargs) if conservar else None,
+            'codigo_respuesta': response.status_code if response is not None else None,
+            'headers_response': _encabezados(response.headers) if response is not None else None,
+            'payload_response': response.text if conservar and response is not None else None,
+            'tiempo_respuesta_ms': int(tiempo_ms),
+            'exitoso': exitoso,
+            'mensaje_error': mensaje_error,
+        })
+        metricas.incrementar("logs_envio_registrados", payload="completo" if conservar else "omitido")
+
+    def registrar(self, fila: Dict[str, Any]) -> None:
+        """Agregar una fila al buffer y programar su escritura"""
+        if len(self._buffer) >= self.capacidad:
+            metricas.incrementar("logs_envio_descartados")
+        self._buffer.append(fila)
+        metricas.fijar("logs_envio_buffer_ocupacion", len(self._buffer) / self.capacidad)
+
+        if len(self._buffer) >= self.lote:
+            self._despertar()
+        elif self._temporizador is None and not self._escribiendo():
+            self._temporizador = asyncio.get_running_loop().call_later(self.intervalo, self._despertar)
+
+    def _escribiendo(self) -> bool:
+        return self._escritor is not None and not self._escritor.done()
+
+    def _despertar(self) -> None:
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+        if not self._escribiendo():
+            self._escritor = asyncio.create_task(self._vaciar())
+
+    # -------------------------------------------------------------- escritura
+
+    async def _vaciar(self) -> None:
+        """Escribir lotes hasta dejar el buffer vacío (una sola tarea a la vez)"""
+        while self._buffer:
+            lote = [self._buffer.popleft() for _ in range(min(self.lote, len(self._buffer)))]
+            metricas.fijar("logs_envio_buffer_ocupacion", len(self._buffer) / self.capacidad)
+            try:
+                if self.modo == "copy":
+                    await self._copiar(lote)
+                else:
+                    await self._insertar(lote)
+                metricas.observar("logs_envio_lote_filas", len(lote))
+            except Exception as e:
+                # La bitácora es de diagnóstico: un lote fallido se pierde, no bloquea los envíos
+                metricas.incrementar("logs_envio_escritura_errores")
+                metricas.incrementar("logs_envio_descartados", len(lote))
+                logger.error(f"❌ No se pudieron escribir {len(lote)} filas de logs_envio: {e}")
+
+    @staticmethod
+    async def _copiar(lote: List[Dict[str, Any]]) -> None:
+        registros = [
+            tuple(json.dumps(fila[c]) if c in _COLUMNAS_JSON and fila[c] is not None else fila[c]
+                  for c in _COLUMNAS)
+            for fila in lote
+        ]
+        async with async_engine.connect() as conexion:
+            crudo = await conexion.get_raw_connection()
+            await crudo.driver_connection.copy_records_to_table(
+                LogEnvio.__tablename__, records=registros, columns=_COLUMNAS
+            )
+
+    @staticmethod
+    async def _insertar(lote: List[Dict[str, Any]]) -> None:
+        async with AsyncSessionLocal() as sesion:
+            await sesion.execute(insert(LogEnvio), lote)
+            await sesion.commit()
+
+    async def cerrar(self) -> None:
+        """Escribir lo pendiente (al apagar el proceso)"""
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+        if self._escribiendo():
+            await self._escritor
+        if self._buffer:
+            await self._vaciar()
+
+
+# Instancia global
+bitacora_envios = BitacoraEnvios()
@@ -0,0 +1,123 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+from app.core.config import settings
+from app.core.metrics import metricas
+from app.core.reference_data import validar_ubicacion
+
+logger = logging.getLogger(__name__)
+
+
+def _contenido(emisor: Union[BaseModel, Dict[str, Any]]) -> Tuple:
+    """
+    Contenido del emisor como tupla de (campo, valor), con un nivel de anidamiento
+    (ubicacion, telefono, fax). Un modelo y su model_dump() dan la misma tupla, así
+    que la ruta puede buscar con el modelo y el generador con el diccionario.
+    """
+    campos = emisor.__dict__ if isinstance(emisor, BaseModel) else emisor
+    return tuple([
+        (campo, tuple(valor.__dict__.items()) if isinstance(valor, BaseModel)
+         else tuple(valor.items()) if isinstance(valor, dict) else valor)
+        for campo, valor in campos.items()
+    ])
+
+
+class PerfilEmisor:
+    """
+    Emisor ya validado: sus datos como diccionario, el resultado de validar la
+    ubicación con los datos oficiales y el bloque <Emisor> ya escrito de cada
+    tipo de comprobante (cada XSD admite elementos distintos).
+
+    Los datos se comparten entre todas las facturas del emisor: no se modifican.
+    """
+
+    def __init__(self, cedula: str, datos: Dict[str, Any]):
+        self.cedula = cedula
+        self.datos = datos
+        self.ubicacion_valida = True
+        self.mensaje_ubicacion = ""
+        ubicacion = datos.get('ubicacion')
+        if ubicacion and all(k in ubicacion for k in ['provincia', 'canton', 'distrito']):
+            # El XSD pide la provincia con un dígito; los datos oficiales la tienen con dos
+            self.ubicacion_valida, self.mensaje_ubicacion = validar_ubicacion(
+                str(ubicacion['provincia']).zfill(2),
+                str(ubicacion['canton']).zfill(2),
+                str(ubicacion['distrito']).zfill(2)
+            )
+            if not self.ubicacion_valida:
+                logger.warning(f"⚠️ Ubicación del emisor {cedula}: {self.mensaje_ubicacion}")
+        # Raíz del tipo de comprobante (FacturaElectronica, TiqueteElectronico...) -> <Emisor>...</Emisor>
+        self.fragmentos: Dict[str, str] = {}
+
+
+class CacheEmisores:
+    """
+    Caché LRU en memoria de perfiles de emisor para el XML v4.4.
+
+    Unos pocos emisores emiten casi todos los comprobantes; en vez de volver a
+    validar la ubicación, convertir el modelo y escapar el bloque <Emisor> en cada
+    factura, se guarda un PerfilEmisor por cédula y contenido. Si el perfil del
+    emisor cambia (nombre, ubicación, correo...) la llave cambia con él, así que
+    nunca se sirve un bloque viejo; la entrada anterior sale por LRU o con
+    `invalidar`. Cada worker de uvicorn tiene su propia caché.
+    """
+
+    def __init__(self, capacidad: Optional[int] = None):
+        self.capacidad = settings.cache_emisores_capacidad if capacidad is None else capacidad
+        self._perfiles: "OrderedDict[Tuple[str, Tuple], PerfilEmisor]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def perfil(self, emisor: Union[BaseModel, Dict[str, Any]]) -> PerfilEmisor:
+        """Perfil del emisor (modelo Emisor o su diccionario), validado una sola vez por contenido"""
+        if isinstance(emisor, BaseModel):
+            cedula = emisor.identificacion_numero
+        else:
+            cedula = emisor['identificacion_numero']
+        if not settings.cache_emisores_habilitado or self.capacidad <= 0:
+            return PerfilEmisor(cedula, emisor.model_dump() if isinstance(emisor, BaseModel) else emisor)
+
+        llave = (cedula, _contenido(emisor))
+        with self._lock:
+            perfil = self._perfiles.get(llave)
+            if perfil is not None:
+                self._perfiles.move_to_end(llave)
+        if perfil is not None:
+            metricas.incrementar("cache_emisores_aciertos")
+            return perfil
+
+        metricas.incrementar("cache_emisores_fallos")
+        perfil = PerfilEmisor(cedula, emisor.model_dump() if isinstance(emisor, BaseModel) else dict(emisor))
+        with self._lock:
+            perfil = self._perfiles.setdefault(llave, perfil)
+            self._perfiles.move_to_end(llave)
+            desalojados = 0
+            while len(self._perfiles) > self.capacidad:
+                self._perfiles.popitem(last=False)
+                desalojados += 1
+        if desalojados:
+            metricas.incrementar("cache_emisores_desalojos", desalojados)
+        return perfil
+
+    def invalidar(self, cedula: Optional[str] = None) -> int:
+        """Descartar los perfiles de una cédula (o todos); devuelve cuántos se descartaron"""
+        with self._lock:
+            if cedula is None:
+                llaves = list(self._perfiles)
+            else:
+                llaves = [llave for llave in self._perfiles if llave[0] == cedula]
+            for llave in llaves:
+                del self._perfiles[llave]
+        if llaves:
+            metricas.incrementar("cache_emisores_invalidaciones", len(llaves))
+        return len(llaves)
+
+    def __len__(self) -> int:
+        return len(self._perfiles)
+
+
+# Instancia global
+cache_emisores = CacheEmisores()
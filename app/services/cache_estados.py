@@ -0,0 +1,114 @@
+import asyncio
+import json
+import logging
+from datetime import date
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from app.core.config import settings
+from app.core.metrics import metricas
+from app.core.redis import obtener_redis
+from app.services.respuesta_hacienda import ESTADOS_FINALES
+
+logger = logging.getLogger(__name__)
+
+Cargador = Callable[[], Awaitable[Optional[Dict[str, Any]]]]
+
+
+def _serializar(valor: Any) -> Any:
+    # Igual que la respuesta JSON de FastAPI: montos como número, fechas ISO
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, date):
+        return valor.isoformat()
+    raise TypeError(f"{type(valor).__name__} no serializable")
+
+
+class CacheEstados:
+    """
+    Caché de lectura en Redis para la consulta de documentos por clave.
+
+    Un estado final (aceptado/rechazado) ya no cambia, así que se guarda sin
+    expiración; los estados intermedios viven `ttl_transitorio` segundos. Las
+    actualizaciones del repositorio (sondeo, callbacks, reenvíos) invalidan la
+    entrada, y las consultas simultáneas de una misma clave sin caché comparten
+    una sola carga. Si Redis no responde se lee directo del almacén.
+    """
+
+    PREFIJO = "estado_documento"
+
+    def __init__(self, ttl_transitorio: Optional[float] = None, ttl_final: Optional[int] = None):
+        self.ttl_transitorio = ttl_transitorio or settings.cache_estados_ttl_transitorio
+        self.ttl_final = settings.cache_estados_ttl_final if ttl_final is None else ttl_final
+        self._cargas: Dict[str, asyncio.Future] = {}
+
+    def _llave(self, clave: str) -> str:
+        return f"{self.PREFIJO}:{clave}"
+
+    async def obtener(self, clave: str, cargar: Cargador) -> Optional[Dict[str, Any]]:
+        """Documento desde la caché, o desde `cargar` (una sola carga por clave a la vez)"""
+        if not settings.cache_estados_habilitado:
+            return await cargar()
+
+        try:
+            guardado = await obtener_redis().get(self._llave(clave))
+        except Exception as e:
+            metricas.incrementar("cache_estados_errores", operacion="leer")
+            logger.warning(f"⚠️ Caché de estados no disponible: {e}")
+            return await cargar()
+        if guardado is not None:
+            metricas.incrementar("cache_estados", resultado="acierto")
+            return json.loads(guardado)
+
+        en_curso = self._cargas.get(clave)
+        if en_curso is not None:
+            metricas.incrementar("cache_estados", resultado="compartido")
+            return await asyncio.shield(en_curso)
+
+        metricas.incrementar("cache_estados", resultado="fallo")
+        futuro = asyncio.get_running_loop().create_future()
+        self._cargas[clave] = futuro
+        try:
+            documento = await cargar()
+            futuro.set_result(documento)
+        except asyncio.CancelledError:
+            futuro.cancel()
+            raise
+        except Exception as e:
+            futuro.set_exception(e)
+            # Que el error no quede sin recuperar cuando no hay nadie más esperando
+            futuro.exception()
+            raise
+        finally:
+            del self._cargas[clave]
+
+        if documento is not None:
+            await self._guardar(clave, documento)
+        return documento
+
+    async def _guardar(self, clave: str, documento: Dict[str, Any]) -> None:
+        final = documento.get('estado') in ESTADOS_FINALES
+        ttl = self.ttl_final if final else self.ttl_transitorio
+        try:
+            await obtener_redis().set(self._llave(clave), json.dumps(documento, ensure_ascii=False, default=_serializar),
+                                      px=int(ttl * 1000) if ttl else None)
+        except Exception as e:
+            metricas.incrementar("cache_estados_errores", operacion="guardar")
+            logger.warning(f"⚠️ No se pudo guardar {clave} en la caché de estados: {e}")
+
+    async def invalidar(self, claves: Iterable[str]) -> None:
+        """Descartar las entradas de documentos que acaban de cambiar"""
+        llaves = [self._llave(clave) for clave in claves]
+        if not llaves or not settings.cache_estados_habilitado:
+            return
+        try:
+            await obtener_redis().delete(*llaves)
+            metricas.incrementar("cache_estados_invalidaciones", len(llaves))
+        except Exception as e:
+            # La entrada vencida se corrige sola con el TTL de los estados intermedios
+            metricas.incrementar("cache_estados_errores", operacion="invalidar")
+            logger.warning(f"⚠️ No se pudo invalidar la caché de estados: {e}")
+
+
+# Instancia global
+cache_estados = CacheEstados()
@@ -0,0 +1,280 @@
+import logging
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.reference_data import UNIDADES_SERVICIO
+
+logger = logging.getLogger(__name__)
+
+CERO = Decimal(0)
+CIEN = Decimal(100)
+CINCO_DECIMALES = Decimal('0.00001')
+TRES_DECIMALES = Decimal('0.001')
+
+CODIGO_IVA = '01'
+TARIFA_REDUCIDA_SALUD = '04'  # 4%: servicios de salud privados, IVA devuelto si se pagan con tarjeta
+MEDIO_PAGO_TARJETA = '02'
+
+# v4.4 exige al menos un Impuesto por línea: las líneas sin impuestos llevan el IVA a tarifa exenta (10)
+IMPUESTO_EXENTO_V44 = {'codigo': CODIGO_IVA, 'codigo_tarifa': '10', 'tarifa': CERO}
+
+CAMPOS_LINEA = ('monto_total', 'subtotal', 'impuesto_neto', 'monto_total_linea')
+
+CAMPOS_RESUMEN = (
+    'total_servicios_gravados', 'total_servicios_exentos', 'total_servicios_exonerados',
+    'total_mercaderias_gravadas', 'total_mercaderias_exentas', 'total_mercaderias_exoneradas',
+    'total_gravado', 'total_exento', 'total_exonerado', 'total_venta', 'total_descuentos',
+    'total_venta_neta', 'total_impuesto', 'total_iva_devuelto', 'total_otros_cargos', 'total_comprobante',
+)
+
+
+def _decimal(valor: Any) -> Decimal:
+    """Decimal exacto de un monto (los float pasan por su texto, no por su binario)"""
+    if type(valor) is Decimal:
+        return valor
+    if valor is None:
+        return CERO
+    if isinstance(valor, float):
+        return Decimal(repr(valor))
+    return Decimal(valor)
+
+
+def _redondear(valor: Decimal) -> Decimal:
+    """Cinco decimales del XSD, mitad hacia arriba"""
+    return valor.quantize(CINCO_DECIMALES, rounding=ROUND_HALF_UP)
+
+
+def _descuentos(detalle: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Descuentos de la línea como lista (v4.4: descuentos o descuento; v4.3: descuento_monto)"""
+    if detalle.get('descuentos'):
+        return [dict(d, monto=_redondear(_decimal(d.get('monto')))) for d in detalle['descuentos']]
+    if detalle.get('descuento'):
+        descuento = detalle['descuento']
+        return [dict(descuento, monto=_redondear(_decimal(descuento.get('monto'))))]
+    if detalle.get('descuento_monto'):
+        return [{'monto': _redondear(_decimal(detalle['descuento_monto'])),
+                 'naturaleza': detalle.get('descuento_naturaleza')}]
+    return []
+
+
+def _porcentaje_exoneracion(impuesto: Dict[str, Any]) -> Optional[Decimal]:
+    """Porcentaje exonerado del impuesto (v4.4: exoneracion anidada; v4.3: campos exoneracion_*)"""
+    exoneracion = impuesto.get('exoneracion')
+    if exoneracion:
+        return _decimal(exoneracion.get('porcentaje_exoneracion'))
+    porcentaje = impuesto.get('exoneracion_porcentaje_exoneracion')
+    return None if porcentaje is None else _decimal(porcentaje)
+
+
+class CalculadoraTotales:
+    """
+    Montos de las líneas y del ResumenFactura calculados en Decimal.
+
+    Una sola pasada por las líneas: cada monto se redondea a 5 decimales
+    (mitad hacia arriba) donde aparece en el XML y los totales son sumas
+    exactas de esos montos redondeados, así que el resumen siempre cuadra
+    con las líneas. Reglas:
+
+    - MontoTotal = Cantidad (3 decimales) × PrecioUnitario; SubTotal = MontoTotal - descuentos
+    - Monto de cada impuesto = SubTotal × Tarifa / 100; la exoneración rebaja
+      su porcentaje del impuesto, e ImpuestoNeto suma lo que queda
+    - La línea es servicio si su unidad de medida está en UNIDADES_SERVICIO y
+      mercancía si no; sin impuestos con tarifa es exenta, con exoneración el
+      porcentaje exonerado del MontoTotal va a exonerado y el resto a gravado
+    - IVA devuelto: IVA a tarifa reducida de salud (código 04) de servicios pagados con tarjeta
+    - TotalComprobante = TotalVentaNeta + TotalImpuesto + TotalOtrosCargos - TotalIVADevuelto
+    - desglose_impuesto (TotalDesgloseImpuesto): impuesto neto por código e impuesto y tarifa
+
+    Las líneas sin impuestos no reciben un IVA supuesto: se declaran exentas,
+    y con `impuesto_exento` (IMPUESTO_EXENTO_V44) llevan ese impuesto en 0.
+    """
+
+    def calcular(self, detalles: Iterable[Dict[str, Any]], otros_cargos: Optional[Iterable[Dict[str, Any]]] = None,
+                 medio_pago: Optional[Iterable[str]] = None,
+                 impuesto_exento: Optional[Dict[str, Any]] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Decimal]]:
+        """
+        Calcular las líneas y los totales del resumen
+
+        Args:
+            detalles: Líneas de detalle (esquema v4.4 o v4.3, como diccionarios)
+            otros_cargos: Otros cargos del comprobante
+            medio_pago: Códigos de medio de pago
+            impuesto_exento: Impuesto para las líneas que no traen ninguno (v4.4: IMPUESTO_EXENTO_V44)
+
+        Returns:
+            Tuple[List[Dict], Dict[str, Decimal]]: (líneas completas, totales del resumen)
+            Las líneas son copias; los montos que traían se reemplazan por los calculados.
+            Los totales traen además `desglose_impuesto`: [{codigo, codigo_tarifa, monto}].
+        """
+        con_tarjeta = MEDIO_PAGO_TARJETA in (medio_pago or ())
+        servicios_gravados = servicios_exentos = servicios_exonerados = CERO
+        mercaderias_gravadas = mercaderias_exentas = mercaderias_exoneradas = CERO
+        total_descuentos = total_impuesto = total_iva_devuelto = CERO
+        desglose = {}
+
+        lineas = []
+        for detalle in detalles:
+            linea = dict(detalle)
+            cantidad = _decimal(linea['cantidad']).quantize(TRES_DECIMALES, ROUND_HALF_UP)
+            monto_total = (cantidad * _decimal(linea['precio_unitario'])).quantize(CINCO_DECIMALES, ROUND_HALF_UP)
+            if linea.get('descuentos') or linea.get('descuento') or linea.get('descuento_monto'):
+                descuentos = _descuentos(linea)
+                descuento = sum(d['monto'] for d in descuentos)
+            else:
+                descuentos, descuento = [], CERO
+            subtotal = monto_total - descuento
+
+            impuesto_neto = iva_salud = CERO
+            gravada = False
+            porcentaje_exonerado = None
+            impuestos = []
+            for impuesto in linea.get('impuestos') or ((impuesto_exento,) if impuesto_exento else ()):
+                impuesto = dict(impuesto)
+                tarifa = _decimal(impuesto['tarifa'])
+                monto = (subtotal * tarifa / CIEN).quantize(CINCO_DECIMALES, ROUND_HALF_UP)
+                impuesto['monto'] = monto
+                neto = monto
+                porcentaje = _porcentaje_exoneracion(impuesto)
+                if porcentaje is not None:
+                    exonerado = (monto * porcentaje / CIEN).quantize(CINCO_DECIMALES, ROUND_HALF_UP)
+                    neto = monto - exonerado
+                    if impuesto.get('exoneracion'):
+                        impuesto['exoneracion'] = dict(impuesto['exoneracion'], monto_exoneracion=exonerado)
+                    else:
+                        impuesto['exoneracion_monto_exoneracion'] = exonerado
+                    if porcentaje_exonerado is None:
+                        porcentaje_exonerado = porcentaje
+                impuesto_neto += neto
+                llave = (impuesto['codigo'], impuesto.get('codigo_tarifa'))
+                desglose[llave] = desglose.get(llave, CERO) + neto
+                if tarifa:
+                    gravada = True
+                if impuesto['codigo'] == CODIGO_IVA and impuesto['codigo_tarifa'] == TARIFA_REDUCIDA_SALUD:
+                    iva_salud += neto
+                impuestos.append(impuesto)
+
+            # Reparto del MontoTotal entre gravado, exento y exonerado
+            if not gravada:
+                gravado, exento, exonerado = CERO, monto_total, CERO
+            elif porcentaje_exonerado:
+                exonerado = (monto_total * porcentaje_exonerado / CIEN).quantize(CINCO_DECIMALES, ROUND_HALF_UP)
+                gravado, exento = monto_total - exonerado, CERO
+            else:
+                gravado, exento, exonerado = monto_total, CERO, CERO
+
+            if linea['unidad_medida'] in UNIDADES_SERVICIO:
+                servicios_gravados += gravado
+                servicios_exentos += exento
+                servicios_exonerados += exonerado
+                if con_tarjeta:
+                    total_iva_devuelto += iva_salud
+            else:
+                mercaderias_gravadas += gravado
+                mercaderias_exentas += exento
+                mercaderias_exoneradas += exonerado
+
+            linea['cantidad'] = cantidad
+            linea['monto_total'] = monto_total
+            linea['descuentos'] = descuentos
+            linea['subtotal'] = subtotal
+            linea['impuestos'] = impuestos
+            linea['impuesto_neto'] = impuesto_neto
+            linea['monto_total_linea'] = subtotal + impuesto_neto
+            lineas.append(linea)
+            total_descuentos += descuento
+            total_impuesto += impuesto_neto
+
+        total_otros_cargos = sum((_redondear(_decimal(c.get('monto_cargo'))) for c in otros_cargos or ()), CERO)
+        total_gravado = servicios_gravados + mercaderias_gravadas
+        total_exento = servicios_exentos + mercaderias_exentas
+        total_exonerado = servicios_exonerados + mercaderias_exoneradas
+        total_venta = total_gravado + total_exento + total_exonerado
+        total_venta_neta = total_venta - total_descuentos
+
+        totales = {
+            'total_servicios_gravados': servicios_gravados,
+            'total_servicios_exentos': servicios_exentos,
+            'total_servicios_exonerados': servicios_exonerados,
+            'total_mercaderias_gravadas': mercaderias_gravadas,
+            'total_mercaderias_exentas': mercaderias_exentas,
+            'total_mercaderias_exoneradas': mercaderias_exoneradas,
+            'total_gravado': total_gravado,
+            'total_exento': total_exento,
+            'total_exonerado': total_exonerado,
+            'total_venta': total_venta,
+            'total_descuentos': total_descuentos,
+            'total_venta_neta': total_venta_neta,
+            'total_impuesto': total_impuesto,
+            'total_iva_devuelto': total_iva_devuelto,
+            'total_otros_cargos': total_otros_cargos,
+            'total_comprobante': total_venta_neta + total_impuesto + total_otros_cargos - total_iva_devuelto,
+            'desglose_impuesto': [{'codigo': codigo, 'codigo_tarifa': tarifa, 'monto': monto}
+                                  for (codigo, tarifa), monto in desglose.items()],
+        }
+        return lineas, totales
+
+    def validar(self, detalles: List[Dict[str, Any]], resumen: Optional[Dict[str, Any]],
+                otros_cargos: Optional[Iterable[Dict[str, Any]]] = None, medio_pago: Optional[Iterable[str]] = None,
+                tolerancia: Optional[Decimal] = None) -> List[Dict[str, Any]]:
+        """
+        Comparar los montos que envió el cliente con los calculados, sin reemplazarlos
+
+        Sólo se revisan los montos presentes (los None no cuentan como diferencia).
+
+        Returns:
+            List[Dict]: Una entrada por monto fuera de tolerancia con `linea`
+            (None para el resumen), `campo`, `enviado` y `calculado`
+        """
+        if tolerancia is None:
+            tolerancia = _decimal(settings.totales_tolerancia)
+        lineas, totales = self.calcular(detalles, otros_cargos, medio_pago)
+        diferencias = []
+
+        def comparar(linea: Optional[int], campo: str, enviado: Any, calculado: Decimal) -> None:
+            if enviado is not None and abs(_decimal(enviado) - calculado) > tolerancia:
+                diferencias.append({'linea': linea, 'campo': campo,
+                                    'enviado': f"{_decimal(enviado):.5f}", 'calculado': f"{calculado:.5f}"})
+
+        for original, linea in zip(detalles, lineas):
+            numero = linea.get('numero_linea')
+            for campo in CAMPOS_LINEA:
+                comparar(numero, campo, original.get(campo), linea[campo])
+            for i, (enviado, calculado) in enumerate(zip(original.get('impuestos') or [], linea['impuestos'])):
+                comparar(numero, f"impuestos[{i}].monto", enviado.get('monto'), calculado['monto'])
+                if enviado.get('exoneracion'):
+                    comparar(numero, f"impuestos[{i}].exoneracion.monto_exoneracion",
+                             enviado['exoneracion'].get('monto_exoneracion'),
+                             calculado['exoneracion']['monto_exoneracion'])
+                elif 'exoneracion_monto_exoneracion' in calculado:
+                    comparar(numero, f"impuestos[{i}].exoneracion_monto_exoneracion",
+                             enviado.get('exoneracion_monto_exoneracion'), calculado['exoneracion_monto_exoneracion'])
+        for campo in CAMPOS_RESUMEN:
+            comparar(None, campo, (resumen or {}).get(campo), totales[campo])
+
+        if diferencias:
+            logger.warning(f"⚠️ Totales del cliente con {len(diferencias)} diferencias contra el cálculo")
+        return diferencias
+
+    def aplicar(self, factura, lineas: List[Dict[str, Any]], resumen: Dict[str, Any]) -> None:
+        """
+        Copiar a la factura (modelos v4.4 o v4.3) los montos calculados
+
+        Así la fila del documento y sus líneas se guardan con los mismos montos del XML.
+        """
+        for modelo, linea in zip(factura.detalles_servicio or [], lineas):
+            modelo.cantidad = linea['cantidad']
+            for campo in CAMPOS_LINEA:
+                setattr(modelo, campo, linea[campo])
+            for impuesto, calculado in zip(modelo.impuestos or [], linea['impuestos']):
+                impuesto.monto = calculado['monto']
+                if getattr(impuesto, 'exoneracion', None) is not None:
+                    impuesto.exoneracion.monto_exoneracion = calculado['exoneracion']['monto_exoneracion']
+                elif 'exoneracion_monto_exoneracion' in calculado:
+                    impuesto.exoneracion_monto_exoneracion = calculado['exoneracion_monto_exoneracion']
+        for campo in CAMPOS_RESUMEN:
+            setattr(factura.resumen_factura, campo, resumen[campo])
+
+
+# Instancia global
+calculadora_totales = CalculadoraTotales()
@@ -0,0 +1,234 @@
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import metricas
+from app.core.redis import obtener_redis
+from app.services.resiliencia import politica_reintentos
+
+logger = logging.getLogger(__name__)
+
+# Encola sólo si la clave no está en cola ni fue entregada (dedupe por clave)
+_ENCOLAR = """
+if redis.call('EXISTS', KEYS[2]) == 1 then return 0 end
+if redis.call('HSETNX', KEYS[1], 'xml', ARGV[1]) == 0 then return 0 end
+redis.call('HSET', KEYS[1], 'intentos', 0, 'encolado_en', ARGV[2])
+redis.call('LPUSH', KEYS[3], ARGV[3])
+return 1
+"""
+
+# Pasa hasta N claves de contingencia a pendientes conservando el orden de emisión
+_DRENAR_CONTINGENCIA = """
+local movidas = 0
+for i = 1, tonumber(ARGV[1]) do
+    local c = redis.call('RPOP', KEYS[1])
+    if not c then break end
+    redis.call('LPUSH', KEYS[2], c)
+    movidas = movidas + 1
+end
+return movidas
+"""
+
+# Suma un intento sólo si el documento sigue en la cola: HINCRBY sobre un hash ya
+# confirmado o borrado lo recrearía sin XML y quedaría huérfano
+_REGISTRAR_FALLO = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('ZREM', KEYS[2], ARGV[2])
+    return -1
+end
+local intentos = redis.call('HINCRBY', KEYS[1], 'intentos', 1)
+redis.call('HSET', KEYS[1], 'ultimo_error', ARGV[1])
+return intentos
+"""
+
+# Mueve hasta N claves de pendientes a procesando con su plazo de visibilidad
+_RESERVAR = """
+local claves = redis.call('RPOP', KEYS[1], ARGV[2])
+if not claves then return {} end
+for _, c in ipairs(claves) do redis.call('ZADD', KEYS[2], ARGV[1], c) end
+return claves
+"""
+
+# Devuelve a pendientes (al frente) las claves cuyo plazo de visibilidad venció
+_RECUPERAR_VENCIDOS = """
+local vencidos = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, c in ipairs(vencidos) do
+    redis.call('ZREM', KEYS[1], c)
+    redis.call('RPUSH', KEYS[2], c)
+end
+return #vencidos
+"""
+
+
+class ColaEnvios:
+    """
+    Cola persistente de envíos a Hacienda en Redis.
+
+    Entrega al menos una vez: cada clave reservada queda en un ZSET de
+    "procesando" con un plazo de visibilidad; si el worker muere sin confirmar,
+    la clave vuelve a pendientes al vencer el plazo. Tras agotar los intentos
+    la clave pasa a la lista de muertos (dead-letter).
+
+    Mientras el circuito de Hacienda está abierto los documentos esperan en la
+    lista de contingencia sin consumir intentos, y se drenan a pendientes
+    cuando el circuito se cierra.
+    """
+
+    PREFIJO = "cola:envios"
+
+    def __init__(self):
+        self.pendientes = f"{self.PREFIJO}:pendientes"
+        self.procesando = f"{self.PREFIJO}:procesando"
+        self.muertos = f"{self.PREFIJO}:muertos"
+        self.contingencia = f"{self.PREFIJO}:contingencia"
+        self.visibilidad = settings.cola_visibilidad_segundos
+        self.max_intentos = settings.cola_max_intentos
+
+    def _clave_doc(self, clave: str) -> str:
+        return f"{self.PREFIJO}:doc:{clave}"
+
+    def _clave_entregado(self, clave: str) -> str:
+        return f"{self.PREFIJO}:entregado:{clave}"
+
+    async def encolar(self, clave: str, xml_firmado: str, contingencia: bool = False) -> bool:
+        """
+        Encolar un documento firmado para envío
+
+        Args:
+            contingencia: Emitido con el circuito abierto; espera el drenado de contingencia
+
+        Returns:
+            bool: False si la clave ya estaba en cola o ya fue entregada
+        """
+        encolado = await obtener_redis().eval(
+            _ENCOLAR, 3,
+            self._clave_doc(clave), self._clave_entregado(clave),
+            self.contingencia if contingencia else self.pendientes,
+            xml_firmado, time.time(), clave
+        )
+        metricas.incrementar("cola_envios_encolados" if encolado else "cola_envios_duplicados")
+        return bool(encolado)
+
+    async def reservar(self, cantidad: int) -> List[Tuple[str, Dict[str, Any]]]:
+        """Reservar hasta `cantidad` documentos para entregar"""
+        redis = obtener_redis()
+        claves = await redis.eval(
+            _RESERVAR, 2, self.pendientes, self.procesando,
+            time.time() + self.visibilidad, cantidad
+        )
+        reservados = []
+        for clave in claves:
+            doc = await redis.hgetall(self._clave_doc(clave))
+            if not doc:
+                # Confirmado por otro worker tras una reentrega
+                await redis.zrem(self.procesando, clave)
+                continue
+            reservados.append((clave, doc))
+        return reservados
+
+    async def confirmar(self, clave: str) -> None:
+        """Marcar como entregado y liberar el documento"""
+        async with obtener_redis().pipeline(transaction=True) as pipe:
+            pipe.zrem(self.procesando, clave)
+            pipe.delete(self._clave_doc(clave))
+            pipe.set(self._clave_entregado(clave), int(time.time()), ex=settings.cola_dedupe_ttl_segundos)
+            await pipe.execute()
+        metricas.incrementar("cola_envios_entregados")
+
+    async def reintentar(self, clave: str, error: str, reintentar_en: Optional[float] = None) -> bool:
+        """
+        Registrar un fallo y programar la reentrega
+
+        Returns:
+            bool: False si se agotaron los intentos y pasó a la lista de muertos
+                (True también si el documento ya no estaba en la cola)
+        """
+        redis = obtener_redis()
+        intentos = await redis.eval(
+            _REGISTRAR_FALLO, 2, self._clave_doc(clave), self.procesando, error[:1000], clave
+        )
+        if intentos < 0:
+            # Otro worker ya lo confirmó (o se descartó): no hay nada que reintentar
+            logger.warning(f"⚠️ Reintento de {clave} ignorado: el documento ya no está en la cola")
+            return True
+
+        if intentos >= self.max_intentos:
+            await self.descartar(clave, error)
+            return False
+
+        retraso = politica_reintentos.retraso(intentos, reintentar_en)
+        # El plazo de visibilidad hace de temporizador de reentrega; xx: no revivir una clave ya confirmada
+        await redis.zadd(self.procesando, {clave: time.time() + retraso}, xx=True)
+        metricas.incrementar("cola_envios_reintentos")
+        return True
+
+    async def a_contingencia(self, clave: str) -> None:
+        """Estacionar un documento reservado hasta que el circuito se cierre (sin consumir intentos)"""
+        async with obtener_redis().pipeline(transaction=True) as pipe:
+            pipe.zrem(self.procesando, clave)
+            pipe.lpush(self.contingencia, clave)
+            await pipe.execute()
+        metricas.incrementar("cola_envios_contingencia")
+
+    async def drenar_contingencia(self, lote: int = 500) -> int:
+        """Reconciliación: devolver a pendientes todo lo emitido o estacionado en contingencia"""
+        total = 0
+        while True:
+            movidas = await obtener_redis().eval(_DRENAR_CONTINGENCIA, 2, self.contingencia, self.pendientes, lote)
+            total += movidas
+            if movidas < lote:
+                break
+        if total:
+            logger.info(f"🔁 Drenado de contingencia: {total} documentos devueltos a la cola")
+        return total
+
+    async def sondear_contingencia(self) -> bool:
+        """Pasar a pendientes sólo el documento más antiguo de contingencia, como envío de prueba"""
+        return bool(await obtener_redis().eval(_DRENAR_CONTINGENCIA, 2, self.contingencia, self.pendientes, 1))
+
+    async def descartar(self, clave: str, error: str) -> None:
+        """Mover a la lista de muertos (errores permanentes o intentos agotados)"""
+        async with obtener_redis().pipeline(transaction=True) as pipe:
+            pipe.hset(self._clave_doc(clave), 'ultimo_error', error[:1000])
+            pipe.zrem(self.procesando, clave)
+            pipe.lpush(self.muertos, clave)
+            await pipe.execute()
+        metricas.incrementar("cola_envios_muertos")
+        logger.error(f"☠️ Documento {clave} enviado a dead-letter: {error}")
+
+    async def recuperar_vencidos(self, limite: int = 500) -> int:
+        """Reencolar documentos cuyo plazo de visibilidad venció"""
+        return await obtener_redis().eval(
+            _RECUPERAR_VENCIDOS, 2, self.procesando, self.pendientes, time.time(), limite
+        )
+
+    async def reencolar_muertos(self, limite: int = 100) -> int:
+        """Devolver documentos de la lista de muertos a pendientes (intentos en cero)"""
+        redis = obtener_redis()
+        total = 0
+        for _ in range(limite):
+            clave = await redis.rpop(self.muertos)
+            if clave is None:
+                break
+            await redis.hset(self._clave_doc(clave), 'intentos', 0)
+            await redis.lpush(self.pendientes, clave)
+            total += 1
+        return total
+
+    async def estadisticas(self) -> Dict[str, int]:
+        """Profundidad de cada lista de la cola"""
+        redis = obtener_redis()
+        stats = {
+            'pendientes': await redis.llen(self.pendientes),
+            'procesando': await redis.zcard(self.procesando),
+            'muertos': await redis.llen(self.muertos),
+            'contingencia': await redis.llen(self.contingencia)
+        }
+        for nombre, valor in stats.items():
+            metricas.fijar("cola_envios_profundidad", valor, lista=nombre)
+        return stats
+
+
+# Instancia global
+cola_envios = ColaEnvios()
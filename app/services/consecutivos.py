@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import metricas
+from app.core.redis import obtener_redis
+
+logger = logging.getLogger(__name__)
+
+# Arrienda el rango libre más bajo (devuelto por otro proceso) o un bloque nuevo del contador
+_ARRENDAR = """
+local libre = redis.call('ZRANGE', KEYS[2], 0, 0)
+if libre[1] then
+    redis.call('ZREM', KEYS[2], libre[1])
+    return libre[1]
+end
+local fin = redis.call('INCRBY', KEYS[1], ARGV[1])
+return (fin - tonumber(ARGV[1]) + 1) .. ':' .. fin
+"""
+
+# Próximo número que se entregaría, sin consumirlo
+_CONSULTAR = """
+local libre = redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')
+if libre[2] then return tonumber(libre[2]) end
+return tonumber(redis.call('GET', KEYS[1]) or '0') + 1
+"""
+
+NUMERO_MAXIMO = 9999999999  # 10 dígitos
+
+
+class AsignadorConsecutivos:
+    """
+    Numeración consecutiva por (emisor, sucursal, terminal, tipo de documento).
+
+    Cada proceso arrienda bloques de números del contador en Redis (INCRBY) y
+    los entrega desde memoria, de modo que el contador compartido sólo se toca
+    una vez por bloque. Al apagar, los números no usados de cada bloque se
+    devuelven a un ZSET de rangos libres que se reparte antes de abrir bloques
+    nuevos: no se pierden ni se repiten números.
+    """
+
+    PREFIJO = "consecutivos"
+
+    def __init__(self, bloque: Optional[int] = None):
+        self.bloque = bloque or settings.consecutivo_bloque
+        self._arriendos: Dict[Tuple[str, str, str, str], list] = {}
+        self._candados: Dict[Tuple[str, str, str, str], asyncio.Lock] = {}
+
+    def _claves_redis(self, llave: Tuple[str, str, str, str]) -> Tuple[str, str]:
+        base = f"{self.PREFIJO}:{':'.join(llave)}"
+        return f"{base}:contador", f"{base}:libres"
+
+    @staticmethod
+    def _llave(emisor: str, tipo_documento: str, sucursal: Optional[str],
+               terminal: Optional[str]) -> Tuple[str, str, str, str]:
+        sucursal = (sucursal or settings.consecutivo_sucursal).zfill(3)
+        terminal = (terminal or settings.consecutivo_terminal).zfill(5)
+        if len(sucursal) != 3 or len(terminal) != 5 or len(tipo_documento) != 2:
+            raise ValueError("Sucursal (3), terminal (5) y tipo de documento (2) exceden su longitud")
+        return emisor, sucursal, terminal, tipo_documento
+
+    async def siguiente(self, emisor: str, tipo_documento: str,
+                        sucursal: Optional[str] = None, terminal: Optional[str] = None) -> str:
+        """
+        Entregar el próximo número consecutivo (20 dígitos)
+
+        Formato: sucursal(3) + terminal(5) + tipo de documento(2) + número(10)
+        """
+        llave = self._llave(emisor, tipo_documento, sucursal, terminal)
+        candado = self._candados.setdefault(llave, asyncio.Lock())
+        async with candado:
+            arriendo = self._arriendos.get(llave)
+            if arriendo is None or arriendo[0] > arriendo[1]:
+                arriendo = self._arriendos[llave] = await self._arrendar(llave)
+            numero = arriendo[0]
+            arriendo[0] += 1
+
+        if numero > NUMERO_MAXIMO:
+            raise ValueError(f"Numeración agotada para {llave}")
+        metricas.incrementar("consecutivos_entregados", tipo=tipo_documento)
+        return f"{llave[1]}{llave[2]}{llave[3]}{numero:010d}"
+
+    async def _arrendar(self, llave: Tuple[str, str, str, str]) -> list:
+        contador, libres = self._claves_redis(llave)
+        rango = await obtener_redis().eval(_ARRENDAR, 2, contador, libres, self.bloque)
+        inicio, fin = (int(x) for x in rango.split(':'))
+        metricas.incrementar("consecutivos_arriendos")
+        return [inicio, fin]
+
+    async def consultar_siguiente(self, emisor: str, tipo_documento: str,
+                                  sucursal: Optional[str] = None, terminal: Optional[str] = None) -> str:
+        """Próximo consecutivo que entregaría un bloque nuevo, sin consumirlo"""
+        llave = self._llave(emisor, tipo_documento, sucursal, terminal)
+        arriendo = self._arriendos.get(llave)
+        if arriendo and arriendo[0] <= arriendo[1]:
+            numero = arriendo[0]
+        else:
+            contador, libres = self._claves_redis(llave)
+            numero = await obtener_redis().eval(_CONSULTAR, 2, contador, libres)
+        return f"{llave[1]}{llave[2]}{llave[3]}{numero:010d}"
+
+    async def liberar(self) -> int:
+        """Devolver los números no usados de cada bloque arrendado (al apagar el proceso)"""
+        devueltos = 0
+        for llave, candado in list(self._candados.items()):
+            async with candado:
+                arriendo = self._arriendos.pop(llave, None)
+                if not arriendo or arriendo[0] > arriendo[1]:
+                    continue
+                _, libres = self._claves_redis(llave)
+                try:
+                    await obtener_redis().zadd(libres, {f"{arriendo[0]}:{arriendo[1]}": arriendo[0]})
+                    devueltos += arriendo[1] - arriendo[0] + 1
+                except Exception as e:
+                    logger.error(f"❌ No se pudo devolver el rango {arriendo[0]}-{arriendo[1]} de {llave}: {e}")
+        if devueltos:
+            logger.info(f"🔢 {devueltos} consecutivos no usados devueltos al asignador")
+        return devueltos
+
+
+# Instancia global
+asignador_consecutivos = AsignadorConsecutivos()
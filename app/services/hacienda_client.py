@@ -1,7 +1,12 @@
 import httpx
 import base64
-from typing import Dict, Any, Optional
+from typing import Dict, Any, AsyncIterator, Iterable, Optional
 from app.core.config import settings
+from app.services.hacienda_transport import hacienda_transport
+from app.services.consecutivos import asignador_consecutivos
+from app.services.hacienda_token import gestor_token
+from app.services.limitador_adaptativo import limitador_envios
+from app.services.resiliencia import circuito_hacienda
 import asyncio
 import secrets
 import string
@@ -15,7 +20,6 @@ class HaciendaClient:
         self.username = settings.hacienda_username
         self.password = settings.hacienda_password
         self.sandbox = settings.hacienda_sandbox
-        self.access_token = None
         
         print(f"🌐 Hacienda Client initialized:")
         print(f"   Base URL: {self.base_url}")
@@ -24,91 +28,59 @@ class HaciendaClient:
         print(f"   Username: {self.username}")
         print(f"   Sandbox: {self.sandbox}")
     
+    @property
+    def access_token(self) -> Optional[str]:
+        """Token vigente compartido (gestionado por GestorTokenHacienda)"""
+        return gestor_token.access_token
+    
     async def obtener_token(self) -> str:
         """Obtener token de acceso OAuth2 para la API de Hacienda"""
-        if not self.client_id:
-            raise ValueError("Client ID es requerido")
-        
-        if not self.username or not self.password:
-            raise ValueError("Username y Password son requeridos")
-        
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-        
-        # Para Hacienda SANDBOX se usa grant_type=password con username/password
-        data = {
-            'grant_type': 'password',
-            'client_id': self.client_id,
-            'username': self.username,
-            'password': self.password,
-        }
-        
-        # Si hay client_secret, incluirlo
-        if self.client_secret:
-            data['client_secret'] = self.client_secret
-        
-        print(f"🔑 Obteniendo token de: {self.token_url}")
-        print(f"   Grant type: password")
-        print(f"   Client ID: {self.client_id}")
-        print(f"   Username: {self.username}")
-        
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    self.token_url,
-                    headers=headers,
-                    data=data,
-                    timeout=30.0
-                )
-                
-                print(f"📡 Response status: {response.status_code}")
-                
-                if response.status_code == 200:
-                    token_data = response.json()
-                    self.access_token = token_data.get('access_token')
-                    print(f"✅ Token obtenido exitosamente")
-                    return self.access_token
-                else:
-                    error_text = response.text
-                    print(f"❌ Error obteniendo token: {response.status_code}")
-                    print(f"   Response: {error_text}")
-                    raise Exception(f"Error obteniendo token: {response.status_code} - {error_text}")
-                    
-            except httpx.TimeoutException:
-                raise Exception("Timeout al obtener token de Hacienda")
-            except Exception as e:
-                print(f"❌ Excepción obteniendo token: {e}")
-                raise
+        return await gestor_token.obtener_token()
+    
+    async def _solicitud_autenticada(self, operacion: str, method: str, url: str,
+                                     clave: Optional[str] = None, **kwargs) -> httpx.Response:
+        """Ejecutar una solicitud con Bearer token, reintentando una vez si Hacienda responde 401"""
+        for intento in range(2):
+            token = await gestor_token.obtener_token()
+            headers = {
+                'Authorization': f'Bearer {token}',
+                'Content-Type': 'application/json'
+            }
+            response = await hacienda_transport.request(operacion, method, url, clave=clave,
+                                                        headers=headers, **kwargs)
+            if response.status_code != 401 or intento == 1:
+                return response
+            await gestor_token.invalidar(token)
+        return response
+    
+    @staticmethod
+    def callback_url() -> Optional[str]:
+        """URL a la que Hacienda notifica el resultado (incluye el token compartido)"""
+        if not settings.hacienda_callback_url:
+            return None
+        if settings.hacienda_callback_token:
+            separador = '&' if '?' in settings.hacienda_callback_url else '?'
+            return f"{settings.hacienda_callback_url}{separador}token={settings.hacienda_callback_token}"
+        return settings.hacienda_callback_url
     
     async def generar_clave(self, pais: str, dia: str, mes: str, anno: str, 
                            cedula_emisor: str, tipo_documento: str, numero_consecutivo: str,
                            situacion: str = "1", codigo_seguridad: str = None) -> str:
-        """Generar clave única para documentos electrónicos"""
+        """
+        Generar clave única para documentos electrónicos (50 dígitos)
+
+        El tipo de documento ya va dentro del consecutivo; la fecha de la clave
+        determina la partición mensual donde se busca el documento.
+        """
         if not codigo_seguridad:
             codigo_seguridad = ''.join(secrets.choice(string.digits) for _ in range(8))
-        
-        # Formato: PAIS + DDMMYY + CEDULA + TIPO_DOC + CONSECUTIVO + SITUACION + SEGURIDAD
-        clave = f"{pais}{dia}{mes}{anno}{cedula_emisor}{tipo_documento}{numero_consecutivo}{situacion}{codigo_seguridad}"
+
+        # Formato: PAIS(3) + DDMMAA(6) + CEDULA(12) + CONSECUTIVO(20) + SITUACION(1) + SEGURIDAD(8)
+        clave = f"{pais}{dia}{mes}{anno[-2:]}{cedula_emisor.zfill(12)}{numero_consecutivo}{situacion}{codigo_seguridad}"
         return clave
     
-    async def obtener_consecutivo(self, tipo_documento: str) -> str:
-        """Obtener próximo consecutivo para un tipo de documento"""
-        # Por ahora generar un consecutivo simple
-        import random
-        consecutivo = f"{tipo_documento}{str(random.randint(1000000, 9999999)).zfill(8)}"
-        return consecutivo
-    
     async def enviar_documento(self, clave: str, xml_firmado: str) -> Dict[str, Any]:
         """Enviar documento electrónico a Hacienda"""
-        if not self.access_token:
-            await self.obtener_token()
-        
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
-        
         # Codificar XML en base64
         xml_base64 = base64.b64encode(xml_firmado.encode('utf-8')).decode('ascii')
         
@@ -121,15 +93,32 @@ class HaciendaClient:
             },
             'comprobanteXml': xml_base64
         }
+        callback_url = self.callback_url()
+        if callback_url:
+            payload['callbackUrl'] = callback_url
         
-        async with httpx.AsyncClient() as client:
+        # Circuito abierto: no insistir contra un endpoint caído
+        if not await circuito_hacienda.permite():
+            return {
+                'clave': clave,
+                'estado': 'circuito_abierto',
+                'error': 'Circuito abierto: recepción de Hacienda no disponible'
+            }
+        
+        # Concurrencia adaptativa por emisor y global (AIMD sobre 429/5xx)
+        async with limitador_envios.reservar(payload['emisor']['numeroIdentificacion']) as resultado:
             try:
-                response = await client.post(
+                response = await self._solicitud_autenticada(
+                    "envio", "POST",
                     self.base_url,  # Ya incluye el endpoint completo
-                    headers=headers,
-                    json=payload,
-                    timeout=60.0
+                    clave=clave,
+                    json=payload
                 )
+                resultado.registrar(response.status_code, response.headers.get('Retry-After'))
+                if response.status_code >= 500:
+                    await circuito_hacienda.registrar_fallo()
+                else:
+                    await circuito_hacienda.registrar_exito()
                 
                 if response.status_code in [200, 201, 202]:
                     return {
@@ -143,16 +132,22 @@ class HaciendaClient:
                         'clave': clave,
                         'estado': 'error',
                         'error': f"HTTP {response.status_code}: {response.text}",
-                        'codigo_respuesta': response.status_code
+                        'codigo_respuesta': response.status_code,
+                        'reintentar_en': resultado.reintentar_en
                     }
                     
             except httpx.TimeoutException:
+                resultado.registrar(None)
+                await circuito_hacienda.registrar_fallo()
                 return {
                     'clave': clave,
                     'estado': 'timeout',
                     'error': 'Timeout al enviar a Hacienda'
                 }
             except Exception as e:
+                if isinstance(e, httpx.TransportError):
+                    resultado.registrar(None)
+                await circuito_hacienda.registrar_fallo()
                 return {
                     'clave': clave,
                     'estado': 'error',
@@ -161,56 +156,47 @@ class HaciendaClient:
     
     async def consultar_estado(self, clave: str) -> Dict[str, Any]:
         """Consultar el estado de un documento en Hacienda"""
-        if not self.access_token:
-            await self.obtener_token()
-        
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
-        
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    f"{self.base_url}/{clave}",  # Ya incluye el endpoint completo
-                    headers=headers,
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    return {
-                        'clave': clave,
-                        'ind-estado': data.get('ind-estado', 'desconocido'),
-                        'fecha-procesamiento': data.get('fecha-procesamiento'),
-                        'mensaje-hacienda': data.get('mensaje-hacienda'),
-                        'respuesta-xml': data.get('respuesta-xml')
-                    }
-                elif response.status_code == 404:
-                    return {
-                        'clave': clave,
-                        'ind-estado': 'no_encontrado',
-                        'mensaje-hacienda': 'Documento no encontrado en Hacienda'
-                    }
-                else:
-                    return {
-                        'clave': clave,
-                        'ind-estado': 'error_consulta',
-                        'mensaje-hacienda': f"Error HTTP {response.status_code}: {response.text}"
-                    }
-                    
-            except httpx.TimeoutException:
+        try:
+            response = await self._solicitud_autenticada(
+                "consulta", "GET",
+                f"{self.base_url}/{clave}",  # Ya incluye el endpoint completo
+                clave=clave
+            )
+            
+            if response.status_code == 200:
+                data = response.json()
                 return {
                     'clave': clave,
-                    'ind-estado': 'timeout',
-                    'mensaje-hacienda': 'Timeout al consultar estado'
+                    'ind-estado': data.get('ind-estado', 'desconocido'),
+                    'fecha-procesamiento': data.get('fecha-procesamiento'),
+                    'mensaje-hacienda': data.get('mensaje-hacienda'),
+                    'respuesta-xml': data.get('respuesta-xml')
                 }
-            except Exception as e:
+            elif response.status_code == 404:
+                return {
+                    'clave': clave,
+                    'ind-estado': 'no_encontrado',
+                    'mensaje-hacienda': 'Documento no encontrado en Hacienda'
+                }
+            else:
                 return {
                     'clave': clave,
                     'ind-estado': 'error_consulta',
-                    'mensaje-hacienda': str(e)
+                    'mensaje-hacienda': f"Error HTTP {response.status_code}: {response.text}"
                 }
+                
+        except httpx.TimeoutException:
+            return {
+                'clave': clave,
+                'ind-estado': 'timeout',
+                'mensaje-hacienda': 'Timeout al consultar estado'
+            }
+        except Exception as e:
+            return {
+                'clave': clave,
+                'ind-estado': 'error_consulta',
+                'mensaje-hacienda': str(e)
+            }
     
     async def reenviar_documento(self, clave: str) -> Dict[str, Any]:
         """Reenviar un documento a Hacienda (requiere el XML original)"""
@@ -221,79 +207,54 @@ class HaciendaClient:
             'mensaje': 'Documento marcado para reenvío'
         }
     
-    async def consultar_masivo(self, claves: list) -> Dict[str, Any]:
-        """Consultar el estado de múltiples documentos"""
-        resultados = {}
-        
-        # Ejecutar consultas en paralelo (máximo 5 concurrentes)
-        semaforo = asyncio.Semaphore(5)
-        
-        async def consultar_con_semaforo(clave):
-            async with semaforo:
-                return await self.consultar_estado(clave)
+    async def consultar_flujo(self, claves: Iterable[str],
+                              concurrencia: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Consultar el estado de muchos documentos con un pool acotado de trabajadores.
+        Cada resultado se entrega apenas termina; la memoria no crece con la cantidad de claves.
+        """
+        concurrencia = max(1, concurrencia or settings.hacienda_consulta_concurrencia)
+        pendientes = iter(claves)
+        resultados: asyncio.Queue = asyncio.Queue(maxsize=concurrencia)
         
-        tareas = [consultar_con_semaforo(clave) for clave in claves]
-        respuestas = await asyncio.gather(*tareas, return_exceptions=True)
+        async def trabajador():
+            for clave in pendientes:
+                try:
+                    respuesta = await self.consultar_estado(clave)
+                except Exception as e:
+                    respuesta = {
+                        'clave': clave,
+                        'ind-estado': 'error',
+                        'mensaje-hacienda': str(e)
+                    }
+                await resultados.put(respuesta)
         
-        for clave, respuesta in zip(claves, respuestas):
-            if isinstance(respuesta, Exception):
-                resultados[clave] = {
-                    'ind-estado': 'error',
-                    'mensaje-hacienda': str(respuesta)
-                }
-            else:
-                resultados[clave] = respuesta
+        async def cerrar():
+            await asyncio.gather(*tareas, return_exceptions=True)
+            await resultados.put(None)
         
+        tareas = [asyncio.create_task(trabajador()) for _ in range(concurrencia)]
+        cierre = asyncio.create_task(cerrar())
+        try:
+            while (respuesta := await resultados.get()) is not None:
+                yield respuesta
+        finally:
+            # Cliente desconectado o consumo interrumpido: no dejar consultas huérfanas
+            for tarea in (*tareas, cierre):
+                tarea.cancel()
+            await asyncio.gather(*tareas, cierre, return_exceptions=True)
+    
+    async def consultar_masivo(self, claves: list, concurrencia: Optional[int] = None) -> Dict[str, Any]:
+        """Consultar el estado de múltiples documentos"""
+        resultados = {}
+        async for respuesta in self.consultar_flujo(claves, concurrencia):
+            resultados[respuesta['clave']] = respuesta
         return resultados
     
-    async def obtener_consecutivo(self, tipo_documento: str = "01") -> str:
-        """Obtener el próximo número consecutivo desde Hacienda"""
-        if not self.access_token:
-            await self.obtener_token()
-        
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
-        
-        # Para sandbox, generar consecutivo válido localmente
-        # En producción, esto debería llamar al endpoint real de Hacienda
-        if self.sandbox:
-            from datetime import datetime
-            import secrets
-            
-            # Formato Costa Rica: 20 caracteres exactos 
-            # Estructura: TTSSSSSSSSNNNNNNNNN
-            # TT = Tipo documento (01) - 2 chars
-            # SSSSSSSS = Terminal/Sucursal (00100001) - 8 chars  
-            # NNNNNNNN = Consecutivo (01000001) - 8 chars
-            # RRHH = Código seguridad (10) - 2 chars
-            # Total: 2 + 8 + 8 + 2 = 20 caracteres
-            
-            contador = secrets.randbelow(99999999)  # Máximo 8 dígitos
-            codigo_seguridad = secrets.randbelow(100)  # 2 dígitos
-            
-            consecutivo = f"{tipo_documento}00100001{contador:08d}{codigo_seguridad:02d}"
-            
-            print(f"🔢 Consecutivo generado para SANDBOX: {consecutivo} (longitud: {len(consecutivo)})")
-            return consecutivo
-        else:
-            # Llamada real al API de Hacienda (para producción)
-            async with httpx.AsyncClient() as client:
-                try:
-                    response = await client.get(
-                        f"{self.base_url}/consecutivos/{tipo_documento}",
-                        headers=headers,
-                        timeout=30.0
-                    )
-                    
-                    if response.status_code == 200:
-                        data = response.json()
-                        return data.get('consecutivo')
-                    else:
-                        raise Exception(f"Error obteniendo consecutivo: {response.status_code}")
-                        
-                except httpx.TimeoutException:
-                    raise Exception("Timeout al obtener consecutivo de Hacienda")
-                except Exception as e:
-                    raise Exception(f"Error al obtener consecutivo: {str(e)}")
\ No newline at end of file
+    async def obtener_consecutivo(self, tipo_documento: str, emisor: str,
+                                  sucursal: Optional[str] = None, terminal: Optional[str] = None) -> str:
+        """
+        Obtener el próximo número consecutivo del emisor (20 dígitos).
+        Hacienda no asigna consecutivos: los lleva el emisor por sucursal y terminal.
+        """
+        return await asignador_consecutivos.siguiente(emisor, tipo_documento, sucursal, terminal)
@@ -0,0 +1,224 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+import httpx
+from app.core.config import settings
+from app.core.metrics import metricas
+from app.core.redis import obtener_redis
+from app.services.hacienda_transport import hacienda_transport
+
+logger = logging.getLogger(__name__)
+
+# Libera el candado sólo si sigue perteneciendo a quien lo tomó
+_LIBERAR_CANDADO = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class GestorTokenHacienda:
+    """
+    Ciclo de vida del token OAuth2 del IdP de Hacienda.
+
+    - Controla expires_in / refresh_expires_in y renueva antes del vencimiento
+      con grant_type=refresh_token (password sólo si el refresh ya no sirve).
+    - Agrupa renovaciones concurrentes del proceso en una sola solicitud.
+    - Comparte el token entre workers vía Redis, con un candado para que sólo
+      un worker inicie sesión a la vez.
+    """
+
+    def __init__(self):
+        self.token_url = settings.hacienda_token_url
+        self.client_id = settings.hacienda_client_id
+        self.client_secret = settings.hacienda_client_secret
+        self.username = settings.hacienda_username
+        self.password = settings.hacienda_password
+        self.margen = settings.hacienda_token_margen_segundos
+
+        self.clave_redis = f"hacienda:token:{self.client_id}:{self.username}"
+        self.clave_candado = f"{self.clave_redis}:candado"
+
+        self._token: Optional[Dict[str, Any]] = None
+        self._renovacion: Optional[asyncio.Future] = None
+
+    # ------------------------------------------------------------------ estado
+
+    @staticmethod
+    def _vigente(token: Optional[Dict[str, Any]], margen: float = 0) -> bool:
+        return bool(token) and token['expira_en'] - margen > time.time()
+
+    @staticmethod
+    def _refresh_vigente(token: Optional[Dict[str, Any]]) -> bool:
+        return bool(token and token.get('refresh_token')) and token['refresh_expira_en'] > time.time()
+
+    @property
+    def access_token(self) -> Optional[str]:
+        return self._token['access_token'] if self._token else None
+
+    # --------------------------------------------------------------- API pública
+
+    async def obtener_token(self) -> str:
+        """Obtener un access_token vigente, renovándolo si está por vencer"""
+        if self._vigente(self._token, self.margen):
+            # Renovación anticipada en segundo plano dentro de la ventana 2x margen
+            if not self._vigente(self._token, self.margen * 2):
+                self._iniciar_renovacion()
+            return self._token['access_token']
+
+        return await asyncio.shield(self._iniciar_renovacion())
+
+    async def invalidar(self, access_token: Optional[str]) -> None:
+        """Descartar un token rechazado por Hacienda (401) para forzar renovación"""
+        if not access_token or self.access_token != access_token:
+            return
+        # Conservar el refresh_token: el siguiente intento puede renovar sin password
+        self._token = dict(self._token, expira_en=0)
+        metricas.incrementar("hacienda_token_invalidado")
+        try:
+            compartido = await self._leer_compartido()
+            if compartido and compartido['access_token'] == access_token:
+                await obtener_redis().delete(self.clave_redis)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo invalidar token compartido en Redis: {e}")
+
+    # ------------------------------------------------------------ single-flight
+
+    def _iniciar_renovacion(self) -> asyncio.Future:
+        if self._renovacion is None or self._renovacion.done():
+            self._renovacion = asyncio.ensure_future(self._renovar())
+            # Evitar "exception was never retrieved" en renovaciones de fondo
+            self._renovacion.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return self._renovacion
+
+    async def _renovar(self) -> str:
+        # 1. Otro worker pudo haberlo renovado ya
+        compartido = await self._leer_compartido()
+        if self._vigente(compartido, self.margen):
+            self._token = compartido
+            metricas.incrementar("hacienda_token_origen", origen="redis")
+            return compartido['access_token']
+
+        # 2. Candado entre workers para que sólo uno vaya al IdP
+        propietario = uuid.uuid4().hex
+        adquirido = await self._tomar_candado(propietario)
+        if not adquirido:
+            token = await self._esperar_compartido()
+            if token:
+                return token
+
+        try:
+            base = compartido or self._token
+            if self._refresh_vigente(base):
+                try:
+                    datos = await self._solicitar({'grant_type': 'refresh_token',
+                                                   'refresh_token': base['refresh_token']})
+                    metricas.incrementar("hacienda_token_origen", origen="refresh_token")
+                except Exception as e:
+                    logger.warning(f"⚠️ refresh_token rechazado, usando password: {e}")
+                    datos = await self._solicitar_password()
+            else:
+                datos = await self._solicitar_password()
+
+            self._token = self._normalizar(datos)
+            await self._guardar_compartido(self._token)
+            return self._token['access_token']
+        finally:
+            if adquirido:
+                await self._liberar_candado(propietario)
+
+    # --------------------------------------------------------------------- IdP
+
+    async def _solicitar_password(self) -> Dict[str, Any]:
+        if not self.client_id:
+            raise ValueError("Client ID es requerido")
+        if not self.username or not self.password:
+            raise ValueError("Username y Password son requeridos")
+
+        metricas.incrementar("hacienda_token_origen", origen="password")
+        return await self._solicitar({'grant_type': 'password',
+                                      'username': self.username,
+                                      'password': self.password})
+
+    async def _solicitar(self, data: Dict[str, str]) -> Dict[str, Any]:
+        data['client_id'] = self.client_id
+        if self.client_secret:
+            data['client_secret'] = self.client_secret
+
+        logger.info(f"🔑 Obteniendo token ({data['grant_type']}) de: {self.token_url}")
+        try:
+            response = await hacienda_transport.request(
+                "token", "POST", self.token_url,
+                headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                data=data
+            )
+        except httpx.TimeoutException:
+            raise Exception("Timeout al obtener token de Hacienda")
+
+        if response.status_code != 200:
+            raise Exception(f"Error obteniendo token: {response.status_code} - {response.text}")
+
+        logger.info("✅ Token obtenido exitosamente")
+        return response.json()
+
+    @staticmethod
+    def _normalizar(datos: Dict[str, Any]) -> Dict[str, Any]:
+        ahora = time.time()
+        return {
+            'access_token': datos['access_token'],
+            'expira_en': ahora + int(datos.get('expires_in', 300)),
+            'refresh_token': datos.get('refresh_token'),
+            'refresh_expira_en': ahora + int(datos.get('refresh_expires_in', 0))
+        }
+
+    # ------------------------------------------------------------------- Redis
+
+    async def _leer_compartido(self) -> Optional[Dict[str, Any]]:
+        try:
+            valor = await obtener_redis().get(self.clave_redis)
+            return json.loads(valor) if valor else None
+        except Exception as e:
+            logger.warning(f"⚠️ Redis no disponible para token compartido: {e}")
+            return None
+
+    async def _guardar_compartido(self, token: Dict[str, Any]) -> None:
+        vida = int(max(token['refresh_expira_en'], token['expira_en']) - time.time())
+        try:
+            await obtener_redis().set(self.clave_redis, json.dumps(token), ex=max(vida, 1))
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo compartir token en Redis: {e}")
+
+    async def _tomar_candado(self, propietario: str) -> bool:
+        try:
+            ttl_ms = int(settings.hacienda_timeout_token * 1000)
+            return bool(await obtener_redis().set(self.clave_candado, propietario, nx=True, px=ttl_ms))
+        except Exception:
+            # Sin Redis cada worker se autentica por su cuenta
+            return True
+
+    async def _liberar_candado(self, propietario: str) -> None:
+        try:
+            await obtener_redis().eval(_LIBERAR_CANDADO, 1, self.clave_candado, propietario)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo liberar candado de token: {e}")
+
+    async def _esperar_compartido(self) -> Optional[str]:
+        """Esperar a que el worker que tiene el candado publique el token"""
+        limite = time.monotonic() + settings.hacienda_timeout_token
+        while time.monotonic() < limite:
+            await asyncio.sleep(0.2)
+            compartido = await self._leer_compartido()
+            if self._vigente(compartido, self.margen):
+                self._token = compartido
+                metricas.incrementar("hacienda_token_origen", origen="redis")
+                return compartido['access_token']
+        return None
+
+
+# Instancia global compartida por todos los HaciendaClient del proceso
+gestor_token = GestorTokenHacienda()
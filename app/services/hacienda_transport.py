@@ -0,0 +1,121 @@
+import httpx
+import time
+import logging
+from typing import Dict, Optional
+from app.core.config import settings
+from app.core.metrics import metricas
+from app.services.bitacora_envios import bitacora_envios
+
+logger = logging.getLogger(__name__)
+
+
+class HaciendaTransport:
+    """
+    Cliente HTTP compartido hacia el IdP y el API de recepción de Hacienda.
+
+    Mantiene un único httpx.AsyncClient durante la vida de la aplicación para
+    reutilizar conexiones (keep-alive y multiplexación HTTP/2) en lugar de
+    pagar un handshake TCP+TLS por cada envío.
+    """
+
+    # Operaciones conocidas y su timeout de lectura configurado
+    OPERACIONES = ('token', 'envio', 'consulta')
+
+    def __init__(self, http2: Optional[bool] = None, max_conexiones: Optional[int] = None,
+                 max_keepalive: Optional[int] = None, verify: bool = True):
+        self.http2 = settings.hacienda_http2 if http2 is None else http2
+        self.max_conexiones = max_conexiones or settings.hacienda_max_conexiones
+        self.limites = httpx.Limits(
+            max_connections=self.max_conexiones,
+            max_keepalive_connections=max_keepalive or settings.hacienda_max_conexiones_keepalive,
+            keepalive_expiry=settings.hacienda_keepalive_expiry
+        )
+        self.timeouts: Dict[str, httpx.Timeout] = {
+            operacion: httpx.Timeout(
+                getattr(settings, f"hacienda_timeout_{operacion}"),
+                connect=settings.hacienda_timeout_conexion,
+                pool=settings.hacienda_timeout_pool
+            )
+            for operacion in self.OPERACIONES
+        }
+        self.verify = verify
+        self._client: Optional[httpx.AsyncClient] = None
+        self._en_vuelo = 0
+
+    def _crear_cliente(self) -> httpx.AsyncClient:
+        """Crear el cliente con el pool configurado"""
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("⚠️ Paquete 'h2' no instalado, usando HTTP/1.1 (instalar httpx[http2])")
+                http2 = False
+
+        logger.info(f"🌐 Transporte Hacienda: http2={http2}, max_conexiones={self.max_conexiones}")
+        return httpx.AsyncClient(http2=http2, limits=self.limites, verify=self.verify)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Cliente compartido (se crea bajo demanda si no se inició en el lifespan)"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._crear_cliente()
+        return self._client
+
+    async def iniciar(self) -> None:
+        """Abrir el cliente compartido (lifespan de la aplicación)"""
+        _ = self.client
+
+    async def cerrar(self) -> None:
+        """Cerrar el cliente y todas las conexiones del pool"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _actualizar_saturacion(self) -> None:
+        metricas.fijar("hacienda_pool_en_vuelo", self._en_vuelo)
+        metricas.fijar("hacienda_pool_saturacion", self._en_vuelo / self.max_conexiones)
+
+    async def request(self, operacion: str, method: str, url: str,
+                      clave: Optional[str] = None, **kwargs) -> httpx.Response:
+        """
+        Ejecutar una solicitud usando el pool compartido
+
+        Args:
+            operacion: 'token', 'envio' o 'consulta' (define el timeout aplicado)
+            method: Método HTTP
+            url: URL absoluta
+            clave: Documento al que corresponde; si se indica, la solicitud queda en logs_envio
+
+        Returns:
+            httpx.Response
+        """
+        kwargs.setdefault('timeout', self.timeouts[operacion])
+
+        self._en_vuelo += 1
+        self._actualizar_saturacion()
+        inicio = time.perf_counter()
+        response = error = None
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            metricas.incrementar("hacienda_solicitudes", operacion=operacion, codigo=response.status_code)
+            return response
+        except httpx.PoolTimeout as e:
+            # El pool estuvo lleno durante todo el timeout de espera
+            metricas.incrementar("hacienda_pool_agotado", operacion=operacion)
+            error = e
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._en_vuelo -= 1
+            self._actualizar_saturacion()
+            duracion_ms = (time.perf_counter() - inicio) * 1000
+            metricas.observar("hacienda_latencia_ms", duracion_ms, operacion=operacion)
+            if clave and settings.logs_envio_habilitado:
+                bitacora_envios.registrar_solicitud(clave, operacion, url, kwargs, response, error, duracion_ms)
+
+
+# Instancia global compartida por todos los HaciendaClient
+hacienda_transport = HaciendaTransport()
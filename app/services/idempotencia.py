@@ -0,0 +1,102 @@
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.core.metrics import metricas
+from app.core.redis import obtener_redis
+
+logger = logging.getLogger(__name__)
+
+
+def huella_solicitud(datos: Dict[str, Any]) -> str:
+    """Hash estable de los datos de una solicitud (cuerpo y parámetros)"""
+    canonico = json.dumps(datos, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonico.encode('utf-8')).hexdigest()
+
+
+class RegistroIdempotencia:
+    """
+    Registro en Redis de las solicitudes de creación con Idempotency-Key.
+
+    La primera solicitud reserva la llave (SET NX) junto con la huella de su
+    cuerpo y, al terminar, guarda su respuesta por `ttl_horas`. Una repetición
+    con la misma llave recibe esa respuesta sin volver a asignar consecutivo,
+    firmar ni enviar; si llega mientras la primera sigue en curso, espera a que
+    termine. Si la primera falla, la reserva se libera para que el cliente
+    pueda reintentar.
+    """
+
+    PREFIJO = "idempotencia"
+
+    def __init__(self, ttl_horas: Optional[float] = None, espera: Optional[float] = None,
+                 ttl_reserva: Optional[int] = None):
+        self.ttl = int((ttl_horas or settings.idempotencia_ttl_horas) * 3600)
+        self.espera = espera or settings.idempotencia_espera
+        self.ttl_reserva = ttl_reserva or settings.idempotencia_ttl_reserva
+        self.intervalo = 0.05
+
+    def _llave(self, alcance: str, llave: str) -> str:
+        return f"{self.PREFIJO}:{alcance}:{llave}"
+
+    async def reservar(self, alcance: str, llave: str, huella: str) -> Optional[Dict[str, Any]]:
+        """
+        Reservar la llave para ejecutar la solicitud
+
+        Returns:
+            None si la reserva es de esta solicitud, o la respuesta guardada de la original
+
+        Raises:
+            ValueError: La llave ya se usó con otra solicitud
+            TimeoutError: La solicitud original sigue en curso tras la espera máxima
+        """
+        redis = obtener_redis()
+        clave_redis = self._llave(alcance, llave)
+        reserva = json.dumps({'estado': 'en_curso', 'huella': huella})
+        loop = asyncio.get_running_loop()
+        limite = loop.time() + self.espera
+        esperando = False
+
+        while True:
+            if await redis.set(clave_redis, reserva, nx=True, ex=self.ttl_reserva):
+                return None
+
+            guardado = await redis.get(clave_redis)
+            if guardado is None:
+                # La original falló y liberó la llave entre el SET y el GET
+                continue
+            registro = json.loads(guardado)
+            if registro['huella'] != huella:
+                metricas.incrementar("idempotencia", resultado="conflicto")
+                raise ValueError("Idempotency-Key ya utilizada con una solicitud distinta")
+            if registro['estado'] == 'completo':
+                metricas.incrementar("idempotencia", resultado="repetida")
+                return registro['respuesta']
+
+            if not esperando:
+                esperando = True
+                metricas.incrementar("idempotencia", resultado="en_espera")
+            if loop.time() >= limite:
+                metricas.incrementar("idempotencia", resultado="espera_agotada")
+                raise TimeoutError("La solicitud original con esta Idempotency-Key sigue en curso")
+            await asyncio.sleep(self.intervalo)
+
+    async def completar(self, alcance: str, llave: str, huella: str, respuesta: Dict[str, Any]) -> None:
+        """Guardar la respuesta de la solicitud original para las repeticiones"""
+        registro = json.dumps({'estado': 'completo', 'huella': huella, 'respuesta': respuesta}, ensure_ascii=False)
+        await obtener_redis().set(self._llave(alcance, llave), registro, ex=self.ttl)
+        metricas.incrementar("idempotencia", resultado="nueva")
+
+    async def liberar(self, alcance: str, llave: str) -> None:
+        """Soltar la reserva de una solicitud que falló"""
+        try:
+            await obtener_redis().delete(self._llave(alcance, llave))
+        except Exception as e:
+            # La reserva vence sola tras ttl_reserva segundos
+            logger.warning(f"⚠️ No se pudo liberar la Idempotency-Key {llave}: {e}")
+
+
+# Instancia global
+registro_idempotencia = RegistroIdempotencia()
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from app.core.config import settings
+from app.core.metrics import metricas
+
+logger = logging.getLogger(__name__)
+
+
+class LimitadorAIMD:
+    """
+    Límite de concurrencia adaptativo (incremento aditivo / reducción multiplicativa).
+
+    Mientras las respuestas son exitosas y la latencia está bajo el objetivo, el
+    límite crece ~1 por ventana completa; ante 429/5xx/timeout se multiplica por
+    el factor de reducción (a lo sumo una vez por ventana de latencia).
+    """
+
+    def __init__(self, nombre: str, inicial: float, minimo: float, maximo: float,
+                 latencia_objetivo_ms: float, factor_reduccion: float):
+        self.nombre = nombre
+        self.limite = float(inicial)
+        self.minimo = float(minimo)
+        self.maximo = float(maximo)
+        self.latencia_objetivo_ms = latencia_objetivo_ms
+        self.factor_reduccion = factor_reduccion
+
+        self.en_vuelo = 0
+        self._condicion = asyncio.Condition()
+        self._ultima_reduccion = 0.0
+        self._pausa_hasta = 0.0
+        self._publicar()
+
+    def retirar_metricas(self) -> None:
+        metricas.retirar("limitador_envios_limite", limitador=self.nombre)
+        metricas.retirar("limitador_envios_en_vuelo", limitador=self.nombre)
+
+    def _publicar(self) -> None:
+        metricas.fijar("limitador_envios_limite", round(self.limite, 2), limitador=self.nombre)
+        metricas.fijar("limitador_envios_en_vuelo", self.en_vuelo, limitador=self.nombre)
+
+    async def adquirir(self) -> None:
+        """Esperar hasta que haya espacio en la ventana actual"""
+        espera = self._pausa_hasta - time.monotonic()
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+        async with self._condicion:
+            await self._condicion.wait_for(lambda: self.en_vuelo < int(self.limite))
+            self.en_vuelo += 1
+            self._publicar()
+
+    async def liberar(self, saturado: bool, exito: bool, latencia_ms: float,
+                      reintentar_en: Optional[float] = None) -> None:
+        """
+        Liberar el espacio y ajustar el límite según el resultado
+
+        Args:
+            saturado: Hacienda respondió 429/5xx o hubo timeout
+            exito: Respuesta 2xx
+            latencia_ms: Duración de la solicitud
+            reintentar_en: Segundos indicados por Retry-After (si vino)
+        """
+        ahora = time.monotonic()
+        async with self._condicion:
+            self.en_vuelo -= 1
+
+            if saturado:
+                # Una sola reducción por ventana: las fallas concurrentes de la misma ráfaga cuentan una vez
+                if ahora - self._ultima_reduccion > latencia_ms / 1000:
+                    self.limite = max(self.minimo, self.limite * self.factor_reduccion)
+                    self._ultima_reduccion = ahora
+                    metricas.incrementar("limitador_envios_reducciones", limitador=self.nombre)
+                    logger.warning(f"⚠️ Limitador {self.nombre}: límite reducido a {self.limite:.1f}")
+                if reintentar_en:
+                    self._pausa_hasta = max(self._pausa_hasta, ahora + reintentar_en)
+            elif exito and latencia_ms <= self.latencia_objetivo_ms:
+                self.limite = min(self.maximo, self.limite + 1.0 / self.limite)
+
+            self._publicar()
+            self._condicion.notify_all()
+
+
+class LimitadorEnvios:
+    """
+    Limitadores AIMD por emisor y global para los envíos a recepción.
+    Cada proceso adapta su propia ventana; con varios workers AIMD converge a
+    un reparto equitativo de la capacidad que Hacienda acepta.
+
+    Los limitadores de emisor se guardan en un LRU de a lo sumo
+    `limitador_emisores_capacidad`: al pasarse se descartan los menos usados
+    que no tengan envíos en vuelo, y el emisor vuelve a empezar en el límite
+    inicial si regresa.
+    """
+
+    def __init__(self, capacidad: Optional[int] = None):
+        self.capacidad = settings.limitador_emisores_capacidad if capacidad is None else capacidad
+        self.global_ = self._crear("global", settings.limitador_maximo_global)
+        self.por_emisor: "OrderedDict[str, LimitadorAIMD]" = OrderedDict()
+
+    @staticmethod
+    def _crear(nombre: str, maximo: int) -> LimitadorAIMD:
+        return LimitadorAIMD(
+            nombre=nombre,
+            inicial=min(settings.limitador_inicial, maximo),
+            minimo=settings.limitador_minimo,
+            maximo=maximo,
+            latencia_objetivo_ms=settings.limitador_latencia_objetivo_ms,
+            factor_reduccion=settings.limitador_factor_reduccion
+        )
+
+    def _limitador_emisor(self, emisor: str) -> LimitadorAIMD:
+        limitador = self.por_emisor.get(emisor)
+        if limitador is not None:
+            self.por_emisor.move_to_end(emisor)
+            return limitador
+        limitador = self.por_emisor[emisor] = self._crear(f"emisor:{emisor}", settings.limitador_maximo_emisor)
+        self._desalojar(emisor)
+        return limitador
+
+    def _desalojar(self, nuevo: str) -> None:
+        """Descartar los limitadores inactivos menos usados hasta volver a la capacidad"""
+        exceso = len(self.por_emisor) - self.capacidad
+        if exceso <= 0:
+            return
+        # Uno con envíos en vuelo sigue en uso: se salta y se reintenta con el próximo emisor nuevo
+        inactivos = []
+        for emisor, limitador in self.por_emisor.items():
+            if len(inactivos) == exceso:
+                break
+            if emisor != nuevo and limitador.en_vuelo == 0:
+                inactivos.append(emisor)
+        for emisor in inactivos:
+            self.por_emisor.pop(emisor).retirar_metricas()
+        if inactivos:
+            metricas.incrementar("limitador_envios_desalojos", len(inactivos))
+
+    @asynccontextmanager
+    async def reservar(self, emisor: str) -> AsyncIterator["ResultadoEnvio"]:
+        """Reservar un espacio de envío para el emisor; registrar el resultado en el objeto devuelto"""
+        limitadores = [self._limitador_emisor(emisor), self.global_]
+        adquiridos = []
+        resultado = ResultadoEnvio()
+        try:
+            # Primero el emisor: no ocupar un espacio global mientras se espera el propio
+            for limitador in limitadores:
+                await limitador.adquirir()
+                adquiridos.append(limitador)
+            resultado.inicio = time.perf_counter()
+            yield resultado
+        finally:
+            latencia_ms = (time.perf_counter() - resultado.inicio) * 1000 if resultado.inicio else 0.0
+            for limitador in adquiridos:
+                await limitador.liberar(resultado.saturado, resultado.exito, latencia_ms, resultado.reintentar_en)
+
+
+class ResultadoEnvio:
+    """Resultado de un envío, usado para ajustar los limitadores"""
+
+    def __init__(self):
+        self.inicio: Optional[float] = None
+        self.exito = False
+        self.saturado = False
+        self.reintentar_en: Optional[float] = None
+
+    def registrar(self, codigo: Optional[int], retry_after: Optional[str] = None) -> None:
+        """Clasificar la respuesta HTTP (None = timeout o error de red)"""
+        self.exito = codigo is not None and 200 <= codigo < 300
+        self.saturado = codigo is None or codigo == 429 or codigo >= 500
+        if retry_after and retry_after.isdigit():
+            self.reintentar_en = float(retry_after)
+
+
+# Instancia global
+limitador_envios = LimitadorEnvios()
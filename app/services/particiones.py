@@ -0,0 +1,214 @@
+import json
+import logging
+import re
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, text
+
+from app.core.config import settings
+from app.core.metrics import metricas
+from app.models.database import AsyncSessionLocal, async_engine
+from app.models.documento import ArchivoParticion
+from app.services.almacen_blobs import almacen_blobs
+
+logger = logging.getLogger(__name__)
+
+# Tabla particionada -> (columna de partición, columna con la clave del documento)
+TABLAS_PARTICIONADAS = {
+    'documentos_electronicos': ('fecha_emision', 'clave'),
+    'logs_envio': ('fecha_intento', 'clave_documento'),
+    'lineas_detalle': ('fecha_emision', 'clave_documento'),
+}
+
+_NOMBRE_PARTICION = re.compile(r'^(?P<tabla>[a-z_]+)_(?P<anno>\d{4})_(?P<mes>\d{2})$')
+
+
+def fecha_de_clave(clave: str) -> Optional[date]:
+    """Fecha de emisión codificada en la clave (DDMMAA tras el código de país)"""
+    if len(clave) != 50 or not clave.isdigit():
+        return None
+    try:
+        return datetime.strptime(clave[3:9], "%d%m%y").date()
+    except ValueError:
+        return None
+
+
+def rango_emision(clave: str) -> Optional[Tuple[datetime, datetime]]:
+    """Rango posible de fecha_emision según la clave, con un día de margen por zona horaria"""
+    fecha = fecha_de_clave(clave)
+    if fecha is None:
+        return None
+    inicio = datetime.combine(fecha, datetime.min.time())
+    return inicio - timedelta(days=1), inicio + timedelta(days=2)
+
+
+def sumar_meses(mes: date, meses: int) -> date:
+    """Primer día del mes desplazado `meses` meses"""
+    indice = mes.year * 12 + mes.month - 1 + meses
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+class GestorParticiones:
+    """
+    Mantenimiento de las particiones mensuales.
+
+    Crea por adelantado las particiones de los próximos meses (función
+    crear_particion_mensual de la migración 0004) y archiva las que salen de la
+    ventana de retención: se separan de la tabla, se exportan ordenadas por clave
+    en bloques JSONL al almacén de blobs (zstd), se registran en
+    archivos_particiones y se eliminan. Lo archivado se sigue consultando por
+    clave con `buscar_archivado`.
+    """
+
+    def __init__(self, meses_adelante: Optional[int] = None, retencion_meses: Optional[int] = None,
+                 filas_bloque: Optional[int] = None):
+        self.meses_adelante = meses_adelante if meses_adelante is not None else settings.particiones_meses_adelante
+        self.retencion_meses = retencion_meses or settings.particiones_retencion_meses
+        self.filas_bloque = filas_bloque or settings.particiones_filas_bloque
+
+    async def particiones(self, tabla: str) -> List[Tuple[str, date, bool]]:
+        """Particiones mensuales de la tabla, adjuntas o ya separadas: (nombre, mes, adjunta)"""
+        async with AsyncSessionLocal() as sesion:
+            filas = await sesion.execute(
+                text("SELECT relname, relispartition FROM pg_class WHERE relkind = 'r' AND relname LIKE :prefijo"),
+                {'prefijo': f"{tabla}%"}
+            )
+        resultado = []
+        for nombre, adjunta in filas:
+            coincidencia = _NOMBRE_PARTICION.match(nombre)
+            if coincidencia and coincidencia['tabla'] == tabla:
+                mes = date(int(coincidencia['anno']), int(coincidencia['mes']), 1)
+                resultado.append((nombre, mes, adjunta))
+        return sorted(resultado, key=lambda particion: particion[1])
+
+    async def asegurar_particiones(self) -> List[str]:
+        """Crear las particiones que falten del mes actual y los próximos meses"""
+        actual = date.today().replace(day=1)
+        creadas = []
+        for tabla, (columna, _) in TABLAS_PARTICIONADAS.items():
+            existentes = {mes for _, mes, _ in await self.particiones(tabla)}
+            for desplazamiento in range(self.meses_adelante + 1):
+                mes = sumar_meses(actual, desplazamiento)
+                if mes in existentes:
+                    continue
+                try:
+                    async with AsyncSessionLocal() as sesion:
+                        nombre = await sesion.scalar(
+                            text("SELECT crear_particion_mensual(:tabla, :columna, :mes)"),
+                            {'tabla': tabla, 'columna': columna, 'mes': mes}
+                        )
+                        await sesion.commit()
+                    creadas.append(nombre)
+                    logger.info(f"🗂️ Partición {nombre} creada")
+                except Exception as e:
+                    metricas.incrementar("particiones_errores", operacion="crear")
+                    logger.error(f"❌ No se pudo crear la partición de {tabla} para {mes:%Y-%m}: {e}")
+        return creadas
+
+    async def retener(self) -> Dict[str, int]:
+        """Archivar las particiones anteriores a la ventana de retención"""
+        corte = sumar_meses(date.today().replace(day=1), -self.retencion_meses)
+        archivadas = {}
+        for tabla in TABLAS_PARTICIONADAS:
+            for nombre, mes, adjunta in await self.particiones(tabla):
+                if mes >= corte:
+                    break
+                try:
+                    archivadas[nombre] = await self.archivar(tabla, nombre, mes, adjunta)
+                except Exception as e:
+                    metricas.incrementar("particiones_errores", operacion="archivar")
+                    logger.error(f"❌ No se pudo archivar {nombre}: {e}")
+        return archivadas
+
+    async def archivar(self, tabla: str, nombre: str, mes: date, adjunta: bool = True) -> int:
+        """
+        Separar una partición, exportarla al almacén y eliminarla
+
+        Se puede repetir tras una falla: una partición ya separada se exporta de
+        nuevo y sólo se elimina junto con el registro de su archivo.
+        """
+        _, columna_clave = TABLAS_PARTICIONADAS[tabla]
+        if adjunta:
+            async with AsyncSessionLocal() as sesion:
+                await sesion.execute(text(f'ALTER TABLE "{tabla}" DETACH PARTITION "{nombre}"'))
+                await sesion.commit()
+            logger.info(f"📤 Partición {nombre} separada de {tabla}")
+
+        bloques: List[Dict[str, Any]] = []
+        filas = 0
+        lote: List[Dict[str, Any]] = []
+        async with async_engine.connect() as conexion:
+            resultado = await conexion.stream(text(f'SELECT * FROM "{nombre}" ORDER BY "{columna_clave}", id'))
+            async for fila in resultado.mappings():
+                lote.append(dict(fila))
+                if len(lote) >= self.filas_bloque:
+                    bloques.append(await self._guardar_bloque(lote, columna_clave))
+                    filas += len(lote)
+                    lote = []
+        if lote:
+            bloques.append(await self._guardar_bloque(lote, columna_clave))
+            filas += len(lote)
+
+        async with AsyncSessionLocal() as sesion:
+            sesion.add(ArchivoParticion(
+                tabla=tabla,
+                particion=nombre,
+                desde=datetime.combine(mes, datetime.min.time()),
+                hasta=datetime.combine(sumar_meses(mes, 1), datetime.min.time()),
+                filas=filas,
+                bloques=bloques
+            ))
+            await sesion.execute(text(f'DROP TABLE "{nombre}"'))
+            await sesion.commit()
+
+        metricas.incrementar("particiones_archivadas", tabla=tabla)
+        metricas.incrementar("particiones_filas_archivadas", filas, tabla=tabla)
+        logger.info(f"🗄️ Partición {nombre} archivada: {filas} filas en {len(bloques)} bloques")
+        return filas
+
+    @staticmethod
+    async def _guardar_bloque(filas: List[Dict[str, Any]], columna_clave: str) -> Dict[str, Any]:
+        contenido = "\n".join(json.dumps(fila, default=str, ensure_ascii=False) for fila in filas)
+        return {
+            'primera': filas[0][columna_clave],
+            'ultima': filas[-1][columna_clave],
+            'filas': len(filas),
+            'ref': await almacen_blobs.guardar(contenido)
+        }
+
+    async def buscar_archivado(self, tabla: str, clave: str) -> List[Dict[str, Any]]:
+        """Filas archivadas de una clave (sólo se descomprimen los bloques cuyo rango la contiene)"""
+        _, columna_clave = TABLAS_PARTICIONADAS[tabla]
+        consulta = select(ArchivoParticion).where(ArchivoParticion.tabla == tabla)
+        rango = rango_emision(clave)
+        if rango is not None:
+            # Documentos y líneas quedan en el mes de emisión; los logs, de ese mes en adelante
+            consulta = consulta.where(ArchivoParticion.hasta > rango[0])
+            if TABLAS_PARTICIONADAS[tabla][0] == 'fecha_emision':
+                consulta = consulta.where(ArchivoParticion.desde < rango[1])
+        async with AsyncSessionLocal() as sesion:
+            archivos = (await sesion.scalars(consulta.order_by(ArchivoParticion.desde))).all()
+
+        encontradas = []
+        buscada = clave.encode('utf-8')
+        for archivo in archivos:
+            for bloque in archivo.bloques:
+                if not bloque['primera'] <= clave <= bloque['ultima']:
+                    continue
+                contenido = await almacen_blobs.obtener(bloque['ref'])
+                if contenido is None:
+                    logger.error(f"❌ Bloque {bloque['ref']} de {archivo.particion} no está en el almacén")
+                    continue
+                for linea in contenido.split(b"\n"):
+                    if buscada in linea:
+                        fila = json.loads(linea)
+                        if fila[columna_clave] == clave:
+                            encontradas.append(fila)
+        metricas.incrementar("particiones_consultas_archivo", tabla=tabla,
+                             resultado="encontrado" if encontradas else "no_encontrado")
+        return encontradas
+
+
+# Instancia global
+gestor_particiones = GestorParticiones()
@@ -58,7 +58,8 @@ class PDFGenerator:
         
         # Parsear XML para extraer datos
         root = ET.fromstring(xml_content)
-        ns = {'fe': 'https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronicaV44'}
+        # Namespace del comprobante que se recibe (factura, nota, tiquete...)
+        ns = {'fe': root.tag[1:].split('}')[0] if root.tag.startswith('{') else ''}
         
         # Construir contenido del PDF
         story = []
@@ -79,96 +79,115 @@ class PDFGeneratorOfficial:
         try:
             # Parsear XML
             datos_factura = self._parsear_xml(xml_content)
+            return self._renderizar(datos_factura)
             
-            # Crear PDF en memoria
-            buffer = BytesIO()
-            doc = SimpleDocTemplate(buffer, pagesize=A4, 
-                                  rightMargin=20*mm, leftMargin=20*mm,
-                                  topMargin=20*mm, bottomMargin=20*mm)
-            
-            # Construir contenido del PDF
-            story = []
-            
-            # Encabezado de la empresa
-            story.extend(self._crear_encabezado_empresa(datos_factura))
-            
-            # Información del documento
-            story.extend(self._crear_info_documento(datos_factura))
-            
-            # Datos del emisor y receptor
-            story.extend(self._crear_datos_emisor_receptor(datos_factura))
-            
-            # Detalle de productos/servicios
-            story.extend(self._crear_detalle_servicios(datos_factura))
-            
-            # Resumen financiero
-            story.extend(self._crear_resumen_financiero(datos_factura))
-            
-            # Pie de página con información legal
-            story.extend(self._crear_pie_pagina(datos_factura))
-            
-            # Construir PDF
-            doc.build(story)
-            
-            pdf_bytes = buffer.getvalue()
-            buffer.close()
-            
-            logger.info(f"PDF generado exitosamente. Tamaño: {len(pdf_bytes)} bytes")
-            return pdf_bytes
+        except Exception as e:
+            logger.error(f"Error generando PDF: {e}")
+            raise
+    
+    def generar_pdf_desde_arbol(self, raiz, datos_adicionales: Dict[str, Any] = None) -> bytes:
+        """
+        Generar PDF de factura a partir del XML ya parseado (lxml o ElementTree)
+        
+        Args:
+            raiz: Elemento raíz del comprobante
+            datos_adicionales: Datos adicionales para el PDF
             
+        Returns:
+            bytes: Contenido del PDF generado
+        """
+        try:
+            return self._renderizar(self._extraer_datos(raiz))
         except Exception as e:
             logger.error(f"Error generando PDF: {e}")
             raise
     
+    def _renderizar(self, datos_factura: Dict[str, Any]) -> bytes:
+        """Construir el PDF con los datos extraídos del XML"""
+        # Crear PDF en memoria
+        buffer = BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=A4, 
+                              rightMargin=20*mm, leftMargin=20*mm,
+                              topMargin=20*mm, bottomMargin=20*mm)
+        
+        # Construir contenido del PDF
+        story = []
+        
+        # Encabezado de la empresa
+        story.extend(self._crear_encabezado_empresa(datos_factura))
+        
+        # Información del documento
+        story.extend(self._crear_info_documento(datos_factura))
+        
+        # Datos del emisor y receptor
+        story.extend(self._crear_datos_emisor_receptor(datos_factura))
+        
+        # Detalle de productos/servicios
+        story.extend(self._crear_detalle_servicios(datos_factura))
+        
+        # Resumen financiero
+        story.extend(self._crear_resumen_financiero(datos_factura))
+        
+        # Pie de página con información legal
+        story.extend(self._crear_pie_pagina(datos_factura))
+        
+        # Construir PDF
+        doc.build(story)
+        
+        pdf_bytes = buffer.getvalue()
+        buffer.close()
+        
+        logger.info(f"PDF generado exitosamente. Tamaño: {len(pdf_bytes)} bytes")
+        return pdf_bytes
+    
     def _parsear_xml(self, xml_content: str) -> Dict[str, Any]:
         """Parsear XML y extraer datos para el PDF"""
         try:
-            # Limpiar namespace del XML para facilitar el parseo
-            xml_clean = xml_content.replace(' xmlns="https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronica"', '')
-            xml_clean = xml_clean.replace(' xmlns="https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.3/facturaElectronica"', '')
-            
-            root = ET.fromstring(xml_clean)
-            
-            datos = {
-                'clave': self._get_text(root, 'Clave'),
-                'numero_consecutivo': self._get_text(root, 'NumeroConsecutivo'),
-                'fecha_emision': self._get_text(root, 'FechaEmision'),
-                'codigo_actividad': self._get_text(root, 'CodigoActividadEmisor') or self._get_text(root, 'CodigoActividad'),
-                'condicion_venta': self._get_text(root, 'CondicionVenta'),
-                'medio_pago': [mp.text for mp in root.findall('.//MedioPago')],
-                
-                # Datos del emisor
-                'emisor': self._parsear_emisor(root),
-                
-                # Datos del receptor
-                'receptor': self._parsear_receptor(root),
-                
-                # Detalle de servicios
-                'detalles': self._parsear_detalle_servicios(root),
-                
-                # Resumen financiero
-                'resumen': self._parsear_resumen_factura(root)
-            }
-            
-            return datos
+            return self._extraer_datos(ET.fromstring(xml_content))
             
         except Exception as e:
             logger.error(f"Error parseando XML: {e}")
             raise
     
+    def _extraer_datos(self, root) -> Dict[str, Any]:
+        """Datos para el PDF; las búsquedas ignoran el namespace ({*}) y sirven con o sin él"""
+        datos = {
+            'clave': self._get_text(root, 'Clave'),
+            'numero_consecutivo': self._get_text(root, 'NumeroConsecutivo'),
+            'fecha_emision': self._get_text(root, 'FechaEmision'),
+            'codigo_actividad': self._get_text(root, 'CodigoActividadEmisor') or self._get_text(root, 'CodigoActividad'),
+            'condicion_venta': self._get_text(root, 'CondicionVenta'),
+            # v4.4: <MedioPago><TipoMedioPago>; v4.3: el código directo en <MedioPago>
+            'medio_pago': [mp.findtext('{*}TipoMedioPago') or mp.text for mp in root.findall('.//{*}MedioPago')],
+            
+            # Datos del emisor
+            'emisor': self._parsear_emisor(root),
+            
+            # Datos del receptor
+            'receptor': self._parsear_receptor(root),
+            
+            # Detalle de servicios
+            'detalles': self._parsear_detalle_servicios(root),
+            
+            # Resumen financiero
+            'resumen': self._parsear_resumen_factura(root)
+        }
+        
+        return datos
+    
     def _get_text(self, element, tag_name: str) -> str:
         """Obtener texto de un elemento XML"""
-        elem = element.find(f'.//{tag_name}')
+        elem = element.find(f'.//{{*}}{tag_name}')
         return elem.text if elem is not None else ""
     
     def _parsear_emisor(self, root) -> Dict[str, Any]:
         """Parsear datos del emisor"""
-        emisor_elem = root.find('.//Emisor')
+        emisor_elem = root.find('.//{*}Emisor')
         if emisor_elem is None:
             return {}
         
         ubicacion = {}
-        ubicacion_elem = emisor_elem.find('.//Ubicacion')
+        ubicacion_elem = emisor_elem.find('.//{*}Ubicacion')
         if ubicacion_elem is not None:
             ubicacion = {
                 'provincia': self._get_text(ubicacion_elem, 'Provincia'),
@@ -178,7 +197,7 @@ class PDFGeneratorOfficial:
             }
         
         telefono = {}
-        telefono_elem = emisor_elem.find('.//Telefono')
+        telefono_elem = emisor_elem.find('.//{*}Telefono')
         if telefono_elem is not None:
             telefono = {
                 'codigo_pais': self._get_text(telefono_elem, 'CodigoPais'),
@@ -197,7 +216,7 @@ class PDFGeneratorOfficial:
     
     def _parsear_receptor(self, root) -> Dict[str, Any]:
         """Parsear datos del receptor"""
-        receptor_elem = root.find('.//Receptor')
+        receptor_elem = root.find('.//{*}Receptor')
         if receptor_elem is None:
             return {}
         
@@ -212,7 +231,7 @@ class PDFGeneratorOfficial:
         """Parsear detalle de servicios incluyendo campos especializados"""
         detalles = []
         
-        for linea in root.findall('.//LineaDetalle'):
+        for linea in root.findall('.//{*}LineaDetalle'):
             detalle = {
                 'numero_linea': self._get_text(linea, 'NumeroLinea'),
                 'codigo': self._get_text(linea, 'Codigo') or self._get_text(linea, 'CodigoCABYS'),
@@ -227,7 +246,7 @@ class PDFGeneratorOfficial:
                 'tipo_transaccion': self._get_text(linea, 'TipoTransaccion'),
                 'registro_medicamento': self._get_text(linea, 'RegistroMedicamento'),
                 'forma_farmaceutica': self._get_text(linea, 'FormaFarmaceutica'),
-                'numero_vin_serie': [vin.text for vin in linea.findall('.//NumeroVINoSerie') if vin.text],
+                'numero_vin_serie': [vin.text for vin in linea.findall('.//{*}NumeroVINoSerie') if vin.text],
                 # Código comercial
                 'codigo_comercial': self._parsear_codigo_comercial(linea),
                 # Descuentos
@@ -239,7 +258,7 @@ class PDFGeneratorOfficial:
     
     def _parsear_resumen_factura(self, root) -> Dict[str, Any]:
         """Parsear resumen de factura"""
-        resumen_elem = root.find('.//ResumenFactura')
+        resumen_elem = root.find('.//{*}ResumenFactura')
         if resumen_elem is None:
             return {}
         
@@ -444,7 +463,7 @@ class PDFGeneratorOfficial:
     
     def _parsear_codigo_comercial(self, linea) -> Dict[str, str]:
         """Parsear código comercial de una línea"""
-        codigo_elem = linea.find('.//CodigoComercial')
+        codigo_elem = linea.find('.//{*}CodigoComercial')
         if codigo_elem is not None:
             return {
                 'tipo': self._get_text(codigo_elem, 'Tipo'),
@@ -455,7 +474,7 @@ class PDFGeneratorOfficial:
     def _parsear_descuentos(self, linea) -> List[Dict[str, Any]]:
         """Parsear descuentos de una línea"""
         descuentos = []
-        for desc in linea.findall('.//Descuento'):
+        for desc in linea.findall('.//{*}Descuento'):
             descuento = {
                 'monto': self._get_text(desc, 'MontoDescuento'),
                 'naturaleza': self._get_text(desc, 'NaturalezaDescuento'),
@@ -581,7 +600,7 @@ class PDFGeneratorOfficial:
             '05': 'Recaudado por terceros',
             '99': 'Otros'
         }
-        return [medios.get(codigo, codigo) for codigo in codigos]
+        return [medios.get(codigo, codigo) for codigo in codigos if codigo]
     
     def _formatear_fecha(self, fecha_str: str) -> str:
         """Formatear fecha para mostrar en PDF"""
@@ -0,0 +1,134 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from lxml import etree
+
+from app.core.metrics import metricas
+from app.services.pdf_generator_official import pdf_generator_official
+from app.services.xml_generator_v44 import TipoComprobanteV44, tipo_comprobante, xml_generator_v44
+from app.services.xml_signer_production import signer_production
+from app.services.xsd_validator import validador_para
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentoEnProceso:
+    """
+    Un comprobante a lo largo de generar → validar → firmar → PDF.
+
+    Lleva los datos estructurados y un único árbol lxml del XML: cada etapa
+    trabaja sobre ese árbol y el texto firmado se serializa una sola vez, al
+    pedirlo. `tiempos` guarda los milisegundos de cada etapa y `tipo` es el
+    tipo de comprobante v4.4 (raíz, namespace y XSD).
+    """
+
+    def __init__(self, datos: Dict[str, Any], xml_sin_firmar: str, arbol: etree._Element,
+                 tiempos: Optional[Dict[str, float]] = None, tipo: Optional[TipoComprobanteV44] = None):
+        self.datos = datos
+        self.tipo = tipo or tipo_comprobante('01')
+        self.xml_sin_firmar = xml_sin_firmar
+        self.arbol = arbol
+        self.validacion: Optional[Dict[str, Any]] = None
+        self.firmado = False
+        self.tiempos: Dict[str, float] = tiempos or {}
+        self._xml_firmado: Optional[str] = None
+
+    @property
+    def clave(self) -> str:
+        return self.datos['clave']
+
+    @property
+    def xml_firmado(self) -> Optional[str]:
+        """Texto del documento firmado (None si no se firmó)"""
+        if not self.firmado:
+            return None
+        if self._xml_firmado is None:
+            with _etapa(self.tiempos, 'serializar'):
+                self._xml_firmado = signer_production.serializar(self.arbol)
+        return self._xml_firmado
+
+    @property
+    def xml(self) -> str:
+        """El XML más completo disponible: firmado o, si no, sin firmar"""
+        return self.xml_firmado or self.xml_sin_firmar
+
+
+@contextmanager
+def _etapa(tiempos: Dict[str, float], nombre: str):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        milisegundos = (time.perf_counter() - inicio) * 1000
+        tiempos[nombre] = tiempos.get(nombre, 0.0) + milisegundos
+        metricas.observar("documento_etapa_ms", milisegundos, etapa=nombre)
+
+
+class PipelineDocumentos:
+    """
+    Etapas de emisión de los comprobantes v4.4 sobre un solo parse del XML.
+
+    El generador escribe el texto sin firmar (que se guarda tal cual) y
+    libxml2 lo parsea una vez; la validación XSD, la firma y el PDF reciben
+    ese árbol en lugar de volver a leer el texto.
+    """
+
+    def generar(self, datos: Dict[str, Any], tipo: str = '01') -> DocumentoEnProceso:
+        """
+        Generar el XML v4.4 y su árbol; el documento lleva los datos ya preparados (montos calculados)
+
+        Args:
+            datos: Datos del comprobante
+            tipo: Código del tipo de documento (01 factura, 02 nota de débito, 03 nota de crédito...)
+        """
+        tiempos: Dict[str, float] = {}
+        with _etapa(tiempos, 'generar'):
+            preparados = xml_generator_v44.preparar_datos(datos, tipo)
+            xml_sin_firmar = xml_generator_v44.generar_xml_preparado(preparados, tipo)
+            arbol = etree.fromstring(xml_sin_firmar.encode('utf-8'))
+        return DocumentoEnProceso(preparados, xml_sin_firmar, arbol, tiempos, tipo_comprobante(tipo))
+
+    def numerar(self, documento: DocumentoEnProceso, clave: str, numero_consecutivo: str) -> None:
+        """
+        Poner la clave y el consecutivo definitivos a un documento generado con los provisionales
+
+        Así el XML se valida antes de asignar consecutivo (uno rechazado no deja huecos)
+        sin volver a generarlo: sólo cambian esos dos elementos del árbol y del texto.
+        """
+        for elemento, valor, campo in (('Clave', clave, 'clave'),
+                                       ('NumeroConsecutivo', numero_consecutivo, 'numero_consecutivo')):
+            nodo = documento.arbol.find(f'{{*}}{elemento}')
+            documento.xml_sin_firmar = documento.xml_sin_firmar.replace(
+                f"<{elemento}>{nodo.text}</{elemento}>", f"<{elemento}>{valor}</{elemento}>", 1
+            )
+            nodo.text = valor
+            documento.datos[campo] = valor
+
+    def validar(self, documento: DocumentoEnProceso) -> Dict[str, Any]:
+        """Validar el árbol contra el XSD v4.4 de su tipo"""
+        with _etapa(documento.tiempos, 'validar'):
+            documento.validacion = validador_para(documento.tipo.xsd).validate_tree_and_report(documento.arbol)
+        return documento.validacion
+
+    def firmar(self, documento: DocumentoEnProceso) -> None:
+        """Firmar el árbol en su lugar (el texto sin firmar ya quedó guardado)"""
+        with _etapa(documento.tiempos, 'firmar'):
+            signer_production.firmar_arbol(documento.arbol)
+        documento.firmado = True
+        documento._xml_firmado = None
+
+    def pdf(self, documento: DocumentoEnProceso) -> bytes:
+        """PDF a partir del árbol"""
+        with _etapa(documento.tiempos, 'pdf'):
+            return pdf_generator_official.generar_pdf_desde_arbol(documento.arbol)
+
+    def registrar(self, documento: DocumentoEnProceso) -> None:
+        """Dejar en el log el desglose por etapa"""
+        desglose = ", ".join(f"{etapa}={ms:.1f}ms" for etapa, ms in documento.tiempos.items())
+        logger.info(f"⏱️ Documento {documento.clave}: {desglose}")
+
+
+# Instancia global
+pipeline_documentos = PipelineDocumentos()
@@ -0,0 +1,536 @@
+import asyncio
+import base64
+import binascii
+import json
+import logging
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, or_, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import func
+
+from app.core.config import settings
+from app.core.metrics import metricas
+from app.models.database import AsyncSessionLocal, sesion_lectura
+from app.models.documento import DocumentoElectronico, LineaDocumento
+from app.services.almacen_blobs import almacen_blobs
+from app.services.cache_estados import cache_estados
+from app.services.particiones import rango_emision
+from app.services.respuesta_hacienda import ESTADOS_FINALES
+
+logger = logging.getLogger(__name__)
+
+# Columnas que nunca se sobrescriben al volver a guardar un documento existente
+_COLUMNAS_INMUTABLES = {'id', 'clave', 'fecha_emision', 'fecha_creacion'}
+
+# XML que van al almacén de blobs: columna en línea (legado) -> columna de referencia
+_REFERENCIAS_XML = {'xml_sin_firmar': 'xml_sin_firmar_ref', 'xml_firmado': 'xml_firmado_ref'}
+
+# Líneas de detalle por INSERT multi-fila
+_LINEAS_POR_INSERT = 1000
+
+# Columnas del listado: nunca los XML ni la respuesta completa de Hacienda
+_COLUMNAS_LISTADO = (
+    DocumentoElectronico.id,
+    DocumentoElectronico.clave,
+    DocumentoElectronico.tipo_documento,
+    DocumentoElectronico.numero_consecutivo,
+    DocumentoElectronico.fecha_emision,
+    DocumentoElectronico.emisor_cedula,
+    DocumentoElectronico.receptor_nombre,
+    DocumentoElectronico.total_comprobante,
+    DocumentoElectronico.codigo_moneda,
+    DocumentoElectronico.estado_local,
+    DocumentoElectronico.estado_hacienda,
+)
+
+
+def _filtros_clave(clave: str) -> List[list]:
+    """
+    Filtros para buscar una clave, en orden: primero acotado a la fecha que trae
+    la clave (sólo toca la partición de ese mes), luego en todas las particiones
+    para claves sin fecha válida o emitidas con otra fecha.
+    """
+    exacta = DocumentoElectronico.clave == clave
+    rango = rango_emision(clave)
+    if rango is None:
+        return [[exacta]]
+    return [
+        [exacta, DocumentoElectronico.fecha_emision >= rango[0], DocumentoElectronico.fecha_emision < rango[1]],
+        [exacta]
+    ]
+
+
+def codificar_cursor(fecha_emision: datetime, id_documento: int) -> str:
+    """Cursor opaco con la última fila entregada (fecha_emision, id)"""
+    crudo = json.dumps([fecha_emision.isoformat(), id_documento]).encode('utf-8')
+    return base64.urlsafe_b64encode(crudo).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverso de codificar_cursor; ValueError si el cursor no es válido"""
+    try:
+        crudo = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        fecha, id_documento = json.loads(crudo)
+        return datetime.fromisoformat(fecha), int(id_documento)
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise ValueError("Cursor inválido") from e
+
+
+def datos_documento(factura, tipo_documento: str, xml_sin_firmar: Optional[str],
+                    xml_firmado: Optional[str], estado_local: str) -> Dict[str, Any]:
+    """Fila de documentos_electronicos a partir de una factura (esquemas v4.3 o v4.4)"""
+    resumen = factura.resumen_factura
+    receptor = factura.receptor
+
+    def monto(nombre: str) -> Optional[Decimal]:
+        return getattr(resumen, nombre, None)
+
+    return {
+        'clave': factura.clave,
+        'tipo_documento': tipo_documento,
+        'numero_consecutivo': factura.numero_consecutivo,
+        'fecha_emision': factura.fecha_emision,
+        'emisor_nombre': factura.emisor.nombre,
+        'emisor_cedula': factura.emisor.identificacion_numero,
+        'emisor_email': factura.emisor.correo_electronico,
+        'receptor_nombre': receptor.nombre if receptor else None,
+        'receptor_cedula': receptor.identificacion_numero if receptor else None,
+        'receptor_email': receptor.correo_electronico if receptor else None,
+        'total_gravado': monto('total_gravado'),
+        'total_exento': monto('total_exento'),
+        'total_exonerado': monto('total_exonerado'),
+        'total_venta': monto('total_venta'),
+        'total_descuentos': monto('total_descuentos'),
+        'total_venta_neta': monto('total_venta_neta'),
+        'total_impuesto': monto('total_impuesto'),
+        'total_comprobante': monto('total_comprobante'),
+        'codigo_moneda': getattr(resumen.codigo_tipo_moneda, 'value', resumen.codigo_tipo_moneda),
+        'tipo_cambio': getattr(resumen, 'tipo_cambio', None) or Decimal('1.00000'),
+        'xml_sin_firmar': xml_sin_firmar,
+        'xml_firmado': xml_firmado,
+        'estado_local': estado_local,
+        'condicion_venta': factura.condicion_venta,
+        'plazo_credito': str(factura.plazo_credito) if factura.plazo_credito is not None else None,
+        'medio_pago': list(factura.medio_pago),
+    }
+
+
+def datos_lineas(factura, tipo_documento: str) -> List[Dict[str, Any]]:
+    """Filas de lineas_detalle a partir de una factura (esquemas v4.3 o v4.4)"""
+    receptor = factura.receptor
+    moneda = factura.resumen_factura.codigo_tipo_moneda
+    lineas = []
+    for linea in factura.detalles_servicio:
+        # v4.4: codigo_cabys y codigo_comercial; v4.3: codigo (CABYS) y codigo_comercial_*
+        cabys = getattr(linea, 'codigo_cabys', None) or getattr(linea, 'codigo', None)
+        comercial = getattr(linea, 'codigo_comercial', None)
+        descuento = getattr(linea, 'descuento', None)
+        lineas.append({
+            'clave_documento': factura.clave,
+            'fecha_emision': factura.fecha_emision,
+            'numero_linea': linea.numero_linea,
+            'tipo_documento': tipo_documento,
+            'emisor_cedula': factura.emisor.identificacion_numero,
+            'receptor_cedula': receptor.identificacion_numero if receptor else None,
+            'codigo_cabys': cabys if cabys and len(cabys) <= 13 else None,
+            'codigo_comercial_tipo': comercial.tipo if comercial else getattr(linea, 'codigo_comercial_tipo', None),
+            'codigo_comercial': comercial.codigo if comercial else getattr(linea, 'codigo_comercial_codigo', None),
+            'detalle': linea.detalle,
+            'unidad_medida': linea.unidad_medida[:15],
+            'codigo_moneda': getattr(moneda, 'value', moneda),
+            'cantidad': linea.cantidad,
+            'precio_unitario': linea.precio_unitario,
+            'monto_total': linea.monto_total,
+            'monto_descuento': descuento.monto if descuento else getattr(linea, 'descuento_monto', None),
+            'subtotal': linea.subtotal,
+            'impuesto_neto': linea.impuesto_neto,
+            'monto_total_linea': linea.monto_total_linea,
+            'impuestos': [
+                {'codigo': i.codigo, 'codigo_tarifa': i.codigo_tarifa, 'tarifa': str(i.tarifa), 'monto': str(i.monto)}
+                for i in (linea.impuestos or [])
+            ],
+        })
+    return lineas
+
+
+class RepositorioDocumentos:
+    """
+    Acceso asíncrono a documentos electrónicos persistidos.
+
+    Las altas se agrupan: cada `guardar` espera a que su fila quede confirmada,
+    pero las filas que llegan dentro de la misma ventana se escriben en un solo
+    INSERT multi-fila (ON CONFLICT por clave) y una sola transacción, junto con
+    sus líneas de detalle.
+    """
+
+    def __init__(self, lote_maximo: Optional[int] = None, ventana_ms: Optional[float] = None):
+        self.lote_maximo = lote_maximo or settings.db_lote_maximo
+        self.ventana = (ventana_ms if ventana_ms is not None else settings.db_lote_ventana_ms) / 1000
+        self._pendientes: List[Tuple[Dict[str, Any], Optional[List[Dict[str, Any]]], asyncio.Future]] = []
+        self._temporizador: Optional[asyncio.TimerHandle] = None
+        self._escrituras: Set[asyncio.Task] = set()
+
+    # ------------------------------------------------------------------ altas
+
+    async def guardar(self, datos: Dict[str, Any], lineas: Optional[List[Dict[str, Any]]] = None) -> None:
+        """
+        Insertar o actualizar un documento (se confirma junto con las demás filas del lote)
+
+        Args:
+            datos: Fila de documentos_electronicos (ver `datos_documento`)
+            lineas: Líneas de detalle (ver `datos_lineas`); si se indican reemplazan las guardadas
+        """
+        datos = await self._externalizar(datos)
+        futuro = asyncio.get_running_loop().create_future()
+        self._pendientes.append((datos, lineas, futuro))
+        self._programar()
+        await futuro
+
+    @staticmethod
+    async def _externalizar(datos: Dict[str, Any]) -> Dict[str, Any]:
+        """Guardar los XML en el almacén de blobs antes que la fila y dejar sólo sus referencias"""
+        datos = dict(datos)
+        contenidos = {_REFERENCIAS_XML[c]: datos[c] for c in _REFERENCIAS_XML if datos.get(c)}
+        referencias = await asyncio.gather(*(almacen_blobs.guardar(x) for x in contenidos.values()))
+        datos.update(zip(contenidos, referencias))
+        for columna in _REFERENCIAS_XML:
+            if columna in datos:
+                datos[columna] = None
+        return datos
+
+    def _programar(self) -> None:
+        if len(self._pendientes) >= self.lote_maximo:
+            self._vaciar()
+        elif self._temporizador is None:
+            self._temporizador = asyncio.get_running_loop().call_later(self.ventana, self._vaciar)
+
+    def _vaciar(self) -> None:
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+        while self._pendientes:
+            lote = self._pendientes[:self.lote_maximo]
+            del self._pendientes[:self.lote_maximo]
+            tarea = asyncio.create_task(self._escribir(lote))
+            self._escrituras.add(tarea)
+            tarea.add_done_callback(self._escrituras.discard)
+
+    async def _escribir(self, lote: List[Tuple[Dict[str, Any], Optional[List[Dict[str, Any]]], asyncio.Future]]) -> None:
+        # Una misma clave dos veces en un INSERT ... ON CONFLICT falla: queda la última versión
+        filas: Dict[str, Dict[str, Any]] = {}
+        lineas: Dict[str, List[Dict[str, Any]]] = {}
+        for datos, lineas_documento, _ in lote:
+            filas[datos['clave']] = {**filas.get(datos['clave'], {}), **datos}
+            if lineas_documento is not None:
+                lineas[datos['clave']] = lineas_documento
+
+        try:
+            async with AsyncSessionLocal() as sesion:
+                # Filas con el mismo juego de columnas van en el mismo INSERT multi-fila
+                grupos: Dict[frozenset, List[Dict[str, Any]]] = {}
+                for fila in filas.values():
+                    grupos.setdefault(frozenset(fila), []).append(fila)
+                for columnas, valores in grupos.items():
+                    sentencia = insert(DocumentoElectronico).values(valores)
+                    actualizar = {c: sentencia.excluded[c] for c in columnas - _COLUMNAS_INMUTABLES}
+                    actualizar['fecha_actualizacion'] = func.now()
+                    await sesion.execute(sentencia.on_conflict_do_update(
+                        index_elements=['clave', 'fecha_emision'], set_=actualizar))
+                if lineas:
+                    await self._reemplazar_lineas(sesion, lineas)
+                await sesion.commit()
+        except Exception as e:
+            metricas.incrementar("documentos_escritura_errores")
+            logger.error(f"❌ Error guardando lote de {len(filas)} documentos: {e}")
+            for *_, futuro in lote:
+                if not futuro.done():
+                    futuro.set_exception(e)
+            return
+
+        metricas.observar("documentos_lote_filas", len(filas))
+        await cache_estados.invalidar(filas)
+        for *_, futuro in lote:
+            if not futuro.done():
+                futuro.set_result(None)
+
+    @staticmethod
+    async def _reemplazar_lineas(sesion, lineas: Dict[str, List[Dict[str, Any]]]) -> None:
+        """Borrar las líneas guardadas de los documentos y escribir las nuevas en un INSERT multi-fila"""
+        claves = [(clave, filas[0]['fecha_emision']) for clave, filas in lineas.items() if filas]
+        vacias = [clave for clave, filas in lineas.items() if not filas]
+        if claves:
+            await sesion.execute(delete(LineaDocumento).where(
+                tuple_(LineaDocumento.clave_documento, LineaDocumento.fecha_emision).in_(claves)))
+        if vacias:
+            await sesion.execute(delete(LineaDocumento).where(LineaDocumento.clave_documento.in_(vacias)))
+        valores = [linea for filas in lineas.values() for linea in filas]
+        # Tramos por debajo del límite de parámetros de una sentencia (32767)
+        for inicio in range(0, len(valores), _LINEAS_POR_INSERT):
+            await sesion.execute(insert(LineaDocumento).values(valores[inicio:inicio + _LINEAS_POR_INSERT]))
+        metricas.observar("lineas_detalle_lote_filas", len(valores))
+
+    async def cerrar(self) -> None:
+        """Escribir lo pendiente y esperar las escrituras en curso"""
+        self._vaciar()
+        if self._escrituras:
+            await asyncio.gather(*self._escrituras, return_exceptions=True)
+
+    # ---------------------------------------------------------- actualizaciones
+
+    async def _actualizar(self, clave: str, condicion=None, **valores) -> bool:
+        async with AsyncSessionLocal() as sesion:
+            for filtros in _filtros_clave(clave):
+                sentencia = update(DocumentoElectronico).where(*filtros)
+                if condicion is not None:
+                    sentencia = sentencia.where(condicion)
+                resultado = await sesion.execute(sentencia.values(fecha_actualizacion=func.now(), **valores))
+                if resultado.rowcount > 0:
+                    await sesion.commit()
+                    await cache_estados.invalidar([clave])
+                    return True
+        return False
+
+    async def registrar_envio(self, clave: str, entregado: bool, error: Optional[str] = None,
+                              definitivo: bool = False) -> bool:
+        """
+        Registrar un intento de entrega a Hacienda
+
+        Args:
+            entregado: Recepción aceptó el comprobante (queda "enviado"/"recibido")
+            error: Detalle del fallo, si lo hubo
+            definitivo: El fallo no se reintentará (queda en estado local "error")
+        """
+        valores: Dict[str, Any] = {
+            'intentos_envio': func.coalesce(DocumentoElectronico.intentos_envio, 0) + 1,
+            'ultimo_intento': datetime.now(),
+        }
+        if entregado:
+            valores['estado_local'] = 'enviado'
+            valores['estado_hacienda'] = func.coalesce(DocumentoElectronico.estado_hacienda, 'recibido')
+        elif definitivo:
+            valores['estado_local'] = 'error'
+        if error:
+            valores['mensaje_hacienda'] = error[:2000]
+        return await self._actualizar(clave, **valores)
+
+    async def actualizar_estado_hacienda(self, clave: str, estado: str, mensaje: Optional[str] = None,
+                                         respuesta: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Guardar el estado de Hacienda de un documento.
+        Idempotente: un estado final (aceptado/rechazado) ya guardado no se sobrescribe.
+
+        Returns:
+            bool: True si el documento existe y se actualizó
+        """
+        valores: Dict[str, Any] = {'estado_hacienda': estado}
+        if mensaje is not None:
+            valores['mensaje_hacienda'] = mensaje
+        if respuesta is not None:
+            # El MensajeHacienda va al almacén; en el JSON quedan sólo los campos extraídos
+            mensaje_xml = respuesta.get('mensaje-hacienda') or {}
+            if mensaje_xml.get('xml'):
+                valores['respuesta_xml_ref'] = await almacen_blobs.guardar(mensaje_xml['xml'])
+                respuesta = {**respuesta, 'mensaje-hacienda': {k: v for k, v in mensaje_xml.items() if k != 'xml'}}
+            valores['respuesta_hacienda'] = respuesta
+        return await self._actualizar(
+            clave,
+            or_(DocumentoElectronico.estado_hacienda.is_(None),
+                DocumentoElectronico.estado_hacienda.notin_(ESTADOS_FINALES)),
+            **valores
+        )
+
+    # ---------------------------------------------------------------- consultas
+
+    @staticmethod
+    async def _primera(clave: str, consulta):
+        async with AsyncSessionLocal() as sesion:
+            for filtros in _filtros_clave(clave):
+                fila = (await sesion.execute(consulta.where(*filtros))).first()
+                if fila is not None:
+                    return fila
+        return None
+
+    async def obtener(self, clave: str) -> Optional[DocumentoElectronico]:
+        """Documento completo por clave"""
+        fila = await self._primera(clave, select(DocumentoElectronico))
+        return fila[0] if fila else None
+
+    async def obtener_xml(self, clave: str, firmado: bool = True) -> Optional[str]:
+        """XML guardado del documento, desde el almacén de blobs (o en línea si es anterior a él)"""
+        columna = 'xml_firmado' if firmado else 'xml_sin_firmar'
+        fila = await self._primera(clave, select(
+            getattr(DocumentoElectronico, _REFERENCIAS_XML[columna]),
+            getattr(DocumentoElectronico, columna)
+        ))
+        if fila is None:
+            return None
+        referencia, en_linea = fila
+        return await almacen_blobs.obtener_texto(referencia) if referencia else en_linea
+
+    async def obtener_respuesta_xml(self, documento: DocumentoElectronico) -> Optional[str]:
+        """MensajeHacienda de un documento ya cargado con `obtener`"""
+        if documento.respuesta_xml_ref:
+            return await almacen_blobs.obtener_texto(documento.respuesta_xml_ref)
+        return ((documento.respuesta_hacienda or {}).get('mensaje-hacienda') or {}).get('xml')
+
+    async def guardar_pdf(self, clave: str, pdf: bytes) -> Optional[str]:
+        """Guardar el PDF generado del documento y devolver su referencia (None si no existe la fila)"""
+        referencia = await almacen_blobs.guardar(pdf)
+        return referencia if await self._actualizar(clave, pdf_ref=referencia) else None
+
+    async def obtener_pdf(self, clave: str) -> Optional[bytes]:
+        """PDF guardado del documento, o None si todavía no se generó"""
+        fila = await self._primera(clave, select(DocumentoElectronico.pdf_ref))
+        return await almacen_blobs.obtener(fila.pdf_ref) if fila and fila.pdf_ref else None
+
+    async def obtener_estados_finales(self, claves: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Estados de Hacienda ya finales (aceptado/rechazado) de las claves dadas"""
+        if not claves:
+            return {}
+        filtros = [DocumentoElectronico.clave.in_(claves), DocumentoElectronico.estado_hacienda.in_(ESTADOS_FINALES)]
+        # Acotar a las particiones de las fechas de las claves (lo que no aparezca se consulta a Hacienda)
+        rangos = [rango_emision(clave) for clave in claves]
+        if all(rangos):
+            filtros.append(DocumentoElectronico.fecha_emision >= min(r[0] for r in rangos))
+            filtros.append(DocumentoElectronico.fecha_emision < max(r[1] for r in rangos))
+        async with AsyncSessionLocal() as sesion:
+            filas = await sesion.execute(
+                select(
+                    DocumentoElectronico.clave,
+                    DocumentoElectronico.estado_hacienda,
+                    DocumentoElectronico.mensaje_hacienda,
+                    DocumentoElectronico.respuesta_hacienda
+                ).where(*filtros)
+            )
+            return {
+                fila.clave: {
+                    'estado': fila.estado_hacienda,
+                    'mensaje': fila.mensaje_hacienda,
+                    'respuesta': fila.respuesta_hacienda
+                }
+                for fila in filas
+            }
+
+    async def listar(self, emisor: Optional[str] = None, tipo_documento: Optional[str] = None,
+                     estado: Optional[str] = None, fecha_inicio: Optional[datetime] = None,
+                     fecha_fin: Optional[datetime] = None, cursor: Optional[str] = None,
+                     limite: int = 50, incluir_total: bool = False) -> Dict[str, Any]:
+        """
+        Listado paginado por cursor, del más reciente al más antiguo
+
+        La página siguiente arranca después de (fecha_emision, id) de la última fila,
+        así que el costo no depende de la profundidad (a diferencia de OFFSET).
+        Cada combinación de filtros tiene su índice compuesto terminado en
+        (fecha_emision, id); el conteo exacto es opcional porque recorre todo el rango.
+        Se lee de una réplica cuando hay (un documento recién creado puede tardar
+        unos segundos en aparecer; la consulta por clave siempre va a la primaria).
+
+        Returns:
+            Dict con 'documentos', 'siguiente_cursor' (None en la última página) y 'total'
+        """
+        filtros = []
+        if emisor:
+            filtros.append(DocumentoElectronico.emisor_cedula == emisor)
+        if tipo_documento:
+            filtros.append(DocumentoElectronico.tipo_documento == tipo_documento)
+        if estado:
+            filtros.append(DocumentoElectronico.estado_hacienda == estado)
+        if fecha_inicio:
+            filtros.append(DocumentoElectronico.fecha_emision >= fecha_inicio)
+        if fecha_fin:
+            filtros.append(DocumentoElectronico.fecha_emision <= fecha_fin)
+
+        consulta = select(*_COLUMNAS_LISTADO).where(*filtros)
+        if cursor:
+            consulta = consulta.where(
+                tuple_(DocumentoElectronico.fecha_emision, DocumentoElectronico.id) < decodificar_cursor(cursor)
+            )
+        # Una fila de más indica si hay otra página sin tener que contar
+        consulta = consulta.order_by(
+            DocumentoElectronico.fecha_emision.desc(), DocumentoElectronico.id.desc()
+        ).limit(limite + 1)
+
+        async with sesion_lectura() as sesion:
+            filas = (await sesion.execute(consulta)).all()
+            total = None
+            if incluir_total:
+                total = await sesion.scalar(select(func.count()).select_from(DocumentoElectronico).where(*filtros))
+
+        siguiente = None
+        if len(filas) > limite:
+            filas = filas[:limite]
+            siguiente = codificar_cursor(filas[-1].fecha_emision, filas[-1].id)
+
+        metricas.observar("documentos_listado_filas", len(filas))
+        return {
+            'documentos': [dict(fila._mapping) for fila in filas],
+            'siguiente_cursor': siguiente,
+            'total': total
+        }
+
+    async def buscar_lineas(self, fecha_inicio: datetime, fecha_fin: datetime,
+                            codigo_cabys: Optional[str] = None, codigo_comercial: Optional[str] = None,
+                            texto: Optional[str] = None, emisor: Optional[str] = None,
+                            receptor: Optional[str] = None, cursor: Optional[str] = None,
+                            limite: int = 50, incluir_totales: bool = False) -> Dict[str, Any]:
+        """
+        Líneas de detalle vendidas por producto, emisor o receptor en un rango de fechas
+
+        Mismo esquema de paginación que `listar` (cursor sobre fecha_emision, id).
+        El texto se busca dentro del detalle con el índice trigram; CABYS, código
+        comercial, emisor y receptor usan sus índices (..., fecha_emision, id).
+
+        Returns:
+            Dict con 'lineas', 'siguiente_cursor' y 'totales' por moneda (si se piden)
+        """
+        filtros = [LineaDocumento.fecha_emision >= fecha_inicio, LineaDocumento.fecha_emision <= fecha_fin]
+        if codigo_cabys:
+            filtros.append(LineaDocumento.codigo_cabys == codigo_cabys)
+        if codigo_comercial:
+            filtros.append(LineaDocumento.codigo_comercial == codigo_comercial)
+        if texto:
+            patron = texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            filtros.append(LineaDocumento.detalle.ilike(f"%{patron}%"))
+        if emisor:
+            filtros.append(LineaDocumento.emisor_cedula == emisor)
+        if receptor:
+            filtros.append(LineaDocumento.receptor_cedula == receptor)
+
+        consulta = select(LineaDocumento).where(*filtros)
+        if cursor:
+            consulta = consulta.where(
+                tuple_(LineaDocumento.fecha_emision, LineaDocumento.id) < decodificar_cursor(cursor)
+            )
+        consulta = consulta.order_by(LineaDocumento.fecha_emision.desc(), LineaDocumento.id.desc()).limit(limite + 1)
+
+        async with sesion_lectura() as sesion:
+            filas = (await sesion.scalars(consulta)).all()
+            totales = None
+            if incluir_totales:
+                resultado = await sesion.execute(
+                    select(
+                        LineaDocumento.codigo_moneda,
+                        func.count().label('lineas'),
+                        func.count(func.distinct(LineaDocumento.clave_documento)).label('documentos'),
+                        func.sum(LineaDocumento.cantidad).label('cantidad'),
+                        func.sum(LineaDocumento.subtotal).label('subtotal'),
+                        func.sum(LineaDocumento.impuesto_neto).label('impuesto_neto'),
+                        func.sum(LineaDocumento.monto_total_linea).label('monto_total_linea'),
+                    ).where(*filtros).group_by(LineaDocumento.codigo_moneda)
+                )
+                totales = {fila.codigo_moneda: dict(fila._mapping) for fila in resultado}
+
+        siguiente = None
+        if len(filas) > limite:
+            filas = filas[:limite]
+            siguiente = codificar_cursor(filas[-1].fecha_emision, filas[-1].id)
+
+        metricas.observar("lineas_busqueda_filas", len(filas))
+        return {'lineas': filas, 'siguiente_cursor': siguiente, 'totales': totales}
+
+
+# Instancia global
+repositorio_documentos = RepositorioDocumentos()
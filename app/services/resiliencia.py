@@ -0,0 +1,151 @@
+import logging
+import random
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from app.core.config import settings
+from app.core.metrics import metricas
+from app.core.redis import obtener_redis
+
+logger = logging.getLogger(__name__)
+
+
+class PoliticaReintentos:
+    """Backoff exponencial con jitter completo (respeta Retry-After como mínimo)"""
+
+    def __init__(self, base: float, maximo: float):
+        self.base = base
+        self.maximo = maximo
+
+    def retraso(self, intento: int, reintentar_en: Optional[float] = None) -> float:
+        """
+        Segundos a esperar antes del siguiente intento
+
+        Args:
+            intento: Número de intento fallido (1 = primer fallo)
+            reintentar_en: Valor de Retry-After indicado por Hacienda
+        """
+        tope = min(self.maximo, self.base * 2 ** max(intento - 1, 0))
+        retraso = random.uniform(0, tope)
+        if reintentar_en:
+            retraso = max(retraso, reintentar_en)
+        return retraso
+
+
+class CircuitoHacienda:
+    """
+    Circuit breaker del API de recepción.
+
+    Tras `umbral` fallas consecutivas (5xx, timeout o error de red) se abre
+    durante `apertura` segundos y deja de enviar; luego pasa a semiabierto y
+    permite un único envío de prueba. El estado abierto se publica en Redis para
+    que el API emita en contingencia y los demás workers dejen de enviar.
+    """
+
+    CERRADO = "cerrado"
+    ABIERTO = "abierto"
+    SEMIABIERTO = "semiabierto"
+
+    CLAVE_REDIS = "hacienda:circuito:abierto"
+    CACHE_REMOTO_SEGUNDOS = 1.0
+
+    def __init__(self, umbral: int, apertura: float):
+        self.umbral = umbral
+        self.apertura = apertura
+        self.estado = self.CERRADO
+        self.fallos = 0
+        self._abierto_hasta = 0.0
+        self._sondeo_en_curso = False
+        self._remoto = (0.0, False)
+        self._al_cerrar: List[Callable[[], Awaitable[None]]] = []
+
+    def al_cerrar(self, callback: Callable[[], Awaitable[None]]) -> None:
+        """Registrar una acción a ejecutar cuando el circuito se cierra (drenado de contingencia)"""
+        self._al_cerrar.append(callback)
+
+    async def _abierto_remoto(self) -> bool:
+        consultado_en, abierto = self._remoto
+        ahora = time.monotonic()
+        if ahora - consultado_en < self.CACHE_REMOTO_SEGUNDOS:
+            return abierto
+        try:
+            abierto = bool(await obtener_redis().exists(self.CLAVE_REDIS))
+        except Exception as e:
+            logger.debug(f"Estado remoto del circuito no disponible: {e}")
+            abierto = False
+        self._remoto = (ahora, abierto)
+        return abierto
+
+    def _cambiar_estado(self, estado: str) -> None:
+        if estado != self.estado:
+            logger.warning(f"⚡ Circuito Hacienda: {self.estado} -> {estado}")
+        self.estado = estado
+        metricas.fijar("hacienda_circuito_abierto", 0 if estado == self.CERRADO else 1)
+
+    async def esta_abierto(self) -> bool:
+        """True mientras no se deba enviar (ni siquiera un envío de prueba)"""
+        if self.estado == self.ABIERTO and time.monotonic() < self._abierto_hasta:
+            return True
+        if self.estado == self.CERRADO:
+            return await self._abierto_remoto()
+        return False
+
+    async def permite(self) -> bool:
+        """Decidir si un envío puede salir ahora (consume el envío de prueba en semiabierto)"""
+        ahora = time.monotonic()
+        if self.estado == self.CERRADO:
+            if not await self._abierto_remoto():
+                return True
+            # Otro proceso abrió el circuito
+            self._abierto_hasta = ahora + self.apertura
+            self._cambiar_estado(self.ABIERTO)
+
+        if self.estado == self.ABIERTO:
+            if ahora < self._abierto_hasta:
+                return False
+            self._sondeo_en_curso = False
+            self._cambiar_estado(self.SEMIABIERTO)
+
+        if self._sondeo_en_curso:
+            return False
+        self._sondeo_en_curso = True
+        return True
+
+    async def registrar_exito(self) -> None:
+        self.fallos = 0
+        if self.estado != self.CERRADO:
+            await self._cerrar()
+
+    async def registrar_fallo(self) -> None:
+        self.fallos += 1
+        if self.estado == self.SEMIABIERTO or self.fallos >= self.umbral:
+            await self._abrir()
+
+    async def _abrir(self) -> None:
+        self._abierto_hasta = time.monotonic() + self.apertura
+        self._sondeo_en_curso = False
+        self._cambiar_estado(self.ABIERTO)
+        metricas.incrementar("hacienda_circuito_aperturas")
+        try:
+            await obtener_redis().set(self.CLAVE_REDIS, int(time.time()), px=int(self.apertura * 1000))
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo publicar apertura del circuito en Redis: {e}")
+
+    async def _cerrar(self) -> None:
+        self._sondeo_en_curso = False
+        self._cambiar_estado(self.CERRADO)
+        self._remoto = (time.monotonic(), False)
+        try:
+            await obtener_redis().delete(self.CLAVE_REDIS)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo publicar cierre del circuito en Redis: {e}")
+        for callback in self._al_cerrar:
+            try:
+                await callback()
+            except Exception as e:
+                logger.error(f"Error en acción de cierre del circuito: {e}")
+
+
+# Instancias globales
+politica_reintentos = PoliticaReintentos(settings.cola_retraso_base_segundos, settings.cola_retraso_max_segundos)
+circuito_hacienda = CircuitoHacienda(settings.circuito_umbral_fallos, settings.circuito_apertura_segundos)
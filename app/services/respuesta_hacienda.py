@@ -0,0 +1,107 @@
+import base64
+import binascii
+import logging
+from typing import Any, Dict, Optional
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# Estados de Hacienda tras los cuales el documento ya no cambia
+ESTADOS_FINALES = frozenset({"aceptado", "rechazado"})
+
+# Código <Mensaje> del MensajeHacienda: 1=Aceptado, 2=Aceptado parcial, 3=Rechazado
+_ESTADO_POR_MENSAJE = {"1": "aceptado", "2": "aceptado", "3": "rechazado"}
+
+
+def decodificar_respuesta_xml(respuesta_b64: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Decodificar el `respuesta-xml` (base64) de Hacienda y extraer el MensajeHacienda
+
+    Returns:
+        Dict con el XML decodificado, la clave, el código de mensaje y el detalle,
+        o None si no viene o no es un XML válido
+    """
+    if not respuesta_b64:
+        return None
+    try:
+        xml_bytes = base64.b64decode(respuesta_b64, validate=True)
+        raiz = etree.fromstring(xml_bytes, parser=etree.XMLParser(resolve_entities=False, no_network=True))
+    except (binascii.Error, ValueError, etree.XMLSyntaxError) as e:
+        logger.warning(f"⚠️ respuesta-xml inválido: {e}")
+        return None
+
+    def texto(nombre: str) -> Optional[str]:
+        valor = raiz.findtext(f"{{*}}{nombre}")
+        if valor is None:
+            valor = raiz.findtext(nombre)
+        return valor.strip() if valor else None
+
+    return {
+        'xml': xml_bytes.decode('utf-8', errors='replace'),
+        'raiz': etree.QName(raiz).localname,
+        'clave': texto('Clave'),
+        'mensaje': texto('Mensaje'),
+        'detalle': texto('DetalleMensaje'),
+        'monto_total_impuesto': texto('MontoTotalImpuesto'),
+        'total_factura': texto('TotalFactura'),
+    }
+
+
+def verificar_respuesta(clave: str, datos: Dict[str, Any]) -> Optional[str]:
+    """
+    Verificar que una notificación de Hacienda sea coherente antes de aplicarla
+
+    Returns:
+        Descripción del problema, o None si la notificación es válida
+    """
+    if datos.get('clave') and datos['clave'] != clave:
+        return "La clave de la notificación no coincide"
+    estado = (datos.get('ind-estado') or '').lower()
+    if not estado:
+        return "Falta ind-estado"
+    if not datos.get('respuesta-xml'):
+        # Los estados finales siempre traen el MensajeHacienda
+        return "Falta respuesta-xml para un estado final" if estado in ESTADOS_FINALES else None
+
+    mensaje_xml = decodificar_respuesta_xml(datos['respuesta-xml'])
+    if mensaje_xml is None:
+        return "respuesta-xml no es un XML base64 válido"
+    if mensaje_xml['raiz'] != 'MensajeHacienda':
+        return f"respuesta-xml inesperado: {mensaje_xml['raiz']}"
+    if mensaje_xml['clave'] != clave:
+        return "La clave del MensajeHacienda no coincide"
+    estado_xml = _ESTADO_POR_MENSAJE.get(mensaje_xml['mensaje'])
+    if estado in ESTADOS_FINALES and estado_xml and estado_xml != estado:
+        return f"ind-estado '{estado}' no coincide con el MensajeHacienda ('{estado_xml}')"
+    return None
+
+
+def interpretar_respuesta(clave: str, datos: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Normalizar una respuesta de estado de Hacienda (consulta o callback)
+
+    Returns:
+        Dict con `estado` (ind-estado), `mensaje` y `respuesta` (JSON a persistir)
+    """
+    estado = (datos.get('ind-estado') or 'desconocido').lower()
+    mensaje_xml = decodificar_respuesta_xml(datos.get('respuesta-xml'))
+
+    if mensaje_xml and mensaje_xml['clave'] and mensaje_xml['clave'] != clave:
+        # El MensajeHacienda pertenece a otro comprobante: no confiar en él
+        logger.warning(f"⚠️ respuesta-xml de {mensaje_xml['clave']} recibido para {clave}")
+        mensaje_xml = None
+
+    if mensaje_xml and estado not in ESTADOS_FINALES:
+        estado = _ESTADO_POR_MENSAJE.get(mensaje_xml['mensaje'], estado)
+
+    mensaje = (mensaje_xml or {}).get('detalle') or datos.get('mensaje-hacienda')
+    return {
+        'estado': estado,
+        'mensaje': mensaje,
+        'respuesta': {
+            'ind-estado': estado,
+            'fecha-procesamiento': datos.get('fecha-procesamiento'),
+            'mensaje-hacienda': mensaje_xml,
+        },
+    }
@@ -0,0 +1,120 @@
+import logging
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, literal_column, select, text
+
+from app.core.metrics import metricas
+from app.models.database import AsyncSessionLocal, sesion_lectura
+from app.models.documento import ResumenDiario
+
+logger = logging.getLogger(__name__)
+
+MONTOS = ('total_gravado', 'total_exento', 'total_exonerado', 'total_venta', 'total_descuentos',
+          'total_venta_neta', 'total_impuesto', 'total_comprobante')
+
+AGRUPACIONES = ('dia', 'mes', 'total')
+
+_RECONSTRUIR = f"""
+INSERT INTO resumen_diario (emisor_cedula, fecha, tipo_documento, codigo_moneda, estado_hacienda,
+                            cantidad, {", ".join(MONTOS)})
+SELECT emisor_cedula, fecha_emision::date, tipo_documento, COALESCE(codigo_moneda, 'CRC'),
+       COALESCE(estado_hacienda, 'pendiente'), count(*),
+       {", ".join(f"COALESCE(sum({monto}), 0)" for monto in MONTOS)}
+FROM documentos_electronicos
+WHERE fecha_emision >= :desde AND fecha_emision < :hasta
+GROUP BY 1, 2, 3, 4, 5
+"""
+
+
+class AgregadorResumen:
+    """
+    Consultas y reconstrucción de resumen_diario.
+
+    La tabla la mantienen al día los triggers de documentos_electronicos
+    (migración 0005), así que los reportes nunca recorren los documentos: un
+    mes de un emisor son a lo sumo unas decenas de filas del resumen.
+    """
+
+    async def consultar(self, fecha_inicio: date, fecha_fin: date, emisor: Optional[str] = None,
+                        tipo_documento: Optional[str] = None, moneda: Optional[str] = None,
+                        estado: Optional[str] = None, agrupacion: str = 'mes') -> List[Dict[str, Any]]:
+        """Totales del rango [fecha_inicio, fecha_fin] por período, tipo, moneda y estado"""
+        if agrupacion not in AGRUPACIONES:
+            raise ValueError(f"Agrupación inválida: {agrupacion}")
+
+        columnas = [ResumenDiario.tipo_documento, ResumenDiario.codigo_moneda, ResumenDiario.estado_hacienda]
+        if agrupacion == 'dia':
+            columnas.insert(0, ResumenDiario.fecha.label('periodo'))
+        elif agrupacion == 'mes':
+            columnas.insert(0, func.date_trunc(literal_column("'month'"), ResumenDiario.fecha).label('periodo'))
+
+        consulta = select(
+            *columnas,
+            func.sum(ResumenDiario.cantidad).label('cantidad'),
+            *[func.sum(getattr(ResumenDiario, monto)).label(monto) for monto in MONTOS]
+        ).where(ResumenDiario.fecha >= fecha_inicio, ResumenDiario.fecha <= fecha_fin)
+        if emisor:
+            consulta = consulta.where(ResumenDiario.emisor_cedula == emisor)
+        if tipo_documento:
+            consulta = consulta.where(ResumenDiario.tipo_documento == tipo_documento)
+        if moneda:
+            consulta = consulta.where(ResumenDiario.codigo_moneda == moneda)
+        if estado:
+            consulta = consulta.where(ResumenDiario.estado_hacienda == estado)
+        consulta = consulta.group_by(*columnas).order_by(*columnas)
+
+        async with sesion_lectura() as sesion:
+            filas = (await sesion.execute(consulta)).mappings().all()
+        metricas.observar("resumen_consulta_filas", len(filas))
+
+        resultado = []
+        for fila in filas:
+            registro = dict(fila)
+            periodo = registro.get('periodo')
+            if isinstance(periodo, datetime):
+                registro['periodo'] = periodo.date().isoformat()[:7]
+            elif isinstance(periodo, date):
+                registro['periodo'] = periodo.isoformat()
+            for monto in MONTOS:
+                registro[monto] = registro[monto] or Decimal(0)
+            resultado.append(registro)
+        return resultado
+
+    async def reconstruir(self, desde: Optional[date] = None, hasta: Optional[date] = None) -> int:
+        """
+        Recalcular el resumen de [desde, hasta) a partir de los documentos
+
+        Sin `desde` empieza en el primer mes con documentos en la base: los meses
+        ya archivados (fuera de la ventana de retención) conservan su resumen.
+        El resumen queda bloqueado durante el cálculo para que los triggers de
+        escrituras concurrentes se apliquen después y no se pierdan.
+        """
+        async with AsyncSessionLocal() as sesion:
+            if desde is None:
+                primera = await sesion.scalar(text("SELECT min(fecha_emision) FROM documentos_electronicos"))
+                if primera is None:
+                    return 0
+                desde = primera.date().replace(day=1)
+            if hasta is None:
+                hasta = date.today() + timedelta(days=1)
+                ultima = await sesion.scalar(text("SELECT max(fecha_emision) FROM documentos_electronicos"))
+                if ultima is not None and ultima.date() >= hasta:
+                    hasta = ultima.date() + timedelta(days=1)
+
+            await sesion.execute(text("LOCK TABLE resumen_diario IN EXCLUSIVE MODE"))
+            await sesion.execute(text("DELETE FROM resumen_diario WHERE fecha >= :desde AND fecha < :hasta"),
+                                 {'desde': desde, 'hasta': hasta})
+            resultado = await sesion.execute(text(_RECONSTRUIR), {
+                'desde': datetime.combine(desde, datetime.min.time()),
+                'hasta': datetime.combine(hasta, datetime.min.time())
+            })
+            await sesion.commit()
+
+        logger.info(f"📊 Resumen diario reconstruido de {desde} a {hasta}: {resultado.rowcount} filas")
+        return resultado.rowcount
+
+
+# Instancia global
+agregador_resumen = AgregadorResumen()
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.metrics import metricas
+from app.core.redis import obtener_redis
+from app.services.repositorio_documentos import repositorio_documentos
+from app.services.resiliencia import circuito_hacienda
+from app.services.respuesta_hacienda import ESTADOS_FINALES, interpretar_respuesta
+
+logger = logging.getLogger(__name__)
+
+# Toma hasta N claves vencidas sin exceder el presupuesto global del segundo actual.
+# Las claves tomadas se corren al plazo de arrendamiento: si el worker muere, vuelven solas.
+_RESERVAR = """
+local usados = tonumber(redis.call('GET', KEYS[2]) or '0')
+local disponibles = tonumber(ARGV[3]) - usados
+if disponibles <= 0 then return {} end
+local claves = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, math.min(disponibles, tonumber(ARGV[2])))
+if #claves == 0 then return {} end
+for _, c in ipairs(claves) do redis.call('ZADD', KEYS[1], ARGV[4], c) end
+redis.call('INCRBY', KEYS[2], #claves)
+redis.call('EXPIRE', KEYS[2], 2)
+return claves
+"""
+
+
+class PlanificadorSondeo:
+    """
+    Seguimiento de documentos enviados hasta que Hacienda los acepta o rechaza.
+
+    Cada clave vive en un ZSET con la hora de su próxima consulta; los intervalos
+    crecen por niveles (segundos, luego minutos, luego horas). Las consultas se
+    agrupan en lotes vía `consultar_masivo` y el total por segundo queda acotado
+    por un presupuesto compartido en Redis entre todos los workers.
+    """
+
+    PREFIJO = "sondeo:estados"
+    ARRENDAMIENTO_SEGUNDOS = 120
+    INTERVALO_VACIO = 1.0
+
+    def __init__(self, hacienda_client=None):
+        self.programados = f"{self.PREFIJO}:programados"
+        self.intentos = f"{self.PREFIJO}:intentos"
+        self.inicio = f"{self.PREFIJO}:inicio"
+        self.niveles = settings.sondeo_niveles_segundos
+        self.max_segundos = settings.sondeo_max_horas * 3600
+        self.presupuesto = settings.sondeo_presupuesto_por_segundo
+        self.lote = settings.sondeo_lote
+        self._hacienda_client = hacienda_client
+        self._detener = asyncio.Event()
+
+    @property
+    def hacienda_client(self):
+        if self._hacienda_client is None:
+            from app.services.hacienda_client import HaciendaClient
+            self._hacienda_client = HaciendaClient()
+        return self._hacienda_client
+
+    def _nivel(self, intentos: int) -> float:
+        return self.niveles[min(intentos, len(self.niveles) - 1)]
+
+    async def programar(self, clave: str, retraso: Optional[float] = None) -> None:
+        """
+        Empezar a seguir un documento recién entregado (no reprograma si ya está).
+        Con callback configurado, la primera consulta espera el plazo del callback:
+        el sondeo queda sólo como respaldo.
+        """
+        ahora = time.time()
+        if retraso is None and settings.hacienda_callback_url:
+            retraso = settings.hacienda_callback_plazo_segundos
+        async with obtener_redis().pipeline(transaction=True) as pipe:
+            pipe.zadd(self.programados, {clave: ahora + (retraso if retraso is not None else self._nivel(0))}, nx=True)
+            pipe.hsetnx(self.inicio, clave, ahora)
+            await pipe.execute()
+
+    async def finalizar(self, clave: str) -> None:
+        """Dejar de seguir un documento"""
+        async with obtener_redis().pipeline(transaction=True) as pipe:
+            pipe.zrem(self.programados, clave)
+            pipe.hdel(self.intentos, clave)
+            pipe.hdel(self.inicio, clave)
+            await pipe.execute()
+
+    async def _reservar(self) -> List[str]:
+        ahora = time.time()
+        return await obtener_redis().eval(
+            _RESERVAR, 2, self.programados, f"{self.PREFIJO}:presupuesto:{int(ahora)}",
+            ahora, self.lote, self.presupuesto, ahora + self.ARRENDAMIENTO_SEGUNDOS
+        )
+
+    async def _reprogramar(self, clave: str) -> None:
+        redis = obtener_redis()
+        intentos = await redis.hincrby(self.intentos, clave, 1)
+        inicio = float(await redis.hget(self.inicio, clave) or time.time())
+        ahora = time.time()
+
+        if ahora - inicio > self.max_segundos:
+            await self.finalizar(clave)
+            metricas.incrementar("sondeo_estados_abandonados")
+            logger.warning(f"⏳ Documento {clave} sin respuesta final tras {intentos} consultas; se deja de consultar")
+            return
+        await redis.zadd(self.programados, {clave: ahora + self._nivel(intentos)})
+
+    async def ciclo(self) -> int:
+        """Consultar un lote de documentos vencidos; devuelve cuántos se consultaron"""
+        claves = await self._reservar()
+        if not claves:
+            return 0
+
+        resultados = await self.hacienda_client.consultar_masivo(claves)
+        for clave in claves:
+            await self._procesar(clave, resultados.get(clave) or {})
+        return len(claves)
+
+    async def _procesar(self, clave: str, datos: Dict[str, Any]) -> None:
+        interpretado = interpretar_respuesta(clave, datos)
+        estado = interpretado['estado']
+        metricas.incrementar("sondeo_estados_consultas", estado=estado)
+
+        if estado not in ESTADOS_FINALES:
+            await self._reprogramar(clave)
+            return
+
+        try:
+            actualizado = await repositorio_documentos.actualizar_estado_hacienda(
+                clave, estado, interpretado['mensaje'], interpretado['respuesta']
+            )
+        except Exception as e:
+            logger.error(f"❌ No se pudo guardar el estado de {clave}: {e}")
+            await self._reprogramar(clave)
+            return
+
+        if not actualizado:
+            logger.warning(f"⚠️ Documento {clave} no existe en la base de datos; estado {estado} no guardado")
+        await self.finalizar(clave)
+        metricas.incrementar("sondeo_estados_finalizados", estado=estado)
+        logger.info(f"📬 Documento {clave}: {estado}")
+
+    async def pendientes(self) -> int:
+        total = await obtener_redis().zcard(self.programados)
+        metricas.fijar("sondeo_estados_pendientes", total)
+        return total
+
+    def detener(self) -> None:
+        self._detener.set()
+
+    async def ejecutar(self) -> None:
+        """Bucle del planificador (corre dentro del worker de envíos)"""
+        logger.info(f"🔎 Sondeo de estados iniciado (presupuesto={self.presupuesto}/s)")
+        ultima_publicacion = 0.0
+        loop = asyncio.get_running_loop()
+
+        while not self._detener.is_set():
+            if loop.time() - ultima_publicacion > 5.0:
+                await self.pendientes()
+                ultima_publicacion = loop.time()
+
+            if await circuito_hacienda.esta_abierto():
+                await self._esperar(self.INTERVALO_VACIO)
+                continue
+
+            try:
+                consultados = await self.ciclo()
+            except Exception as e:
+                logger.error(f"❌ Error en ciclo de sondeo: {e}")
+                consultados = 0
+
+            if not consultados:
+                await self._esperar(self.INTERVALO_VACIO)
+
+    async def _esperar(self, segundos: float) -> None:
+        try:
+            await asyncio.wait_for(self._detener.wait(), timeout=segundos)
+        except asyncio.TimeoutError:
+            pass
+
+
+# Instancia global
+planificador_sondeo = PlanificadorSondeo()
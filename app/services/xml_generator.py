@@ -1,15 +1,16 @@
 from jinja2 import Template
 from datetime import datetime
 from app.schemas.factura import FacturaElectronica
+from app.services.xml_generator_v44 import TIPOS_V44, UBICACION_ESQUEMAS
 import secrets
 import string
 
 class XMLGenerator:
     def __init__(self):
         self.factura_template = Template("""<?xml version="1.0" encoding="UTF-8"?>
-<FacturaElectronica xmlns="https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronicaV44" 
+<{{ raiz }} xmlns="{{ namespace }}" 
                    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" 
-                   xsi:schemaLocation="https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronicaV44 https://www.hacienda.go.cr/ATV/ComprobanteElectronico/docs/esquemas/2016/v4.4/FacturaElectronicaV44.xsd">
+                   xsi:schemaLocation="{{ namespace }} {{ ubicacion_esquemas }}/{{ raiz }}_V4.4.xsd">
     <Clave>{{ clave }}</Clave>
     <CodigoActividad>{{ codigo_actividad }}</CodigoActividad>
     <NumeroConsecutivo>{{ numero_consecutivo }}</NumeroConsecutivo>
@@ -157,7 +158,7 @@ class XMLGenerator:
         <NumeroResolucion>DGT-R-48-2016</NumeroResolucion>
         <FechaResolucion>07-10-2016 01:00:00</FechaResolucion>
     </Normativa>
-</FacturaElectronica>""")
+</{{ raiz }}>""")
 
     def generar_clave(self, pais: str, dia: str, mes: str, año: str, 
                      cedula_emisor: str, consecutivo: str, 
@@ -181,7 +182,12 @@ class XMLGenerator:
                 situacion="1"
             )
         
+        # Raíz y namespace del tipo de documento que va en el consecutivo (posiciones 9-10)
+        tipo = TIPOS_V44.get(factura.numero_consecutivo[8:10], TIPOS_V44['01'])
         return self.factura_template.render(
+            raiz=tipo.raiz,
+            namespace=tipo.namespace,
+            ubicacion_esquemas=UBICACION_ESQUEMAS,
             clave=factura.clave,
             codigo_actividad=factura.codigo_actividad,
             numero_consecutivo=factura.numero_consecutivo,
@@ -193,4 +199,7 @@ class XMLGenerator:
             medio_pago=factura.medio_pago,
             detalles_servicio=factura.detalles_servicio,
             resumen_factura=factura.resumen_factura
-        )
\ No newline at end of file
+        )
+
+# Instancia global
+xml_generator = XMLGenerator()
\ No newline at end of file
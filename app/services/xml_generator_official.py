@@ -1,6 +1,8 @@
 from jinja2 import Template
 from datetime import datetime
+from typing import List, Tuple
 from app.schemas.factura import FacturaElectronica
+from app.services.calculo_totales import calculadora_totales
 import secrets
 import string
 
@@ -16,11 +18,8 @@ class XMLGeneratorOfficial:
         """
         Generar XML de factura siguiendo formato oficial de Hacienda
         """
-        # Calcular totales automáticamente si no están definidos
-        resumen_calculado = self.calcular_resumen_oficial(factura)
-        
-        # Actualizar detalles con impuestos automáticos
-        detalles_completos = self.completar_detalles_linea(factura.detalles_servicio)
+        # Montos de las líneas y totales del resumen, calculados en Decimal
+        detalles_completos, resumen_calculado = self.calcular_totales(factura)
         
         # Generar firma digital simulada
         firma_digital = self.generar_firma_digital_simulada(factura.clave)
@@ -41,83 +40,17 @@ class XMLGeneratorOfficial:
         
         return xml
     
-    def calcular_resumen_oficial(self, factura: FacturaElectronica) -> dict:
+    def calcular_totales(self, factura: FacturaElectronica) -> Tuple[List[dict], dict]:
         """
-        Calcular resumen de factura siguiendo formato oficial
+        Líneas completas y resumen con los totales calculados de las líneas
         """
-        # Usar el resumen proporcionado como base
+        detalles, totales = calculadora_totales.calcular(
+            [detalle.model_dump() for detalle in factura.detalles_servicio or []],
+            factura.otros_cargos, factura.medio_pago
+        )
         resumen = factura.resumen_factura.model_dump()
-        
-        # Agregar campos obligatorios del formato oficial
-        if 'total_servicios_gravados' not in resumen:
-            resumen['total_servicios_gravados'] = resumen.get('total_venta', 0)
-        
-        if 'total_servicios_exentos' not in resumen:
-            resumen['total_servicios_exentos'] = 0.00000
-            
-        if 'total_servicios_exonerados' not in resumen:
-            resumen['total_servicios_exonerados'] = 0.00000
-            
-        if 'total_mercaderias_gravadas' not in resumen:
-            resumen['total_mercaderias_gravadas'] = 0.00000
-            
-        if 'total_mercaderias_exentas' not in resumen:
-            resumen['total_mercaderias_exentas'] = 0.00000
-            
-        if 'total_mercaderias_exoneradas' not in resumen:
-            resumen['total_mercaderias_exoneradas'] = 0.00000
-            
-        if 'total_gravado' not in resumen:
-            resumen['total_gravado'] = resumen.get('total_venta', 0)
-            
-        if 'total_exento' not in resumen:
-            resumen['total_exento'] = 0.00000
-            
-        if 'total_exonerado' not in resumen:
-            resumen['total_exonerado'] = 0.00000
-            
-        if 'total_iva_devuelto' not in resumen:
-            resumen['total_iva_devuelto'] = 0.00000
-            
-        if 'total_otros_cargos' not in resumen:
-            resumen['total_otros_cargos'] = 0.00000
-        
-        return resumen
-    
-    def completar_detalles_linea(self, detalles):
-        """
-        Completar detalles de línea con impuestos automáticos
-        """
-        detalles_completos = []
-        
-        for detalle in detalles:
-            detalle_dict = detalle.model_dump()
-            
-            # Agregar base imponible si no existe
-            if 'base_imponible' not in detalle_dict:
-                detalle_dict['base_imponible'] = detalle_dict.get('subtotal', detalle_dict.get('monto_total', 0))
-            
-            # Agregar impuestos automáticos (IVA 13%)
-            if 'impuestos' not in detalle_dict or not detalle_dict['impuestos']:
-                base_imponible = detalle_dict['base_imponible']
-                impuesto_monto = round(base_imponible * 0.13, 5)
-                
-                detalle_dict['impuestos'] = [{
-                    'codigo': '01',  # IVA
-                    'codigo_tarifa': '08',  # 13%
-                    'tarifa': 13.00,
-                    'monto': impuesto_monto
-                }]
-                
-                detalle_dict['impuesto_neto'] = impuesto_monto
-                
-                # Recalcular monto total línea
-                if detalle_dict['monto_total_linea'] == detalle_dict['subtotal']:
-                    detalle_dict['monto_total_linea'] = detalle_dict['subtotal'] + impuesto_monto
-            
-            detalles_completos.append(detalle_dict)
-        
-        return detalles_completos
+        resumen.update(totales)
+        return detalles, resumen
     
     def generar_firma_digital_simulada(self, clave: str) -> str:
         """
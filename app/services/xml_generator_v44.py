@@ -1,175 +1,633 @@
-from jinja2 import Template
+from lxml import etree
 from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+from enum import Enum
 from typing import Dict, Any, List
+from xml.sax.saxutils import escape
 import logging
-from app.core.reference_data import validar_ubicacion, validar_moneda, MONEDAS_OFICIALES
+import os
+from app.core.reference_data import validar_moneda, MONEDAS_OFICIALES
+from app.services.cache_emisores import cache_emisores
+from app.services.calculo_totales import IMPUESTO_EXENTO_V44, calculadora_totales
 
 logger = logging.getLogger(__name__)
 
+NS_BASE = "https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4"
+NS_FACTURA = f"{NS_BASE}/facturaElectronica"
+NS_XSI = "http://www.w3.org/2001/XMLSchema-instance"
+NS_DS = "http://www.w3.org/2000/09/xmldsig#"
+NS_XS = "{http://www.w3.org/2001/XMLSchema}"
+UBICACION_ESQUEMAS = "https://www.hacienda.go.cr/ATV/ComprobanteElectronico/docs/esquemas/2016/v4.4"
+RUTA_ESQUEMAS = "Referencias"
+DECLARACION_XML = '<?xml version="1.0" encoding="utf-8"?>'
+
+# Totales opcionales del resumen, en el orden del XSD (cada tipo escribe los que su esquema admite)
+TOTALES_RESUMEN_INICIALES = [
+    ('total_servicios_gravados', 'TotalServGravados'),
+    ('total_servicios_exentos', 'TotalServExentos'),
+    ('total_servicios_exonerados', 'TotalServExonerado'),
+    ('total_servicios_no_sujetos', 'TotalServNoSujeto'),
+    ('total_mercaderias_gravadas', 'TotalMercanciasGravadas'),
+    ('total_mercaderias_exentas', 'TotalMercanciasExentas'),
+    ('total_mercaderias_exoneradas', 'TotalMercExonerada'),
+    ('total_mercaderias_no_sujetas', 'TotalMercNoSujeta'),
+    ('total_gravado', 'TotalGravado'),
+    ('total_exento', 'TotalExento'),
+    ('total_exonerado', 'TotalExonerado'),
+    ('total_no_sujeto', 'TotalNoSujeto'),
+]
+TOTALES_RESUMEN_FINALES = [
+    ('total_impuesto', 'TotalImpuesto'),
+    ('total_impuesto_asumido_emisor_fabrica', 'TotalImpAsumEmisorFabrica'),
+    ('total_iva_devuelto', 'TotalIVADevuelto'),
+    ('total_otros_cargos', 'TotalOtrosCargos'),
+]
+
+# Elemento raíz del XSD que obliga a enviar cada campo de los datos
+CAMPOS_RAIZ = {
+    'CodigoActividadEmisor': 'codigo_actividad_emisor',
+    'CodigoActividadReceptor': 'codigo_actividad_receptor',
+    'Receptor': 'receptor',
+    'InformacionReferencia': 'informacion_referencia',
+}
+
+# Tipo de identificación del tercero de OtrosCargos según la longitud de la cédula
+TIPO_IDENTIFICACION_POR_LONGITUD = {9: '01', 10: '02', 11: '03', 12: '03'}
+
+# Consecutivo del MensajeReceptor según el mensaje: 1=Aceptado, 2=Aceptado parcial, 3=Rechazado
+TIPO_MENSAJE_RECEPTOR = {'1': '05', '2': '06', '3': '07'}
+
+DOS_DECIMALES = Decimal('0.01')
+
+
+def _texto(valor: Any) -> str:
+    """Texto de un elemento, escapado (&, <, >)"""
+    if valor is None:
+        return ''
+    if isinstance(valor, Enum):
+        valor = valor.value
+    return escape(valor if isinstance(valor, str) else str(valor))
+
+
+def _monto(valor: Any, decimales: int = 5) -> str:
+    """Monto con los decimales del XSD, redondeado en decimal (sin pasar por float)"""
+    if not isinstance(valor, Decimal):
+        valor = Decimal(str(valor))
+    return f"{valor:.{decimales}f}"
+
+
+def _fecha(valor: Any) -> str:
+    """xs:dateTime con el huso de Costa Rica si la fecha no trae uno"""
+    if isinstance(valor, datetime):
+        if valor.tzinfo is None:
+            return valor.strftime('%Y-%m-%dT%H:%M:%S-06:00')
+        return valor.isoformat(timespec='seconds')
+    return _texto(valor)
+
+
+def _elemento(etiqueta: str, valor: Any) -> str:
+    return f"<{etiqueta}>{_texto(valor)}</{etiqueta}>"
+
+
+def _estructura_xsd(ruta: str) -> Dict[str, Dict[str, bool]]:
+    """
+    Elementos que admite cada bloque de un XSD v4.4: {bloque: {elemento: obligatorio}}
+
+    Los bloques son 'raiz' (la secuencia del elemento raíz), los complexType con
+    nombre (EmisorType, ImpuestoType...) y los elementos con tipo anónimo
+    (LineaDetalle, ResumenFactura, InformacionReferencia...).
+    """
+    esquema = etree.parse(ruta).getroot()
+
+    def hijos(nodo, destino: Dict[str, bool]) -> Dict[str, bool]:
+        for hijo in nodo:
+            if hijo.tag == f'{NS_XS}element':
+                nombre = hijo.get('name') or hijo.get('ref').split(':')[-1]
+                destino.setdefault(nombre, hijo.get('minOccurs') != '0')
+            elif hijo.tag in (f'{NS_XS}sequence', f'{NS_XS}choice', f'{NS_XS}complexType'):
+                hijos(hijo, destino)
+        return destino
+
+    estructura = {'raiz': hijos(esquema.find(f'{NS_XS}element/{NS_XS}complexType'), {})}
+    for tipo in esquema.findall(f'{NS_XS}complexType'):
+        estructura[tipo.get('name')] = hijos(tipo, {})
+    for elemento in esquema.iter(f'{NS_XS}element'):
+        anonimo = elemento.find(f'{NS_XS}complexType')
+        if anonimo is not None and elemento.get('name') not in estructura:
+            estructura[elemento.get('name')] = hijos(anonimo, {})
+    return estructura
+
+
+class TipoComprobanteV44:
+    """
+    Un tipo de comprobante v4.4: código, elemento raíz, namespace y XSD.
+
+    Los elementos que admite cada bloque compartido (Emisor, Receptor,
+    LineaDetalle, Impuesto, ResumenFactura, InformacionReferencia) se leen de
+    su XSD la primera vez que se usa y quedan compilados junto con la etiqueta
+    de apertura y la lista de totales del resumen; el escritor es el mismo para
+    todos los tipos y sólo consulta esos conjuntos.
+    """
+
+    def __init__(self, codigo: str, raiz: str, namespace: str, xsd: str, nombre: str,
+                 emite_receptor: bool = False):
+        self.codigo = codigo
+        self.raiz = raiz
+        self.namespace = f"{NS_BASE}/{namespace}"
+        self.xsd = os.path.join(RUTA_ESQUEMAS, xsd)
+        self.nombre = nombre
+        # FacturaElectronicaCompra la emite el comprador (el Receptor del XML)
+        self.emite_receptor = emite_receptor
+        self._compilado = False
+
+    def compilar(self) -> 'TipoComprobanteV44':
+        """Leer el XSD y precalcular lo que el escritor necesita (una sola vez)"""
+        if self._compilado:
+            return self
+        estructura = _estructura_xsd(self.xsd)
+        self.elementos = estructura['raiz']
+        self.emisor = estructura.get('EmisorType', {})
+        self.receptor = estructura.get('ReceptorType', {})
+        self.linea = estructura.get('LineaDetalle', {})
+        self.impuesto = estructura.get('ImpuestoType', {})
+        self.resumen = estructura.get('ResumenFactura', {})
+        self.referencia = estructura.get('InformacionReferencia', {})
+        self.inicio = (
+            f'<{self.raiz} xmlns="{self.namespace}" '
+            f'xsi:schemaLocation="{self.namespace} {UBICACION_ESQUEMAS}/{self.raiz}_V4.4.xsd" '
+            f'xmlns:xsi="{NS_XSI}" xmlns:ds="{NS_DS}">'
+        )
+        self.cierre = f'</{self.raiz}>'
+        self.totales_iniciales = [(c, e) for c, e in TOTALES_RESUMEN_INICIALES if e in self.resumen]
+        self.totales_finales = [(c, e) for c, e in TOTALES_RESUMEN_FINALES if e in self.resumen]
+        self.campos_obligatorios = [campo for elemento, campo in CAMPOS_RAIZ.items()
+                                    if self.elementos.get(elemento)]
+        self._compilado = True
+        return self
+
+
+# Comprobantes v4.4 por código de tipo de documento (el que va en el consecutivo y la clave)
+TIPOS_V44 = {
+    '01': TipoComprobanteV44('01', 'FacturaElectronica', 'facturaElectronica',
+                             'Factura/FacturaElectronica_V4.4.xsd.xml', 'Factura electrónica'),
+    '02': TipoComprobanteV44('02', 'NotaDebitoElectronica', 'notaDebitoElectronica',
+                             'Nota de Debito/NotaDebitoElectronica_V4.4.xsd.xml', 'Nota de débito electrónica'),
+    '03': TipoComprobanteV44('03', 'NotaCreditoElectronica', 'notaCreditoElectronica',
+                             'Nota de Credito/NotaCreditoElectronica_V4.4.xsd.xml', 'Nota de crédito electrónica'),
+    '04': TipoComprobanteV44('04', 'TiqueteElectronico', 'tiqueteElectronico',
+                             'TiqueteElectronico/TiqueteElectronico_V4.4.xsd.xml', 'Tiquete electrónico'),
+    '08': TipoComprobanteV44('08', 'FacturaElectronicaCompra', 'facturaElectronicaCompra',
+                             'FEDeCompra/FacturaElectronicaCompra_V4.4.xsd.xml', 'Factura electrónica de compra',
+                             emite_receptor=True),
+    '09': TipoComprobanteV44('09', 'FacturaElectronicaExportacion', 'facturaElectronicaExportacion',
+                             'FEExport/FEExportacion.xml', 'Factura electrónica de exportación'),
+    '10': TipoComprobanteV44('10', 'ReciboElectronicoPago', 'reciboElectronicoPago',
+                             'ReciboDePAgo/ReciboElectronicoPago_V4.4.xsd.xml', 'Recibo electrónico de pago'),
+}
+# Respuesta del receptor a un comprobante recibido (consecutivo 05, 06 o 07 según el mensaje)
+MENSAJE_RECEPTOR_V44 = TipoComprobanteV44('05', 'MensajeReceptor', 'mensajeReceptor',
+                                          'MensajeReceptor/MensajeReceptor_V4.4.xsd.xml', 'Mensaje receptor')
+
+
+def tipo_comprobante(codigo: str) -> TipoComprobanteV44:
+    """Tipo v4.4 compilado a partir de su código de documento"""
+    try:
+        return TIPOS_V44[codigo].compilar()
+    except KeyError:
+        raise ValueError(f"Tipo de comprobante v4.4 no soportado: {codigo}")
+
+
 class XMLGeneratorV44:
     """
     Generador XML oficial para Facturación Electrónica v4.4 del Ministerio de Hacienda de Costa Rica
-    Basado en el XSD oficial FacturaElectronica_V4.4.xsd.xml
+    Basado en los XSD oficiales de Referencias/: un solo escritor para todos los
+    tipos de comprobante (ver TIPOS_V44) más el MensajeReceptor.
     """
     
-    def __init__(self):
-        # Template compacto sin espacios siguiendo el formato oficial
-        self.factura_template = Template("""<?xml version="1.0" encoding="utf-8"?><FacturaElectronica xmlns="https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronica" xsi:schemaLocation="https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronica https://www.hacienda.go.cr/ATV/ComprobanteElectronico/docs/esquemas/2016/v4.4/FacturaElectronica_V4.4.xsd" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:ds="http://www.w3.org/2000/09/xmldsig#"><Clave>{{ clave }}</Clave><ProveedorSistemas>{{ proveedor_sistemas }}</ProveedorSistemas><CodigoActividadEmisor>{{ codigo_actividad_emisor }}</CodigoActividadEmisor>{% if codigo_actividad_receptor %}<CodigoActividadReceptor>{{ codigo_actividad_receptor }}</CodigoActividadReceptor>{% endif %}<NumeroConsecutivo>{{ numero_consecutivo }}</NumeroConsecutivo><FechaEmision>{{ fecha_emision }}</FechaEmision><Emisor><Nombre>{{ emisor.nombre }}</Nombre><Identificacion><Tipo>{{ emisor.identificacion_tipo }}</Tipo><Numero>{{ emisor.identificacion_numero }}</Numero></Identificacion>{% if emisor.nombre_comercial %}<NombreComercial>{{ emisor.nombre_comercial }}</NombreComercial>{% endif %}<Ubicacion><Provincia>{{ emisor.ubicacion.provincia }}</Provincia><Canton>{{ emisor.ubicacion.canton }}</Canton><Distrito>{{ emisor.ubicacion.distrito }}</Distrito>{% if emisor.ubicacion.barrio %}<Barrio>{{ emisor.ubicacion.barrio }}</Barrio>{% endif %}{% if emisor.ubicacion.otras_senas %}<OtrasSenas>{{ emisor.ubicacion.otras_senas }}</OtrasSenas>{% endif %}</Ubicacion>{% if emisor.telefono %}<Telefono><CodigoPais>{{ emisor.telefono.codigo_pais }}</CodigoPais><NumTelefono>{{ emisor.telefono.numero }}</NumTelefono></Telefono>{% endif %}<CorreoElectronico>{{ emisor.correo_electronico }}</CorreoElectronico></Emisor>{% if receptor %}<Receptor><Nombre>{{ receptor.nombre }}</Nombre>{% if receptor.identificacion_tipo and receptor.identificacion_numero %}<Identificacion><Tipo>{{ receptor.identificacion_tipo }}</Tipo><Numero>{{ receptor.identificacion_numero }}</Numero></Identificacion>{% endif %}{% if receptor.correo_electronico %}<CorreoElectronico>{{ receptor.correo_electronico }}</CorreoElectronico>{% endif %}</Receptor>{% endif %}<CondicionVenta>{{ condicion_venta }}</CondicionVenta>{% if condicion_venta_otros %}<CondicionVentaOtros>{{ condicion_venta_otros }}</CondicionVentaOtros>{% endif %}{% if plazo_credito %}<PlazoCredito>{{ plazo_credito }}</PlazoCredito>{% endif %}{% for medio in medio_pago %}<MedioPago>{{ medio }}</MedioPago>{% endfor %}<DetalleServicio>{% for detalle in detalles_servicio %}<LineaDetalle><NumeroLinea>{{ detalle.numero_linea }}</NumeroLinea><CodigoCABYS>{{ detalle.codigo_cabys }}</CodigoCABYS>{% if detalle.codigo_comercial %}<CodigoComercial><Tipo>{{ detalle.codigo_comercial.tipo or '01' }}</Tipo><Codigo>{{ detalle.codigo_comercial.codigo }}</Codigo></CodigoComercial>{% endif %}<Cantidad>{{ "%.3f"|format(detalle.cantidad) }}</Cantidad><UnidadMedida>{{ detalle.unidad_medida }}</UnidadMedida>{% if detalle.tipo_transaccion %}<TipoTransaccion>{{ detalle.tipo_transaccion }}</TipoTransaccion>{% endif %}{% if detalle.unidad_medida_comercial %}<UnidadMedidaComercial>{{ detalle.unidad_medida_comercial }}</UnidadMedidaComercial>{% endif %}<Detalle>{{ detalle.detalle }}</Detalle>{% if detalle.numero_vin_serie %}{% for numero in detalle.numero_vin_serie %}<NumeroVINoSerie>{{ numero }}</NumeroVINoSerie>{% endfor %}{% endif %}{% if detalle.registro_medicamento %}<RegistroMedicamento>{{ detalle.registro_medicamento }}</RegistroMedicamento>{% endif %}{% if detalle.forma_farmaceutica %}<FormaFarmaceutica>{{ detalle.forma_farmaceutica }}</FormaFarmaceutica>{% endif %}<PrecioUnitario>{{ "%.5f"|format(detalle.precio_unitario) }}</PrecioUnitario><MontoTotal>{{ "%.5f"|format(detalle.monto_total) }}</MontoTotal>{% if detalle.descuentos %}{% for descuento in detalle.descuentos %}<Descuento><MontoDescuento>{{ "%.5f"|format(descuento.monto) }}</MontoDescuento><NaturalezaDescuento>{{ descuento.naturaleza or "01" }}</NaturalezaDescuento>{% if descuento.codigo %}<CodigoDescuento>{{ descuento.codigo }}</CodigoDescuento>{% endif %}{% if descuento.otros and descuento.codigo == "99" %}<DescuentoOtros>{{ descuento.otros }}</DescuentoOtros>{% endif %}</Descuento>{% endfor %}{% endif %}<SubTotal>{{ "%.5f"|format(detalle.subtotal) }}</SubTotal>{% if detalle.impuestos %}{% for impuesto in detalle.impuestos %}<Impuesto><Codigo>{{ impuesto.codigo }}</Codigo><CodigoTarifa>{{ impuesto.codigo_tarifa }}</CodigoTarifa><Tarifa>{{ "%.2f"|format(impuesto.tarifa) }}</Tarifa><Monto>{{ "%.5f"|format(impuesto.monto) }}</Monto>{% if impuesto.exoneracion %}<Exoneracion><TipoDocumento>{{ impuesto.exoneracion.tipo_documento }}</TipoDocumento><NumeroDocumento>{{ impuesto.exoneracion.numero_documento }}</NumeroDocumento><NombreInstitucion>{{ impuesto.exoneracion.nombre_institucion }}</NombreInstitucion><FechaEmision>{{ impuesto.exoneracion.fecha_emision }}</FechaEmision><PorcentajeExoneracion>{{ impuesto.exoneracion.porcentaje_exoneracion }}</PorcentajeExoneracion><MontoExoneracion>{{ "%.5f"|format(impuesto.exoneracion.monto_exoneracion) }}</MontoExoneracion></Exoneracion>{% endif %}</Impuesto>{% endfor %}<ImpuestoNeto>{{ "%.5f"|format(detalle.impuesto_neto) }}</ImpuestoNeto>{% endif %}<MontoTotalLinea>{{ "%.5f"|format(detalle.monto_total_linea) }}</MontoTotalLinea></LineaDetalle>{% endfor %}</DetalleServicio>{% if otros_cargos %}<OtrosCargos>{% for cargo in otros_cargos %}<TipoDocumento>{{ cargo.tipo_documento }}</TipoDocumento><NumeroIdentidadTercero>{{ cargo.numero_identidad_tercero }}</NumeroIdentidadTercero><NombreTercero>{{ cargo.nombre_tercero }}</NombreTercero><Detalle>{{ cargo.detalle }}</Detalle><Porcentaje>{{ cargo.porcentaje }}</Porcentaje><MontoCargo>{{ "%.5f"|format(cargo.monto_cargo) }}</MontoCargo>{% endfor %}</OtrosCargos>{% endif %}<ResumenFactura><CodigoTipoMoneda><CodigoMoneda>{{ resumen.codigo_tipo_moneda }}</CodigoMoneda><TipoCambio>{{ "%.5f"|format(resumen.tipo_cambio) }}</TipoCambio></CodigoTipoMoneda>{% if resumen.total_servicios_gravados is defined %}<TotalServGravados>{{ "%.5f"|format(resumen.total_servicios_gravados) }}</TotalServGravados>{% endif %}{% if resumen.total_servicios_exentos is defined %}<TotalServExentos>{{ "%.5f"|format(resumen.total_servicios_exentos) }}</TotalServExentos>{% endif %}{% if resumen.total_servicios_exonerados is defined %}<TotalServExonerado>{{ "%.5f"|format(resumen.total_servicios_exonerados) }}</TotalServExonerado>{% endif %}{% if resumen.total_mercaderias_gravadas is defined %}<TotalMercanciasGravadas>{{ "%.5f"|format(resumen.total_mercaderias_gravadas) }}</TotalMercanciasGravadas>{% endif %}{% if resumen.total_mercaderias_exentas is defined %}<TotalMercanciasExentas>{{ "%.5f"|format(resumen.total_mercaderias_exentas) }}</TotalMercanciasExentas>{% endif %}{% if resumen.total_mercaderias_exoneradas is defined %}<TotalMercExonerada>{{ "%.5f"|format(resumen.total_mercaderias_exoneradas) }}</TotalMercExonerada>{% endif %}{% if resumen.total_gravado is defined %}<TotalGravado>{{ "%.5f"|format(resumen.total_gravado) }}</TotalGravado>{% endif %}{% if resumen.total_exento is defined %}<TotalExento>{{ "%.5f"|format(resumen.total_exento) }}</TotalExento>{% endif %}{% if resumen.total_exonerado is defined %}<TotalExonerado>{{ "%.5f"|format(resumen.total_exonerado) }}</TotalExonerado>{% endif %}<TotalVenta>{{ "%.5f"|format(resumen.total_venta) }}</TotalVenta>{% if resumen.total_descuentos is defined %}<TotalDescuentos>{{ "%.5f"|format(resumen.total_descuentos) }}</TotalDescuentos>{% endif %}<TotalVentaNeta>{{ "%.5f"|format(resumen.total_venta_neta) }}</TotalVentaNeta>{% if resumen.total_impuesto is defined %}<TotalImpuesto>{{ "%.5f"|format(resumen.total_impuesto) }}</TotalImpuesto>{% endif %}{% if resumen.total_iva_devuelto is defined %}<TotalIVADevuelto>{{ "%.5f"|format(resumen.total_iva_devuelto) }}</TotalIVADevuelto>{% endif %}{% if resumen.total_otros_cargos is defined %}<TotalOtrosCargos>{{ "%.5f"|format(resumen.total_otros_cargos) }}</TotalOtrosCargos>{% endif %}<TotalComprobante>{{ "%.5f"|format(resumen.total_comprobante) }}</TotalComprobante></ResumenFactura>{% if informacion_referencia %}<InformacionReferencia>{% for ref in informacion_referencia %}<TipoDoc>{{ ref.tipo_doc }}</TipoDoc><Numero>{{ ref.numero }}</Numero><FechaEmision>{{ ref.fecha_emision }}</FechaEmision><Codigo>{{ ref.codigo }}</Codigo><Razon>{{ ref.razon }}</Razon>{% endfor %}</InformacionReferencia>{% endif %}{{ firma_digital }}</FacturaElectronica>""")
-    
     def generar_xml_factura(self, data: Dict[str, Any]) -> str:
         """
         Generar XML de factura siguiendo especificación oficial v4.4
         
         Args:
             data: Diccionario con todos los datos de la factura
-            
+        
         Returns:
             str: XML de factura en formato oficial v4.4
         """
+        return self.generar_xml(data, '01')
+    
+    def generar_xml(self, data: Dict[str, Any], tipo: str = '01') -> str:
+        """
+        Generar el XML v4.4 de cualquier tipo de comprobante
+        
+        Args:
+            data: Diccionario con los datos del comprobante
+            tipo: Código del tipo de documento (01, 02, 03, 04, 08, 09, 10)
+        """
+        return self.generar_xml_preparado(self.preparar_datos(data, tipo), tipo)
+    
+    def preparar_datos(self, data: Dict[str, Any], tipo: str = '01') -> Dict[str, Any]:
+        """
+        Validar los campos obligatorios y completar los datos del XML
+        
+        Los montos de las líneas y los totales del resumen quedan calculados
+        (CalculadoraTotales); quien guarda el documento puede usarlos para que
+        lo guardado cuadre con el XML.
+        """
         try:
-            # Validar campos obligatorios
-            self._validar_campos_obligatorios(data)
-            
-            # Procesar y completar datos
-            data_procesada = self._procesar_datos(data)
-            
-            # Generar XML
-            xml = self.factura_template.render(**data_procesada)
-            
-            logger.info(f"XML v4.4 generado exitosamente para clave: {data_procesada.get('clave', 'N/A')}")
-            return xml
+            self._validar_campos_obligatorios(data, tipo_comprobante(tipo))
+            return self._procesar_datos(data)
+        except Exception as e:
+            logger.error(f"Error generando XML v4.4: {e}")
+            raise
+    
+    def generar_xml_preparado(self, data_procesada: Dict[str, Any], tipo: str = '01') -> str:
+        """XML v4.4 a partir del resultado de preparar_datos"""
+        return DECLARACION_XML + self._escribir(data_procesada, tipo_comprobante(tipo))
+    
+    def construir_factura(self, data: Dict[str, Any], tipo: str = '01') -> etree._Element:
+        """
+        Generar el comprobante v4.4 como árbol lxml
+        
+        El documento se escribe una vez y libxml2 lo convierte en árbol; las
+        etapas siguientes (validación XSD, firma) usan ese árbol sin volver a
+        parsear el texto. `serializar` devuelve el XML final.
+        
+        Returns:
+            etree._Element: Elemento raíz del comprobante
+        """
+        comprobante = tipo_comprobante(tipo)
+        return etree.fromstring(self._escribir(self.preparar_datos(data, tipo), comprobante).encode('utf-8'))
+    
+    @staticmethod
+    def serializar(raiz: etree._Element) -> str:
+        """Texto XML del comprobante con la declaración utf-8"""
+        return DECLARACION_XML + etree.tostring(raiz, encoding='unicode')
+    
+    def generar_xml_mensaje_receptor(self, data: Dict[str, Any]) -> str:
+        """
+        MensajeReceptor v4.4: aceptación o rechazo de un comprobante recibido
+        
+        Args:
+            data: clave, numero_cedula_emisor, fecha_emision_doc, mensaje (1, 2 o 3),
+                total_factura, numero_cedula_receptor, numero_consecutivo_receptor y
+                los opcionales del XSD (detalle_mensaje, montos de impuesto, codigo_actividad...)
+        """
+        tipo = MENSAJE_RECEPTOR_V44.compilar()
+        for campo in ('clave', 'numero_cedula_emisor', 'fecha_emision_doc', 'mensaje', 'total_factura',
+                      'numero_cedula_receptor', 'numero_consecutivo_receptor'):
+            if data.get(campo) is None:
+                raise ValueError(f"Campo obligatorio faltante: {campo}")
+        
+        partes = [DECLARACION_XML, tipo.inicio]
+        agregar = partes.append
+        agregar(_elemento('Clave', data['clave']))
+        agregar(_elemento('NumeroCedulaEmisor', data['numero_cedula_emisor']))
+        agregar(f"<FechaEmisionDoc>{_fecha(data['fecha_emision_doc'])}</FechaEmisionDoc>")
+        agregar(_elemento('Mensaje', data['mensaje']))
+        if data.get('detalle_mensaje'):
+            agregar(_elemento('DetalleMensaje', data['detalle_mensaje']))
+        if data.get('monto_total_impuesto') is not None:
+            agregar(f"<MontoTotalImpuesto>{_monto(data['monto_total_impuesto'])}</MontoTotalImpuesto>")
+        if data.get('codigo_actividad'):
+            agregar(_elemento('CodigoActividad', data['codigo_actividad']))
+        if data.get('condicion_impuesto'):
+            agregar(_elemento('CondicionImpuesto', data['condicion_impuesto']))
+        if data.get('monto_total_impuesto_acreditar') is not None:
+            agregar(f"<MontoTotalImpuestoAcreditar>{_monto(data['monto_total_impuesto_acreditar'])}"
+                    f"</MontoTotalImpuestoAcreditar>")
+        if data.get('monto_total_de_gasto_aplicable') is not None:
+            agregar(f"<MontoTotalDeGastoAplicable>{_monto(data['monto_total_de_gasto_aplicable'])}"
+                    f"</MontoTotalDeGastoAplicable>")
+        agregar(f"<TotalFactura>{_monto(data['total_factura'])}</TotalFactura>")
+        agregar(_elemento('NumeroCedulaReceptor', data['numero_cedula_receptor']))
+        agregar(_elemento('NumeroConsecutivoReceptor', data['numero_consecutivo_receptor']))
+        agregar(tipo.cierre)
+        
+        logger.info(f"MensajeReceptor v4.4 generado para clave: {data['clave']}")
+        return ''.join(partes)
+    
+    def _escribir(self, data_procesada: Dict[str, Any], tipo: TipoComprobanteV44) -> str:
+        """Escribir el documento ya preparado (sin la declaración XML ni la firma, que agrega el firmador)"""
+        try:
+            partes = [tipo.inicio]
+            self._escribir_comprobante(partes, data_procesada, tipo)
+            partes.append(tipo.cierre)
             
+            logger.info(f"XML v4.4 ({tipo.raiz}) generado exitosamente para clave: {data_procesada.get('clave', 'N/A')}")
+            return ''.join(partes)
+        
         except Exception as e:
             logger.error(f"Error generando XML v4.4: {e}")
             raise
     
-    def _validar_campos_obligatorios(self, data: Dict[str, Any]) -> None:
-        """Validar que todos los campos obligatorios estén presentes"""
+    def _escribir_comprobante(self, partes: List[str], datos: Dict[str, Any], tipo: TipoComprobanteV44) -> None:
+        """Elementos del comprobante en el orden del XSD v4.4; todo texto pasa por _texto o _monto"""
+        agregar = partes.append
+        elementos = tipo.elementos
+        agregar(_elemento('Clave', datos['clave']))
+        agregar(_elemento('ProveedorSistemas', datos['proveedor_sistemas']))
+        if 'CodigoActividadEmisor' in elementos and datos.get('codigo_actividad_emisor'):
+            agregar(_elemento('CodigoActividadEmisor', datos['codigo_actividad_emisor']))
+        if 'CodigoActividadReceptor' in elementos and datos.get('codigo_actividad_receptor'):
+            agregar(_elemento('CodigoActividadReceptor', datos['codigo_actividad_receptor']))
+        agregar(_elemento('NumeroConsecutivo', datos['numero_consecutivo']))
+        agregar(_elemento('FechaEmision', datos['fecha_emision']))
+        
+        # El bloque <Emisor> sale ya escrito de la caché de emisores (uno por tipo de comprobante)
+        perfil = datos.get('perfil_emisor') or cache_emisores.perfil(datos['emisor'])
+        emisor = perfil.fragmentos.get(tipo.raiz)
+        if emisor is None:
+            bloque = []
+            self._escribir_emisor(bloque, perfil.datos, tipo.emisor)
+            emisor = perfil.fragmentos[tipo.raiz] = ''.join(bloque)
+        agregar(emisor)
+        if datos.get('receptor'):
+            self._escribir_receptor(partes, datos['receptor'], tipo.receptor)
+        
+        agregar(_elemento('CondicionVenta', datos['condicion_venta']))
+        if 'CondicionVentaOtros' in elementos and datos.get('condicion_venta_otros'):
+            agregar(_elemento('CondicionVentaOtros', datos['condicion_venta_otros']))
+        if 'PlazoCredito' in elementos and datos.get('plazo_credito'):
+            agregar(_elemento('PlazoCredito', datos['plazo_credito']))
+        
+        agregar('<DetalleServicio>')
+        linea, impuesto = tipo.linea, tipo.impuesto
+        for detalle in datos['detalles_servicio']:
+            self._escribir_linea(partes, detalle, linea, impuesto)
+        agregar('</DetalleServicio>')
+        
+        if 'OtrosCargos' in elementos:
+            for cargo in datos.get('otros_cargos') or []:
+                self._escribir_otro_cargo(partes, cargo)
+        
+        self._escribir_resumen(partes, datos['resumen'], datos['medio_pago'], tipo)
+        
+        if 'InformacionReferencia' in elementos:
+            for referencia in datos.get('informacion_referencia') or []:
+                self._escribir_referencia(partes, referencia, tipo.referencia)
+        
+        if 'Otros' in elementos and datos.get('otros'):
+            otros = datos['otros']
+            agregar('<Otros>')
+            for texto in [otros] if isinstance(otros, str) else otros:
+                agregar(_elemento('OtroTexto', texto))
+            agregar('</Otros>')
+    
+    @staticmethod
+    def _escribir_identificacion(partes: List[str], tipo_identificacion: Any, numero: Any,
+                                 etiqueta: str = 'Identificacion') -> None:
+        partes.append(f"<{etiqueta}>{_elemento('Tipo', tipo_identificacion)}"
+                      f"{_elemento('Numero', numero)}</{etiqueta}>")
+    
+    @staticmethod
+    def _escribir_ubicacion(partes: List[str], ubicacion: Dict[str, Any]) -> None:
+        """Ubicacion con los códigos como los pide el XSD: provincia de un dígito, cantón y distrito de dos"""
+        provincia = _texto(ubicacion['provincia'])
+        agregar = partes.append
+        agregar(f"<Ubicacion><Provincia>{provincia.lstrip('0') or provincia}</Provincia>"
+                f"<Canton>{_texto(ubicacion['canton']).zfill(2)}</Canton>"
+                f"<Distrito>{_texto(ubicacion['distrito']).zfill(2)}</Distrito>")
+        if ubicacion.get('barrio'):
+            agregar(_elemento('Barrio', ubicacion['barrio']))
+        if ubicacion.get('otras_senas'):
+            agregar(_elemento('OtrasSenas', ubicacion['otras_senas']))
+        agregar('</Ubicacion>')
+    
+    @staticmethod
+    def _escribir_telefono(partes: List[str], telefono: Dict[str, Any]) -> None:
+        partes.append(f"<Telefono>{_elemento('CodigoPais', telefono['codigo_pais'])}"
+                      f"{_elemento('NumTelefono', telefono['numero'])}</Telefono>")
+    
+    @classmethod
+    def _escribir_emisor(cls, partes: List[str], emisor: Dict[str, Any], admite: Dict[str, bool]) -> None:
+        agregar = partes.append
+        agregar('<Emisor>')
+        agregar(_elemento('Nombre', emisor['nombre']))
+        cls._escribir_identificacion(partes, emisor['identificacion_tipo'], emisor['identificacion_numero'])
+        if 'NombreComercial' in admite and emisor.get('nombre_comercial'):
+            agregar(_elemento('NombreComercial', emisor['nombre_comercial']))
+        if 'Ubicacion' in admite and emisor.get('ubicacion'):
+            cls._escribir_ubicacion(partes, emisor['ubicacion'])
+        if 'OtrasSenasExtranjero' in admite and emisor.get('otras_senas_extranjero'):
+            agregar(_elemento('OtrasSenasExtranjero', emisor['otras_senas_extranjero']))
+        if 'Telefono' in admite and emisor.get('telefono'):
+            cls._escribir_telefono(partes, emisor['telefono'])
+        if emisor.get('correo_electronico'):
+            agregar(_elemento('CorreoElectronico', emisor['correo_electronico']))
+        agregar('</Emisor>')
+    
+    @classmethod
+    def _escribir_receptor(cls, partes: List[str], receptor: Dict[str, Any], admite: Dict[str, bool]) -> None:
+        agregar = partes.append
+        agregar('<Receptor>')
+        agregar(_elemento('Nombre', receptor['nombre']))
+        if receptor.get('identificacion_tipo') and receptor.get('identificacion_numero'):
+            cls._escribir_identificacion(partes, receptor['identificacion_tipo'], receptor['identificacion_numero'])
+        if 'NombreComercial' in admite and receptor.get('nombre_comercial'):
+            agregar(_elemento('NombreComercial', receptor['nombre_comercial']))
+        if 'Ubicacion' in admite and receptor.get('ubicacion'):
+            cls._escribir_ubicacion(partes, receptor['ubicacion'])
+        if 'OtrasSenasExtranjero' in admite and receptor.get('otras_senas_extranjero'):
+            agregar(_elemento('OtrasSenasExtranjero', receptor['otras_senas_extranjero']))
+        if 'Telefono' in admite and receptor.get('telefono'):
+            cls._escribir_telefono(partes, receptor['telefono'])
+        if receptor.get('correo_electronico'):
+            agregar(_elemento('CorreoElectronico', receptor['correo_electronico']))
+        agregar('</Receptor>')
+    
+    @staticmethod
+    def _escribir_linea(partes: List[str], detalle: Dict[str, Any], admite: Dict[str, bool],
+                        admite_impuesto: Dict[str, bool]) -> None:
+        agregar = partes.append
+        agregar(f"<LineaDetalle><NumeroLinea>{_texto(detalle['numero_linea'])}</NumeroLinea>")
+        if 'PartidaArancelaria' in admite and detalle.get('partida_arancelaria'):
+            agregar(_elemento('PartidaArancelaria', detalle['partida_arancelaria']))
+        if 'CodigoCABYS' in admite:
+            agregar(f"<CodigoCABYS>{_texto(detalle['codigo_cabys'])}</CodigoCABYS>")
+            codigo_comercial = detalle.get('codigo_comercial')
+            if codigo_comercial:
+                agregar(f"<CodigoComercial>{_elemento('Tipo', codigo_comercial.get('tipo') or '01')}"
+                        f"{_elemento('Codigo', codigo_comercial.get('codigo'))}</CodigoComercial>")
+            agregar(f"<Cantidad>{_monto(detalle['cantidad'], 3)}</Cantidad>"
+                    f"<UnidadMedida>{_texto(detalle['unidad_medida'])}</UnidadMedida>")
+            if 'TipoTransaccion' in admite and detalle.get('tipo_transaccion'):
+                agregar(_elemento('TipoTransaccion', detalle['tipo_transaccion']))
+            if 'UnidadMedidaComercial' in admite and detalle.get('unidad_medida_comercial'):
+                agregar(_elemento('UnidadMedidaComercial', detalle['unidad_medida_comercial']))
+        agregar(_elemento('Detalle', detalle['detalle']))
+        if 'NumeroVINoSerie' in admite:
+            for numero in detalle.get('numero_vin_serie') or []:
+                agregar(_elemento('NumeroVINoSerie', numero))
+        if 'RegistroMedicamento' in admite and detalle.get('registro_medicamento'):
+            agregar(_elemento('RegistroMedicamento', detalle['registro_medicamento']))
+        if 'FormaFarmaceutica' in admite and detalle.get('forma_farmaceutica'):
+            agregar(_elemento('FormaFarmaceutica', detalle['forma_farmaceutica']))
+        if 'PrecioUnitario' in admite:
+            agregar(f"<PrecioUnitario>{_monto(detalle['precio_unitario'])}</PrecioUnitario>")
+        agregar(f"<MontoTotal>{_monto(detalle['monto_total'])}</MontoTotal>")
+        if 'Descuento' in admite:
+            for descuento in detalle.get('descuentos') or []:
+                codigo = descuento.get('codigo') or '99'
+                agregar(f"<Descuento><MontoDescuento>{_monto(descuento['monto'])}</MontoDescuento>"
+                        f"<CodigoDescuento>{_texto(codigo)}</CodigoDescuento>")
+                if codigo == '99' and (descuento.get('otros') or descuento.get('naturaleza')):
+                    agregar(_elemento('CodigoDescuentoOTRO', descuento.get('otros') or descuento['naturaleza']))
+                if descuento.get('naturaleza'):
+                    agregar(_elemento('NaturalezaDescuento', descuento['naturaleza']))
+                agregar('</Descuento>')
+        agregar(f"<SubTotal>{_monto(detalle['subtotal'])}</SubTotal>")
+        if 'IVACobradoFabrica' in admite and detalle.get('iva_cobrado_fabrica'):
+            agregar(_elemento('IVACobradoFabrica', detalle['iva_cobrado_fabrica']))
+        if 'BaseImponible' in admite:
+            base = detalle.get('base_imponible')
+            agregar(f"<BaseImponible>{_monto(detalle['subtotal'] if base is None else base)}</BaseImponible>")
+        for impuesto in detalle.get('impuestos') or []:
+            agregar(f"<Impuesto>{_elemento('Codigo', impuesto['codigo'])}")
+            if impuesto.get('codigo_impuesto_otro'):
+                agregar(_elemento('CodigoImpuestoOTRO', impuesto['codigo_impuesto_otro']))
+            if impuesto.get('codigo_tarifa'):
+                agregar(_elemento('CodigoTarifaIVA', impuesto['codigo_tarifa']))
+            agregar(f"<Tarifa>{_monto(impuesto['tarifa'], 2)}</Tarifa><Monto>{_monto(impuesto['monto'])}</Monto>")
+            if 'MontoExportacion' in admite_impuesto and impuesto.get('monto_exportacion') is not None:
+                agregar(f"<MontoExportacion>{_monto(impuesto['monto_exportacion'])}</MontoExportacion>")
+            exoneracion = impuesto.get('exoneracion')
+            if exoneracion and 'Exoneracion' in admite_impuesto:
+                # TarifaExonerada: puntos de la tarifa que se exoneran (no el porcentaje)
+                tarifa_exonerada = exoneracion.get('tarifa_exonerada')
+                if tarifa_exonerada is None:
+                    tarifa_exonerada = (Decimal(str(impuesto['tarifa'])) * Decimal(str(exoneracion['porcentaje_exoneracion']))
+                                        / 100).quantize(DOS_DECIMALES, ROUND_HALF_UP)
+                agregar(f"<Exoneracion>{_elemento('TipoDocumentoEX1', exoneracion['tipo_documento'])}")
+                if exoneracion.get('tipo_documento_otro'):
+                    agregar(_elemento('TipoDocumentoOTRO', exoneracion['tipo_documento_otro']))
+                agregar(_elemento('NumeroDocumento', exoneracion['numero_documento']))
+                if exoneracion.get('articulo'):
+                    agregar(_elemento('Articulo', exoneracion['articulo']))
+                if exoneracion.get('inciso'):
+                    agregar(_elemento('Inciso', exoneracion['inciso']))
+                agregar(_elemento('NombreInstitucion', exoneracion['nombre_institucion']))
+                if exoneracion.get('nombre_institucion_otros'):
+                    agregar(_elemento('NombreInstitucionOtros', exoneracion['nombre_institucion_otros']))
+                agregar(f"<FechaEmisionEX>{_fecha(exoneracion['fecha_emision'])}</FechaEmisionEX>"
+                        f"<TarifaExonerada>{_monto(tarifa_exonerada, 2)}</TarifaExonerada>"
+                        f"<MontoExoneracion>{_monto(exoneracion['monto_exoneracion'])}</MontoExoneracion>"
+                        f"</Exoneracion>")
+            agregar('</Impuesto>')
+        if 'ImpuestoAsumidoEmisorFabrica' in admite:
+            agregar(f"<ImpuestoAsumidoEmisorFabrica>{_monto(detalle.get('impuesto_asumido_emisor_fabrica') or 0)}"
+                    f"</ImpuestoAsumidoEmisorFabrica>")
+        if 'ImpuestoNeto' in admite:
+            agregar(f"<ImpuestoNeto>{_monto(detalle['impuesto_neto'])}</ImpuestoNeto>")
+        agregar(f"<MontoTotalLinea>{_monto(detalle['monto_total_linea'])}</MontoTotalLinea></LineaDetalle>")
+    
+    @classmethod
+    def _escribir_otro_cargo(cls, partes: List[str], cargo: Dict[str, Any]) -> None:
+        agregar = partes.append
+        agregar(f"<OtrosCargos>{_elemento('TipoDocumentoOC', cargo.get('tipo_documento'))}")
+        if cargo.get('tipo_documento_otros'):
+            agregar(_elemento('TipoDocumentoOTROS', cargo['tipo_documento_otros']))
+        numero = cargo.get('numero_identidad_tercero')
+        tipo_identificacion = cargo.get('tipo_identidad_tercero') or TIPO_IDENTIFICACION_POR_LONGITUD.get(len(numero or ''))
+        if numero and tipo_identificacion:
+            cls._escribir_identificacion(partes, tipo_identificacion, numero, 'IdentificacionTercero')
+        if cargo.get('nombre_tercero'):
+            agregar(_elemento('NombreTercero', cargo['nombre_tercero']))
+        agregar(_elemento('Detalle', cargo.get('detalle')))
+        if cargo.get('porcentaje') is not None:
+            agregar(f"<PorcentajeOC>{_monto(cargo['porcentaje'])}</PorcentajeOC>")
+        agregar(f"<MontoCargo>{_monto(cargo['monto_cargo'])}</MontoCargo></OtrosCargos>")
+    
+    @staticmethod
+    def _escribir_resumen(partes: List[str], resumen: Dict[str, Any], medio_pago: List[Any],
+                          tipo: TipoComprobanteV44) -> None:
+        agregar = partes.append
+        agregar(f"<ResumenFactura><CodigoTipoMoneda>{_elemento('CodigoMoneda', resumen['codigo_tipo_moneda'])}"
+                f"<TipoCambio>{_monto(resumen['tipo_cambio'])}</TipoCambio></CodigoTipoMoneda>")
+        for campo, etiqueta in tipo.totales_iniciales:
+            if resumen.get(campo) is not None:
+                agregar(f"<{etiqueta}>{_monto(resumen[campo])}</{etiqueta}>")
+        agregar(f"<TotalVenta>{_monto(resumen['total_venta'])}</TotalVenta>")
+        if 'TotalDescuentos' in tipo.resumen and resumen.get('total_descuentos') is not None:
+            agregar(f"<TotalDescuentos>{_monto(resumen['total_descuentos'])}</TotalDescuentos>")
+        agregar(f"<TotalVentaNeta>{_monto(resumen['total_venta_neta'])}</TotalVentaNeta>")
+        for desglose in resumen.get('desglose_impuesto') or []:
+            agregar(f"<TotalDesgloseImpuesto>{_elemento('Codigo', desglose['codigo'])}")
+            if desglose.get('codigo_tarifa'):
+                agregar(_elemento('CodigoTarifaIVA', desglose['codigo_tarifa']))
+            agregar(f"<TotalMontoImpuesto>{_monto(desglose['monto'])}</TotalMontoImpuesto></TotalDesgloseImpuesto>")
+        for campo, etiqueta in tipo.totales_finales:
+            if resumen.get(campo) is not None:
+                agregar(f"<{etiqueta}>{_monto(resumen[campo])}</{etiqueta}>")
+        for medio in medio_pago or []:
+            agregar(f"<MedioPago>{_elemento('TipoMedioPago', medio)}</MedioPago>")
+        agregar(f"<TotalComprobante>{_monto(resumen['total_comprobante'])}</TotalComprobante></ResumenFactura>")
+    
+    @staticmethod
+    def _escribir_referencia(partes: List[str], referencia: Dict[str, Any], admite: Dict[str, bool]) -> None:
+        agregar = partes.append
+        agregar(f"<InformacionReferencia>{_elemento('TipoDocIR', referencia.get('tipo_doc'))}")
+        if referencia.get('tipo_doc_otro'):
+            agregar(_elemento('TipoDocRefOTRO', referencia['tipo_doc_otro']))
+        if referencia.get('numero'):
+            agregar(_elemento('Numero', referencia['numero']))
+        agregar(f"<FechaEmisionIR>{_fecha(referencia.get('fecha_emision'))}</FechaEmisionIR>")
+        if referencia.get('codigo'):
+            agregar(_elemento('Codigo', referencia['codigo']))
+        if referencia.get('codigo_otro'):
+            agregar(_elemento('CodigoReferenciaOTRO', referencia['codigo_otro']))
+        if referencia.get('razon'):
+            agregar(_elemento('Razon', referencia['razon']))
+        agregar('</InformacionReferencia>')
+    
+    def _validar_campos_obligatorios(self, data: Dict[str, Any], tipo: TipoComprobanteV44) -> None:
+        """Validar que todos los campos obligatorios estén presentes (los de la raíz según el XSD del tipo)"""
         campos_obligatorios = [
-            'clave', 'proveedor_sistemas', 'codigo_actividad_emisor', 
-            'numero_consecutivo', 'fecha_emision', 'emisor', 'condicion_venta',
-            'medio_pago', 'detalles_servicio', 'resumen_factura'
+            'clave', 'proveedor_sistemas', 'numero_consecutivo', 'fecha_emision', 'emisor',
+            'condicion_venta', 'medio_pago', 'detalles_servicio', 'resumen_factura',
+            *tipo.campos_obligatorios
         ]
         
         for campo in campos_obligatorios:
-            if campo not in data or data[campo] is None:
-                raise ValueError(f"Campo obligatorio faltante: {campo}")
+            if campo not in data or data[campo] is None or data[campo] == []:
+                raise ValueError(f"Campo obligatorio faltante para {tipo.nombre}: {campo}")
         
-        # Validar ubicación del emisor con datos oficiales
-        if 'emisor' in data and 'ubicacion' in data['emisor']:
-            ubicacion = data['emisor']['ubicacion']
-            if all(k in ubicacion for k in ['provincia', 'canton', 'distrito']):
-                es_valida, mensaje = validar_ubicacion(
-                    ubicacion['provincia'],
-                    ubicacion['canton'], 
-                    ubicacion['distrito']
-                )
-                if not es_valida:
-                    logger.warning(f"⚠️ Ubicación del emisor: {mensaje}")
+        # La ubicación del emisor se valida con los datos oficiales al crear su perfil (cache_emisores)
         
         # Validar detalles de servicio
         if not data['detalles_servicio'] or len(data['detalles_servicio']) == 0:
             raise ValueError("Debe incluir al menos una línea de detalle")
         
-        # Validar códigos CABYS
-        for i, detalle in enumerate(data['detalles_servicio']):
-            if 'codigo_cabys' not in detalle:
-                raise ValueError(f"Línea {i+1}: Campo 'codigo_cabys' es obligatorio")
-            if len(detalle['codigo_cabys']) != 13:
-                raise ValueError(f"Línea {i+1}: codigo_cabys debe tener exactamente 13 caracteres")
+        # Validar códigos CABYS (el recibo de pago no los lleva; en las notas son opcionales)
+        if tipo.linea.get('CodigoCABYS'):
+            for i, detalle in enumerate(data['detalles_servicio']):
+                if 'codigo_cabys' not in detalle:
+                    raise ValueError(f"Línea {i+1}: Campo 'codigo_cabys' es obligatorio")
+                if len(detalle['codigo_cabys']) != 13:
+                    raise ValueError(f"Línea {i+1}: codigo_cabys debe tener exactamente 13 caracteres")
     
     def _procesar_datos(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        """Procesar y completar datos para el template"""
+        """Procesar y completar datos para el XML"""
         data_procesada = data.copy()
         
+        # Emisor validado (ubicación incluida) y su bloque XML, compartidos entre facturas
+        data_procesada['perfil_emisor'] = data.get('perfil_emisor') or cache_emisores.perfil(data['emisor'])
+        
         # Procesar fecha de emisión
         if isinstance(data_procesada['fecha_emision'], datetime):
             data_procesada['fecha_emision'] = data_procesada['fecha_emision'].strftime('%Y-%m-%dT%H:%M:%S-06:00')
         
-        # Completar detalles de servicio
-        data_procesada['detalles_servicio'] = self._completar_detalles_servicio(data['detalles_servicio'])
-        
-        # Completar resumen de factura
-        data_procesada['resumen'] = self._completar_resumen_factura(data['resumen_factura'])
-        
-        # Generar firma digital
-        data_procesada['firma_digital'] = self._generar_firma_digital(data['clave'])
-        
-        # Asegurar que todos los valores numéricos no sean None
-        self._limpiar_valores_none(data_procesada)
+        # Montos de las líneas y totales del resumen, calculados en Decimal
+        detalles, totales = calculadora_totales.calcular(
+            data['detalles_servicio'], data.get('otros_cargos'), data.get('medio_pago'), IMPUESTO_EXENTO_V44
+        )
+        data_procesada['detalles_servicio'] = detalles
+        data_procesada['resumen'] = self._completar_resumen_factura(data['resumen_factura'], totales)
         
         return data_procesada
-        
-    def _limpiar_valores_none(self, data: Dict[str, Any]):
-        """Limpiar valores None que pueden causar errores en el template"""
-        # Limpiar detalles de servicio
-        if 'detalles_servicio' in data:
-            for detalle in data['detalles_servicio']:
-                for key, value in detalle.items():
-                    if value is None and key in ['cantidad', 'precio_unitario', 'monto_total', 'subtotal', 'impuesto_neto', 'monto_total_linea']:
-                        detalle[key] = 0.0
-                if 'impuestos' in detalle and detalle['impuestos']:
-                    for impuesto in detalle['impuestos']:
-                        for key, value in impuesto.items():
-                            if value is None and key in ['tarifa', 'monto']:
-                                impuesto[key] = 0.0
-        
-        # Limpiar resumen
-        if 'resumen' in data:
-            for key, value in data['resumen'].items():
-                if value is None:
-                    data['resumen'][key] = 0.0
-    
-    def _completar_detalles_servicio(self, detalles: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Completar detalles de servicio con campos calculados"""
-        detalles_completos = []
-        
-        for detalle in detalles:
-            detalle_completo = detalle.copy()
-            
-            # Agregar código CABYS por defecto si no existe
-            if 'codigo_cabys' not in detalle_completo:
-                detalle_completo['codigo_cabys'] = '8411000000000'  # Código genérico para servicios
-            
-            # Calcular subtotal si no existe
-            if 'subtotal' not in detalle_completo:
-                from decimal import Decimal
-                cantidad = Decimal(str(detalle_completo['cantidad']))
-                precio = Decimal(str(detalle_completo['precio_unitario']))
-                subtotal = cantidad * precio
-                if 'descuento' in detalle_completo and detalle_completo['descuento']:
-                    descuento = Decimal(str(detalle_completo['descuento'].get('monto', 0)))
-                    subtotal -= descuento
-                detalle_completo['subtotal'] = float(subtotal)
-            
-            # Calcular impuestos automáticamente si no existen
-            if 'impuestos' not in detalle_completo or not detalle_completo['impuestos']:
-                from decimal import Decimal
-                subtotal_decimal = Decimal(str(detalle_completo['subtotal']))
-                impuesto_monto = float(subtotal_decimal * Decimal('0.13'))  # IVA 13%
-                detalle_completo['impuestos'] = [{
-                    'codigo': '01',  # IVA
-                    'codigo_tarifa': '08',  # 13%
-                    'tarifa': 13.00,
-                    'monto': impuesto_monto
-                }]
-                detalle_completo['impuesto_neto'] = impuesto_monto
-            else:
-                total_impuestos = sum(imp.get('monto', 0) or 0 for imp in detalle_completo['impuestos'])
-                detalle_completo['impuesto_neto'] = total_impuestos
-            
-            # Calcular monto total línea
-            if 'monto_total_linea' not in detalle_completo:
-                subtotal = detalle_completo.get('subtotal', 0) or 0
-                impuesto_neto = detalle_completo.get('impuesto_neto', 0) or 0
-                detalle_completo['monto_total_linea'] = subtotal + impuesto_neto
-            
-            detalles_completos.append(detalle_completo)
-        
-        return detalles_completos
     
-    def _completar_resumen_factura(self, resumen: Dict[str, Any]) -> Dict[str, Any]:
-        """Completar resumen de factura con campos obligatorios"""
+    def _completar_resumen_factura(self, resumen: Dict[str, Any], totales: Dict[str, Any]) -> Dict[str, Any]:
+        """Resumen con la moneda validada y los totales calculados de las líneas"""
         resumen_completo = resumen.copy()
         
         # Validar y asignar código de moneda
@@ -194,35 +652,11 @@ class XMLGeneratorV44:
         # Asignar el código de moneda limpio
         resumen_completo['codigo_tipo_moneda'] = codigo_moneda
         
-        # Valores por defecto para campos obligatorios
-        defaults = {
-            'codigo_tipo_moneda': codigo_moneda,
-            'tipo_cambio': 1.00000,
-            'total_servicios_gravados': resumen.get('total_venta', 0) or 0.00000,
-            'total_servicios_exentos': 0.00000,
-            'total_servicios_exonerados': 0.00000,
-            'total_mercaderias_gravadas': 0.00000,
-            'total_mercaderias_exentas': 0.00000,
-            'total_mercaderias_exoneradas': 0.00000,
-            'total_gravado': resumen.get('total_venta', 0) or 0.00000,
-            'total_exento': 0.00000,
-            'total_exonerado': 0.00000,
-            'total_descuentos': 0.00000,
-            'total_impuesto': resumen.get('total_impuestos', 0) or 0.00000,
-            'total_iva_devuelto': 0.00000,
-            'total_otros_cargos': 0.00000
-        }
-        
-        for campo, valor_default in defaults.items():
-            if campo not in resumen_completo:
-                resumen_completo[campo] = valor_default
+        if resumen_completo.get('tipo_cambio') is None:
+            resumen_completo['tipo_cambio'] = Decimal('1.00000')
+        resumen_completo.update(totales)
         
         return resumen_completo
-    
-    def _generar_firma_digital(self, clave: str) -> str:
-        """Generar firma digital simulada para desarrollo"""
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        return f'<ds:Signature xmlns:ds="http://www.w3.org/2000/09/xmldsig#" Id="Signature-{timestamp}"><!-- Firma digital simulada para desarrollo --></ds:Signature>'
 
 # Instancia global
-xml_generator_v44 = XMLGeneratorV44()
\ No newline at end of file
+xml_generator_v44 = XMLGeneratorV44()
@@ -185,18 +185,33 @@ class XMLDigitalSignerProduction:
         Returns:
             XML firmado digitalmente
         """
+        try:
+            parser = etree.XMLParser(remove_blank_text=True)
+            xml_doc = etree.fromstring(xml_content.encode('utf-8'), parser)
+        except Exception as e:
+            logger.error(f"❌ Error signing XML: {e}")
+            return xml_content
+        
+        return self.serializar(self.firmar_arbol(xml_doc))
+    
+    def firmar_arbol(self, xml_doc: etree._Element) -> etree._Element:
+        """
+        Firmar en el mismo árbol un documento ya parseado (sin volver a leer el texto)
+        
+        Args:
+            xml_doc: Elemento raíz del comprobante
+            
+        Returns:
+            El mismo elemento raíz, con la firma agregada
+        """
         if not self.certificate or not self.private_key:
             logger.error("❌ Certificate or private key not available")
             # Fallback a firma simulada para desarrollo
-            return self._simulated_signature(xml_content)
+            return self._simulated_signature(xml_doc)
         
         try:
             logger.info("🔐 Starting digital signature process...")
             
-            # Parsear XML
-            parser = etree.XMLParser(remove_blank_text=True)
-            xml_doc = etree.fromstring(xml_content.encode('utf-8'), parser)
-            
             # Remover cualquier firma existente (simulada o anterior)
             ns_ds = "http://www.w3.org/2000/09/xmldsig#"
             signatures_to_remove = xml_doc.xpath(".//ds:Signature", namespaces={'ds': ns_ds})
@@ -231,57 +246,44 @@ class XMLDigitalSignerProduction:
             # Agregar firma al documento
             xml_doc.append(signature_element)
             
-            # Generar XML final
-            signed_xml = etree.tostring(
-                xml_doc, 
-                encoding='unicode', 
-                pretty_print=True,
-                xml_declaration=False
-            )
-            
             logger.info("✅ Document signed successfully with production certificate")
-            return signed_xml
+            return xml_doc
             
         except Exception as e:
             logger.error(f"❌ Error signing XML: {e}")
             # Fallback a firma simulada en caso de error
-            return self._simulated_signature(xml_content)
+            return self._simulated_signature(xml_doc)
     
-    def _simulated_signature(self, xml_content: str) -> str:
+    @staticmethod
+    def serializar(xml_doc: etree._Element) -> str:
+        """Texto del documento firmado"""
+        return etree.tostring(
+            xml_doc, 
+            encoding='unicode', 
+            pretty_print=True,
+            xml_declaration=False
+        )
+    
+    def _simulated_signature(self, xml_doc: etree._Element) -> etree._Element:
         """Firma simulada como fallback para desarrollo"""
-        try:
-            parser = etree.XMLParser(remove_blank_text=True)
-            xml_doc = etree.fromstring(xml_content.encode('utf-8'), parser)
-            
-            # Crear firma simulada con formato similar al real
-            ns_ds = "http://www.w3.org/2000/09/xmldsig#"
-            signature = etree.Element(f"{{{ns_ds}}}Signature", nsmap={'ds': ns_ds})
-            signature.set("Id", f"Signature-{datetime.now().strftime('%Y%m%d%H%M%S')}")
-            
-            # Comentario indicando que es simulada
-            comment = etree.Comment(" Firma digital simulada para desarrollo ")
-            signature.append(comment)
-            
-            xml_doc.append(signature)
-            
-            # También agregar elemento Signature simple para compatibilidad
-            simple_signature = etree.Element("Signature")
-            simple_signature.text = f"CERTIFICADO_OFICIAL_{settings.proveedor_sistemas}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-            xml_doc.append(simple_signature)
-            
-            signed_xml = etree.tostring(
-                xml_doc, 
-                encoding='unicode', 
-                pretty_print=True,
-                xml_declaration=False
-            )
-            
-            logger.warning("⚠️ Using simulated signature for development")
-            return signed_xml
-            
-        except Exception as e:
-            logger.error(f"Error creating simulated signature: {e}")
-            return xml_content
+        # Crear firma simulada con formato similar al real
+        ns_ds = "http://www.w3.org/2000/09/xmldsig#"
+        signature = etree.Element(f"{{{ns_ds}}}Signature", nsmap={'ds': ns_ds})
+        signature.set("Id", f"Signature-{datetime.now().strftime('%Y%m%d%H%M%S')}")
+        
+        # Comentario indicando que es simulada
+        comment = etree.Comment(" Firma digital simulada para desarrollo ")
+        signature.append(comment)
+        
+        xml_doc.append(signature)
+        
+        # También agregar elemento Signature simple para compatibilidad
+        simple_signature = etree.Element("Signature")
+        simple_signature.text = f"CERTIFICADO_OFICIAL_{settings.proveedor_sistemas}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        xml_doc.append(simple_signature)
+        
+        logger.warning("⚠️ Using simulated signature for development")
+        return xml_doc
     
     def verificar_firma(self, xml_firmado: str) -> Tuple[bool, str]:
         """
@@ -5,6 +5,21 @@ import os
 
 logger = logging.getLogger(__name__)
 
+XSD_FACTURA_V44 = "Referencias/Factura/FacturaElectronica_V4.4.xsd.xml"
+# Los XSD v4.4 importan ../../xmldsig-core-schema.xsd; se resuelve a la copia local
+XSD_XMLDSIG = "Referencias/xmldsig-core-schema.xsd"
+NS_XS = "http://www.w3.org/2001/XMLSchema"
+
+
+class _ResolvedorXmldsig(etree.Resolver):
+    """Entrega el esquema de XML Signature desde Referencias/ en lugar de buscarlo en la red"""
+
+    def resolve(self, url, pubid, context):
+        if url and url.endswith("xmldsig-core-schema.xsd"):
+            return self.resolve_filename(XSD_XMLDSIG, context)
+        return None
+
+
 class XSDValidator:
     """
     Validador XML contra el esquema XSD oficial v4.4 del Ministerio de Hacienda
@@ -19,10 +34,11 @@ class XSDValidator:
         """
         if xsd_path is None:
             # Ruta por defecto al XSD oficial v4.4
-            xsd_path = "Referencias/FacturaElectronica_V4.4.xsd.xml"
+            xsd_path = XSD_FACTURA_V44
         
         self.xsd_path = xsd_path
         self.schema = None
+        self.namespace = None
         self._load_schema()
     
     def _load_schema(self) -> None:
@@ -33,9 +49,16 @@ class XSDValidator:
                 logger.warning("Validación XSD deshabilitada")
                 return
             
-            with open(self.xsd_path, 'r', encoding='utf-8') as xsd_file:
-                xsd_doc = etree.parse(xsd_file)
-                self.schema = etree.XMLSchema(xsd_doc)
+            parser = etree.XMLParser()
+            parser.resolvers.add(_ResolvedorXmldsig())
+            xsd_doc = etree.parse(self.xsd_path, parser)
+            self.namespace = xsd_doc.getroot().get('targetNamespace')
+            
+            # La firma se agrega después de validar: en la raíz, ds:Signature pasa a ser opcional
+            for firma in xsd_doc.getroot().iterfind(
+                    f"{{{NS_XS}}}element/{{{NS_XS}}}complexType/{{{NS_XS}}}sequence/{{{NS_XS}}}element[@ref='ds:Signature']"):
+                firma.set('minOccurs', '0')
+            self.schema = etree.XMLSchema(xsd_doc)
             
             logger.info(f"Esquema XSD v4.4 cargado exitosamente desde: {self.xsd_path}")
             
@@ -62,20 +85,7 @@ class XSDValidator:
             xml_doc = etree.fromstring(xml_content.encode('utf-8'))
             
             # Validar contra esquema
-            is_valid = self.schema.validate(xml_doc)
-            
-            if is_valid:
-                logger.info("XML válido según esquema XSD v4.4")
-                return True, []
-            else:
-                # Recopilar errores
-                errors = []
-                for error in self.schema.error_log:
-                    error_msg = f"Línea {error.line}: {error.message}"
-                    errors.append(error_msg)
-                    logger.error(f"Error XSD: {error_msg}")
-                
-                return False, errors
+            return self.validate_tree(xml_doc)
                 
         except etree.XMLSyntaxError as e:
             error_msg = f"Error de sintaxis XML: {e}"
@@ -87,6 +97,34 @@ class XSDValidator:
             logger.error(error_msg)
             return False, [error_msg]
     
+    def validate_tree(self, xml_doc: etree._Element) -> Tuple[bool, List[str]]:
+        """
+        Validar contra el esquema XSD un documento ya parseado
+        
+        Args:
+            xml_doc: Elemento raíz del comprobante
+            
+        Returns:
+            Tuple[bool, List[str]]: (es_valido, lista_de_errores)
+        """
+        if self.schema is None:
+            return True, ["Validación XSD no disponible - esquema no cargado"]
+        
+        is_valid = self.schema.validate(xml_doc)
+        
+        if is_valid:
+            logger.info("XML válido según esquema XSD v4.4")
+            return True, []
+        
+        # Recopilar errores
+        errors = []
+        for error in self.schema.error_log:
+            error_msg = f"Línea {error.line}: {error.message}"
+            errors.append(error_msg)
+            logger.error(f"Error XSD: {error_msg}")
+        
+        return False, errors
+    
     def validate_and_report(self, xml_content: str) -> Dict[str, any]:
         """
         Validar XML y retornar reporte detallado
@@ -97,8 +135,13 @@ class XSDValidator:
         Returns:
             Dict con resultado de validación
         """
-        is_valid, errors = self.validate_xml(xml_content)
-        
+        return self._reporte(*self.validate_xml(xml_content))
+    
+    def validate_tree_and_report(self, xml_doc: etree._Element) -> Dict[str, any]:
+        """Como validate_and_report, para un documento ya parseado"""
+        return self._reporte(*self.validate_tree(xml_doc))
+    
+    def _reporte(self, is_valid: bool, errors: List[str]) -> Dict[str, any]:
         return {
             'valido': is_valid,
             'errores': errors,
@@ -118,8 +161,20 @@ class XSDValidator:
             'esquema_cargado': self.schema is not None,
             'ruta_xsd': self.xsd_path,
             'version': '4.4' if self.schema else None,
-            'namespace': 'https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronica' if self.schema else None
+            'namespace': self.namespace if self.schema else None
         }
 
+
+_validadores: Dict[str, XSDValidator] = {}
+
+
+def validador_para(xsd_path: str) -> XSDValidator:
+    """Validador del XSD de un tipo de comprobante; cada esquema se compila una sola vez"""
+    validador = _validadores.get(xsd_path)
+    if validador is None:
+        validador = _validadores[xsd_path] = XSDValidator(xsd_path)
+    return validador
+
+
 # Instancia global del validador
-xsd_validator = XSDValidator()
\ No newline at end of file
+xsd_validator = validador_para(XSD_FACTURA_V44)
\ No newline at end of file
@@ -0,0 +1,29 @@
+"""
+Levantar el simulador de Hacienda
+
+    python -m app.simulador --puerto 8090 [--tls]
+
+Los parámetros de latencia y fallas se leen de variables SIMULADOR_*
+(ver app/simulador/config.py), p.ej. SIMULADOR_TASA_LIMITE=0.2.
+"""
+
+import argparse
+import tempfile
+
+import uvicorn
+
+from app.simulador.app import crear_app
+from app.simulador.tls import generar_certificado
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8090)
+    parser.add_argument("--tls", action="store_true", help="Servir HTTPS con un certificado autofirmado")
+    args = parser.parse_args()
+
+    opciones = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.tls:
+            opciones['ssl_certfile'], opciones['ssl_keyfile'] = generar_certificado(tmp)
+        uvicorn.run(crear_app(), host=args.host, port=args.puerto, **opciones)
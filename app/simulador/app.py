@@ -0,0 +1,276 @@
+"""
+Simulador local del IdP y de la API de recepción de Hacienda
+
+Imita los endpoints que usa HaciendaClient para pruebas de carga y de fallas
+sin red. Levantar con:
+
+    python -m app.simulador --puerto 8090
+
+y apuntar el API o el worker a él:
+
+    HACIENDA_TOKEN_URL=http://127.0.0.1:8090/auth/realms/rut-stag/protocol/openid-connect/token
+    HACIENDA_BASE_URL=http://127.0.0.1:8090/recepcion-sandbox/v1/recepcion
+"""
+
+import asyncio
+import base64
+import binascii
+import logging
+import math
+import random
+import secrets
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+from xml.sax.saxutils import escape
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+from app.simulador.config import ConfigSimulador
+
+logger = logging.getLogger(__name__)
+
+
+class SimuladorHacienda:
+    """Estado en memoria del simulador: tokens emitidos y comprobantes recibidos"""
+
+    def __init__(self, config: ConfigSimulador):
+        self.config = config
+        self.azar = random.Random(config.semilla)
+        self.tokens: Dict[str, float] = {}
+        self.refresh_tokens: Dict[str, float] = {}
+        self.documentos: Dict[str, Dict[str, Any]] = {}
+        self.contadores: Counter = Counter()
+        self.en_vuelo = 0
+        self._callbacks: set = set()
+        self._cliente: Optional[httpx.AsyncClient] = None
+
+    # ---------------------------------------------------------------- fallas
+
+    def latencia(self, media_ms: float) -> float:
+        """Muestra de latencia (segundos) según la distribución configurada"""
+        distribucion = self.config.latencia_distribucion
+        desviacion = self.config.latencia_desviacion_ms
+        if media_ms <= 0:
+            return 0.0
+        if distribucion == "fija":
+            ms = media_ms
+        elif distribucion == "uniforme":
+            ms = self.azar.uniform(max(0.0, media_ms - desviacion), media_ms + desviacion)
+        elif distribucion == "exponencial":
+            ms = self.azar.expovariate(1 / media_ms)
+        else:
+            # Lognormal con la media y desviación indicadas (cola larga, como la red real)
+            sigma2 = math.log(1 + (desviacion / media_ms) ** 2)
+            ms = self.azar.lognormvariate(math.log(media_ms) - sigma2 / 2, math.sqrt(sigma2))
+        return ms / 1000
+
+    async def inyectar_falla(self, media_ms: float) -> Optional[Response]:
+        """Aplicar latencia y, según las tasas, devolver 503/429 o colgar la conexión"""
+        capacidad = self.config.capacidad_concurrente
+        if capacidad and self.en_vuelo >= capacidad:
+            self.contadores['429_capacidad'] += 1
+            return Response(status_code=429, content="Capacidad excedida (simulado)",
+                            headers={'Retry-After': str(self.config.retry_after_segundos)})
+        self.en_vuelo += 1
+        try:
+            await asyncio.sleep(self.latencia(media_ms))
+        finally:
+            self.en_vuelo -= 1
+        sorteo = self.azar.random()
+        if sorteo < self.config.tasa_desconexion:
+            self.contadores['desconexion'] += 1
+            await asyncio.sleep(self.config.desconexion_segundos)
+            return Response(status_code=504)
+        sorteo -= self.config.tasa_desconexion
+        if sorteo < self.config.tasa_error:
+            self.contadores['503'] += 1
+            return Response(status_code=503, content="Servicio no disponible (simulado)")
+        sorteo -= self.config.tasa_error
+        if sorteo < self.config.tasa_limite:
+            self.contadores['429'] += 1
+            return Response(status_code=429, content="Demasiadas solicitudes (simulado)",
+                            headers={'Retry-After': str(self.config.retry_after_segundos)})
+        return None
+
+    # ------------------------------------------------------------------ estado
+
+    def token_valido(self, autorizacion: Optional[str]) -> bool:
+        if not self.config.validar_token:
+            return True
+        if not autorizacion or not autorizacion.startswith("Bearer "):
+            return False
+        return self.tokens.get(autorizacion[7:], 0) > time.time()
+
+    def emitir_token(self) -> Dict[str, Any]:
+        ahora = time.time()
+        access_token = secrets.token_urlsafe(24)
+        refresh_token = secrets.token_urlsafe(24)
+        self.tokens[access_token] = ahora + self.config.token_expira_segundos
+        self.refresh_tokens[refresh_token] = ahora + self.config.refresh_expira_segundos
+        self.contadores['tokens'] += 1
+        return {
+            'access_token': access_token,
+            'expires_in': self.config.token_expira_segundos,
+            'refresh_token': refresh_token,
+            'refresh_expires_in': self.config.refresh_expira_segundos,
+            'token_type': 'bearer'
+        }
+
+    def estado(self, documento: Dict[str, Any]) -> str:
+        transcurrido = time.time() - documento['recibido_en']
+        if transcurrido < self.config.demora_procesando_segundos:
+            return "recibido"
+        if transcurrido < self.config.demora_final_segundos:
+            return "procesando"
+        return documento['estado_final']
+
+    def respuesta_estado(self, clave: str, documento: Dict[str, Any]) -> Dict[str, Any]:
+        estado = self.estado(documento)
+        respuesta = {
+            'clave': clave,
+            'fecha': documento['fecha'],
+            'ind-estado': estado
+        }
+        if estado in ("aceptado", "rechazado"):
+            respuesta['fecha-procesamiento'] = documento['fecha']
+            respuesta['respuesta-xml'] = generar_respuesta_xml(clave, documento)
+        return respuesta
+
+    # --------------------------------------------------------------- callbacks
+
+    def programar_callback(self, clave: str, url: str) -> None:
+        tarea = asyncio.create_task(self._enviar_callback(clave, url))
+        self._callbacks.add(tarea)
+        tarea.add_done_callback(self._callbacks.discard)
+
+    async def _enviar_callback(self, clave: str, url: str) -> None:
+        await asyncio.sleep(self.config.demora_final_segundos)
+        if self._cliente is None:
+            self._cliente = httpx.AsyncClient(timeout=10.0, verify=False)
+        try:
+            respuesta = await self._cliente.post(url, json=self.respuesta_estado(clave, self.documentos[clave]))
+            self.contadores[f'callback_{respuesta.status_code}'] += 1
+        except Exception as e:
+            self.contadores['callback_error'] += 1
+            logger.warning(f"⚠️ Callback de {clave} falló: {e}")
+
+    async def cerrar(self) -> None:
+        for tarea in list(self._callbacks):
+            tarea.cancel()
+        if self._cliente is not None:
+            await self._cliente.aclose()
+
+
+def generar_respuesta_xml(clave: str, documento: Dict[str, Any]) -> str:
+    """MensajeHacienda en base64, como lo devuelve recepción para los estados finales"""
+    aceptado = documento['estado_final'] == "aceptado"
+    detalle = "Este comprobante fue aceptado en el ambiente de pruebas" if aceptado else \
+        "Este comprobante fue rechazado en el ambiente de pruebas (simulado)"
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<MensajeHacienda xmlns="https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/mensajeHacienda">'
+        f'<Clave>{escape(clave)}</Clave>'
+        '<NombreEmisor>Emisor simulado</NombreEmisor>'
+        f'<TipoIdentificacionEmisor>{escape(documento["emisor_tipo"])}</TipoIdentificacionEmisor>'
+        f'<NumeroCedulaEmisor>{escape(documento["emisor_numero"])}</NumeroCedulaEmisor>'
+        f'<Mensaje>{"1" if aceptado else "3"}</Mensaje>'
+        f'<DetalleMensaje>{detalle}</DetalleMensaje>'
+        '<MontoTotalImpuesto>0</MontoTotalImpuesto>'
+        '<TotalFactura>0</TotalFactura>'
+        '</MensajeHacienda>'
+    )
+    return base64.b64encode(xml.encode('utf-8')).decode('ascii')
+
+
+def crear_app(config: Optional[ConfigSimulador] = None) -> FastAPI:
+    """Construir la aplicación ASGI del simulador"""
+    config = config or ConfigSimulador()
+    simulador = SimuladorHacienda(config)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        yield
+        await simulador.cerrar()
+
+    app = FastAPI(title="Simulador Hacienda", docs_url=None, redoc_url=None, lifespan=lifespan)
+    app.state.simulador = simulador
+
+    @app.post(config.ruta_token)
+    async def token(request: Request):
+        falla = await simulador.inyectar_falla(config.latencia_token_ms)
+        if falla:
+            return falla
+        datos = await request.form()
+        tipo = datos.get('grant_type')
+        if tipo == 'refresh_token':
+            if simulador.refresh_tokens.pop(datos.get('refresh_token'), 0) <= time.time():
+                return JSONResponse({'error': 'invalid_grant'}, status_code=400)
+        elif tipo != 'password' or not datos.get('username') or not datos.get('password'):
+            return JSONResponse({'error': 'invalid_grant'}, status_code=400)
+        return simulador.emitir_token()
+
+    @app.post(config.ruta_recepcion)
+    async def recepcion(request: Request):
+        simulador.contadores['envios'] += 1
+        if not simulador.token_valido(request.headers.get('authorization')):
+            return Response(status_code=401)
+        falla = await simulador.inyectar_falla(config.latencia_media_ms)
+        if falla:
+            return falla
+
+        payload = await request.json()
+        clave = payload.get('clave') or ''
+        if len(clave) != 50:
+            return Response(status_code=400, headers={'X-Error-Cause': 'Clave inválida'}, content="Clave inválida")
+        try:
+            base64.b64decode(payload.get('comprobanteXml') or '', validate=True)
+        except (binascii.Error, ValueError):
+            return Response(status_code=400, headers={'X-Error-Cause': 'comprobanteXml inválido'},
+                            content="comprobanteXml inválido")
+        if clave in simulador.documentos:
+            causa = f"El comprobante {clave} ya fue recibido anteriormente"
+            return Response(status_code=400, headers={'X-Error-Cause': causa}, content=causa)
+
+        emisor = payload.get('emisor') or {}
+        simulador.documentos[clave] = {
+            'recibido_en': time.time(),
+            'fecha': datetime.now(timezone.utc).isoformat(),
+            'emisor_tipo': emisor.get('tipoIdentificacion', ''),
+            'emisor_numero': emisor.get('numeroIdentificacion', ''),
+            'estado_final': "rechazado" if simulador.azar.random() < config.tasa_rechazo else "aceptado"
+        }
+        simulador.contadores['recibidos'] += 1
+        if config.callbacks and payload.get('callbackUrl'):
+            simulador.programar_callback(clave, payload['callbackUrl'])
+        return Response(status_code=202, headers={'Location': f"{request.url}/{clave}"})
+
+    @app.get(config.ruta_recepcion + "/{clave}")
+    async def consulta(clave: str, request: Request):
+        simulador.contadores['consultas'] += 1
+        if not simulador.token_valido(request.headers.get('authorization')):
+            return Response(status_code=401)
+        falla = await simulador.inyectar_falla(config.latencia_media_ms)
+        if falla:
+            return falla
+        documento = simulador.documentos.get(clave)
+        if documento is None:
+            return Response(status_code=404)
+        return simulador.respuesta_estado(clave, documento)
+
+    @app.get("/simulador/estadisticas")
+    async def estadisticas():
+        return {
+            'contadores': dict(simulador.contadores),
+            'documentos': len(simulador.documentos),
+            'estados': Counter(simulador.estado(d) for d in simulador.documentos.values())
+        }
+
+    return app
+
+
+app = crear_app()
@@ -0,0 +1,39 @@
+from pydantic_settings import BaseSettings
+from typing import Optional
+
+class ConfigSimulador(BaseSettings):
+    """Parámetros del simulador de Hacienda (variables de entorno SIMULADOR_*)"""
+
+    # Rutas (las mismas del sandbox de Hacienda)
+    ruta_token: str = "/auth/realms/rut-stag/protocol/openid-connect/token"
+    ruta_recepcion: str = "/recepcion-sandbox/v1/recepcion"
+
+    # Latencia: fija, uniforme, exponencial o lognormal
+    latencia_distribucion: str = "lognormal"
+    latencia_media_ms: float = 80.0
+    latencia_desviacion_ms: float = 40.0
+    latencia_token_ms: float = 30.0
+
+    # Fallas inyectadas (probabilidad por solicitud)
+    tasa_error: float = 0.0  # 503 Service Unavailable
+    tasa_limite: float = 0.0  # 429 Too Many Requests
+    retry_after_segundos: int = 1
+    capacidad_concurrente: int = 0  # Solicitudes simultáneas antes de responder 429 (0 = sin tope)
+    tasa_desconexion: float = 0.0  # Se demora más allá del timeout del cliente
+    desconexion_segundos: float = 90.0
+
+    # Procesamiento: recibido -> procesando -> aceptado/rechazado
+    demora_procesando_segundos: float = 1.0
+    demora_final_segundos: float = 5.0
+    tasa_rechazo: float = 0.05
+    callbacks: bool = True
+
+    # IdP
+    validar_token: bool = True
+    token_expira_segundos: int = 300
+    refresh_expira_segundos: int = 36000
+
+    semilla: Optional[int] = None
+
+    class Config:
+        env_prefix = "SIMULADOR_"
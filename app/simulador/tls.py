@@ -0,0 +1,32 @@
+import datetime
+import os
+from typing import Tuple
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+
+def generar_certificado(directorio: str) -> Tuple[str, str]:
+    """Certificado autofirmado para localhost (rutas del certificado y de la llave)"""
+    clave = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nombre = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    ahora = datetime.datetime.utcnow()
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(nombre).issuer_name(nombre)
+        .public_key(clave.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(ahora).not_valid_after(ahora + datetime.timedelta(days=1))
+        .sign(clave, hashes.SHA256())
+    )
+    ruta_cert = os.path.join(directorio, "cert.pem")
+    ruta_clave = os.path.join(directorio, "key.pem")
+    with open(ruta_cert, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(ruta_clave, "wb") as f:
+        f.write(clave.private_bytes(serialization.Encoding.PEM,
+                                    serialization.PrivateFormat.TraditionalOpenSSL,
+                                    serialization.NoEncryption()))
+    return ruta_cert, ruta_clave
@@ -0,0 +1,176 @@
+"""
+Worker de entrega de documentos a Hacienda
+
+Drena la cola persistente de Redis con concurrencia controlada y, en el mismo
+proceso, consulta el estado de los documentos entregados hasta su respuesta
+final. Se escala agregando procesos:
+
+    python -m app.workers.envio_worker
+"""
+
+import asyncio
+import logging
+import signal
+from typing import Any, Dict, Set
+
+from app.core.config import settings
+from app.core.redis import cerrar_redis
+from app.models.database import cerrar_base_datos
+from app.services.bitacora_envios import bitacora_envios
+from app.services.cola_envios import cola_envios
+from app.services.hacienda_client import HaciendaClient
+from app.services.hacienda_transport import hacienda_transport
+from app.services.repositorio_documentos import repositorio_documentos
+from app.services.resiliencia import circuito_hacienda
+from app.services.sondeo_estados import planificador_sondeo
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerEnvios:
+    """Consume la cola de envíos y confirma o reprograma cada documento"""
+
+    INTERVALO_VACIO = 0.5
+    INTERVALO_RECUPERACION = 5.0
+
+    def __init__(self, concurrencia: int = None):
+        self.concurrencia = concurrencia or settings.cola_concurrencia
+        self.hacienda_client = HaciendaClient()
+        self._tareas: Set[asyncio.Task] = set()
+        self._detener = asyncio.Event()
+        # Hay un documento de contingencia en pendientes como envío de prueba
+        self._sondeando = False
+        circuito_hacienda.al_cerrar(cola_envios.drenar_contingencia)
+
+    def detener(self) -> None:
+        """Dejar de reservar trabajo nuevo; las entregas en curso terminan"""
+        logger.info("🛑 Deteniendo worker de envíos...")
+        self._detener.set()
+
+    async def ejecutar(self) -> None:
+        logger.info(f"🚚 Worker de envíos iniciado (concurrencia={self.concurrencia})")
+        ultima_recuperacion = 0.0
+        loop = asyncio.get_running_loop()
+        # Contingencia de antes de arrancar o de una apertura: sondear en cuanto el circuito lo permita
+        sondear = True
+
+        while not self._detener.is_set():
+            if loop.time() - ultima_recuperacion > self.INTERVALO_RECUPERACION:
+                recuperados = await cola_envios.recuperar_vencidos()
+                if recuperados:
+                    logger.info(f"♻️ {recuperados} documentos reencolados por visibilidad vencida")
+                profundidad = await cola_envios.estadisticas()
+                ultima_recuperacion = loop.time()
+                sondear = sondear or profundidad['contingencia'] > 0
+
+            libres = self.concurrencia - len(self._tareas)
+            if await circuito_hacienda.esta_abierto():
+                # Hacienda caída: no reservar; lo nuevo se acumula en contingencia
+                self._sondeando = False
+                sondear = True
+                await self._esperar(self.INTERVALO_VACIO)
+                continue
+            if sondear and not self._sondeando:
+                # El circuito dejó de estar abierto: con pendientes vacía nadie enviaría la prueba que
+                # lo cierra y drena la contingencia, así que la prueba es el documento estacionado más antiguo
+                sondear = False
+                self._sondeando = await cola_envios.sondear_contingencia()
+            if libres <= 0:
+                # Concurrencia completa: esperar a que termine alguna entrega
+                await asyncio.wait(self._tareas, return_when=asyncio.FIRST_COMPLETED)
+                continue
+
+            reservados = await cola_envios.reservar(libres)
+            for clave, doc in reservados:
+                tarea = asyncio.create_task(self._entregar(clave, doc))
+                self._tareas.add(tarea)
+                tarea.add_done_callback(self._tareas.discard)
+
+            if not reservados:
+                await self._esperar(self.INTERVALO_VACIO)
+
+        if self._tareas:
+            await asyncio.gather(*self._tareas, return_exceptions=True)
+
+    async def _esperar(self, segundos: float) -> None:
+        try:
+            await asyncio.wait_for(self._detener.wait(), timeout=segundos)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _entregar(self, clave: str, doc: Dict[str, Any]) -> None:
+        try:
+            resultado = await self.hacienda_client.enviar_documento(clave, doc['xml'])
+        except Exception as e:
+            await cola_envios.reintentar(clave, str(e))
+            await self._registrar(clave, entregado=False, error=str(e))
+            return
+
+        codigo = resultado.get('codigo_respuesta')
+        error = resultado.get('error')
+        if resultado.get('estado') == 'circuito_abierto':
+            await cola_envios.a_contingencia(clave)
+        elif resultado.get('estado') == 'enviado':
+            await cola_envios.confirmar(clave)
+            await self._registrar(clave, entregado=True)
+            await planificador_sondeo.programar(clave)
+            logger.info(f"✅ Documento {clave} entregado a Hacienda")
+            await self._fin_sondeo()
+        elif codigo == 400 and 'recibido' in (error or '').lower():
+            # Hacienda ya tiene el comprobante: una entrega previa sí llegó
+            await cola_envios.confirmar(clave)
+            await self._registrar(clave, entregado=True)
+            await planificador_sondeo.programar(clave)
+            logger.info(f"✅ Documento {clave} ya estaba recibido en Hacienda")
+            await self._fin_sondeo()
+        elif codigo is not None and 400 <= codigo < 500 and codigo not in (401, 403, 408, 429):
+            await cola_envios.descartar(clave, error or f"HTTP {codigo}")
+            await self._registrar(clave, entregado=False, error=error or f"HTTP {codigo}", definitivo=True)
+        elif await circuito_hacienda.esta_abierto():
+            # Esta falla abrió el circuito: esperar la reconciliación sin gastar intentos
+            await cola_envios.a_contingencia(clave)
+        else:
+            vigente = await cola_envios.reintentar(clave, error or 'error desconocido',
+                                                   resultado.get('reintentar_en'))
+            await self._registrar(clave, entregado=False, error=error, definitivo=not vigente)
+
+    async def _fin_sondeo(self) -> None:
+        """Hacienda respondió: devolver a la cola el resto de la contingencia"""
+        if self._sondeando:
+            # Con el circuito cerrado en otro proceso, al_cerrar no corre aquí
+            self._sondeando = False
+            await cola_envios.drenar_contingencia()
+
+    @staticmethod
+    async def _registrar(clave: str, entregado: bool, error: str = None, definitivo: bool = False) -> None:
+        """Reflejar el intento en documentos_electronicos (la cola sigue siendo la fuente de verdad)"""
+        try:
+            await repositorio_documentos.registrar_envio(clave, entregado, error, definitivo)
+        except Exception as e:
+            logger.error(f"❌ No se pudo registrar el envío de {clave}: {e}")
+
+
+async def main() -> None:
+    await hacienda_transport.iniciar()
+    worker = WorkerEnvios()
+
+    def detener() -> None:
+        worker.detener()
+        planificador_sondeo.detener()
+
+    loop = asyncio.get_running_loop()
+    for senal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(senal, detener)
+
+    try:
+        await asyncio.gather(worker.ejecutar(), planificador_sondeo.ejecutar())
+    finally:
+        await hacienda_transport.cerrar()
+        await bitacora_envios.cerrar()
+        await cerrar_redis()
+        await cerrar_base_datos()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    asyncio.run(main())
@@ -0,0 +1,56 @@
+"""
+Mantenimiento de las particiones mensuales
+
+Cada PARTICIONES_INTERVALO_HORAS crea las particiones de los próximos meses
+y archiva al almacén de blobs las que salieron de la ventana de retención.
+Basta un proceso por base de datos:
+
+    python -m app.workers.mantenimiento_particiones
+    python -m app.workers.mantenimiento_particiones --una-vez
+"""
+
+import argparse
+import asyncio
+import logging
+import signal
+
+from app.core.config import settings
+from app.models.database import cerrar_base_datos
+from app.services.particiones import gestor_particiones
+
+logger = logging.getLogger(__name__)
+
+
+async def ciclo() -> None:
+    creadas = await gestor_particiones.asegurar_particiones()
+    archivadas = await gestor_particiones.retener()
+    logger.info(f"🗂️ Mantenimiento de particiones: {len(creadas)} creadas, {len(archivadas)} archivadas")
+
+
+async def main(una_vez: bool) -> None:
+    detenido = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for senal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(senal, detenido.set)
+
+    try:
+        while not detenido.is_set():
+            try:
+                await ciclo()
+            except Exception as e:
+                logger.error(f"❌ Error en el mantenimiento de particiones: {e}")
+            if una_vez:
+                break
+            try:
+                await asyncio.wait_for(detenido.wait(), timeout=settings.particiones_intervalo_horas * 3600)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await cerrar_base_datos()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--una-vez", action="store_true", help="Ejecutar un ciclo y salir")
+    asyncio.run(main(parser.parse_args().una_vez))
@@ -0,0 +1,96 @@
+"""
+Traslado de los XML en línea de documentos_electronicos al almacén de blobs
+
+Recorre por id las filas que todavía tienen xml_sin_firmar/xml_firmado en la
+tabla o el MensajeHacienda dentro de respuesta_hacienda, guarda cada contenido
+en el almacén y deja sólo la referencia. Se puede interrumpir y volver a correr:
+cada lote se confirma por separado y los blobs repetidos no se duplican.
+
+    python -m app.workers.migrar_blobs --lote 200
+"""
+
+import argparse
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from sqlalchemy import or_, select, update
+
+from app.models.database import AsyncSessionLocal, cerrar_base_datos
+from app.models.documento import DocumentoElectronico
+from app.services.almacen_blobs import almacen_blobs
+
+logger = logging.getLogger(__name__)
+
+
+async def migrar_fila(fila) -> Dict[str, Any]:
+    """Valores a actualizar para una fila: referencias nuevas y columnas en línea vacías"""
+    valores: Dict[str, Any] = {}
+    for columna, referencia in (('xml_sin_firmar', 'xml_sin_firmar_ref'), ('xml_firmado', 'xml_firmado_ref')):
+        contenido = getattr(fila, columna)
+        if contenido:
+            valores[referencia] = await almacen_blobs.guardar(contenido)
+            valores[columna] = None
+
+    respuesta = fila.respuesta_hacienda or {}
+    mensaje_xml = respuesta.get('mensaje-hacienda') or {}
+    if mensaje_xml.get('xml'):
+        valores['respuesta_xml_ref'] = await almacen_blobs.guardar(mensaje_xml['xml'])
+        valores['respuesta_hacienda'] = {
+            **respuesta,
+            'mensaje-hacienda': {k: v for k, v in mensaje_xml.items() if k != 'xml'}
+        }
+    return valores
+
+
+async def migrar(lote: int, maximo: Optional[int] = None) -> int:
+    """Migrar hasta `maximo` filas (todas si es None); devuelve cuántas se actualizaron"""
+    pendiente = or_(
+        DocumentoElectronico.xml_sin_firmar.isnot(None),
+        DocumentoElectronico.xml_firmado.isnot(None),
+        DocumentoElectronico.respuesta_xml_ref.is_(None) & DocumentoElectronico.respuesta_hacienda.isnot(None)
+    )
+    ultimo_id = 0
+    migradas = 0
+    while maximo is None or migradas < maximo:
+        async with AsyncSessionLocal() as sesion:
+            filas = (await sesion.execute(
+                select(
+                    DocumentoElectronico.id,
+                    DocumentoElectronico.xml_sin_firmar,
+                    DocumentoElectronico.xml_firmado,
+                    DocumentoElectronico.respuesta_hacienda
+                ).where(DocumentoElectronico.id > ultimo_id, pendiente)
+                .order_by(DocumentoElectronico.id)
+                .limit(lote)
+            )).all()
+            if not filas:
+                break
+
+            cambios = await asyncio.gather(*(migrar_fila(fila) for fila in filas))
+            for fila, valores in zip(filas, cambios):
+                if valores:
+                    await sesion.execute(
+                        update(DocumentoElectronico).where(DocumentoElectronico.id == fila.id).values(**valores)
+                    )
+                    migradas += 1
+            await sesion.commit()
+            ultimo_id = filas[-1].id
+        logger.info(f"📦 {migradas} documentos trasladados al almacén (id ≤ {ultimo_id})")
+    return migradas
+
+
+async def main(args) -> None:
+    try:
+        total = await migrar(args.lote, args.maximo)
+        logger.info(f"✅ Migración terminada: {total} documentos")
+    finally:
+        await cerrar_base_datos()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lote", type=int, default=200, help="Filas por transacción")
+    parser.add_argument("--maximo", type=int, default=None, help="Detenerse tras migrar este número de filas")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,37 @@
+"""
+Reconstrucción de resumen_diario a partir de documentos_electronicos
+
+Los triggers mantienen el resumen al día; esto sólo hace falta tras cargas
+masivas con los triggers deshabilitados o para corregir una diferencia. Sin
+fechas recalcula desde el primer mes que sigue en la base (los meses ya
+archivados conservan su resumen):
+
+    python -m app.workers.reconstruir_resumen
+    python -m app.workers.reconstruir_resumen --desde 2024-11-01 --hasta 2024-12-01
+"""
+
+import argparse
+import asyncio
+import logging
+from datetime import date
+
+from app.models.database import cerrar_base_datos
+from app.services.resumen_diario import agregador_resumen
+
+logger = logging.getLogger(__name__)
+
+
+async def main(args) -> None:
+    try:
+        filas = await agregador_resumen.reconstruir(args.desde, args.hasta)
+        logger.info(f"✅ Reconstrucción terminada: {filas} filas de resumen")
+    finally:
+        await cerrar_base_datos()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--desde", type=date.fromisoformat, default=None, help="Primer día (AAAA-MM-DD)")
+    parser.add_argument("--hasta", type=date.fromisoformat, default=None, help="Día siguiente al último (AAAA-MM-DD)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,89 @@
+"""
+Benchmark: caché de emisores (perfil validado y bloque <Emisor> ya escrito)
+
+Para facturas de 1, 100 y 1000 líneas de un mismo emisor mide la mediana del
+camino de la ruta /facturas-v44 hasta el XML:
+
+    sin caché   model_dump del Emisor, validar_ubicacion y escribir <Emisor> en cada factura
+    con caché   perfil de cache_emisores (cédula + contenido) y el bloque ya escrito
+
+El ahorro es fijo por factura (no depende de las líneas): pesa en los tiquetes
+y facturas cortas que dominan el volumen y se pierde en el ruido con cientos de
+líneas. También verifica que ambos XML sean idénticos y que al cambiar el
+perfil del emisor (p. ej. el correo) la caché escriba el bloque nuevo en lugar
+del anterior.
+
+Uso:
+    python -m benchmarks.bench_cache_emisores --lineas 1 100 1000 --repeticiones 2000
+"""
+
+import argparse
+import logging
+import statistics
+import time
+
+from app.core.config import settings
+from app.schemas.factura_v44 import Emisor
+from app.services.cache_emisores import cache_emisores
+from app.services.xml_generator_v44 import XMLGeneratorV44
+from benchmarks.bench_xml_v44 import datos_factura
+
+
+def emisor_modelo(datos: dict) -> Emisor:
+    """Emisor completo, como llega validado en el cuerpo de la solicitud"""
+    return Emisor(**datos['emisor'], nombre_comercial='Ejemplo & Compañía',
+                  telefono={'codigo_pais': '506', 'numero': '22223333'})
+
+
+def medir(generador: XMLGeneratorV44, datos: dict, emisor: Emisor, repeticiones: int):
+    """Medianas en ms de una factura (emisor + XML) sin y con caché, alternando para no sesgar el orden"""
+    tiempos = {False: [], True: []}
+    for _ in range(repeticiones):
+        for habilitada in (False, True):
+            settings.cache_emisores_habilitado = habilitada
+            inicio = time.perf_counter()
+            generar(generador, datos, emisor)
+            tiempos[habilitada].append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos[False]), statistics.median(tiempos[True])
+
+
+def generar(generador: XMLGeneratorV44, datos: dict, emisor: Emisor) -> str:
+    # Lo mismo que hace crear_factura_v44 con el emisor antes de generar
+    perfil = cache_emisores.perfil(emisor)
+    return generador.generar_xml_factura(dict(datos, emisor=perfil.datos, perfil_emisor=perfil))
+
+
+def main(lineas, repeticiones: int) -> None:
+    generador = XMLGeneratorV44()
+    print(f"{'líneas':>7} {'sin caché':>11} {'con caché':>11} {'ahorro':>9} {'µs/factura':>11}  XML idéntico")
+    for cantidad in lineas:
+        datos = datos_factura(cantidad)
+        emisor = emisor_modelo(datos)
+        veces = max(10, repeticiones // max(1, cantidad // 10))
+
+        cache_emisores.invalidar()
+        sin_cache, con_cache = medir(generador, datos, emisor, veces)
+
+        settings.cache_emisores_habilitado = False
+        xml_sin_cache = generar(generador, datos, emisor)
+        settings.cache_emisores_habilitado = True
+        identico = generar(generador, datos, emisor) == xml_sin_cache
+
+        print(f"{cantidad:>7} {sin_cache:9.4f}ms {con_cache:9.4f}ms {1 - con_cache / sin_cache:8.1%} "
+              f"{(sin_cache - con_cache) * 1000:11.2f}  {'sí' if identico else 'NO'}")
+
+    # Un cambio del perfil cambia la llave: nunca se sirve el bloque anterior
+    cambiado = emisor.model_copy(update={'correo_electronico': 'nuevo@ejemplo.com'})
+    xml = generar(generador, datos, cambiado)
+    print(f"\nperfil cambiado: {'bloque nuevo' if 'nuevo@ejemplo.com' in xml else 'BLOQUE VIEJO'}, "
+          f"perfiles en caché: {len(cache_emisores)}, "
+          f"invalidados al descartar la cédula: {cache_emisores.invalidar(emisor.identificacion_numero)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lineas", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--repeticiones", type=int, default=2000)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    main(args.lineas, args.repeticiones)
@@ -0,0 +1,125 @@
+"""
+Benchmark de envíos contra el simulador de Hacienda (throughput y modos de falla)
+
+Levanta app.simulador con la latencia y las tasas de falla indicadas, apunta
+HaciendaClient a él y entrega N documentos por el camino real (token, limitador
+AIMD, circuit breaker y backoff). Al final consulta los estados en lote.
+
+Uso:
+    python -m benchmarks.bench_envios_simulador --documentos 1000 --tasa-limite 0.1 --tasa-error 0.02
+"""
+
+import argparse
+import asyncio
+import os
+import threading
+import time
+from collections import Counter
+
+import uvicorn
+
+PUERTO_DEFECTO = 8091
+
+
+def configurar_entorno(puerto: int) -> None:
+    """Apuntar la configuración del API al simulador (antes de importar los servicios)"""
+    base = f"http://127.0.0.1:{puerto}"
+    os.environ["HACIENDA_TOKEN_URL"] = f"{base}/auth/realms/rut-stag/protocol/openid-connect/token"
+    os.environ["HACIENDA_BASE_URL"] = f"{base}/recepcion-sandbox/v1/recepcion"
+    os.environ["HACIENDA_USERNAME"] = "benchmark"
+    os.environ["HACIENDA_PASSWORD"] = "benchmark"
+    os.environ["HACIENDA_CALLBACK_URL"] = ""
+
+
+def iniciar_simulador(puerto: int, config) -> uvicorn.Server:
+    from app.simulador.app import crear_app
+
+    servidor = uvicorn.Server(uvicorn.Config(crear_app(config), host="127.0.0.1", port=puerto, log_level="warning"))
+    threading.Thread(target=servidor.run, daemon=True).start()
+    while not servidor.started:
+        time.sleep(0.05)
+    return servidor
+
+
+async def main(args) -> None:
+    from app.core.metrics import metricas
+    from app.services.hacienda_client import HaciendaClient
+    from app.services.hacienda_transport import hacienda_transport
+    from app.services.limitador_adaptativo import limitador_envios
+    from app.services.resiliencia import politica_reintentos
+
+    cliente = HaciendaClient()
+    estados = Counter()
+    intentos = Counter()
+    xml = "<FacturaElectronica/>" * 50
+
+    async def entregar(i: int) -> None:
+        clave = f"50601012400{args.emisor}{i:020d}"[:50].ljust(50, "0")
+        for intento in range(1, args.max_intentos + 1):
+            intentos['total'] += 1
+            resultado = await cliente.enviar_documento(clave, xml)
+            if resultado['estado'] == 'enviado':
+                estados['enviado'] += 1
+                return
+            retraso = politica_reintentos.retraso(intento, resultado.get('reintentar_en')) * args.escala_retraso
+            await asyncio.sleep(retraso)
+        estados['agotado'] += 1
+
+    await hacienda_transport.iniciar()
+    inicio = time.perf_counter()
+    await asyncio.gather(*(entregar(i) for i in range(args.documentos)))
+    total = time.perf_counter() - inicio
+
+    print(f"documentos={args.documentos}  entregados={estados['enviado']}  agotados={estados['agotado']}  "
+          f"solicitudes={intentos['total']}  total={total:.2f}s  docs/s={estados['enviado'] / total:.1f}")
+    print(f"límite AIMD global={limitador_envios.global_.limite:.1f}")
+
+    await asyncio.sleep(args.demora_final)
+    claves = [f"50601012400{args.emisor}{i:020d}"[:50].ljust(50, "0") for i in range(args.documentos)]
+    finales = Counter()
+    async for respuesta in cliente.consultar_flujo(claves, 20):
+        finales[respuesta['ind-estado']] += 1
+    print(f"estados en Hacienda: {dict(finales)}")
+
+    for nombre, valor in sorted(metricas.snapshot().items()):
+        if nombre.startswith(("hacienda_circuito", "limitador_envios_reducciones", "hacienda_solicitudes")):
+            print(f"  {nombre} = {valor}")
+    await hacienda_transport.cerrar()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documentos", type=int, default=500)
+    parser.add_argument("--emisor", default="003101123456")
+    parser.add_argument("--latencia-ms", type=float, default=80.0)
+    parser.add_argument("--distribucion", default="lognormal")
+    parser.add_argument("--tasa-error", type=float, default=0.0)
+    parser.add_argument("--tasa-limite", type=float, default=0.0)
+    parser.add_argument("--capacidad", type=int, default=0, help="Solicitudes simultáneas que acepta el simulador")
+    parser.add_argument("--tasa-rechazo", type=float, default=0.05)
+    parser.add_argument("--max-intentos", type=int, default=10)
+    parser.add_argument("--escala-retraso", type=float, default=0.01,
+                        help="Factor aplicado al backoff para acortar la corrida")
+    parser.add_argument("--demora-final", type=float, default=1.0)
+    parser.add_argument("--puerto", type=int, default=PUERTO_DEFECTO)
+    args = parser.parse_args()
+
+    configurar_entorno(args.puerto)
+    from app.simulador.config import ConfigSimulador
+
+    config = ConfigSimulador(
+        latencia_distribucion=args.distribucion,
+        latencia_media_ms=args.latencia_ms,
+        tasa_error=args.tasa_error,
+        tasa_limite=args.tasa_limite,
+        capacidad_concurrente=args.capacidad,
+        tasa_rechazo=args.tasa_rechazo,
+        demora_procesando_segundos=args.demora_final / 2,
+        demora_final_segundos=args.demora_final,
+        callbacks=False
+    )
+    servidor = iniciar_simulador(args.puerto, config)
+    try:
+        asyncio.run(main(args))
+    finally:
+        servidor.should_exit = True
@@ -0,0 +1,88 @@
+"""
+Benchmark: emisión v4.4 encadenando texto vs PipelineDocumentos
+
+Para facturas de 1, 100 y 1000 líneas mide el CPU (time.process_time) por
+factura de generar → validar XSD → firmar → PDF en dos caminos:
+
+    texto      cada etapa recibe el texto y lo vuelve a parsear (flujo anterior)
+    pipeline   un solo árbol para todas las etapas y una sola serialización
+
+y el desglose por etapa del pipeline. Sin --certificado la firma es la simulada;
+la validación sólo cuesta si el esquema XSD se pudo cargar. El PDF domina el
+total: --sin-pdf deja sólo el XML para ver el ahorro de parseos.
+
+Uso:
+    python -m benchmarks.bench_pipeline_documentos --lineas 1 100 1000 --repeticiones 50
+    python -m benchmarks.bench_pipeline_documentos --certificado cert.p12 --clave 1234 --sin-pdf
+"""
+
+import argparse
+import logging
+import statistics
+import time
+
+import app.services.pipeline_documentos as modulo_pipeline
+from app.services.pdf_generator_official import pdf_generator_official
+from app.services.xml_generator_v44 import xml_generator_v44
+from app.services.xml_signer_production import XMLDigitalSignerProduction
+from app.services.xsd_validator import xsd_validator
+from benchmarks.bench_xml_v44 import datos_factura
+
+
+def emitir_texto(datos: dict, firmador: XMLDigitalSignerProduction, pdf: bool) -> None:
+    """Flujo anterior de /facturas-v44: cada etapa recibe el texto"""
+    xml_sin_firmar = xml_generator_v44.generar_xml_factura(datos)
+    xsd_validator.validate_and_report(xml_sin_firmar)
+    xml_firmado = firmador.firmar_xml(xml_sin_firmar)
+    if pdf:
+        pdf_generator_official.generar_pdf_factura(xml_firmado)
+
+
+def emitir_pipeline(datos: dict, pdf: bool, etapas: dict) -> None:
+    pipeline = modulo_pipeline.pipeline_documentos
+    documento = pipeline.generar(datos)
+    pipeline.validar(documento)
+    pipeline.firmar(documento)
+    documento.xml_firmado
+    if pdf:
+        pipeline.pdf(documento)
+    for etapa, ms in documento.tiempos.items():
+        etapas.setdefault(etapa, []).append(ms)
+
+
+def cpu(funcion, repeticiones: int) -> float:
+    """Mediana de CPU en ms de una emisión"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.process_time()
+        funcion()
+        tiempos.append((time.process_time() - inicio) * 1000)
+    return statistics.median(tiempos)
+
+
+def main(lineas, repeticiones: int, certificado: str = None, clave: str = None, pdf: bool = True) -> None:
+    firmador = XMLDigitalSignerProduction(certificado, clave)
+    # El pipeline usa el firmador global; se reemplaza para firmar con el mismo certificado
+    modulo_pipeline.signer_production = firmador
+
+    print(f"{'líneas':>7} {'texto':>10} {'pipeline':>10} {'ahorro':>7}  etapas del pipeline")
+    for cantidad in lineas:
+        datos = datos_factura(cantidad)
+        veces = max(10, repeticiones // max(1, cantidad // 10))
+        etapas = {}
+        texto = cpu(lambda: emitir_texto(datos, firmador, pdf), veces)
+        pipeline = cpu(lambda: emitir_pipeline(datos, pdf, etapas), veces)
+        desglose = " ".join(f"{etapa}={statistics.median(ms):.2f}" for etapa, ms in etapas.items())
+        print(f"{cantidad:>7} {texto:8.2f}ms {pipeline:8.2f}ms {1 - pipeline / texto:6.1%}  {desglose}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lineas", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--repeticiones", type=int, default=50)
+    parser.add_argument("--certificado", help="Archivo .p12 para firmar de verdad")
+    parser.add_argument("--clave", help="Contraseña del certificado")
+    parser.add_argument("--sin-pdf", action="store_true", help="Medir sólo generar, validar y firmar")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    main(args.lineas, args.repeticiones, args.certificado, args.clave, not args.sin_pdf)
@@ -0,0 +1,75 @@
+"""
+Benchmark: generación de cada tipo de comprobante v4.4 con XMLGeneratorV44
+
+Para facturas de 1, 100 y 1000 líneas mide la mediana de construir_factura
+(texto + árbol lxml) de cada tipo de TIPOS_V44 y la compara con la factura
+electrónica (01): todos comparten los fragmentos de Emisor, Receptor,
+LineaDetalle, ResumenFactura e InformacionReferencia, así que deberían tardar
+lo mismo. Además valida cada documento contra su propio XSD de Referencias/
+(sin la firma, que agrega el firmador). Los casos límite y los XML golden
+están en verificaciones.golden_v44.
+
+Uso:
+    python -m benchmarks.bench_tipos_v44 --lineas 1 100 1000 --repeticiones 200
+"""
+
+import argparse
+import logging
+import statistics
+import time
+from datetime import datetime
+
+from app.services.xml_generator_v44 import TIPOS_V44, XMLGeneratorV44
+from app.services.xsd_validator import validador_para
+from benchmarks.bench_xml_v44 import datos_factura
+
+REFERENCIA = {'tipo_doc': '01', 'numero': '50624112400310123456700100001010000000001199999999',
+              'fecha_emision': datetime(2024, 11, 1, 9, 0), 'codigo': '01', 'razon': 'Referencia de prueba'}
+
+
+def datos_tipo(codigo: str, lineas: int) -> dict:
+    """Factura de bench_xml_v44 con lo que el XSD de cada tipo exige además"""
+    datos = datos_factura(lineas)
+    datos['numero_consecutivo'] = f"00100001{codigo}0000000001"
+    datos['clave'] = datos['clave'][:29] + codigo + datos['clave'][31:]
+    if codigo in ('02', '03', '08', '10'):
+        datos['informacion_referencia'] = [REFERENCIA]
+    if codigo == '08':
+        datos['codigo_actividad_receptor'] = '722010'
+    if codigo == '10':
+        datos['condicion_venta'] = '09'
+    return datos
+
+
+def medir(funcion, datos: dict, codigo: str, repeticiones: int) -> float:
+    """Mediana en ms de una generación"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(datos, codigo)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos)
+
+
+def main(lineas, repeticiones: int) -> None:
+    generador = XMLGeneratorV44()
+    print(f"{'líneas':>7} {'tipo':<6} {'documento':<31} {'mediana':>10} {'vs 01':>7}  XSD")
+    for cantidad in lineas:
+        veces = max(10, repeticiones // max(1, cantidad // 10))
+        base = None
+        for codigo, tipo in TIPOS_V44.items():
+            datos = datos_tipo(codigo, cantidad)
+            mediana = medir(generador.construir_factura, datos, codigo, veces)
+            base = base or mediana
+            valido, errores = validador_para(tipo.xsd).validate_tree(generador.construir_factura(datos, codigo))
+            estado = "válido" if valido else f"INVÁLIDO: {errores[0]}"
+            print(f"{cantidad:>7} {codigo:<6} {tipo.raiz:<31} {mediana:8.3f}ms {mediana / base:6.2f}x  {estado}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lineas", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--repeticiones", type=int, default=200)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    main(args.lineas, args.repeticiones)
@@ -0,0 +1,108 @@
+"""
+Benchmark: cálculo de líneas y ResumenFactura con CalculadoraTotales
+
+Para facturas de 1, 100 y 1000 líneas (1000 es el máximo del XSD) mide la
+mediana de tiempo de:
+
+    anterior   el completado que hacía XMLGeneratorV44 (Decimal y float mezclados,
+               IVA 13% supuesto y el resumen con valores por defecto)
+    calcular   CalculadoraTotales.calcular: todos los montos en Decimal, una pasada
+    validar    CalculadoraTotales.validar: cálculo más comparación con lo enviado
+
+y cuántos campos del resumen dejaba el completado anterior distintos del
+cálculo o sin llenar (p. ej. mercancías contadas como servicios gravados).
+
+Uso:
+    python -m benchmarks.bench_totales --lineas 1 100 1000 --repeticiones 200
+"""
+
+import argparse
+import logging
+import statistics
+import time
+from decimal import Decimal
+
+from app.services.calculo_totales import CAMPOS_RESUMEN, calculadora_totales
+from benchmarks.bench_xml_v44 import datos_factura
+
+
+def completar_anterior(datos: dict):
+    """Lógica que tenía XMLGeneratorV44 antes de CalculadoraTotales (sin cambios, como referencia)"""
+    detalles = []
+    for detalle in datos['detalles_servicio']:
+        detalle_completo = detalle.copy()
+        if 'subtotal' not in detalle_completo:
+            subtotal = Decimal(str(detalle_completo['cantidad'])) * Decimal(str(detalle_completo['precio_unitario']))
+            detalle_completo['subtotal'] = float(subtotal)
+        if not detalle_completo.get('impuestos'):
+            impuesto_monto = float(Decimal(str(detalle_completo['subtotal'])) * Decimal('0.13'))
+            detalle_completo['impuestos'] = [{'codigo': '01', 'codigo_tarifa': '08', 'tarifa': 13.00,
+                                              'monto': impuesto_monto}]
+            detalle_completo['impuesto_neto'] = impuesto_monto
+        else:
+            detalle_completo['impuesto_neto'] = sum(imp.get('monto', 0) or 0 for imp in detalle_completo['impuestos'])
+        if 'monto_total_linea' not in detalle_completo:
+            detalle_completo['monto_total_linea'] = detalle_completo['subtotal'] + detalle_completo['impuesto_neto']
+        detalles.append(detalle_completo)
+
+    resumen = datos['resumen_factura']
+    resumen_completo = dict(resumen)
+    for campo, valor in {
+        'tipo_cambio': 1.00000,
+        'total_servicios_gravados': resumen.get('total_venta', 0) or 0.00000,
+        'total_gravado': resumen.get('total_venta', 0) or 0.00000,
+        'total_descuentos': 0.00000,
+        'total_impuesto': resumen.get('total_impuestos', 0) or 0.00000,
+        'total_otros_cargos': 0.00000,
+    }.items():
+        resumen_completo.setdefault(campo, valor)
+    return detalles, resumen_completo
+
+
+def calcular(datos: dict):
+    return calculadora_totales.calcular(datos['detalles_servicio'], datos.get('otros_cargos'), datos['medio_pago'])
+
+
+def validar(datos: dict):
+    return calculadora_totales.validar(datos['detalles_servicio'], datos['resumen_factura'],
+                                       datos.get('otros_cargos'), datos['medio_pago'])
+
+
+def campos_distintos(resumen_anterior: dict, totales: dict) -> int:
+    """Campos del resumen que el completado anterior omitía o llenaba con otro valor"""
+    return sum(1 for campo in CAMPOS_RESUMEN
+               if resumen_anterior.get(campo) is None
+               or Decimal(str(resumen_anterior[campo])) != totales[campo])
+
+
+def medir(funcion, datos: dict, repeticiones: int) -> float:
+    """Mediana en ms de una llamada"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(datos)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos)
+
+
+def main(lineas, repeticiones: int) -> None:
+    print(f"{'líneas':>7} {'anterior':>10} {'calcular':>10} {'validar':>10} {'µs/línea':>9}  campos distintos (anterior)")
+    for cantidad in lineas:
+        datos = datos_factura(cantidad)
+        veces = max(10, repeticiones // max(1, cantidad // 10))
+        anterior = medir(completar_anterior, datos, veces)
+        calculado = medir(calcular, datos, veces)
+        validado = medir(validar, datos, veces)
+        _, totales = calcular(datos)
+        distintos = campos_distintos(completar_anterior(datos)[1], totales)
+        print(f"{cantidad:>7} {anterior:8.3f}ms {calculado:8.3f}ms {validado:8.3f}ms "
+              f"{calculado * 1000 / cantidad:9.2f}  {distintos}/{len(CAMPOS_RESUMEN)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lineas", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--repeticiones", type=int, default=200)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    main(args.lineas, args.repeticiones)
@@ -0,0 +1,94 @@
+"""
+Benchmark: cliente httpx nuevo por solicitud vs transporte compartido (pool keep-alive)
+
+Levanta el simulador de Hacienda (app.simulador) sobre TLS con certificado autofirmado
+y envía N documentos con la concurrencia indicada usando ambas estrategias.
+
+Uso:
+    python -m benchmarks.bench_transporte_hacienda --solicitudes 500 --concurrencia 20
+"""
+
+import argparse
+import asyncio
+import statistics
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+
+from app.services.hacienda_transport import HaciendaTransport
+from app.simulador.app import crear_app
+from app.simulador.config import ConfigSimulador
+from app.simulador.tls import generar_certificado
+
+# Sin latencia ni fallas: sólo se mide el costo del transporte
+CONFIG_SIMULADOR = ConfigSimulador(latencia_media_ms=0, latencia_token_ms=0, validar_token=False, callbacks=False)
+
+
+def iniciar_servidor(puerto: int, ruta_cert: str, ruta_clave: str) -> uvicorn.Server:
+    config = uvicorn.Config(crear_app(CONFIG_SIMULADOR), host="127.0.0.1", port=puerto, log_level="warning",
+                            ssl_certfile=ruta_cert, ssl_keyfile=ruta_clave)
+    servidor = uvicorn.Server(config)
+    threading.Thread(target=servidor.run, daemon=True).start()
+    while not servidor.started:
+        time.sleep(0.05)
+    return servidor
+
+
+async def ejecutar(nombre: str, enviar, solicitudes: int, concurrencia: int) -> None:
+    semaforo = asyncio.Semaphore(concurrencia)
+    latencias = []
+
+    async def una():
+        async with semaforo:
+            inicio = time.perf_counter()
+            await enviar()
+            latencias.append((time.perf_counter() - inicio) * 1000)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(una() for _ in range(solicitudes)))
+    total = time.perf_counter() - inicio
+    latencias.sort()
+    print(f"{nombre:<14} total={total:7.2f}s  rps={solicitudes / total:8.1f}  "
+          f"p50={statistics.median(latencias):7.2f}ms  p95={latencias[int(len(latencias) * 0.95) - 1]:7.2f}ms")
+
+
+async def main(solicitudes: int, concurrencia: int, puerto: int) -> None:
+    url = f"https://127.0.0.1:{puerto}{CONFIG_SIMULADOR.ruta_recepcion}"
+    xml = 'PEZhY3R1cmEvPg==' * 200
+    secuencia = iter(range(10 ** 9))
+
+    def payload():
+        # Claves únicas: el simulador rechaza comprobantes repetidos
+        return {'clave': str(next(secuencia)).zfill(50), 'comprobanteXml': xml}
+
+    async def por_solicitud():
+        async with httpx.AsyncClient(verify=False) as client:
+            await client.post(url, json=payload())
+
+    transporte = HaciendaTransport(max_conexiones=concurrencia, max_keepalive=concurrencia, verify=False)
+
+    async def compartido():
+        await transporte.request("envio", "POST", url, json=payload())
+
+    await ejecutar("por_solicitud", por_solicitud, solicitudes, concurrencia)
+    await ejecutar("compartido", compartido, solicitudes, concurrencia)
+    await transporte.cerrar()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--solicitudes", type=int, default=500)
+    parser.add_argument("--concurrencia", type=int, default=20)
+    parser.add_argument("--puerto", type=int, default=8443)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, clave = generar_certificado(tmp)
+        servidor = iniciar_servidor(args.puerto, cert, clave)
+        try:
+            asyncio.run(main(args.solicitudes, args.concurrencia, args.puerto))
+        finally:
+            servidor.should_exit = True
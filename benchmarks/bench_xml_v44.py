@@ -0,0 +1,117 @@
+"""
+Benchmark: XML v4.4 con la plantilla Jinja anterior vs el escritor de XMLGeneratorV44
+
+Para facturas de 1, 100 y 1000 líneas mide el tiempo de generación y el pico de
+memoria de Python (tracemalloc) de cada camino:
+
+    jinja          texto con la plantilla anterior
+    jinja+arbol    texto de Jinja + etree.fromstring (lo que hacen el validador y el firmador)
+    texto          generar_xml_factura
+    arbol          construir_factura (texto + un solo parse en libxml2)
+
+tracemalloc no ve la memoria de libxml2: en los caminos con árbol sólo cuenta
+lo que Python asigna para producirlo.
+
+Uso:
+    python -m benchmarks.bench_xml_v44 --lineas 1 100 1000 --repeticiones 200
+"""
+
+import argparse
+import logging
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+from decimal import Decimal
+
+from jinja2 import Template
+from lxml import etree
+
+from app.services.xml_generator_v44 import XMLGeneratorV44, tipo_comprobante
+
+# Plantilla que usaba XMLGeneratorV44 antes del árbol lxml (sin cambios, como referencia)
+PLANTILLA_JINJA = Template("""<?xml version="1.0" encoding="utf-8"?><FacturaElectronica xmlns="https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronica" xsi:schemaLocation="https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronica https://www.hacienda.go.cr/ATV/ComprobanteElectronico/docs/esquemas/2016/v4.4/FacturaElectronica_V4.4.xsd" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:ds="http://www.w3.org/2000/09/xmldsig#"><Clave>{{ clave }}</Clave><ProveedorSistemas>{{ proveedor_sistemas }}</ProveedorSistemas><CodigoActividadEmisor>{{ codigo_actividad_emisor }}</CodigoActividadEmisor>{% if codigo_actividad_receptor %}<CodigoActividadReceptor>{{ codigo_actividad_receptor }}</CodigoActividadReceptor>{% endif %}<NumeroConsecutivo>{{ numero_consecutivo }}</NumeroConsecutivo><FechaEmision>{{ fecha_emision }}</FechaEmision><Emisor><Nombre>{{ emisor.nombre }}</Nombre><Identificacion><Tipo>{{ emisor.identificacion_tipo }}</Tipo><Numero>{{ emisor.identificacion_numero }}</Numero></Identificacion>{% if emisor.nombre_comercial %}<NombreComercial>{{ emisor.nombre_comercial }}</NombreComercial>{% endif %}<Ubicacion><Provincia>{{ emisor.ubicacion.provincia }}</Provincia><Canton>{{ emisor.ubicacion.canton }}</Canton><Distrito>{{ emisor.ubicacion.distrito }}</Distrito>{% if emisor.ubicacion.barrio %}<Barrio>{{ emisor.ubicacion.barrio }}</Barrio>{% endif %}{% if emisor.ubicacion.otras_senas %}<OtrasSenas>{{ emisor.ubicacion.otras_senas }}</OtrasSenas>{% endif %}</Ubicacion>{% if emisor.telefono %}<Telefono><CodigoPais>{{ emisor.telefono.codigo_pais }}</CodigoPais><NumTelefono>{{ emisor.telefono.numero }}</NumTelefono></Telefono>{% endif %}<CorreoElectronico>{{ emisor.correo_electronico }}</CorreoElectronico></Emisor>{% if receptor %}<Receptor><Nombre>{{ receptor.nombre }}</Nombre>{% if receptor.identificacion_tipo and receptor.identificacion_numero %}<Identificacion><Tipo>{{ receptor.identificacion_tipo }}</Tipo><Numero>{{ receptor.identificacion_numero }}</Numero></Identificacion>{% endif %}{% if receptor.correo_electronico %}<CorreoElectronico>{{ receptor.correo_electronico }}</CorreoElectronico>{% endif %}</Receptor>{% endif %}<CondicionVenta>{{ condicion_venta }}</CondicionVenta>{% if condicion_venta_otros %}<CondicionVentaOtros>{{ condicion_venta_otros }}</CondicionVentaOtros>{% endif %}{% if plazo_credito %}<PlazoCredito>{{ plazo_credito }}</PlazoCredito>{% endif %}{% for medio in medio_pago %}<MedioPago>{{ medio }}</MedioPago>{% endfor %}<DetalleServicio>{% for detalle in detalles_servicio %}<LineaDetalle><NumeroLinea>{{ detalle.numero_linea }}</NumeroLinea><CodigoCABYS>{{ detalle.codigo_cabys }}</CodigoCABYS>{% if detalle.codigo_comercial %}<CodigoComercial><Tipo>{{ detalle.codigo_comercial.tipo or '01' }}</Tipo><Codigo>{{ detalle.codigo_comercial.codigo }}</Codigo></CodigoComercial>{% endif %}<Cantidad>{{ "%.3f"|format(detalle.cantidad) }}</Cantidad><UnidadMedida>{{ detalle.unidad_medida }}</UnidadMedida>{% if detalle.tipo_transaccion %}<TipoTransaccion>{{ detalle.tipo_transaccion }}</TipoTransaccion>{% endif %}{% if detalle.unidad_medida_comercial %}<UnidadMedidaComercial>{{ detalle.unidad_medida_comercial }}</UnidadMedidaComercial>{% endif %}<Detalle>{{ detalle.detalle }}</Detalle>{% if detalle.numero_vin_serie %}{% for numero in detalle.numero_vin_serie %}<NumeroVINoSerie>{{ numero }}</NumeroVINoSerie>{% endfor %}{% endif %}{% if detalle.registro_medicamento %}<RegistroMedicamento>{{ detalle.registro_medicamento }}</RegistroMedicamento>{% endif %}{% if detalle.forma_farmaceutica %}<FormaFarmaceutica>{{ detalle.forma_farmaceutica }}</FormaFarmaceutica>{% endif %}<PrecioUnitario>{{ "%.5f"|format(detalle.precio_unitario) }}</PrecioUnitario><MontoTotal>{{ "%.5f"|format(detalle.monto_total) }}</MontoTotal>{% if detalle.descuentos %}{% for descuento in detalle.descuentos %}<Descuento><MontoDescuento>{{ "%.5f"|format(descuento.monto) }}</MontoDescuento><NaturalezaDescuento>{{ descuento.naturaleza or "01" }}</NaturalezaDescuento>{% if descuento.codigo %}<CodigoDescuento>{{ descuento.codigo }}</CodigoDescuento>{% endif %}{% if descuento.otros and descuento.codigo == "99" %}<DescuentoOtros>{{ descuento.otros }}</DescuentoOtros>{% endif %}</Descuento>{% endfor %}{% endif %}<SubTotal>{{ "%.5f"|format(detalle.subtotal) }}</SubTotal>{% if detalle.impuestos %}{% for impuesto in detalle.impuestos %}<Impuesto><Codigo>{{ impuesto.codigo }}</Codigo><CodigoTarifa>{{ impuesto.codigo_tarifa }}</CodigoTarifa><Tarifa>{{ "%.2f"|format(impuesto.tarifa) }}</Tarifa><Monto>{{ "%.5f"|format(impuesto.monto) }}</Monto>{% if impuesto.exoneracion %}<Exoneracion><TipoDocumento>{{ impuesto.exoneracion.tipo_documento }}</TipoDocumento><NumeroDocumento>{{ impuesto.exoneracion.numero_documento }}</NumeroDocumento><NombreInstitucion>{{ impuesto.exoneracion.nombre_institucion }}</NombreInstitucion><FechaEmision>{{ impuesto.exoneracion.fecha_emision }}</FechaEmision><PorcentajeExoneracion>{{ impuesto.exoneracion.porcentaje_exoneracion }}</PorcentajeExoneracion><MontoExoneracion>{{ "%.5f"|format(impuesto.exoneracion.monto_exoneracion) }}</MontoExoneracion></Exoneracion>{% endif %}</Impuesto>{% endfor %}<ImpuestoNeto>{{ "%.5f"|format(detalle.impuesto_neto) }}</ImpuestoNeto>{% endif %}<MontoTotalLinea>{{ "%.5f"|format(detalle.monto_total_linea) }}</MontoTotalLinea></LineaDetalle>{% endfor %}</DetalleServicio>{% if otros_cargos %}<OtrosCargos>{% for cargo in otros_cargos %}<TipoDocumento>{{ cargo.tipo_documento }}</TipoDocumento><NumeroIdentidadTercero>{{ cargo.numero_identidad_tercero }}</NumeroIdentidadTercero><NombreTercero>{{ cargo.nombre_tercero }}</NombreTercero><Detalle>{{ cargo.detalle }}</Detalle><Porcentaje>{{ cargo.porcentaje }}</Porcentaje><MontoCargo>{{ "%.5f"|format(cargo.monto_cargo) }}</MontoCargo>{% endfor %}</OtrosCargos>{% endif %}<ResumenFactura><CodigoTipoMoneda><CodigoMoneda>{{ resumen.codigo_tipo_moneda }}</CodigoMoneda><TipoCambio>{{ "%.5f"|format(resumen.tipo_cambio) }}</TipoCambio></CodigoTipoMoneda>{% if resumen.total_servicios_gravados is defined %}<TotalServGravados>{{ "%.5f"|format(resumen.total_servicios_gravados) }}</TotalServGravados>{% endif %}{% if resumen.total_servicios_exentos is defined %}<TotalServExentos>{{ "%.5f"|format(resumen.total_servicios_exentos) }}</TotalServExentos>{% endif %}{% if resumen.total_servicios_exonerados is defined %}<TotalServExonerado>{{ "%.5f"|format(resumen.total_servicios_exonerados) }}</TotalServExonerado>{% endif %}{% if resumen.total_mercaderias_gravadas is defined %}<TotalMercanciasGravadas>{{ "%.5f"|format(resumen.total_mercaderias_gravadas) }}</TotalMercanciasGravadas>{% endif %}{% if resumen.total_mercaderias_exentas is defined %}<TotalMercanciasExentas>{{ "%.5f"|format(resumen.total_mercaderias_exentas) }}</TotalMercanciasExentas>{% endif %}{% if resumen.total_mercaderias_exoneradas is defined %}<TotalMercExonerada>{{ "%.5f"|format(resumen.total_mercaderias_exoneradas) }}</TotalMercExonerada>{% endif %}{% if resumen.total_gravado is defined %}<TotalGravado>{{ "%.5f"|format(resumen.total_gravado) }}</TotalGravado>{% endif %}{% if resumen.total_exento is defined %}<TotalExento>{{ "%.5f"|format(resumen.total_exento) }}</TotalExento>{% endif %}{% if resumen.total_exonerado is defined %}<TotalExonerado>{{ "%.5f"|format(resumen.total_exonerado) }}</TotalExonerado>{% endif %}<TotalVenta>{{ "%.5f"|format(resumen.total_venta) }}</TotalVenta>{% if resumen.total_descuentos is defined %}<TotalDescuentos>{{ "%.5f"|format(resumen.total_descuentos) }}</TotalDescuentos>{% endif %}<TotalVentaNeta>{{ "%.5f"|format(resumen.total_venta_neta) }}</TotalVentaNeta>{% if resumen.total_impuesto is defined %}<TotalImpuesto>{{ "%.5f"|format(resumen.total_impuesto) }}</TotalImpuesto>{% endif %}{% if resumen.total_iva_devuelto is defined %}<TotalIVADevuelto>{{ "%.5f"|format(resumen.total_iva_devuelto) }}</TotalIVADevuelto>{% endif %}{% if resumen.total_otros_cargos is defined %}<TotalOtrosCargos>{{ "%.5f"|format(resumen.total_otros_cargos) }}</TotalOtrosCargos>{% endif %}<TotalComprobante>{{ "%.5f"|format(resumen.total_comprobante) }}</TotalComprobante></ResumenFactura>{% if informacion_referencia %}<InformacionReferencia>{% for ref in informacion_referencia %}<TipoDoc>{{ ref.tipo_doc }}</TipoDoc><Numero>{{ ref.numero }}</Numero><FechaEmision>{{ ref.fecha_emision }}</FechaEmision><Codigo>{{ ref.codigo }}</Codigo><Razon>{{ ref.razon }}</Razon>{% endfor %}</InformacionReferencia>{% endif %}{{ firma_digital }}</FacturaElectronica>""")
+
+FIRMA_SIMULADA = ('<ds:Signature xmlns:ds="http://www.w3.org/2000/09/xmldsig#" Id="Signature-0">'
+                  '<!-- Firma digital simulada para desarrollo --></ds:Signature>')
+
+
+def datos_factura(lineas: int) -> dict:
+    """Factura como la arma la ruta /facturas-v44 (montos Decimal)"""
+    detalles = []
+    for numero in range(1, lineas + 1):
+        cantidad = Decimal(numero % 7 + 1)
+        precio = Decimal("1520.50000") + numero
+        monto = cantidad * precio
+        impuesto = (monto * Decimal("0.13")).quantize(Decimal("0.00001"))
+        detalles.append({
+            'numero_linea': numero, 'codigo_cabys': '4321000000000',
+            'codigo_comercial': {'tipo': '01', 'codigo': f'PROD{numero:05d}'},
+            'cantidad': cantidad, 'unidad_medida': 'Unid', 'detalle': f'Producto de prueba número {numero}',
+            'precio_unitario': precio, 'monto_total': monto, 'subtotal': monto,
+            'impuestos': [{'codigo': '01', 'codigo_tarifa': '08', 'tarifa': Decimal('13'), 'monto': impuesto}],
+            'impuesto_neto': impuesto, 'monto_total_linea': monto + impuesto,
+        })
+    total_venta = sum(d['subtotal'] for d in detalles)
+    total_impuesto = sum(d['impuesto_neto'] for d in detalles)
+    return {
+        'clave': '50624112400310123456700100001010000000001199999999',
+        'proveedor_sistemas': '310277607903', 'codigo_actividad_emisor': '722010',
+        'codigo_actividad_receptor': None, 'numero_consecutivo': '00100001010000000001',
+        'fecha_emision': datetime(2024, 11, 24, 10, 30),
+        'emisor': {'nombre': 'EMPRESA EJEMPLO SA', 'identificacion_tipo': '02', 'identificacion_numero': '3101234567',
+                   'ubicacion': {'provincia': '01', 'canton': '01', 'distrito': '01', 'otras_senas': 'Centro'},
+                   'correo_electronico': 'facturacion@ejemplo.com'},
+        'receptor': {'nombre': 'CLIENTE EJEMPLO', 'identificacion_tipo': '01', 'identificacion_numero': '112345678',
+                     'correo_electronico': 'cliente@ejemplo.com'},
+        'condicion_venta': '01', 'condicion_venta_otros': None, 'plazo_credito': None, 'medio_pago': ['01'],
+        'detalles_servicio': detalles, 'otros_cargos': [], 'informacion_referencia': [],
+        'resumen_factura': {'codigo_tipo_moneda': 'CRC', 'tipo_cambio': Decimal('1'),
+                            'total_venta': total_venta, 'total_venta_neta': total_venta,
+                            'total_impuesto': total_impuesto, 'total_comprobante': total_venta + total_impuesto},
+    }
+
+
+def medir(funcion, datos: dict, repeticiones: int):
+    """Mediana en ms y pico de memoria en KiB de una generación"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(datos)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tracemalloc.start()
+    funcion(datos)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(tiempos), pico / 1024
+
+
+def main(lineas, repeticiones: int) -> None:
+    generador = XMLGeneratorV44()
+
+    def jinja(datos):
+        generador._validar_campos_obligatorios(datos, tipo_comprobante('01'))
+        return PLANTILLA_JINJA.render(**generador._procesar_datos(datos), firma_digital=FIRMA_SIMULADA)
+
+    caminos = {
+        'jinja': jinja,
+        'jinja+arbol': lambda datos: etree.fromstring(jinja(datos).encode('utf-8')),
+        'texto': generador.generar_xml_factura,
+        'arbol': generador.construir_factura,
+    }
+    print(f"{'líneas':>7} {'camino':<12} {'mediana':>10} {'memoria':>11}")
+    for cantidad in lineas:
+        datos = datos_factura(cantidad)
+        veces = max(10, repeticiones // max(1, cantidad // 10))
+        for nombre, funcion in caminos.items():
+            mediana, pico = medir(funcion, datos, veces)
+            print(f"{cantidad:>7} {nombre:<12} {mediana:8.3f}ms {pico:8.1f}KiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lineas", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--repeticiones", type=int, default=200)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    main(args.lineas, args.repeticiones)
@@ -1,7 +1,29 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.v1.api import api_router
 from app.core.config import settings
+from app.core.metrics import metricas
+from app.core.redis import cerrar_redis
+from app.models.database import cerrar_base_datos
+from app.services.bitacora_envios import bitacora_envios
+from app.services.consecutivos import asignador_consecutivos
+from app.services.hacienda_transport import hacienda_transport
+from app.services.repositorio_documentos import repositorio_documentos
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Cliente HTTP compartido hacia Hacienda durante toda la vida del proceso
+    await hacienda_transport.iniciar()
+    yield
+    # Devolver los consecutivos arrendados y no usados antes de cerrar Redis
+    await asignador_consecutivos.liberar()
+    await repositorio_documentos.cerrar()
+    await hacienda_transport.cerrar()
+    # Filas de logs_envio aún en memoria
+    await bitacora_envios.cerrar()
+    await cerrar_redis()
+    await cerrar_base_datos()
 
 app = FastAPI(
     title="API Facturación Electrónica Costa Rica",
@@ -9,6 +31,7 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -29,6 +52,10 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def obtener_metricas():
+    return metricas.snapshot()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,158 @@
+"""
+Verificación dorada de los comprobantes v4.4
+
+Para cada tipo de TIPOS_V44 y cada caso (gravado, exento, exonerado, descuento,
+otros cargos, sin receptor, texto con caracteres a escapar) genera el XML con
+pipeline_documentos y revisa que:
+
+    xsd      valide contra el XSD de su tipo en Referencias/
+    golden   sea igual al XML guardado en verificaciones/golden_v44/<caso>_<tipo>.xml
+    pdf      el PDF se genere y lea el medio de pago y las líneas del árbol
+
+El MensajeReceptor se revisa igual (XSD y golden). Termina con código 1 si algo
+falla, así que sirve en CI. Con --actualizar reescribe los golden después de un
+cambio intencional del XML (revisar el diff antes de confirmarlo).
+
+Uso:
+    python -m verificaciones.golden_v44
+    python -m verificaciones.golden_v44 --actualizar
+"""
+
+import argparse
+import difflib
+import logging
+import os
+import sys
+from datetime import datetime
+from decimal import Decimal
+
+from lxml import etree
+
+from app.services.pdf_generator_official import pdf_generator_official
+from app.services.pipeline_documentos import pipeline_documentos
+from app.services.xml_generator_v44 import MENSAJE_RECEPTOR_V44, TIPOS_V44, xml_generator_v44
+from app.services.xsd_validator import validador_para
+from benchmarks.bench_tipos_v44 import datos_tipo
+
+RUTA_GOLDEN = os.path.join(os.path.dirname(__file__), "golden_v44")
+LINEAS = 3
+
+
+def _exento(datos: dict) -> None:
+    datos['detalles_servicio'][0]['impuestos'] = []
+
+
+def _exonerado(datos: dict) -> None:
+    datos['detalles_servicio'][1]['impuestos'][0]['exoneracion'] = {
+        'tipo_documento': '04', 'numero_documento': 'AL-00012345-24', 'nombre_institucion': '01',
+        'fecha_emision': datetime(2024, 1, 15, 8, 0), 'porcentaje_exoneracion': Decimal('50'),
+        'monto_exoneracion': Decimal('0'),
+    }
+
+
+def _descuento(datos: dict) -> None:
+    datos['detalles_servicio'][0]['descuentos'] = [{'monto': Decimal('100'), 'naturaleza': 'Cliente frecuente'}]
+
+
+def _otros_cargos(datos: dict) -> None:
+    datos['otros_cargos'] = [{'tipo_documento': '06', 'numero_identidad_tercero': '3101234567',
+                              'nombre_tercero': 'Servicios Tercero SA', 'detalle': 'Servicio 10%',
+                              'porcentaje': Decimal('10'), 'monto_cargo': Decimal('150')}]
+
+
+def _sin_receptor(datos: dict) -> None:
+    datos['receptor'] = None
+
+
+def _escape(datos: dict) -> None:
+    datos['emisor'] = dict(datos['emisor'], nombre='Ferretería "El Tornillo" & Cía')
+    datos['detalles_servicio'][0]['detalle'] = 'Tornillos <1/4"> & tuercas'
+
+
+CASOS = {
+    'gravado': None,
+    'exento': _exento,
+    'exonerado': _exonerado,
+    'descuento': _descuento,
+    'otros_cargos': _otros_cargos,
+    'sin_receptor': _sin_receptor,
+    'escape': _escape,
+}
+
+MENSAJE_RECEPTOR = {
+    'clave': '50624112400310123456700100001010000000001199999999', 'numero_cedula_emisor': '3101234567',
+    'fecha_emision_doc': datetime(2024, 11, 24, 10, 30), 'mensaje': '1', 'detalle_mensaje': 'Aceptado & conforme',
+    'monto_total_impuesto': Decimal('13'), 'codigo_actividad': '722010', 'condicion_impuesto': '01',
+    'monto_total_impuesto_acreditar': Decimal('13'), 'total_factura': Decimal('113'),
+    'numero_cedula_receptor': '112345678', 'numero_consecutivo_receptor': '00100001050000000001',
+}
+
+
+def _legible(xml: str) -> str:
+    """XML con sangría: los golden se guardan así para que sus diffs se puedan revisar"""
+    return etree.tostring(etree.fromstring(xml.encode('utf-8')), pretty_print=True, encoding='unicode')
+
+
+def _comparar_golden(nombre: str, xml: str, actualizar: bool) -> str:
+    ruta = os.path.join(RUTA_GOLDEN, f"{nombre}.xml")
+    legible = _legible(xml)
+    if actualizar:
+        with open(ruta, 'w', encoding='utf-8') as archivo:
+            archivo.write(legible)
+        return "actualizado"
+    if not os.path.exists(ruta):
+        return "FALTA (correr con --actualizar)"
+    with open(ruta, encoding='utf-8') as archivo:
+        guardado = archivo.read()
+    if guardado == legible:
+        return "ok"
+    diferencias = difflib.unified_diff(guardado.splitlines(), legible.splitlines(), "golden", "generado", lineterm="")
+    return "DIFERENTE\n" + "\n".join(list(diferencias)[:40])
+
+
+def _revisar_pdf(documento, datos: dict) -> str:
+    extraidos = pdf_generator_official._extraer_datos(documento.arbol)
+    if extraidos['medio_pago'] != list(datos['medio_pago']):
+        return f"medio_pago {extraidos['medio_pago']}"
+    if len(extraidos['detalles']) != len(datos['detalles_servicio']):
+        return f"{len(extraidos['detalles'])} líneas"
+    return "ok" if pipeline_documentos.pdf(documento).startswith(b'%PDF') else "no es PDF"
+
+
+def main(actualizar: bool) -> int:
+    os.makedirs(RUTA_GOLDEN, exist_ok=True)
+    fallas = 0
+    print(f"{'tipo':<5} {'caso':<13} {'xsd':<9} {'pdf':<9} golden")
+    for codigo, tipo in TIPOS_V44.items():
+        for caso, preparar in CASOS.items():
+            datos = datos_tipo(codigo, LINEAS)
+            if preparar:
+                preparar(datos)
+            if datos.get('receptor') is None and 'receptor' in tipo.compilar().campos_obligatorios:
+                continue
+            documento = pipeline_documentos.generar(datos, codigo)
+            validacion = pipeline_documentos.validar(documento)
+            xsd = "ok" if validacion['valido'] else f"INVÁLIDO: {validacion['errores'][:2]}"
+            pdf = _revisar_pdf(documento, datos)
+            golden = _comparar_golden(f"{caso}_{codigo}", documento.xml_sin_firmar, actualizar)
+            fallas += (xsd != "ok") + (pdf != "ok") + (golden not in ("ok", "actualizado"))
+            print(f"{codigo:<5} {caso:<13} {xsd if xsd == 'ok' else '':<9} {pdf:<9} {golden}")
+            if xsd != "ok":
+                print(f"      {xsd}")
+
+    xml = xml_generator_v44.generar_xml_mensaje_receptor(MENSAJE_RECEPTOR)
+    valido, errores = validador_para(MENSAJE_RECEPTOR_V44.compilar().xsd).validate_xml(xml)
+    golden = _comparar_golden("mensaje_receptor", xml, actualizar)
+    fallas += (not valido) + (golden not in ("ok", "actualizado"))
+    print(f"{'MR':<5} {'mensaje':<13} {'ok' if valido else errores[:2]!s:<9} {'-':<9} {golden}")
+
+    print(f"\n{'Sin fallas' if not fallas else f'{fallas} fallas'}")
+    return 1 if fallas else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--actualizar", action="store_true", help="Reescribir los XML golden con la salida actual")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    sys.exit(main(args.actualizar))